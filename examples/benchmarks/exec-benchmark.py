@@ -0,0 +1,66 @@
+"""
+Benchmark of the per command latency of plain execs against the exec agent of
+a node. The same command is run --count times on a node of the running
+topology, one at a time and with --threads concurrent callers, once with every
+command as an exec of its own and once through the agent. The backend is
+selected as usual with TESTBED_BACKEND; the agent is started before the
+measurement, its start time is reported separately.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+from docker_backend import default_backend
+
+
+def measure(backend, node, cmd, count, threads):
+	def timed(_):
+		start = time.perf_counter()
+		result = backend.exec(node, cmd)
+		if result.exit_code != 0:
+			raise RuntimeError(result.stderr.decode('utf-8', errors='replace'))
+		return time.perf_counter() - start
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=threads) as pool:
+		latencies = sorted(pool.map(timed, range(count)))
+	return latencies, time.perf_counter() - start
+
+
+def report(name, latencies, wall):
+	p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+	print(f"  {name:<6} mean {1000 * statistics.mean(latencies):8.2f}ms  median {1000 * statistics.median(latencies):8.2f}ms"
+	      f"  p95 {1000 * p95:8.2f}ms  {len(latencies) / wall:8.1f} commands/s")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('node', help='node of the running topology to run the commands on')
+	parser.add_argument('--count', type=int, default=200, help='commands per measurement')
+	parser.add_argument('--threads', type=int, nargs='+', default=[1, 8], help='concurrent callers')
+	parser.add_argument('--cmd', type=str, nargs='+', default=['ip', 'route', 'show'], help='command to run')
+	args = parser.parse_args()
+
+	plain = default_backend()
+	plain.agents = None
+	agent = default_backend()
+	if getattr(agent, "agents", None) is None:
+		# the backend reads TESTBED_EXEC_AGENT on creation
+		os.environ["TESTBED_EXEC_AGENT"] = "1"
+		agent = default_backend()
+	if getattr(agent, "agents", None) is None:
+		sys.exit(f"{type(agent).__name__} has no exec agent")
+	start = time.perf_counter()
+	if agent.agents.agent(args.node) is None:
+		sys.exit(f"the agent could not be started on {args.node}, is python3 installed there?")
+	print(f"{type(agent).__name__}: agent on {args.node} started in {1000 * (time.perf_counter() - start):.1f}ms")
+	for threads in args.threads:
+		print(f"{args.count} x {' '.join(args.cmd)} with {threads} threads")
+		for name, backend in (("exec", plain), ("agent", agent)):
+			latencies, wall = measure(backend, args.node, args.cmd, args.count, threads)
+			report(name, latencies, wall)
+	agent.agents.close()
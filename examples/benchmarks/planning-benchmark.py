@@ -0,0 +1,57 @@
+"""
+Benchmark of the setup planning: address allocation, link parameters, all pairs shortest
+paths with the next hop matrix and building the provisioning graph, for random
+connected topologies of increasing size. No Docker operation is run. The time
+needed to build the route lists of all nodes, which happens while the route
+steps run, is reported separately, as is storing the plan in the plan cache.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from functools import partial
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+import routing
+from compiler import compile_topology, plan_routes, save_plan
+from provision import Provisioner
+from setup import plan_provisioning
+from topology_generator import attach_hosts, random_graph, to_config
+
+
+def plan(config_links):
+	topology = compile_topology(None, config_links)
+	routes = {node: partial(plan_routes, topology, node) for node in topology["connections"]}
+	plan_provisioning(Provisioner(), topology["nodes"], topology["links"], routes)
+	return topology, routes
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500, 1000, 2000, 4000])
+	parser.add_argument('--degree', type=float, default=3.0, help='average router degree')
+	parser.add_argument('--hosts', type=float, default=0.0, help='fraction of single homed hosts')
+	parser.add_argument('--routes', action='store_true', help='also build the route lists of all nodes')
+	args = parser.parse_args()
+
+	print(f"shortest paths by {'scipy.sparse.csgraph' if routing.csgraph_dijkstra else 'heapq'}")
+	for n in args.sizes:
+		n_hosts = int(n * args.hosts)
+		graph = attach_hosts(random_graph(n - n_hosts, args.degree), n_hosts)
+		config_links, _ = to_config(graph, bandwidth=[10, 100, 1000])
+		start = time.perf_counter()
+		topology, routes = plan(config_links)
+		planning = time.perf_counter() - start
+		line = f"{n:>6} nodes {len(config_links):>6} links  planning {planning:7.3f}s"
+		with tempfile.TemporaryDirectory() as cache_dir:
+			start = time.perf_counter()
+			save_plan(topology, "benchmark", cache_dir)
+			saving = time.perf_counter() - start
+			size = sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir))
+		line += f"  saved in {saving:7.3f}s ({size / 1e6:.1f} MB)"
+		if args.routes:
+			start = time.perf_counter()
+			n_routes = sum(len(build()) for build in routes.values())
+			line += f"  {n_routes} routes built in {time.perf_counter() - start:7.3f}s"
+		print(line)
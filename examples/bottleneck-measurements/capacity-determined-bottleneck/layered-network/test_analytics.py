@@ -1,8 +1,23 @@
+import os
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 
-# read csv into a pandas dataframe
-df = pd.read_csv('test_results.csv')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..', 'utils'))
+from result_store import ResultStore
+
+# read the results of one run of real-world-experiment-bw-limited.py into a pandas dataframe,
+# the run given as argument or the latest one, the segments are read in the order they were written
+store = ResultStore()
+runs = store.query('bottleneck', ['run'], {'experiment': 'bw-limited'})['run']
+if len(sys.argv) < 2 and len(runs) == 0:
+    sys.exit("No results of the bw-limited experiment")
+run = sys.argv[1] if len(sys.argv) > 1 else runs[-1]
+print(f"Results of run {run}")
+columns = {'point_bandwidth': 'Bandwidth', 'iteration': 'Iteration', 'bottleneck': 'Bottleneck',
+           'bottleneck_bw': 'Bottleneck_BW', 'conf_level': 'Conf_Level'}
+results = store.query('bottleneck', list(columns), {'experiment': 'bw-limited', 'run': run})
+df = pd.DataFrame(results).rename(columns=columns)
 
 bottlneck_bw_values = []
 mean_bandwidth_list = []
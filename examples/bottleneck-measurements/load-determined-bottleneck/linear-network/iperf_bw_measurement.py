@@ -4,7 +4,7 @@ with linear topology and estimate the bandwidth on the bottleneck link.
 """
 import os
 import numpy as np
-from setup import configure_link, read_state_json
+from setup import configure_link, read_state
 import matplotlib.pyplot as plt
 import time
 
@@ -39,7 +39,7 @@ confidence_level_list = []
 test_results = []
 for i in range(len(bottlneck_bw_values)):
 	# configure bandwidth on bottleneck link
-	current_state = read_state_json()
+	current_state = read_state()
 	links = current_state["links"]
 	tc_params = (bottlneck_bw_values[i], burst_const, latency_const)
 	bottleneck_endpoint0 = links[bottleneck_link_name][1][0]
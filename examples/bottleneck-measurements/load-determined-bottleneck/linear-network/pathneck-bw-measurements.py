@@ -4,12 +4,16 @@ with a capacity determined bottleneck
 """
 import subprocess
 import os
+import sys
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..', 'utils'))
+from tool_parsers import PathneckHop, parse
+
 n_iter = 20
 bottleneck_bandwidth = []
-data = {'00': [], '01': [], '02': [], '03': []}
+data = {hop: [] for hop in range(4)}
 
 bottleneck_link_dest = {'name': 'r3', 'ip': '10.0.3.3'}
 server = {'name': 's1', 'ip': '10.0.5.5'}
@@ -30,14 +34,10 @@ for i in range(n_iter):
 	                        stdout=subprocess.PIPE)
 	output = result.stdout.decode('utf-8')
 	print(output)
-	for line in output.splitlines():
-		line = line.split()
-		if len(line) == 8:
-			if line[5] == '1':
-				bottleneck = line[0]
-				bottleneck_bw = float(line[6])
-				bottleneck_bandwidth.append(float(line[6]))
-				data[line[0]].append(bottleneck_bw)
+	for hop in parse('pathneck', output):
+		if isinstance(hop, PathneckHop) and hop.bottleneck:
+			bottleneck_bandwidth.append(hop.bandwidth)
+			data[hop.hop].append(hop.bandwidth)
 
 # plot bandwidth test results
 total_data = [data[key] for key in data]
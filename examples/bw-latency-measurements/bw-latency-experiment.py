@@ -6,22 +6,29 @@ on an existing topology.
 """
 import subprocess
 import os
-import re
+import sys
 import numpy as np
-from setup import configure_link, read_state_json
+from setup import read_state
+from traffic_control import configure_links
 import matplotlib.pyplot as plt
 import importlib
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'utils'))
+from tool_parsers import PingSummary, parse
+
 
 server = 's1'
 client = 'ue1'
 
 bandwidth_values = list(np.arange(1, 101, 20))
+# configured and measured values of the runs with a result
+bandwidth_points = []
 bandwidth_results = []
 latency_const = 1
 burst_const = 12500
 
 latency_values = list(np.arange(1, 20, 5))
+latency_points = []
 latency_results = []
 bandwidth_const = 2
 
@@ -37,16 +44,12 @@ for node_name, node_param in config.nodes.items():
 
 def configure_params(links, params):
 	"""
-	Configure links in network with same params
+	Configure links in network with same params, one tc exec per node
 	:param links: links in the current state
 	:param params: tuple (bandwidth, burst, latency)
 	:return: None
 	"""
-	for _, link_param in links.items():
-		endpoint0 = link_param[1][0]
-		endpoint1 = link_param[1][1]
-		configure_link(endpoint0[0], endpoint0[2], params)
-		configure_link(endpoint1[0], endpoint1[2], params)
+	configure_links(links, params)
 
 
 # setup iperf server on server node(destination node)
@@ -56,7 +59,7 @@ for i in range(len(bandwidth_values)):
 	# update bw on all links
 	tc_params = (bandwidth_values[i], burst_const, latency_const)
 	print(tc_params)
-	current_state = read_state_json()
+	current_state = read_state()
 	links = current_state["links"]
 	configure_params(links, tc_params)
 
@@ -64,17 +67,17 @@ for i in range(len(bandwidth_values)):
 	output = result.stdout.decode('utf-8')
 	print(output)
 
-	# parse output to get bandwidth
-	unit = output.split(' ')[-1]
-	bandwidth = float(output.split(' ')[-2])
-	if 'Kbits' in unit:
-		bandwidth /= 1000
-	elif 'Gbits' in unit:
-		bandwidth *= 1000
-	bandwidth_results.append(bandwidth)
+	# bandwidth of the last interval iperf reports, the whole run, in Mbits/sec
+	intervals = parse('iperf', output)
+	if not intervals:
+		# a failed or truncated run has no point in the plot
+		print(f"iperf gave no result for {tc_params}, skipped")
+		continue
+	bandwidth_points.append(bandwidth_values[i])
+	bandwidth_results.append(intervals[-1].bits_per_second / 1e6)
 
 # plot bandwidth test results
-plt.scatter(bandwidth_values, bandwidth_results, c='orange')
+plt.scatter(bandwidth_points, bandwidth_results, c='orange')
 plt.axline((0, 0), slope=1, c='black', linestyle='--')
 plt.xlabel('Bandwidth values configured with tc')
 plt.ylabel('Measured bandwidth using iperf')
@@ -88,7 +91,7 @@ for i in range(len(latency_values)):
 	# update latency on all links
 	tc_params = (bandwidth_const, burst_const, latency_values[i])
 	print(tc_params)
-	current_state = read_state_json()
+	current_state = read_state()
 	links = current_state["links"]
 	configure_params(links, tc_params)
 
@@ -96,13 +99,16 @@ for i in range(len(latency_values)):
 	output = result.stdout.decode('utf-8')
 	print(output)
 
-	# parse output to get bandwidth
-	output = re.split('[ /]', output)
-	avg_latency = float(output[-4])/2
-	latency_results.append(avg_latency)
+	# one way latency from the average rtt
+	summary = [record for record in parse('ping', output) if isinstance(record, PingSummary)]
+	if not summary or summary[0].avg is None:
+		print(f"ping gave no result for {tc_params}, skipped")
+		continue
+	latency_points.append(latency_values[i])
+	latency_results.append(summary[0].avg / 2)
 
 # plot latency results
-plt.scatter(latency_values, latency_results, c='orange')
+plt.scatter(latency_points, latency_results, c='orange')
 plt.axline((0, 0), slope=1, c='black', linestyle='--')
 plt.xlabel('Latency values configured with tc')
 plt.ylabel('Measured latency using ping')
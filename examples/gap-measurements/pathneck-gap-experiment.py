@@ -4,8 +4,12 @@ with a capacity determined bottleneck
 """
 import subprocess
 import os
+import sys
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'utils'))
+from tool_parsers import PathneckHop, parse
+
 bottleneck_link_dest = {'name': 'r3', 'ip': '10.0.3.3'}
 server = {'name': 's1', 'ip': '10.0.5.5'}
 contesting_client = 'c2'
@@ -21,16 +25,10 @@ os.system(f"docker exec {contesting_client} iperf -t 0 -c {bottleneck_link_dest[
 result = subprocess.run(['docker', 'exec', client, './pathneck-1.3/pathneck', '-o', server['ip']], stdout=subprocess.PIPE)
 output = result.stdout.decode('utf-8')
 print(output)
-hop_ids = []
-gap_values = []
-bottleneck = None
-for line in output.splitlines():
-	line = line.split()
-	if len(line) == 8:
-		hop_ids.append(line[0])
-		gap_values.append(int(line[4]))
-		if line[5] == '1':
-			bottleneck = line[0]
+hops = [record for record in parse('pathneck', output) if isinstance(record, PathneckHop)]
+hop_ids = [hop.hop for hop in hops]
+gap_values = [hop.gap for hop in hops]
+bottleneck = next((hop.hop for hop in hops if hop.bottleneck), None)
 
 # plot gap values results
 plt.scatter(hop_ids, gap_values, c='orange')
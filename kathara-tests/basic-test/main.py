@@ -35,7 +35,7 @@ def main():
         # global variables
         n_iter = 20
         bottleneck_bandwidth = []
-        data = {'00': [], '01': [], '02': [], '03': [], '04': [], '05': []}
+        data = {hop: [] for hop in range(6)}
 
         server = {'name': 's1', 'ip': '10.0.4.4'}
         contesting_client = 'c2'
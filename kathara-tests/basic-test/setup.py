@@ -1,7 +1,7 @@
 import os
+import sys
 import ast
 import importlib
-from queue import PriorityQueue
 import json
 import argparse
 from Kathara.model.Lab import Lab
@@ -9,37 +9,9 @@ from Kathara.manager.Kathara import Kathara
 from Kathara.model.Machine import Machine
 from collections import defaultdict
 
-def dijkstra(graph, start):
-    """
-    Function to compute the shortest path from a source node to all other nodes in the graph
-    param: graph: the graph of the network
-    param: start: the source/start node from where minimum distance to other nodes is calculated.
-    return: Distance dictionary, where each element is a tuple of distance from source node and 
-    the previous node in the shortest path from the source.
-    """
-    # Initialize the distance dictionary and set the distance of the start node to 0
-    dist = {}
-    for node in graph:
-        dist[node] = [float('inf'), node]
-    dist[start][0] = 0
-
-    # Initialize the priority queue and add the start node with distance 0
-    pq = PriorityQueue()
-    pq.put((0, start))
-
-    # Traverse the graph using BFS and update the distance for each neighbor node
-    while not pq.empty():
-        current_dist, current_node = pq.get()
-        if current_dist > dist[current_node][0]:
-            continue
-        for neighbor, weight in graph[current_node]:
-            # weights are bandwidth values
-            distance = current_dist + 1. / weight[0]
-            if distance < dist[neighbor][0]:
-                dist[neighbor] = [distance, current_node]
-                pq.put([distance, neighbor])
-    # Return the distance dictionary
-    return dist
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+from routing import build_graph, compute_routing, route_table
+from traffic_control import group_by_node, plan_changes
 
 def build_image(img_name, img_path):
     """
@@ -225,6 +197,47 @@ def configure_link(lab, node, interface, tc_params):
         Kathara.get_instance().exec(lab_hash=lab.hash, machine_name=node, command=cmd_latency, stream=False, wait=True)
     print(f'Completed configuring node {node}')
 
+def batch_commands(cmd, commands):
+    """
+    Wrap commands into a single batch invocation for a startup file
+    :param cmd (string): batch command reading its commands from stdin, e.g. ip -batch -
+    :param commands (list[string]): commands of the batch
+    :return: list of startup file lines, empty if there are no commands
+    """
+    if not commands:
+        return []
+    return [f"{cmd} <<'EOF'"] + list(commands) + ["EOF"]
+
+
+def startup_config(links, node_vs_ip):
+    """
+    Precompute the full configuration of every machine so it is applied by its
+    startup file during deploy_lab: the addresses of all interfaces, the tbf/netem
+    qdiscs of every link endpoint as one tc batch and the complete route table as
+    one ip batch. No exec is needed after deploying the lab.
+    :param links: link information as generated by generate_link_param
+    :param node_vs_ip: dict node -> list of ips of the node
+    :return: dict node -> list of startup commands
+    """
+    start_up_cmds = defaultdict(list)
+    for link_name, link_param in links.items():
+        for node_name, ip, interface in link_param[1]:
+            start_up_cmds[node_name].append(f'ip address add {ip}/24 dev {interface}')
+
+    # interfaces of a fresh machine have no qdiscs yet
+    for node_name, params in group_by_node(links).items():
+        start_up_cmds[node_name] += batch_commands("tc -batch -", plan_changes(params, {}))
+
+    graph, connections = build_graph(links)
+    routing = compute_routing(links, graph)
+    for start_node in graph:
+        routes = route_table(routing, start_node, connections, node_vs_ip)
+        start_up_cmds[start_node] += batch_commands(
+            "ip -batch -", [f"route replace {dest_node_ip} via {next_hop_node_ip} dev {interface}"
+                            for dest_node_ip, (next_hop_node_ip, interface) in routes.items()])
+    return start_up_cmds
+
+
 def setup_topology():
     """
     Sets up configured topology as described in topology_config
@@ -237,7 +250,6 @@ def setup_topology():
         # import topology configuration
         config = importlib.import_module('topology_config')
 
-        start_up_cmds = defaultdict(list)
         start_up_links = defaultdict(list)
         node_vs_ip = {}
         node_vs_eth = {}
@@ -255,12 +267,6 @@ def setup_topology():
 
             source, dest = link_param[1][0][0], link_param[1][1][0]
 
-            # set ip addresses for interfaces
-            cmd_source = f'ip address add {link_param[1][0][1]}/24 dev {link_param[1][0][2]}'
-            cmd_dest = f'ip address add {link_param[1][1][1]}/24 dev {link_param[1][1][2]}'
-            start_up_cmds[source].append(cmd_source)
-            start_up_cmds[dest].append(cmd_dest)
-
             # add collision domains
             start_up_links[source].append(link_name)
             start_up_links[dest].append(link_name)
@@ -269,34 +275,8 @@ def setup_topology():
         nodes = config.nodes
         print(links)
 
-        # uncomment to rebuild docker image
-        # build_image("katharatestimage", ".")
-
-        # create devices
-        for node_name, node_param in nodes.items():
-            create_device(lab, node_name, "katharatestimage", start_up_links[node_name], start_up_cmds[node_name])
-
-        # deploy Kathara lab scenario
-        # NOTE: Make sure to undeploy lab in test code
-        Kathara.get_instance().deploy_lab(lab)
-
-        # attach devices to collision domains
         for link_name, link_param in links.items():
             endpoints = link_param[1]
-            tc_params = link_param[2]
-            try:
-                configure_link(lab, endpoints[0][0], endpoints[0][2], tc_params)
-                configure_link(lab, endpoints[1][0], endpoints[1][2], tc_params)
-            except Exception as e:
-                print(e)
-        # Using Dijkstra to configure routing tables with add route function above
-        graph = {}
-        connections = {}
-        # Create Graph
-        for link_name, link_param in links.items():
-            endpoints = link_param[1]
-            tc_params = link_param[2]
-
             if endpoints[0][0] not in node_vs_ip:
                 node_vs_ip[endpoints[0][0]] = []
             node_vs_ip[endpoints[0][0]].append(endpoints[0][1])
@@ -304,40 +284,19 @@ def setup_topology():
                 node_vs_ip[endpoints[1][0]] = []
             node_vs_ip[endpoints[1][0]].append(endpoints[1][1])
 
-            if endpoints[0][0] not in graph:
-                graph[endpoints[0][0]] = []
-                connections[endpoints[0][0]] = {}
-            graph[endpoints[0][0]].append((endpoints[1][0], tc_params))
-            connections[endpoints[0][0]][endpoints[1][0]] = (
-                endpoints[1][1], endpoints[0][2])  # ip of other node,eth of itself
-            if endpoints[1][0] not in graph:
-                graph[endpoints[1][0]] = []
-                connections[endpoints[1][0]] = {}
-            graph[endpoints[1][0]].append((endpoints[0][0], tc_params))
-            connections[endpoints[1][0]][endpoints[0][0]] = (endpoints[0][1], endpoints[1][2])
-
-        print("Begin routing procedure\n")
-        for start_node in graph:
-            dist = dijkstra(graph, start_node)
-            hops = []
-            for node in graph:
-                if node == start_node:
-                    continue
-                prev_node = dist[node][1]
-                next_hop = node
-                while prev_node != start_node and dist[prev_node][0] != float('inf'):
-                    next_hop = prev_node
-                    prev_node = dist[prev_node][1]
-                if dist[prev_node][0] == float('inf'):
-                    continue
-                hops.append((node, next_hop))
-            print(f"\nStart Node = {start_node}")
-            for dest_node, next_hop_node in hops:
-                next_hop_node_ip = connections[start_node][next_hop_node][0]
-                interface = connections[start_node][next_hop_node][1]
-                for dest_node_ip in node_vs_ip[dest_node]:
-                    add_route(lab, start_node, dest_node_ip, next_hop_node_ip, interface)
-                print(f"Destination Node = {dest_node}, Next hop = {next_hop_node}")
+        # addresses, qdiscs and routes are all applied by the startup files
+        start_up_cmds = startup_config(links, node_vs_ip)
+
+        # uncomment to rebuild docker image
+        # build_image("katharatestimage", ".")
+
+        # create devices
+        for node_name, node_param in nodes.items():
+            create_device(lab, node_name, "katharatestimage", start_up_links[node_name], start_up_cmds[node_name])
+
+        # deploy Kathara lab scenario, the machines come up fully configured
+        # NOTE: Make sure to undeploy lab in test code
+        Kathara.get_instance().deploy_lab(lab)
 
         # Store the current state to state.json file
         write_state_json(nodes, links, node_vs_ip, node_vs_eth)
@@ -1,22 +1,29 @@
 """
 Helper functions and utilities useful when setting up an experiment
 """
+import os
 import subprocess
+import sys
 from Kathara.model.Lab import Lab
 from Kathara.manager.Kathara import Kathara
 from Kathara.model.Machine import Machine
 
-def capture_traffic(lab, node_name, interface, duration, filename):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'utils'))
+from tool_parsers import PathneckHop, parse
+
+def capture_traffic(lab, node_name, interface, duration, filename, bpf_filter="", snaplen=96):
     """
     Capture traffic with tcpdump on a node for a given time
     duration and write to file.
     :param node_name: name of node to run tcpdump on
     :param interface: interface to capture traffic on
     :param duration: time to measure traffic in seconds
-    :param filename: file to write output to
+    :param filename: pcap file on the node to write output to
+    :param bpf_filter: BPF filter expression, all packets if empty
+    :param snaplen: bytes captured of every packet
     :return: None
     """
-    command = f'touch {filename}.txt; timeout {duration} -i {interface} > {filename}.txt &'
+    command = f'timeout -s INT {duration} tcpdump -i {interface} -s {snaplen} -n -w {filename}.pcap {bpf_filter} > /dev/null 2>&1 &'
     stdout, stderr, retcode = Kathara.get_instance().exec(lab_hash=lab.hash, machine_name=node_name, command=command, stream=False, wait=True)
     if retcode != 0:
         print(stderr)
@@ -51,26 +58,11 @@ def iperf3_client(lab, pc, server_ip, port=5201):
 
 def parse_iperf3_bandwidth(stdout):
     """
-    Returns bandwidth in Mbits/sec
+    Returns bandwidth in Mbits/sec of the last interval iperf3 reports,
+    None if there is none
     """
-    output_string = stdout.decode('utf-8')
-    output_tokens = output_string.split()
-
-    bandwidth, unit = None, None
-
-    reversed_tokens = list(reversed(output_tokens))
-
-    for i, token in enumerate(reversed_tokens):
-        if token.endswith("/sec"):
-            bandwidth, unit = float(reversed_tokens[i+1]), token
-            break
-
-    if 'Kbits' in unit:
-        bandwidth /= 1000
-    elif 'Gbits' in unit:
-        bandwidth *= 1000
-    
-    return bandwidth
+    intervals = parse('iperf3', stdout)
+    return intervals[-1].bits_per_second / 1e6 if intervals else None
 
 
 def pathneck(lab, client_name, server_ip):
@@ -92,14 +84,10 @@ def parse_pathneck_result(pathneck_result):
     :param pathneck_result: result of pathneck run such as output
     of pathneck function
     :return: tuple (bottleneck, bottleneck_bandwidth)
-    the detected bottleneck and the estimated bottleneck bandwidth if found,
-    else returns None
+    the hop id of the first detected bottleneck and the estimated bottleneck
+    bandwidth if found, else returns None
     """
-    for line in pathneck_result.splitlines():
-        line = line.split()
-        if len(line) == 8:
-            if line[5] == '1':
-                bottleneck = line[0]
-                bottleneck_bw = float(line[6])
-                return bottleneck, bottleneck_bw
+    for record in parse('pathneck', pathneck_result):
+        if isinstance(record, PathneckHop) and record.bottleneck:
+            return record.hop, record.bandwidth
     return None, None
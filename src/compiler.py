@@ -0,0 +1,294 @@
+"""
+Topology compiler.
+
+Turns a topology config into a plan holding everything setup needs before it
+touches Docker: the subnets, the interfaces of every node, the tc parameters
+and the routing of all nodes. The plan is serializable and cached on disk
+under a hash of COMPILER_VERSION and the source of the config, the compiler
+and every module of the testbed either of them imports, so running setup
+again, dry runs and teardown load it instead of redoing the interface
+numbering and the shortest path computation. A changed config, a changed
+module it imports or a change to ipam.py, routing.py, images.py and the other
+modules the compiler imports gets a new hash and is compiled again.
+
+A plan is stored as two files in PLAN_CACHE_DIR: <hash>.json with the
+topology and <hash>.npz with the next hop matrix. The route table of a node
+is derived from its row of the next hop matrix (see plan_routes).
+"""
+import ast
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import numpy as np
+from images import DEFAULT_ROLE, image_of
+from ipam import AddressPool, address_links, endpoint_name, legacy_subnet
+from routing import build_graph, compute_routing, node_routes
+
+# bump whenever the layout of a plan or the way it is compiled changes
+COMPILER_VERSION = 4
+PLAN_CACHE_DIR = "../tmp/plans"
+
+
+def _imported_names(source):
+	# names of the absolute imports of a module
+	for node in ast.walk(ast.parse(source)):
+		if isinstance(node, ast.Import):
+			yield from (alias.name for alias in node.names)
+		elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+			yield node.module
+
+
+def local_sources(path, directories, sources=None):
+	"""
+	Source of a module and of every module it imports, directly or not, that lives
+	in one of the directories
+	:param path: path of the module
+	:param directories: directories of the local modules
+	:param sources: dict path -> source to add to
+	:return: dict path -> source
+	"""
+	sources = {} if sources is None else sources
+	if path in sources:
+		return sources
+	with open(path, "rb") as f:
+		sources[path] = f.read()
+	for name in _imported_names(sources[path]):
+		try:
+			spec = importlib.util.find_spec(name)
+		except (ImportError, ValueError):
+			continue
+		if spec is not None and spec.origin and spec.origin.endswith(".py") and \
+				os.path.dirname(os.path.abspath(spec.origin)) in directories:
+			local_sources(os.path.abspath(spec.origin), directories, sources)
+	return sources
+
+
+def config_hash(config):
+	"""
+	Hash identifying a compiled plan
+	:param config: name of the config module
+	:return: hex digest over the compiler version and the source of the config, the
+	compiler and the local modules they import
+	"""
+	spec = importlib.util.find_spec(config)
+	if spec is None or spec.origin is None:
+		raise ValueError(f"Config {config} not found")
+	config_path, compiler_path = os.path.abspath(spec.origin), os.path.abspath(__file__)
+	directories = {os.path.dirname(config_path), os.path.dirname(compiler_path)}
+	sources = local_sources(config_path, directories)
+	local_sources(compiler_path, directories, sources)
+	digest = hashlib.sha256(f"compiler {COMPILER_VERSION}\n".encode())
+	digest.update(sources.pop(config_path))
+	for path in sorted(sources, key=os.path.basename):
+		digest.update(f"\n{os.path.basename(path)}\n".encode())
+		digest.update(sources[path])
+	return digest.hexdigest()
+
+
+def link_name_of(link_info):
+	"""
+	:param link_info: link in the format of the config file or the add and delete link
+	commands, endpoints with or without ip
+	:return: name of the link
+	"""
+	return endpoint_name(link_info[0]) + "-" + endpoint_name(link_info[1])
+
+
+def generate_link_param(node_vs_eth, link_info, subnet=None):
+	"""
+	Generates more parameters from the limited set of info taken form config file.
+	:param node_vs_eth: contains the node vs ethernet number mapping to decide the next
+	ethernet available to use for the link.
+	:param link_info: contains the info provided for the link in the config file or add
+	and delete link commands.
+	:param subnet: subnet of the link, the /24 of the first endpoint if None
+	:return: link_name, node_vs_eth, link_param
+	"""
+	node0 = link_info[0]
+	node1 = link_info[1]
+	link_name = link_name_of(link_info)
+	subnet_ip = subnet or legacy_subnet(node0[1])
+	if node0[0] not in node_vs_eth:
+		node_vs_eth[node0[0]] = 0
+	else:
+		node_vs_eth[node0[0]] += 1
+	if node1[0] not in node_vs_eth:
+		node_vs_eth[node1[0]] = 0
+	else:
+		node_vs_eth[node1[0]] += 1
+	link_param = (subnet_ip, ((node0[0], node0[1], "eth" + str(node_vs_eth[node0[0]])),
+	                          (node1[0], node1[1], "eth" + str(node_vs_eth[node1[0]]))), link_info[2])
+	return link_name, node_vs_eth, link_param
+
+
+def get_node_vs_ip(nodes, links):
+	"""
+	Collect all ip addresses of every node
+	:param nodes: node information in the format as defined in the config file.
+	:param links: link information as generated by generate_link_param.
+	:return: dict node -> list of ips, base ip first
+	"""
+	node_vs_ip = {}
+	for node_name, node_param in nodes.items():
+		node_vs_ip[node_name] = [node_param[0]]
+	for link_name, link_param in links.items():
+		for endpoint in link_param[1]:
+			ips = node_vs_ip.setdefault(endpoint[0], [])
+			if endpoint[1] not in ips:
+				ips.append(endpoint[1])
+	return node_vs_ip
+
+
+def complete_nodes(nodes, links):
+	"""
+	Fill in the base link and address of nodes the config does not address
+	:param nodes: node information in the format as defined in the config file.
+	:param links: link information as generated by generate_link_param.
+	:return: dict node -> (ip, base link) of all nodes with links
+	"""
+	complete = {}
+	for link_name, link_param in links.items():
+		for node_name, ip, _ in link_param[1]:
+			if node_name in complete:
+				continue
+			ip_given, base_link = nodes.get(node_name, (None, None))
+			if base_link is None:
+				base_link = link_name
+			if ip_given is None and base_link != link_name:
+				continue
+			complete[node_name] = (ip_given or ip, base_link)
+	for node_name, (ip, base_link) in nodes.items():
+		if node_name not in complete and ip is None:
+			raise ValueError(f"Node {node_name} has no address on its base link {base_link}")
+	# the nodes of the config keep their order
+	return dict({node_name: complete.get(node_name, node_param) for node_name, node_param in nodes.items()},
+	            **{node_name: node_param for node_name, node_param in complete.items() if node_name not in nodes})
+
+
+def compile_topology(nodes, config_links, roles=None, ipam=None):
+	"""
+	Compile a topology into a plan
+	:param nodes: node information in the format as defined in the config file. Nodes
+	missing or without ip get the address of their base link, which defaults to their
+	first link.
+	:param config_links: links in the format as defined in the config file. Links whose
+	endpoints are given by name only get a subnet from the address pool.
+	:param roles: dict node -> role as defined in images, nodes missing get DEFAULT_ROLE
+	:param ipam: dict of ipam.AddressPool arguments (pool, prefix, gateway)
+	:return: plan dict with the keys nodes, links, node_vs_eth, node_vs_ip, subnets
+	(link -> subnet), interfaces (node -> {interface: (ip, link)}), tc (node ->
+	{interface: tc_params}), connections (as returned by routing.build_graph), roles
+	(node -> role), images (node -> image), ipam (settings of the address pool) and routing
+	"""
+	pool = AddressPool(**(ipam or {}))
+	node_vs_eth = {}
+	links = {}
+	for link_info, subnet in address_links(config_links, pool):
+		link_name, node_vs_eth, link_param = generate_link_param(node_vs_eth, link_info, subnet)
+		if link_name in links:
+			raise ValueError(f"Link {link_name} is defined twice")
+		links[link_name] = link_param
+	nodes = complete_nodes(nodes or {}, links)
+	roles = {node_name: (roles or {}).get(node_name, DEFAULT_ROLE) for node_name in nodes}
+	interfaces = {}
+	tc = {}
+	for link_name, link_param in links.items():
+		for node_name, ip, interface in link_param[1]:
+			interfaces.setdefault(node_name, {})[interface] = (ip, link_name)
+			tc.setdefault(node_name, {})[interface] = tuple(link_param[2])
+	graph, connections = build_graph(links)
+	return {"nodes": dict(nodes), "links": links, "node_vs_eth": node_vs_eth,
+	        "node_vs_ip": get_node_vs_ip(nodes, links),
+	        "subnets": {link_name: link_param[0] for link_name, link_param in links.items()},
+	        "interfaces": interfaces, "tc": tc, "connections": connections, "roles": roles,
+	        "images": {node_name: image_of(role) for node_name, role in roles.items()},
+	        "ipam": pool.settings(), "routing": compute_routing(links, graph)}
+
+
+def plan_routes(plan, node):
+	"""
+	Route table of a node
+	:param plan: compiled plan
+	:param node: name of node
+	:return: list of (destination ip, gateway ip, interface)
+	"""
+	if node not in plan["connections"]:
+		return []
+	return node_routes(plan["routing"], node, plan["connections"], plan["node_vs_ip"])
+
+
+def _plan_paths(digest, cache_dir):
+	base = os.path.join(cache_dir, digest)
+	return base + ".json", base + ".npz"
+
+
+def save_plan(plan, digest, cache_dir=PLAN_CACHE_DIR):
+	"""
+	Store a plan in the cache. The files are written under temporary names and
+	renamed, so a concurrent reader never sees a partial plan.
+	:param plan: compiled plan
+	:param digest: hash of the plan as returned by config_hash
+	:param cache_dir: cache directory
+	:return: None
+	"""
+	os.makedirs(cache_dir, exist_ok=True)
+	json_path, npz_path = _plan_paths(digest, cache_dir)
+	routing = plan["routing"]
+	tmp_npz = f"{npz_path}.{os.getpid()}.tmp.npz"
+	np.savez(tmp_npz, next_hop=routing["next_hop"])
+	os.replace(tmp_npz, npz_path)
+	data = {key: value for key, value in plan.items() if key != "routing"}
+	data["version"] = COMPILER_VERSION
+	data["routing_nodes"] = routing["nodes"]
+	tmp_json = f"{json_path}.{os.getpid()}.tmp"
+	with open(tmp_json, "w") as f:
+		json.dump(data, f)
+	os.replace(tmp_json, json_path)
+
+
+def load_plan(digest, cache_dir=PLAN_CACHE_DIR):
+	"""
+	Load a plan from the cache
+	:param digest: hash of the plan as returned by config_hash
+	:param cache_dir: cache directory
+	:return: plan or None if it is not cached
+	"""
+	json_path, npz_path = _plan_paths(digest, cache_dir)
+	try:
+		with open(json_path, "r") as f:
+			data = json.load(f)
+		matrices = np.load(npz_path)
+	except (OSError, ValueError):
+		return None
+	if data.get("version") != COMPILER_VERSION:
+		return None
+	# json turns the tuples into lists
+	data["tc"] = {node: {interface: tuple(tc_params) for interface, tc_params in params.items()}
+	              for node, params in data["tc"].items()}
+	data["connections"] = {node: {neighbor: tuple(value) for neighbor, value in neighbors.items()}
+	                       for node, neighbors in data["connections"].items()}
+	data["routing"] = {"nodes": data.pop("routing_nodes"), "next_hop": matrices["next_hop"]}
+	return data
+
+
+def get_plan(config, cache_dir=PLAN_CACHE_DIR):
+	"""
+	Plan of a topology config, compiled only if the config changed since the
+	last compilation
+	:param config: name of the config module
+	:param cache_dir: cache directory
+	:return: tuple (plan, True if it was loaded from the cache)
+	"""
+	digest = config_hash(config)
+	plan = load_plan(digest, cache_dir)
+	if plan is not None:
+		return plan, True
+	module = importlib.import_module(config)
+	plan = compile_topology(getattr(module, "nodes", None), module.links, getattr(module, "roles", None),
+	                        getattr(module, "ipam", None))
+	plan["hash"] = digest
+	plan["config"] = config
+	save_plan(plan, digest, cache_dir)
+	return plan, False
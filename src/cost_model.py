@@ -0,0 +1,141 @@
+"""
+Cost model of the provisioning operations, used to estimate setup times.
+
+Every step of the provisioner costs one backend operation: creating a network,
+starting a container, connecting a network or an exec whose cost grows with
+the number of lines of its tc or ip batch. The costs are kept per backend type
+in the state store. They start out as rough defaults and are replaced by the
+step times measured in every setup, so they reflect the daemon, the machine
+and the concurrency of the last run. The estimate simulates the dependency
+graph of the provisioner on the given number of workers.
+"""
+import heapq
+import json
+from collections import deque
+
+COST_KEY = "cost_model"
+OPERATIONS = ["network", "container", "connect", "exec", "exec_line"]
+# seconds per operation at 8 workers, until a setup measured them
+DEFAULT_COSTS = {
+	"EngineBackend": {"network": 0.08, "container": 0.4, "connect": 0.15, "exec": 0.06, "exec_line": 0.0002},
+	"CliBackend": {"network": 0.2, "container": 0.55, "connect": 0.25, "exec": 0.15, "exec_line": 0.0002},
+	"ShardedBackend": {"network": 0.3, "container": 0.55, "connect": 0.25, "exec": 0.15, "exec_line": 0.0002},
+	"NetnsBackend": {"network": 0.02, "container": 0.12, "connect": 0.05, "exec": 0.02, "exec_line": 0.0001},
+	"FakeBackend": {"network": 0.0, "container": 0.0, "connect": 0.0, "exec": 0.0, "exec_line": 0.0},
+}
+# phase of the provisioner -> operation of its steps
+PHASE_OPERATIONS = {"subnets": "network", "containers": "container", "connects": "connect"}
+
+
+class CostModel:
+	"""
+	Cost of the provisioning operations of one backend type
+	:param kind: name of the backend class
+	:param costs: dict operation -> seconds, the defaults of the kind for operations missing
+	:param calibrated: run id of the setup the costs were measured in, None for the defaults
+	"""
+
+	def __init__(self, kind, costs=None, calibrated=None):
+		self.kind = kind
+		self.costs = dict(DEFAULT_COSTS.get(kind, DEFAULT_COSTS["EngineBackend"]), **(costs or {}))
+		self.calibrated = calibrated
+
+	@classmethod
+	def from_store(cls, store, kind):
+		"""
+		:param store: state_store.StateStore
+		:param kind: name of the backend class
+		:return: CostModel of the kind as calibrated by the last setup, the defaults if there was none
+		"""
+		stored = json.loads(store.get_meta(COST_KEY) or "{}").get(kind)
+		if stored is None:
+			return cls(kind)
+		return cls(kind, stored["costs"], stored["calibrated"])
+
+	def save(self, store):
+		"""
+		Keep the costs in the state store next to those of the other backend types
+		:param store: state_store.StateStore
+		:return: None
+		"""
+		models = json.loads(store.get_meta(COST_KEY) or "{}")
+		models[self.kind] = {"costs": self.costs, "calibrated": self.calibrated}
+		store.set_meta(COST_KEY, json.dumps(models))
+
+	def cost(self, operation, lines=0):
+		"""
+		:param operation: one of network, container, connect and exec
+		:param lines: number of lines of the batch passed to an exec
+		:return: estimated seconds of the operation
+		"""
+		if operation == "exec":
+			return self.costs["exec"] + lines * self.costs["exec_line"]
+		return self.costs.get(operation, 0.0)
+
+	def calibrate(self, provisioner, route_stats, run_id):
+		"""
+		Take the costs from the steps of a finished setup. An exec costs what the
+		route steps took, fitted linearly in the number of routes if they differ.
+		:param provisioner: provision.Provisioner that ran the setup
+		:param route_stats: dict node -> (number of routes, seconds) of the route steps
+		:param run_id: id of the run
+		:return: None
+		"""
+		durations = {}
+		for name, step in provisioner.steps.items():
+			operation = PHASE_OPERATIONS.get(step.phase)
+			# steps of the container pool cost something else than creating containers
+			if operation is None or step.duration is None or step.name.startswith("wire:"):
+				continue
+			durations.setdefault(operation, []).append(step.duration)
+		for operation, values in durations.items():
+			self.costs[operation] = sum(values) / len(values)
+		samples = list(route_stats.values())
+		if samples:
+			n_mean = sum(n for n, _ in samples) / len(samples)
+			t_mean = sum(t for _, t in samples) / len(samples)
+			variance = sum((n - n_mean) ** 2 for n, _ in samples)
+			if variance > 0:
+				slope = sum((n - n_mean) * (t - t_mean) for n, t in samples) / variance
+				self.costs["exec_line"] = max(0.0, slope)
+			self.costs["exec"] = max(0.0, t_mean - n_mean * self.costs["exec_line"])
+		if durations or samples:
+			self.calibrated = run_id
+
+	def estimate(self, provisioner, step_costs, workers):
+		"""
+		Simulate a provisioner running its steps on a number of workers. Like the
+		provisioner, steps are started in the order they became ready.
+		:param provisioner: provision.Provisioner with all steps added
+		:param step_costs: dict step name -> estimated seconds
+		:param workers: number of concurrent steps
+		:return: tuple (total seconds, dict phase -> (wall seconds, summed step seconds, number of steps))
+		"""
+		remaining = {name: len(step.deps) for name, step in provisioner.steps.items()}
+		dependents = {name: [] for name in provisioner.steps}
+		for name, step in provisioner.steps.items():
+			for dep in step.deps:
+				dependents[dep].append(name)
+		ready = deque(name for name, count in remaining.items() if count == 0)
+		running = []
+		now = 0.0
+		sequence = 0
+		phase_start, phase_end, phase_busy, phase_count = {}, {}, {}, {}
+		while ready or running:
+			while ready and len(running) < workers:
+				name = ready.popleft()
+				phase = provisioner.steps[name].phase
+				phase_start.setdefault(phase, now)
+				heapq.heappush(running, (now + step_costs[name], sequence, name))
+				sequence += 1
+			now, _, name = heapq.heappop(running)
+			phase = provisioner.steps[name].phase
+			phase_end[phase] = now
+			phase_busy[phase] = phase_busy.get(phase, 0.0) + step_costs[name]
+			phase_count[phase] = phase_count.get(phase, 0) + 1
+			for dependent in dependents[name]:
+				remaining[dependent] -= 1
+				if remaining[dependent] == 0:
+					ready.append(dependent)
+		return now, {phase: (phase_end[phase] - phase_start[phase], phase_busy[phase], phase_count[phase])
+		             for phase in phase_start}
@@ -0,0 +1,903 @@
+"""
+Backends executing the Docker operations of the testbed.
+
+EngineBackend talks to the Docker Engine API over the unix socket of the
+daemon and keeps a pool of persistent connections, so no docker CLI process is
+forked per operation. CliBackend runs the same operations with the docker CLI
+and is used when the daemon is not reachable over a local socket (e.g. a tcp
+or ssh DOCKER_HOST). FakeBackend does not touch Docker at all, it records the
+stream of calls and simulates the resulting networks and containers so setup
+logic can be tested and benchmarked without a daemon.
+
+All operations return an ExecResult. For operations other than exec the exit
+code is 0 on success and 1 on failure with the error message in stderr.
+
+With TESTBED_EXEC_AGENT=1 the Engine, CLI and netns backends run the execs of a node
+through a persistent agent in the node instead (see exec_agent.py).
+"""
+import fnmatch
+import http.client
+import io
+import json
+import os
+import queue
+import socket
+import struct
+import subprocess
+import tarfile
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import quote, urlencode
+
+ExecResult = namedtuple("ExecResult", ["exit_code", "stdout", "stderr"])
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+API_VERSION = "v1.41"
+
+
+def _ok():
+	return ExecResult(0, b"", b"")
+
+
+def _label_filters(labels):
+	# a label without value matches every resource carrying the label
+	return [key if value is None else f"{key}={value}" for key, value in (labels or {}).items()]
+
+
+def _has_labels(resource_labels, labels):
+	return all(key in resource_labels if value is None else resource_labels.get(key) == value
+	           for key, value in (labels or {}).items())
+
+
+def _ignore_patterns(path):
+	patterns = []
+	try:
+		with open(os.path.join(path, ".dockerignore")) as f:
+			for line in f:
+				line = line.strip()
+				if line and not line.startswith("#"):
+					negated = line.startswith("!")
+					patterns.append((negated, os.path.normpath(line.lstrip("!").strip("/"))))
+	except OSError:
+		pass
+	return patterns
+
+
+def _ignored(rel_path, patterns):
+	parts = rel_path.split("/")
+	prefixes = ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+	ignored = False
+	for negated, pattern in patterns:
+		if any(fnmatch.fnmatchcase(prefix, pattern) for prefix in prefixes):
+			ignored = not negated
+	return ignored
+
+
+def context_files(path):
+	"""
+	Files of a build context that are sent to the daemon, honoring .dockerignore
+	:param path: path of the build context
+	:return: sorted list of paths relative to the context
+	"""
+	patterns = _ignore_patterns(path)
+	exceptions = [pattern for negated, pattern in patterns if negated]
+	files = []
+	for root, dirs, names in os.walk(path):
+		rel_root = os.path.relpath(root, path)
+		rel_root = "" if rel_root == "." else rel_root + "/"
+		# an ignored directory is only entered if an exception may match below it
+		dirs[:] = [d for d in dirs if not _ignored(rel_root + d, patterns)
+		           or any(e.startswith(rel_root + d + "/") or e.startswith("*") for e in exceptions)]
+		files += [rel_root + name for name in names if not _ignored(rel_root + name, patterns)
+		          or name in ("Dockerfile", ".dockerignore") and not rel_root]
+	return sorted(files)
+
+
+def _parse_size(text):
+	"""
+	:param text: size as printed by the docker CLI, e.g. 1.5MiB or 800kB
+	:return: bytes, None if the text is no size
+	"""
+	text = text.strip()
+	units = {"B": 1, "kB": 1e3, "KiB": 2 ** 10, "MB": 1e6, "MiB": 2 ** 20, "GB": 1e9, "GiB": 2 ** 30}
+	for unit in sorted(units, key=len, reverse=True):
+		if text.endswith(unit):
+			try:
+				return int(float(text[:-len(unit)]) * units[unit])
+			except ValueError:
+				return None
+	return None
+
+
+def _error(message):
+	if isinstance(message, str):
+		message = message.encode()
+	return ExecResult(1, b"", message)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+	"""
+	HTTP connection over a unix domain socket
+	:param socket_path: path of the socket
+	:param timeout: socket timeout in seconds
+	"""
+
+	def __init__(self, socket_path, timeout=None):
+		super().__init__("localhost", timeout=timeout)
+		self.socket_path = socket_path
+
+	def connect(self):
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		if self.timeout is not None:
+			sock.settimeout(self.timeout)
+		sock.connect(self.socket_path)
+		self.sock = sock
+
+
+class EngineBackend:
+	"""
+	Docker Engine API client with a pool of persistent unix socket connections
+	:param socket_path: path of the docker daemon socket
+	:param pool_size: maximum number of idle connections kept open
+	:param timeout: socket timeout in seconds, None blocks forever
+	:param exec_agent: run execs through agents in the containers, TESTBED_EXEC_AGENT=1 if None
+	"""
+
+	def __init__(self, socket_path=DEFAULT_SOCKET, pool_size=16, timeout=None, exec_agent=None):
+		self.socket_path = socket_path
+		self.timeout = timeout
+		self._pool = queue.LifoQueue(maxsize=pool_size)
+		self.agents = _agent_pool(self, exec_agent)
+
+	def _get_connection(self):
+		try:
+			return self._pool.get_nowait()
+		except queue.Empty:
+			return UnixHTTPConnection(self.socket_path, self.timeout)
+
+	def _put_connection(self, conn):
+		try:
+			self._pool.put_nowait(conn)
+		except queue.Full:
+			conn.close()
+
+	def request(self, method, path, body=None, params=None, headers=None, raw_body=None):
+		"""
+		Send a request to the Engine API over a pooled connection
+		:param method: HTTP method
+		:param path: API path without version prefix
+		:param body: object sent as json body
+		:param params: dict of query parameters
+		:param headers: additional headers
+		:param raw_body: bytes sent as body instead of json
+		:return: tuple (status, response body bytes)
+		"""
+		url = f"/{API_VERSION}{path}"
+		if params:
+			url += "?" + urlencode(params)
+		send_headers = dict(headers or {})
+		if body is not None:
+			raw_body = json.dumps(body).encode()
+			send_headers["Content-Type"] = "application/json"
+		for attempt in range(2):
+			conn = self._get_connection()
+			try:
+				conn.request(method, url, body=raw_body, headers=send_headers)
+				response = conn.getresponse()
+				data = response.read()
+			except (ConnectionError, http.client.HTTPException, OSError):
+				conn.close()
+				# a pooled connection may have been closed by the daemon, retry once on a new one
+				if attempt == 1:
+					raise
+				continue
+			if response.will_close:
+				conn.close()
+			else:
+				self._put_connection(conn)
+			return response.status, data
+
+	def _call(self, method, path, body=None, params=None, ok=(200, 201, 204)):
+		try:
+			status, data = self.request(method, path, body=body, params=params)
+		except OSError as e:
+			return _error(str(e)), None
+		if status not in ok:
+			try:
+				message = json.loads(data).get("message", data.decode())
+			except ValueError:
+				message = data.decode(errors="replace")
+			return _error(message), None
+		return ExecResult(0, data, b""), (json.loads(data) if data else None)
+
+	def ping(self):
+		"""
+		Check if the daemon is reachable
+		:return: True if the daemon answered
+		"""
+		try:
+			status, _ = self.request("GET", "/_ping")
+		except OSError:
+			return False
+		return status == 200
+
+	def create_network(self, name, subnet, labels=None, options=None):
+		"""
+		Create a bridge network
+		:param name: name of network
+		:param subnet: subnet of network in CIDR notation
+		:param labels: dict of labels
+		:param options: dict of driver options, e.g. com.docker.network.driver.mtu
+		:return: ExecResult
+		"""
+		body = {"Name": name, "CheckDuplicate": True, "Driver": "bridge",
+		        "IPAM": {"Config": [{"Subnet": subnet}]}, "Labels": labels or {}, "Options": options or {}}
+		return self._call("POST", "/networks/create", body)[0]
+
+	def remove_network(self, name):
+		"""
+		Remove a network
+		:param name: name of network
+		:return: ExecResult
+		"""
+		return self._call("DELETE", f"/networks/{quote(name)}")[0]
+
+	def connect_network(self, network, container, ip=None):
+		"""
+		Connect a container to a network on its next free interface
+		:param network: name of network
+		:param container: name of container
+		:param ip: ipv4 address of the container on the network
+		:return: ExecResult
+		"""
+		body = {"Container": container, "EndpointConfig": {}}
+		if ip is not None:
+			body["EndpointConfig"]["IPAMConfig"] = {"IPv4Address": ip}
+		return self._call("POST", f"/networks/{quote(network)}/connect", body)[0]
+
+	def disconnect_network(self, network, container, force=False):
+		"""
+		Disconnect a container from a network
+		:param network: name of network
+		:param container: name of container
+		:param force: force the disconnect
+		:return: ExecResult
+		"""
+		body = {"Container": container, "Force": force}
+		return self._call("POST", f"/networks/{quote(network)}/disconnect", body)[0]
+
+	def run_container(self, name, image, network, ip, privileged=True, labels=None):
+		"""
+		Create and start a container attached to a network
+		:param name: name of container
+		:param image: name of image
+		:param network: network on eth0, host to share the network namespace of the host
+		:param ip: ipv4 address on network, None to let docker choose
+		:param privileged: run the container privileged
+		:param labels: dict of labels
+		:return: ExecResult
+		"""
+		body = {"Image": image, "Labels": labels or {},
+		        "HostConfig": {"Privileged": privileged, "NetworkMode": network}}
+		if ip is not None:
+			body["NetworkingConfig"] = {"EndpointsConfig": {network: {"IPAMConfig": {"IPv4Address": ip}}}}
+		result, _ = self._call("POST", "/containers/create", body, params={"name": name})
+		if result.exit_code != 0:
+			return result
+		return self._call("POST", f"/containers/{quote(name)}/start")[0]
+
+	def remove_container(self, name, force=True):
+		"""
+		Remove a container
+		:param name: name of container
+		:param force: kill the container if it is running
+		:return: ExecResult
+		"""
+		if self.agents is not None:
+			self.agents.discard(name)
+		return self._call("DELETE", f"/containers/{quote(name)}", params={"force": int(force)})[0]
+
+	def rename_container(self, name, new_name):
+		"""
+		Rename a container
+		:param name: name of container
+		:param new_name: new name of container
+		:return: ExecResult
+		"""
+		if self.agents is not None:
+			self.agents.discard(name)
+		return self._call("POST", f"/containers/{quote(name)}/rename", params={"name": new_name})[0]
+
+	def container_networks(self, name):
+		"""
+		Networks a container is connected to
+		:param name: name of container
+		:return: list of network names, empty if the container does not exist
+		"""
+		_, container = self._call("GET", f"/containers/{quote(name)}/json")
+		if not container:
+			return []
+		return list((container.get("NetworkSettings") or {}).get("Networks") or {})
+
+	def container_memory(self, name):
+		"""
+		Memory used by a container, without the page cache like docker stats shows it
+		:param name: name of container
+		:return: bytes, None if the container does not exist or reports no usage
+		"""
+		_, stats = self._call("GET", f"/containers/{quote(name)}/stats", params={"stream": 0})
+		memory = (stats or {}).get("memory_stats") or {}
+		if "usage" not in memory:
+			return None
+		cache = memory.get("stats", {}).get("inactive_file", memory.get("stats", {}).get("cache", 0))
+		return memory["usage"] - cache
+
+	def list_containers(self, labels=None):
+		"""
+		List containers, including stopped ones
+		:param labels: dict of labels the containers must carry, a value of None matches any value
+		:return: list of container names
+		"""
+		params = {"all": 1}
+		if labels:
+			params["filters"] = json.dumps({"label": _label_filters(labels)})
+		_, containers = self._call("GET", "/containers/json", params=params)
+		return [c["Names"][0].lstrip("/") for c in containers or []]
+
+	def list_networks(self, labels=None):
+		"""
+		List networks
+		:param labels: dict of labels the networks must carry, a value of None matches any value
+		:return: list of network names
+		"""
+		params = {}
+		if labels:
+			params["filters"] = json.dumps({"label": _label_filters(labels)})
+		_, networks = self._call("GET", "/networks", params=params)
+		return [n["Name"] for n in networks or []]
+
+	def inspect_image(self, name):
+		"""
+		Inspect an image
+		:param name: name of image
+		:return: dict as returned by the API, None if the image does not exist
+		"""
+		return self._call("GET", f"/images/{quote(name)}/json")[1]
+
+	def build_image(self, name, path, dockerfile="Dockerfile", labels=None):
+		"""
+		Build an image from a directory
+		:param name: tag of image
+		:param path: path of build context
+		:param dockerfile: path of Dockerfile relative to the context
+		:param labels: dict of labels
+		:return: ExecResult with the build log in stdout
+		"""
+		context = io.BytesIO()
+		with tarfile.open(fileobj=context, mode="w") as tar:
+			for rel_path in context_files(path):
+				tar.add(os.path.join(path, rel_path), arcname=rel_path, recursive=False)
+		params = {"t": name, "dockerfile": dockerfile, "labels": json.dumps(labels or {})}
+		try:
+			status, data = self.request("POST", "/build", params=params, raw_body=context.getvalue(),
+			                            headers={"Content-Type": "application/x-tar"})
+		except OSError as e:
+			return _error(str(e))
+		if status != 200:
+			return _error(data)
+		for line in data.splitlines():
+			try:
+				message = json.loads(line)
+			except ValueError:
+				continue
+			if "error" in message:
+				return ExecResult(1, data, message["error"].encode())
+		return ExecResult(0, data, b"")
+
+	def _create_exec(self, container, cmd, stdin):
+		body = {"AttachStdin": stdin, "AttachStdout": True, "AttachStderr": True, "Tty": False, "Cmd": cmd}
+		result, created = self._call("POST", f"/containers/{quote(container)}/exec", body)
+		if result.exit_code != 0:
+			return result, None
+		return result, created["Id"]
+
+	def exec(self, container, cmd, stdin=None):
+		"""
+		Run a command in a container and wait for it to finish
+		:param container: name of container
+		:param cmd: command as list of arguments
+		:param stdin: bytes written to stdin of the command
+		:return: ExecResult
+		"""
+		if self.agents is not None:
+			result = self.agents.exec(container, cmd, stdin)
+			if result is not None:
+				return result
+		result, exec_id = self._create_exec(container, cmd, stdin is not None)
+		if exec_id is None:
+			return result
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			stream, error = self._start_exec(sock, exec_id)
+			if error is not None:
+				return error
+			if stdin is not None:
+				sock.sendall(stdin)
+				sock.shutdown(socket.SHUT_WR)
+			stdout, stderr = _read_frames(stream)
+		except OSError as e:
+			return _error(str(e))
+		finally:
+			sock.close()
+		_, info = self._call("GET", f"/exec/{exec_id}/json")
+		exit_code = info.get("ExitCode") if info else None
+		return ExecResult(exit_code if exit_code is not None else 1, stdout, stderr)
+
+	def _start_exec(self, sock, exec_id):
+		# the start request hijacks the connection, so it gets one of its own
+		sock.connect(self.socket_path)
+		body = json.dumps({"Detach": False, "Tty": False}).encode()
+		sock.sendall(f"POST /{API_VERSION}/exec/{exec_id}/start HTTP/1.1\r\n"
+		             f"Host: localhost\r\nContent-Type: application/json\r\n"
+		             f"Connection: Upgrade\r\nUpgrade: tcp\r\n"
+		             f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+		stream = sock.makefile("rb")
+		status_line = stream.readline().decode()
+		while stream.readline() not in (b"\r\n", b"\n", b""):
+			pass
+		if " 101 " not in status_line and " 200 " not in status_line:
+			return stream, _error(status_line)
+		return stream, None
+
+	def open_exec(self, container, cmd):
+		"""
+		Start a command in a container and keep its stdin and stdout open
+		:param container: name of container
+		:param cmd: command as list of arguments
+		:return: channel to the command with write, read and close, None if it could not be started
+		"""
+		_, exec_id = self._create_exec(container, cmd, True)
+		if exec_id is None:
+			return None
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			stream, error = self._start_exec(sock, exec_id)
+		except OSError:
+			error = True
+		if error is not None:
+			sock.close()
+			return None
+		return _SocketChannel(sock, stream)
+
+	def exec_detached(self, container, cmd):
+		"""
+		Start a command in a container without waiting for it
+		:param container: name of container
+		:param cmd: command as list of arguments
+		:return: tuple (ExecResult, exec id), use inspect_exec to follow the command
+		"""
+		body = {"AttachStdin": False, "AttachStdout": False, "AttachStderr": False, "Tty": False, "Cmd": cmd}
+		result, created = self._call("POST", f"/containers/{quote(container)}/exec", body)
+		if result.exit_code != 0:
+			return result, None
+		result, _ = self._call("POST", f"/exec/{created['Id']}/start", {"Detach": True, "Tty": False})
+		return result, created["Id"]
+
+	def inspect_exec(self, exec_id):
+		"""
+		Inspect a command started with exec_detached
+		:param exec_id: id returned by exec_detached
+		:return: dict with Running, ExitCode and Pid
+		"""
+		return self._call("GET", f"/exec/{exec_id}/json")[1]
+
+
+def _read_frames(stream):
+	"""
+	Demultiplex the stdout and stderr frames of a non tty exec stream
+	:param stream: binary file like object
+	:return: tuple (stdout bytes, stderr bytes)
+	"""
+	out = [io.BytesIO(), io.BytesIO(), io.BytesIO()]
+	while True:
+		header = stream.read(8)
+		if len(header) < 8:
+			break
+		kind, size = struct.unpack(">BxxxL", header)
+		out[kind if kind in (1, 2) else 1].write(stream.read(size))
+	return out[1].getvalue(), out[2].getvalue()
+
+
+class _SocketChannel:
+	"""
+	Stdin and stdout of an exec on a hijacked Engine API connection. Output on
+	stderr is dropped.
+	"""
+
+	def __init__(self, sock, stream):
+		self.sock = sock
+		self.stream = stream
+		self.buffer = bytearray()
+
+	def write(self, data):
+		self.sock.sendall(data)
+
+	def read(self, size):
+		while len(self.buffer) < size:
+			header = self.stream.read(8)
+			if len(header) < 8:
+				break
+			kind, frame_size = struct.unpack(">BxxxL", header)
+			frame = self.stream.read(frame_size)
+			if kind != 2:
+				self.buffer += frame
+		data = bytes(self.buffer[:size])
+		del self.buffer[:size]
+		return data
+
+	def close(self):
+		try:
+			self.sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+		self.sock.close()
+
+
+class _ProcessChannel:
+	"""
+	Stdin and stdout of a command run by a local process. Output on stderr is dropped.
+	"""
+
+	def __init__(self, process):
+		self.process = process
+
+	def write(self, data):
+		self.process.stdin.write(data)
+		self.process.stdin.flush()
+
+	def read(self, size):
+		return self.process.stdout.read(size)
+
+	def close(self):
+		try:
+			self.process.stdin.close()
+		except OSError:
+			pass
+		self.process.kill()
+		self.process.wait()
+
+
+def _agent_pool(backend, exec_agent):
+	if exec_agent is None:
+		exec_agent = os.environ.get("TESTBED_EXEC_AGENT") == "1"
+	if not exec_agent:
+		return None
+	# imported here, the agents build on the results of this module
+	from exec_agent import AgentPool
+	return AgentPool(backend)
+
+
+class CliBackend:
+	"""
+	Backend running the docker CLI, used when the daemon socket is not local.
+	The methods behave like the ones of EngineBackend.
+	:param docker: docker executable
+	:param host: daemon to talk to as accepted by docker -H, DOCKER_HOST if None
+	:param exec_agent: run execs through agents in the containers, TESTBED_EXEC_AGENT=1 if None
+	"""
+
+	def __init__(self, docker="docker", host=None, exec_agent=None):
+		self.docker = docker
+		self.host = host
+		self.agents = _agent_pool(self, exec_agent)
+
+	def _run(self, args, stdin=None):
+		result = subprocess.run([self.docker] + (["-H", self.host] if self.host else []) + args, input=stdin,
+		                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		return ExecResult(result.returncode, result.stdout, result.stderr)
+
+	@staticmethod
+	def _labels(labels):
+		args = []
+		for key, value in (labels or {}).items():
+			args += ["--label", f"{key}={value}"]
+		return args
+
+	def ping(self):
+		return self._run(["version"]).exit_code == 0
+
+	def create_network(self, name, subnet, labels=None, options=None):
+		options = [f"--opt={key}={value}" for key, value in (options or {}).items()]
+		return self._run(["network", "create", f"--subnet={subnet}"] + self._labels(labels) + options + [name])
+
+	def remove_network(self, name):
+		return self._run(["network", "rm", name])
+
+	def connect_network(self, network, container, ip=None):
+		return self._run(["network", "connect"] + (["--ip", ip] if ip else []) + [network, container])
+
+	def disconnect_network(self, network, container, force=False):
+		return self._run(["network", "disconnect"] + (["-f"] if force else []) + [network, container])
+
+	def run_container(self, name, image, network, ip, privileged=True, labels=None):
+		return self._run(["run", "-d", "--name", name, "--network", network] + (["--ip", ip] if ip else [])
+		                 + (["--privileged"] if privileged else []) + self._labels(labels) + [image])
+
+	def remove_container(self, name, force=True):
+		if self.agents is not None:
+			self.agents.discard(name)
+		return self._run(["rm"] + (["-f"] if force else []) + [name])
+
+	def rename_container(self, name, new_name):
+		if self.agents is not None:
+			self.agents.discard(name)
+		return self._run(["rename", name, new_name])
+
+	def container_networks(self, name):
+		result = self._run(["inspect", "-f", "{{json .NetworkSettings.Networks}}", name])
+		if result.exit_code != 0:
+			return []
+		return list(json.loads(result.stdout) or {})
+
+	def container_memory(self, name):
+		result = self._run(["stats", "--no-stream", "--format", "{{.MemUsage}}", name])
+		if result.exit_code != 0:
+			return None
+		return _parse_size(result.stdout.decode().split("/")[0])
+
+	def list_containers(self, labels=None):
+		filters = [f"--filter=label={label}" for label in _label_filters(labels)]
+		result = self._run(["ps", "-a", "--format", "{{.Names}}"] + filters)
+		return result.stdout.decode().split()
+
+	def list_networks(self, labels=None):
+		filters = [f"--filter=label={label}" for label in _label_filters(labels)]
+		result = self._run(["network", "ls", "--format", "{{.Name}}"] + filters)
+		return result.stdout.decode().split()
+
+	def inspect_image(self, name):
+		result = self._run(["image", "inspect", name])
+		if result.exit_code != 0:
+			return None
+		return json.loads(result.stdout)[0]
+
+	def build_image(self, name, path, dockerfile="Dockerfile", labels=None):
+		return self._run(["build", "-t", name, "-f", os.path.join(path, dockerfile)]
+		                 + self._labels(labels) + [path])
+
+	def exec(self, container, cmd, stdin=None):
+		if self.agents is not None:
+			result = self.agents.exec(container, cmd, stdin)
+			if result is not None:
+				return result
+		return self._run(["exec"] + (["-i"] if stdin is not None else []) + [container] + list(cmd), stdin)
+
+	def open_exec(self, container, cmd):
+		try:
+			process = subprocess.Popen([self.docker] + (["-H", self.host] if self.host else [])
+			                           + ["exec", "-i", container] + list(cmd), stdin=subprocess.PIPE,
+			                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		except OSError:
+			return None
+		return _ProcessChannel(process)
+
+	def exec_detached(self, container, cmd):
+		return self._run(["exec", "-d", container] + list(cmd)), None
+
+	def inspect_exec(self, exec_id):
+		return None
+
+
+class FakeBackend:
+	"""
+	Backend simulating the Docker daemon in memory. Every call is recorded in
+	calls as a tuple (operation, arguments) so the command stream of the setup
+	can be inspected, and an optional per operation latency makes it possible to
+	benchmark the setup logic. The methods behave like the ones of EngineBackend.
+	:param latency: dict operation -> seconds slept per call
+	:param exec_handler: callable (container, cmd, stdin) -> ExecResult answering exec calls
+	"""
+
+	def __init__(self, latency=None, exec_handler=None):
+		self.latency = latency or {}
+		self.exec_handler = exec_handler
+		self.calls = []
+		self.networks = {}
+		self.containers = {}
+		self.images = {}
+		self._lock = threading.Lock()
+
+	def _record(self, operation, **args):
+		with self._lock:
+			self.calls.append((operation, args))
+		if self.latency.get(operation):
+			time.sleep(self.latency[operation])
+
+	def count(self, operation=None):
+		"""
+		Number of recorded calls
+		:param operation: only count calls of this operation
+		:return: number of calls
+		"""
+		return sum(1 for op, _ in self.calls if operation is None or op == operation)
+
+	def ping(self):
+		return True
+
+	def create_network(self, name, subnet, labels=None, options=None):
+		self._record("create_network", name=name, subnet=subnet, labels=labels, options=options)
+		with self._lock:
+			if name in self.networks:
+				return _error(f"network with name {name} already exists")
+			self.networks[name] = {"subnet": subnet, "labels": labels or {}, "options": options or {},
+			                       "containers": set()}
+		return _ok()
+
+	def remove_network(self, name):
+		self._record("remove_network", name=name)
+		with self._lock:
+			network = self.networks.get(name)
+			if network is None:
+				return _error(f"network {name} not found")
+			if network["containers"]:
+				return _error(f"network {name} has active endpoints")
+			del self.networks[name]
+		return _ok()
+
+	def connect_network(self, network, container, ip=None):
+		self._record("connect_network", network=network, container=container, ip=ip)
+		with self._lock:
+			if network not in self.networks or container not in self.containers:
+				return _error(f"no such network or container: {network} {container}")
+			# like docker the interface index is never reused within a container
+			self.containers[container]["next_if"] += 1
+			interfaces = self.containers[container]["interfaces"]
+			interfaces.append((f"eth{self.containers[container]['next_if']}", network, ip))
+			self.networks[network]["containers"].add(container)
+		return _ok()
+
+	def disconnect_network(self, network, container, force=False):
+		self._record("disconnect_network", network=network, container=container)
+		with self._lock:
+			if network not in self.networks or container not in self.containers:
+				return _error(f"no such network or container: {network} {container}")
+			interfaces = self.containers[container]["interfaces"]
+			interfaces[:] = [i for i in interfaces if i[1] != network]
+			self.networks[network]["containers"].discard(container)
+		return _ok()
+
+	def run_container(self, name, image, network, ip, privileged=True, labels=None):
+		self._record("run_container", name=name, image=image, network=network, ip=ip, labels=labels)
+		with self._lock:
+			if name in self.containers:
+				return _error(f"container name {name} is already in use")
+			if network == "host":
+				self.containers[name] = {"image": image, "labels": labels or {}, "interfaces": [], "next_if": -1}
+				return _ok()
+			if network not in self.networks:
+				return _error(f"network {network} not found")
+			self.containers[name] = {"image": image, "labels": labels or {},
+			                         "interfaces": [("eth0", network, ip)], "next_if": 0}
+			self.networks[network]["containers"].add(name)
+		return _ok()
+
+	def remove_container(self, name, force=True):
+		self._record("remove_container", name=name)
+		with self._lock:
+			container = self.containers.pop(name, None)
+			if container is None:
+				return _error(f"no such container: {name}")
+			for _, network, _ in container["interfaces"]:
+				if network in self.networks:
+					self.networks[network]["containers"].discard(name)
+		return _ok()
+
+	def rename_container(self, name, new_name):
+		self._record("rename_container", name=name, new_name=new_name)
+		with self._lock:
+			if name not in self.containers:
+				return _error(f"no such container: {name}")
+			if new_name in self.containers:
+				return _error(f"container name {new_name} is already in use")
+			self.containers[new_name] = self.containers.pop(name)
+			for network in self.networks.values():
+				if name in network["containers"]:
+					network["containers"].discard(name)
+					network["containers"].add(new_name)
+		return _ok()
+
+	def container_networks(self, name):
+		with self._lock:
+			container = self.containers.get(name)
+			return [network for _, network, _ in container["interfaces"]] if container else []
+
+	def container_memory(self, name):
+		with self._lock:
+			return 0 if name in self.containers else None
+
+	def list_containers(self, labels=None):
+		with self._lock:
+			return [name for name, c in self.containers.items() if _has_labels(c["labels"], labels)]
+
+	def list_networks(self, labels=None):
+		with self._lock:
+			return [name for name, n in self.networks.items() if _has_labels(n["labels"], labels)]
+
+	def inspect_image(self, name):
+		return self.images.get(name)
+
+	def build_image(self, name, path, dockerfile="Dockerfile", labels=None):
+		self._record("build_image", name=name, path=path, dockerfile=dockerfile, labels=labels)
+		self.images[name] = {"Config": {"Labels": labels or {}}}
+		return _ok()
+
+	def exec(self, container, cmd, stdin=None):
+		self._record("exec", container=container, cmd=list(cmd), stdin=stdin)
+		if container not in self.containers:
+			return _error(f"no such container: {container}")
+		if self.exec_handler is not None:
+			return self.exec_handler(container, cmd, stdin)
+		if list(cmd) == ["ip", "-j", "addr", "show"]:
+			# the addresses docker assigned, enough for callers mapping ips to interfaces
+			with self._lock:
+				interfaces = [{"ifname": name, "addr_info": [{"family": "inet", "local": ip}] if ip else []}
+				              for name, _, ip in self.containers[container]["interfaces"]]
+			return ExecResult(0, json.dumps(interfaces).encode(), b"")
+		return _ok()
+
+	def exec_detached(self, container, cmd):
+		self._record("exec_detached", container=container, cmd=list(cmd))
+		if container not in self.containers:
+			return _error(f"no such container: {container}"), None
+		return _ok(), f"fake-{len(self.calls)}"
+
+	def inspect_exec(self, exec_id):
+		return {"Running": True, "ExitCode": None, "Pid": 0}
+
+
+_backend = None
+
+
+def default_backend():
+	"""
+	Backend of a single daemon selected with the TESTBED_BACKEND environment
+	variable (engine, cli, netns or fake). By default the Engine API is used if the
+	daemon socket is local and the CLI otherwise.
+	:return: new backend instance
+	"""
+	kind = os.environ.get("TESTBED_BACKEND")
+	docker_host = os.environ.get("DOCKER_HOST", f"unix://{DEFAULT_SOCKET}")
+	if kind == "fake":
+		return FakeBackend()
+	if kind == "netns":
+		# imported here, the netns backend builds on the results of this module
+		from netns_backend import NetnsBackend
+		return NetnsBackend()
+	if kind == "cli" or not docker_host.startswith("unix://"):
+		return CliBackend()
+	return EngineBackend(docker_host[len("unix://"):])
+
+
+def get_backend():
+	"""
+	Backend used by the testbed. If the state store holds a testbed spread over
+	several daemons this is a sharding.ShardedBackend, otherwise the default_backend.
+	:return: backend instance shared by the process
+	"""
+	global _backend
+	if _backend is None:
+		# imported here, sharding builds on the backends of this module
+		from sharding import stored_backend
+		_backend = stored_backend() or default_backend()
+	return _backend
+
+
+def set_backend(backend):
+	"""
+	Replace the backend used by the testbed, e.g. with a FakeBackend
+	:param backend: backend instance
+	:return: None
+	"""
+	global _backend
+	_backend = backend
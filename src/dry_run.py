@@ -0,0 +1,142 @@
+"""
+Dry run of a setup.
+
+The steps of the provisioner are run one at a time in the order the
+provisioner would start them, against a backend recording the docker commands
+instead of running them. The commands are written as a shell script, every
+step as a comment followed by its commands, and batches passed on stdin as
+here-documents. The cost of every step is estimated with the cost model from
+the commands it recorded, and the provisioner is simulated on the configured
+number of workers to estimate the setup time.
+"""
+import contextlib
+import io
+import shlex
+from collections import deque
+from docker_backend import CliBackend, ExecResult
+from provision import PHASES
+
+# docker subcommand -> operation of the cost model
+COMMAND_OPERATIONS = {("network", "create"): "network", ("run",): "container",
+                      ("network", "connect"): "connect", ("exec",): "exec"}
+
+
+class DryRunBackend(CliBackend):
+	"""
+	Backend recording the docker commands of all changes in a log instead of
+	running them. Queries find an empty daemon.
+	:param log: list the tuples (operation, lines of stdin, command) are appended to
+	:param host: daemon as accepted by docker -H, shown in the commands
+	"""
+
+	def __init__(self, log=None, host=None):
+		super().__init__(host=host, exec_agent=False)
+		self.log = log if log is not None else []
+
+	def _run(self, args, stdin=None):
+		command = shlex.join([self.docker] + (["-H", self.host] if self.host else []) + args)
+		lines = 0
+		if stdin is not None:
+			script = stdin.decode()
+			lines = script.count("\n")
+			command += f" <<'EOF'\n{script}EOF"
+		operation = COMMAND_OPERATIONS.get(tuple(args[:2])) or COMMAND_OPERATIONS.get(tuple(args[:1]))
+		self.log.append((operation, lines, command))
+		return ExecResult(0, b"", b"")
+
+	def ping(self):
+		return True
+
+	def container_networks(self, name):
+		return []
+
+	def container_memory(self, name):
+		return None
+
+	def list_containers(self, labels=None):
+		return []
+
+	def list_networks(self, labels=None):
+		return []
+
+	def inspect_image(self, name):
+		return None
+
+
+def record_plan(provisioner, log, out):
+	"""
+	Run the steps of a provisioner one at a time in dependency order. The
+	backend has to be a DryRunBackend (or a sharding.ShardedBackend of them)
+	appending to log.
+	:param provisioner: provision.Provisioner with all steps added
+	:param log: log of the recording backends
+	:param out: file the commands are written to
+	:return: dict step name -> list of (operation, lines of stdin) of the commands of the step
+	"""
+	remaining = {name: set(step.deps) for name, step in provisioner.steps.items()}
+	dependents = {name: [] for name in provisioner.steps}
+	for name, step in provisioner.steps.items():
+		for dep in step.deps:
+			dependents[dep].append(name)
+	ready = deque(name for name, deps in remaining.items() if not deps)
+	operations = {}
+	while ready:
+		name = ready.popleft()
+		step = provisioner.steps[name]
+		start = len(log)
+		# the steps print what they do, the plan shows it as commands
+		with contextlib.redirect_stdout(io.StringIO()):
+			step.action()
+		out.write(f"# [{step.phase}] {name}\n")
+		for _, _, command in log[start:]:
+			out.write(command + "\n")
+		operations[name] = [(operation, lines) for operation, lines, _ in log[start:]]
+		for dependent in dependents[name]:
+			remaining[dependent].discard(name)
+			if not remaining[dependent]:
+				ready.append(dependent)
+	if len(operations) != len(provisioner.steps):
+		raise ValueError("Dependency cycle between provisioning steps")
+	return operations
+
+
+def format_duration(seconds):
+	"""
+	:param seconds: duration
+	:return: duration as h:mm:ss, or in seconds if shorter than a minute
+	"""
+	if seconds < 60:
+		return f"{seconds:.1f}s"
+	minutes, seconds = divmod(round(seconds), 60)
+	return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}"
+
+
+def report_plan(provisioner, operations, model, workers):
+	"""
+	Print the number of steps and commands of every phase and the estimated setup time
+	:param provisioner: provision.Provisioner with all steps added
+	:param operations: dict step name -> list of (operation, lines) as returned by record_plan
+	:param model: cost_model.CostModel of the backend
+	:param workers: number of concurrent steps
+	:return: estimated seconds of the setup
+	"""
+	step_costs = {name: sum(model.cost(operation, lines) for operation, lines in step_operations if operation)
+	              for name, step_operations in operations.items()}
+	total, phase_times = model.estimate(provisioner, step_costs, workers)
+	commands, lines = {}, {}
+	for name, step_operations in operations.items():
+		phase = provisioner.steps[name].phase
+		commands[phase] = commands.get(phase, 0) + len(step_operations)
+		lines[phase] = lines.get(phase, 0) + sum(n for _, n in step_operations)
+	print("\nDry run plan:")
+	for phase in PHASES + [p for p in phase_times if p not in PHASES]:
+		if phase not in phase_times:
+			continue
+		wall, busy, count = phase_times[phase]
+		batch = f" {lines[phase]:>7} batch lines" if lines[phase] else ""
+		print(f"  {phase:<12} {count:>5} steps {commands[phase]:>6} commands  est. wall {format_duration(wall):>9}"
+		      f"  step time {format_duration(busy):>9}{batch}")
+	source = f"measured in run {model.calibrated}" if model.calibrated else "defaults, not calibrated yet"
+	print(f"  estimated setup time {format_duration(total)} with {workers} workers "
+	      f"({model.kind} costs {source})")
+	return total
@@ -0,0 +1,246 @@
+"""
+Persistent exec agents of the nodes.
+
+Every docker exec creates and starts an exec instance in the daemon, which
+costs tens of milliseconds. With TESTBED_EXEC_AGENT=1 the Engine, CLI and
+netns backends instead start the agent of node_agent.py once per node, over a
+single exec whose stdin and stdout stay open, and send every later exec of the
+node to it as a request. Requests of several threads share the agent and run
+concurrently in the node. exec returns the same ExecResult as a plain exec, so
+setup and the experiment helpers are unchanged; AgentPool.request additionally
+returns the start and end time of the command on the node and streams its
+output to a callback.
+
+The agent needs python3 in the node. If it cannot be started the backend falls
+back to plain execs for that node and tries the agent again after
+AGENT_RETRY seconds. Agents are ended when their container is removed or
+renamed, at most max_agents are kept open, the least recently used idle one is
+closed first.
+"""
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from docker_backend import ExecResult
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "node_agent.py")) as f:
+	AGENT_SOURCE = f.read()
+AGENT_CMD = ["python3", "-c", AGENT_SOURCE]
+# seconds to wait for the agent to report ready
+AGENT_START_TIMEOUT = 10
+# seconds before starting the agent of a node is tried again after it failed
+AGENT_RETRY = 30
+MAX_AGENTS = 256
+
+AgentResult = namedtuple("AgentResult", ["exit_code", "stdout", "stderr", "start", "end"])
+
+
+class Agent:
+	"""
+	Connection to the agent of one node
+	:param channel: channel to the agent as returned by open_exec of a backend
+	"""
+
+	def __init__(self, channel):
+		self.channel = channel
+		self.alive = True
+		self.ready = threading.Event()
+		self._pending = {}
+		self._next_id = 1
+		self._lock = threading.Lock()
+		self._write_lock = threading.Lock()
+		threading.Thread(target=self._read_loop, daemon=True).start()
+
+	def _read_loop(self):
+		try:
+			while True:
+				size = self.channel.read(4)
+				if len(size) < 4:
+					break
+				header = json.loads(self.channel.read(struct.unpack(">L", size)[0]))
+				data = self.channel.read(header["len"]) if header["len"] else b""
+				if header.get("ready"):
+					self.ready.set()
+					continue
+				with self._lock:
+					request = self._pending.get(header["id"])
+				if request is None:
+					continue
+				if "exit" in header:
+					request["result"] = AgentResult(header["exit"], b"".join(request[1]), b"".join(request[2]),
+					                                header["start"], header["ts"])
+					with self._lock:
+						del self._pending[header["id"]]
+					request["done"].set()
+					continue
+				request[header["stream"]].append(data)
+				if request["callback"] is not None:
+					try:
+						request["callback"](header["stream"], header["ts"], data)
+					except Exception as e:
+						# the output is still collected, only the callback of the request is dropped
+						print(f"Output callback of {request['cmd'][0]} raised {type(e).__name__}: {e}")
+						request["callback"] = None
+		except (OSError, ValueError, KeyError):
+			pass
+		finally:
+			# every exit of the loop releases the pending requests
+			self.alive = False
+			self.ready.set()
+			with self._lock:
+				pending = list(self._pending.values())
+				self._pending.clear()
+			for request in pending:
+				request["done"].set()
+
+	def request(self, cmd, stdin=None, callback=None):
+		"""
+		Run a command in the node
+		:param cmd: command as list of arguments
+		:param stdin: bytes written to stdin of the command
+		:param callback: function (stream, timestamp, bytes) called with every chunk of
+		stdout (stream 1) and stderr (stream 2) as it arrives
+		:return: AgentResult, None if the agent ended before the command finished
+		"""
+		request = {1: [], 2: [], "callback": callback, "cmd": list(cmd), "done": threading.Event(), "result": None}
+		with self._lock:
+			if not self.alive:
+				return None
+			request_id = self._next_id
+			self._next_id += 1
+			self._pending[request_id] = request
+		header = json.dumps({"id": request_id, "cmd": list(cmd), "stdin": stdin is not None,
+		                     "len": len(stdin or b"")}).encode()
+		try:
+			with self._write_lock:
+				self.channel.write(struct.pack(">L", len(header)) + header + (stdin or b""))
+		except OSError:
+			self.close()
+		request["done"].wait()
+		return request["result"]
+
+	def busy(self):
+		"""
+		:return: True if commands of the agent are running
+		"""
+		with self._lock:
+			return bool(self._pending)
+
+	def close(self):
+		"""
+		End the agent, commands still running in the node are not waited for
+		:return: None
+		"""
+		self.alive = False
+		self.channel.close()
+
+
+class AgentPool:
+	"""
+	Agents of the nodes of one backend
+	:param backend: backend providing open_exec
+	:param max_agents: maximum number of agents kept open
+	"""
+
+	def __init__(self, backend, max_agents=MAX_AGENTS):
+		self.backend = backend
+		self.max_agents = max_agents
+		self._agents = OrderedDict()
+		self._failed = {}
+		self._starting = {}
+		self._lock = threading.Lock()
+
+	def _start(self, container):
+		channel = self.backend.open_exec(container, AGENT_CMD)
+		if channel is None:
+			return None
+		agent = Agent(channel)
+		if not agent.ready.wait(AGENT_START_TIMEOUT) or not agent.alive:
+			agent.close()
+			return None
+		return agent
+
+	def agent(self, container):
+		"""
+		:param container: name of container
+		:return: the running agent of the container, started if needed, None if it cannot be started
+		"""
+		with self._lock:
+			agent = self._agents.get(container)
+			if agent is not None and agent.alive:
+				self._agents.move_to_end(container)
+				return agent
+			self._agents.pop(container, None)
+			if time.monotonic() - self._failed.get(container, -AGENT_RETRY) < AGENT_RETRY:
+				return None
+			start_lock = self._starting.setdefault(container, threading.Lock())
+		with start_lock:
+			with self._lock:
+				agent = self._agents.get(container)
+			if agent is not None and agent.alive:
+				return agent
+			agent = self._start(container)
+			with self._lock:
+				if agent is None:
+					self._failed[container] = time.monotonic()
+					return None
+				self._failed.pop(container, None)
+				self._agents[container] = agent
+				idle = [name for name, other in self._agents.items() if not other.busy() and name != container]
+				for name in idle[:max(0, len(self._agents) - self.max_agents)]:
+					self._agents.pop(name).close()
+			return agent
+
+	def request(self, container, cmd, stdin=None, callback=None):
+		"""
+		Run a command in a container through its agent
+		:param container: name of container
+		:param cmd: command as list of arguments
+		:param stdin: bytes written to stdin of the command
+		:param callback: function (stream, timestamp, bytes) receiving the output as it arrives
+		:return: AgentResult, None if the container has no agent
+		"""
+		agent = self.agent(container)
+		if agent is None:
+			return None
+		result = agent.request(cmd, stdin, callback)
+		if result is None:
+			return AgentResult(1, b"", b"exec agent ended before the command finished\n", None, None)
+		return result
+
+	def exec(self, container, cmd, stdin=None):
+		"""
+		:param container: name of container
+		:param cmd: command as list of arguments
+		:param stdin: bytes written to stdin of the command
+		:return: ExecResult, None if the container has no agent and a plain exec is needed
+		"""
+		result = self.request(container, cmd, stdin)
+		if result is None:
+			return None
+		return ExecResult(result.exit_code, result.stdout, result.stderr)
+
+	def discard(self, container):
+		"""
+		End the agent of a container
+		:param container: name of container
+		:return: None
+		"""
+		with self._lock:
+			agent = self._agents.pop(container, None)
+			self._failed.pop(container, None)
+		if agent is not None:
+			agent.close()
+
+	def close(self):
+		"""
+		End all agents
+		:return: None
+		"""
+		with self._lock:
+			agents = list(self._agents.values())
+			self._agents.clear()
+		for agent in agents:
+			agent.close()
@@ -2,18 +2,20 @@
 An experiment measuring the gap values of hops for a linear network topology
 with a capacity determined bottleneck
 """
-import os
 import sys
 import matplotlib.pyplot as plt
 import seaborn as sns
 
 sys.path.append('..')
-from utils.experiment_helpers import iperf_server, iperf_client, pathneck, parse_pathneck_result, capture_traffic
+from utils.experiment_helpers import capture_traffic
+from utils.measurement_runner import Job, MeasurementRunner
+from utils.tool_parsers import PathneckHop
+from utils.traffic_manager import Flow, TrafficManager
 
 # global variables
 n_iter = 20
 bottleneck_bandwidth = []
-data = {'00': [], '01': [], '02': [], '03': [], '04': [], '05': []}
+data = {hop: [] for hop in range(6)}
 
 server = {'name': 's1', 'ip': '10.0.4.4'}
 contesting_client = 'c2'
@@ -21,23 +23,26 @@ client = 'c1'
 bottleneck_link_dest = {'name': 'r6', 'ip': '10.0.8.4'}
 bottleneck_router = 'r5'
 
-# setup iperf server on bottleneck link destination
-iperf_server(bottleneck_link_dest['name'])
-
-# generate background traffic
-iperf_client(contesting_client, bottleneck_link_dest['ip'])
+# generate background traffic to the bottleneck link destination
+traffic = TrafficManager()
+traffic.start([Flow(contesting_client, bottleneck_link_dest['name'], ip=bottleneck_link_dest['ip'])])
 
 # capture traffic on bottleneck router
-capture_traffic(bottleneck_router, 'eth1', '180', 'traffic-capture')
+capture = capture_traffic(bottleneck_router, 'eth1', '180', 'traffic-capture')
+
+
+def collect(job_result):
+	print(job_result.stdout.decode('utf-8'))
+	# the first hop pathneck flags as bottleneck
+	for record in job_result.records or []:
+		if isinstance(record, PathneckHop) and record.bottleneck:
+			bottleneck_bandwidth.append(record.bandwidth)
+			data[record.hop].append(record.bandwidth)
+			break
+
 
-# run pathneck from client to server
-for i in range(n_iter):
-	result = pathneck(client, server['ip'])
-	print(result)
-	bottleneck, bottleneck_bw = parse_pathneck_result(result)
-	if bottleneck is not None:
-		bottleneck_bandwidth.append(bottleneck_bw)
-		data[bottleneck].append(bottleneck_bw)
+# run pathneck from client to server, one probe at a time on the client, a hung probe is killed and retried
+MeasurementRunner(timeout=120).run([Job("pathneck", client, server['ip'], tag=i) for i in range(n_iter)], collect)
 
 # plot bandwidth test results
 total_data = [data[key] for key in data]
@@ -49,7 +54,6 @@ plt.title(f'Bandwidth [Mbits/sec] distributions of detected bottlenecks')
 plt.savefig('pathneck-boxplot')
 plt.show()
 
-os.system(f"docker exec {contesting_client} pkill iperf")
-os.system(f"docker exec {client} pkill iperf")
-os.system(f"docker exec {server['name']} pkill iperf")
-os.system(f"docker exec {bottleneck_link_dest['name']} pkill iperf")
+traffic.stop()
+# tcpdump flushes and ends if the probes finished within its duration
+capture.stop()
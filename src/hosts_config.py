@@ -0,0 +1,11 @@
+"""
+Hosts Format:
+{host_name: {"docker_host": daemon, "address": ip between the hosts, "capacity": relative share of nodes}, ...}
+
+The sample spreads a topology over two Docker-in-Docker daemons on this machine, started with
+docker run -d --privileged --name h1 -e DOCKER_TLS_CERTDIR= docker:dind
+docker run -d --privileged --name h2 -e DOCKER_TLS_CERTDIR= docker:dind
+and addressed by their ip on the default bridge (docker inspect -f '{{.NetworkSettings.IPAddress}}' h1).
+"""
+hosts = {"h1": {"docker_host": "tcp://172.17.0.2:2375", "address": "172.17.0.2", "capacity": 1},
+         "h2": {"docker_host": "tcp://172.17.0.3:2375", "address": "172.17.0.3", "capacity": 1}}
@@ -0,0 +1,127 @@
+"""
+Images of the testbed nodes.
+
+Every node has a role selecting its image. The default role node uses the
+full image of the repository Dockerfile, the other roles use the slimmer
+variants in the images directory:
+
+- router: iproute2, ping and tcpdump, for nodes that only forward traffic
+- host: adds traceroute and iperf, for endpoints of measurement traffic
+- probe: adds Pathneck, built in a separate stage so no compiler is shipped
+
+Images are content addressed. An image is labeled with a hash of its
+Dockerfile and build context, and the build is skipped if the existing image
+carries the hash of the current files.
+"""
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from docker_backend import context_files, get_backend
+
+HASH_LABEL = "net-measure.content-hash"
+DEFAULT_ROLE = "node"
+# role -> (image name, build context, Dockerfile relative to the context)
+ROLES = {"node": ("node-image", "..", "Dockerfile"),
+         "router": ("node-image-router", "../images/router", "Dockerfile"),
+         "host": ("node-image-host", "../images/host", "Dockerfile"),
+         "probe": ("node-image-probe", "../images/probe", "Dockerfile")}
+
+
+def image_of(role):
+	"""
+	:param role: role of a node
+	:return: name of the image of the role
+	"""
+	if role not in ROLES:
+		raise ValueError(f"Unknown role {role}, expected one of {', '.join(ROLES)}")
+	return ROLES[role][0]
+
+
+def content_hash(path, dockerfile="Dockerfile"):
+	"""
+	Hash of a build context
+	:param path: path of the build context
+	:param dockerfile: path of the Dockerfile relative to the context
+	:return: hex digest over the names and contents of all files sent to the daemon
+	"""
+	digest = hashlib.sha256()
+	files = context_files(path)
+	if dockerfile not in files:
+		files.append(dockerfile)
+	for rel_path in files:
+		digest.update(rel_path.encode() + b"\0")
+		with open(os.path.join(path, rel_path), "rb") as f:
+			digest.update(f.read())
+		digest.update(b"\0")
+	return digest.hexdigest()
+
+
+def build_role_image(role, force=False):
+	"""
+	Build the image of a role unless it is up to date
+	:param role: role of a node
+	:param force: build even if the image is up to date
+	:return: exit status of the build, 0 if it was skipped
+	"""
+	name, path, dockerfile = ROLES[role]
+	backend = get_backend()
+	digest = content_hash(path, dockerfile)
+	image = backend.inspect_image(name)
+	labels = ((image or {}).get("Config") or {}).get("Labels") or {}
+	if not force and labels.get(HASH_LABEL) == digest:
+		print(f"Image {name} is up to date ({digest[:12]}), skipping build")
+		return 0
+	print(f"docker build -t {name} -f {os.path.join(path, dockerfile)} {path}")
+	start = time.monotonic()
+	result = backend.build_image(name, path, dockerfile, labels={HASH_LABEL: digest})
+	if result.exit_code != 0:
+		print(result.stderr.decode('utf-8', errors='replace').strip())
+	else:
+		print(f"Built {name} in {time.monotonic() - start:.1f}s")
+	return result.exit_code
+
+
+def build_images(roles, force=False):
+	"""
+	Build the images of all roles used by a topology
+	:param roles: iterable of roles
+	:param force: build even if the images are up to date
+	:return: exit status of the first failing build, 0 on success
+	"""
+	for role in sorted(set(roles)):
+		image_of(role)
+		status = build_role_image(role, force)
+		if status != 0:
+			return status
+	return 0
+
+
+def report_roles(roles, start_latency, workers=16):
+	"""
+	Print the mean container start latency and memory usage of the nodes of every role
+	:param roles: dict node -> role
+	:param start_latency: dict node -> seconds it took to start the container
+	:param workers: number of concurrent stats requests
+	:return: dict role -> (number of nodes, mean start latency, mean memory in bytes or None)
+	"""
+	backend = get_backend()
+	nodes = list(roles)
+	with ThreadPoolExecutor(max_workers=max(1, min(workers, len(nodes)))) as pool:
+		memory = dict(zip(nodes, pool.map(backend.container_memory, nodes)))
+	summary = {}
+	print("\nNode roles:")
+	for role in sorted(set(roles.values())):
+		members = [node for node in nodes if roles[node] == role]
+		latencies = [start_latency[node] for node in members if node in start_latency]
+		usage = [memory[node] for node in members if memory[node] is not None]
+		mean_latency = sum(latencies) / len(latencies) if latencies else None
+		mean_memory = sum(usage) / len(usage) if usage else None
+		summary[role] = (len(members), mean_latency, mean_memory)
+		line = f"  {role:<8} {image_of(role):<20} {len(members):>5} nodes"
+		if mean_latency is not None:
+			line += f"  start {mean_latency:7.3f}s"
+		if mean_memory is not None:
+			line += f"  memory {mean_memory / 2 ** 20:8.1f}MiB"
+		print(line)
+	return summary
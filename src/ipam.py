@@ -0,0 +1,194 @@
+"""
+IP address management of the links.
+
+A link given by node names only gets a point-to-point subnet of PREFIX bits
+out of a pool, allocated in increasing order, and its endpoints get the first
+free addresses of the subnet. Docker reserves the first host address of a
+bridge network for the gateway, so the default prefix is /29; a /30 or /31
+only works without a gateway. Links with explicit addresses keep the /24 of
+their first endpoint, those subnets are reserved in the pool so allocated
+subnets never overlap them.
+
+Allocation is deterministic: the same config always gets the same addresses.
+The settings of the pool are stored in the state store with the subnets of
+all links, so links added at runtime get the lowest subnet not in use and
+removing a link frees its subnet without moving any other address.
+"""
+import bisect
+import ipaddress
+import json
+
+DEFAULT_POOL = "10.0.0.0/8"
+DEFAULT_PREFIX = 29
+
+
+def endpoint_name(endpoint):
+	"""
+	:param endpoint: endpoint of a link in the config, (name, ip) or name
+	:return: name of the node
+	"""
+	return endpoint if isinstance(endpoint, str) else endpoint[0]
+
+
+def endpoint_ip(endpoint):
+	"""
+	:param endpoint: endpoint of a link in the config, (name, ip) or name
+	:return: ip of the endpoint, None if it is not given
+	"""
+	if isinstance(endpoint, str) or len(endpoint) < 2:
+		return None
+	return endpoint[1]
+
+
+def legacy_subnet(ip):
+	"""
+	:param ip: address of the first endpoint of a link with explicit addresses
+	:return: the /24 containing the address
+	"""
+	return ".".join(ip.split(".")[:3]) + ".0/24"
+
+
+class AddressPool:
+	"""
+	Pool of point-to-point subnets
+	:param pool: network the subnets are allocated from
+	:param prefix: prefix length of the subnets
+	:param gateway: the first host address of every subnet is taken by a gateway
+	"""
+
+	def __init__(self, pool=DEFAULT_POOL, prefix=DEFAULT_PREFIX, gateway=True):
+		self.pool = ipaddress.ip_network(pool)
+		self.prefix = prefix
+		self.gateway = gateway
+		if prefix < self.pool.prefixlen or prefix > 31:
+			raise ValueError(f"Cannot allocate /{prefix} subnets from {pool}")
+		if self._n_hosts() < 2 + gateway:
+			raise ValueError(f"A /{prefix} subnet has no room for two endpoints"
+			                 + (" and a gateway, use a prefix of at most 29" if gateway else ""))
+		self.size = 2 ** (32 - prefix)
+		self.capacity = self.pool.num_addresses // self.size
+		# sorted disjoint (first, last) address ranges in use, as integers
+		self._used = []
+		# index of the lowest subnet that may be free
+		self._next = 0
+
+	def _n_hosts(self):
+		return 2 if self.prefix == 31 else 2 ** (32 - self.prefix) - 2
+
+	def settings(self):
+		"""
+		:return: dict of the pool settings, stored as json in the state store
+		"""
+		return {"pool": str(self.pool), "prefix": self.prefix, "gateway": self.gateway}
+
+	@classmethod
+	def from_settings(cls, settings, subnets=()):
+		"""
+		Restore a pool
+		:param settings: json string as stored from settings(), None for the defaults
+		:param subnets: subnets in use
+		:return: AddressPool
+		"""
+		pool = cls(**(json.loads(settings) if settings else {}))
+		for subnet in subnets:
+			pool.reserve(subnet)
+		return pool
+
+	def _overlaps(self, first, last):
+		i = bisect.bisect_right(self._used, (last, float("inf")))
+		return i > 0 and self._used[i - 1][1] >= first
+
+	def reserve(self, subnet):
+		"""
+		Mark a subnet as used
+		:param subnet: subnet in CIDR notation
+		:return: None
+		:raises ValueError: if the subnet overlaps a used one
+		"""
+		network = ipaddress.ip_network(subnet, strict=False)
+		first, last = int(network.network_address), int(network.broadcast_address)
+		if self._overlaps(first, last):
+			raise ValueError(f"Subnet {subnet} overlaps a subnet in use")
+		bisect.insort(self._used, (first, last))
+
+	def release(self, subnet):
+		"""
+		Return a subnet to the pool
+		:param subnet: subnet in CIDR notation
+		:return: None
+		"""
+		network = ipaddress.ip_network(subnet, strict=False)
+		key = (int(network.network_address), int(network.broadcast_address))
+		i = bisect.bisect_left(self._used, key)
+		if i < len(self._used) and self._used[i] == key:
+			del self._used[i]
+			base = int(self.pool.network_address)
+			if key[0] >= base:
+				self._next = min(self._next, (key[0] - base) // self.size)
+
+	def allocate(self):
+		"""
+		Allocate the lowest free subnet
+		:return: subnet in CIDR notation
+		:raises ValueError: if the pool is exhausted
+		"""
+		base = int(self.pool.network_address)
+		while self._next < self.capacity:
+			first = base + self._next * self.size
+			last = first + self.size - 1
+			if not self._overlaps(first, last):
+				bisect.insort(self._used, (first, last))
+				self._next += 1
+				return f"{ipaddress.ip_address(first)}/{self.prefix}"
+			# skip the used range the candidate overlaps
+			i = bisect.bisect_right(self._used, (last, float("inf"))) - 1
+			self._next = max(self._next + 1, (self._used[i][1] + 1 - base + self.size - 1) // self.size)
+		raise ValueError(f"Address pool {self.pool} has no free /{self.prefix} subnet left")
+
+	def endpoints(self, subnet):
+		"""
+		Addresses of the two endpoints of a link
+		:param subnet: subnet allocated by allocate
+		:return: tuple (ip of the first endpoint, ip of the second endpoint)
+		"""
+		network = ipaddress.ip_network(subnet)
+		first = int(network.network_address) + (0 if network.prefixlen == 31 else 1 + self.gateway)
+		return str(ipaddress.ip_address(first)), str(ipaddress.ip_address(first + 1))
+
+
+def address_links(config_links, pool):
+	"""
+	Assign subnets and addresses to the links of a config
+	:param config_links: links in the format as defined in the config file, endpoints
+	without an ip get addresses from the pool
+	:param pool: AddressPool
+	:return: list of (link_info with the ips of both endpoints, subnet)
+	:raises ValueError: if explicit subnets or addresses collide
+	"""
+	addressed = [None] * len(config_links)
+	subnets = {}
+	ips = {}
+	# explicit subnets first, so allocated ones go around them
+	for i, link_info in enumerate(config_links):
+		ip0, ip1 = endpoint_ip(link_info[0]), endpoint_ip(link_info[1])
+		if ip0 is None or ip1 is None:
+			continue
+		subnet = legacy_subnet(ip0)
+		name = f"{endpoint_name(link_info[0])}-{endpoint_name(link_info[1])}"
+		if subnet in subnets:
+			raise ValueError(f"Links {subnets[subnet]} and {name} share the subnet {subnet}")
+		for ip in (ip0, ip1):
+			if ip in ips:
+				raise ValueError(f"Address {ip} of link {name} is already used by link {ips[ip]}")
+			ips[ip] = name
+		subnets[subnet] = name
+		pool.reserve(subnet)
+		addressed[i] = (link_info, subnet)
+	for i, link_info in enumerate(config_links):
+		if addressed[i] is not None:
+			continue
+		subnet = pool.allocate()
+		ip0, ip1 = pool.endpoints(subnet)
+		addressed[i] = (((endpoint_name(link_info[0]), ip0), (endpoint_name(link_info[1]), ip1), link_info[2]),
+		                subnet)
+	return addressed
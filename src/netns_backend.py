@@ -0,0 +1,254 @@
+"""
+Backend building the topology out of Linux network namespaces.
+
+Every node is a network namespace instead of a container and every network a
+Linux bridge in the namespace of the host, so a node costs a few kernel
+objects and comes up in milliseconds. Connecting a node to a network creates a
+veth pair with one end on the bridge and the other end moved into the
+namespace of the node, named eth0, eth1, ... in the order of the connects like
+docker names them. Commands run on a node with ip netns exec, so tc, the
+routes and the experiment helpers work unchanged. The nodes share the file
+system of the host, the tools the experiments run (ping, iperf, tcpdump,
+pathneck, ...) have to be installed on the host.
+
+Namespaces and bridges carry no labels, so the labels, interfaces and subnets
+are kept in json files in REGISTRY_DIR, which like the namespaces does not
+survive a reboot. The methods behave like the ones of
+docker_backend.EngineBackend. Selected with TESTBED_BACKEND=netns, needs root.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import threading
+from docker_backend import ExecResult, _ProcessChannel, _agent_pool, _error, _has_labels, _ok
+
+REGISTRY_DIR = "/run/net-measure"
+
+
+def _short_name(prefix, name):
+	# interface names are limited to 15 characters
+	return prefix + hashlib.sha1(name.encode()).hexdigest()[:11]
+
+
+def _run(cmd, stdin=None):
+	result = subprocess.run(cmd, input=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	return ExecResult(result.returncode, result.stdout, result.stderr)
+
+
+def _ip_batch(commands, namespace=None, force=False):
+	script = "".join(command + "\n" for command in commands)
+	return _run(["ip"] + (["-n", namespace] if namespace else []) + (["-force"] if force else []) + ["-batch", "-"],
+	            script.encode())
+
+
+class NetnsBackend:
+	"""
+	Backend running every node in a network namespace of this host
+	:param registry_dir: directory of the registry of nodes and networks
+	:param exec_agent: run execs through agents in the namespaces, TESTBED_EXEC_AGENT=1 if None
+	"""
+
+	def __init__(self, registry_dir=REGISTRY_DIR, exec_agent=None):
+		self.registry_dir = registry_dir
+		for kind in ("nodes", "networks"):
+			os.makedirs(os.path.join(registry_dir, kind), exist_ok=True)
+		self._processes = {}
+		self._lock = threading.Lock()
+		self.agents = _agent_pool(self, exec_agent)
+
+	def _path(self, kind, name):
+		return os.path.join(self.registry_dir, kind, name + ".json")
+
+	def _read(self, kind, name):
+		try:
+			with open(self._path(kind, name)) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+	def _write(self, kind, name, entry):
+		path = self._path(kind, name)
+		with open(f"{path}.{threading.get_ident()}.tmp", "w") as f:
+			json.dump(entry, f)
+		os.replace(f"{path}.{threading.get_ident()}.tmp", path)
+
+	def _delete(self, kind, name):
+		try:
+			os.remove(self._path(kind, name))
+		except OSError:
+			pass
+
+	def _list(self, kind, labels):
+		names = []
+		for file_name in sorted(os.listdir(os.path.join(self.registry_dir, kind))):
+			if file_name.endswith(".json"):
+				entry = self._read(kind, file_name[:-len(".json")])
+				if entry is not None and _has_labels(entry["labels"], labels):
+					names.append(file_name[:-len(".json")])
+		return names
+
+	def ping(self):
+		return _run(["ip", "netns", "list"]).exit_code == 0
+
+	def create_network(self, name, subnet, labels=None, options=None):
+		if self._read("networks", name) is not None:
+			return _error(f"network with name {name} already exists")
+		bridge = _short_name("nmb", name)
+		mtu = (options or {}).get("com.docker.network.driver.mtu")
+		result = _ip_batch([f"link add {bridge} type bridge"] + ([f"link set {bridge} mtu {mtu}"] if mtu else [])
+		                   + [f"link set {bridge} up"])
+		if result.exit_code == 0:
+			self._write("networks", name, {"subnet": subnet, "bridge": bridge, "labels": labels or {}})
+		return result
+
+	def remove_network(self, name):
+		network = self._read("networks", name)
+		if network is None:
+			return _error(f"network {name} not found")
+		result = _run(["ip", "link", "del", network["bridge"]])
+		if result.exit_code == 0:
+			self._delete("networks", name)
+		return result
+
+	def connect_network(self, network, container, ip=None):
+		net = self._read("networks", network)
+		node = self._read("nodes", container)
+		if net is None or node is None:
+			return _error(f"no such network or container: {network} {container}")
+		if ip is None:
+			return _error("the netns backend needs the address of every interface")
+		# like docker the interface index is never reused within a node
+		node["next_if"] += 1
+		interface = f"eth{node['next_if']}"
+		host_end = _short_name("nmv", f"{container}/{network}")
+		peer = _short_name("nmp", f"{container}/{network}")
+		result = _ip_batch([f"link add {host_end} type veth peer name {peer} netns {container}",
+		                    f"link set {host_end} master {net['bridge']} up"])
+		if result.exit_code != 0:
+			return result
+		prefix = net["subnet"].split("/")[1]
+		result = _ip_batch([f"link set {peer} name {interface}", f"addr add {ip}/{prefix} dev {interface}",
+		                    f"link set {interface} up"], container)
+		if result.exit_code != 0:
+			_run(["ip", "link", "del", host_end])
+			return result
+		node["interfaces"].append([interface, network, ip])
+		self._write("nodes", container, node)
+		return result
+
+	def disconnect_network(self, network, container, force=False):
+		node = self._read("nodes", container)
+		if node is None:
+			return _error(f"no such container: {container}")
+		interfaces = [i for i in node["interfaces"] if i[1] == network]
+		if not interfaces:
+			return _error(f"container {container} is not connected to network {network}")
+		# deleting one end of a veth pair deletes both
+		result = _run(["ip", "link", "del", _short_name("nmv", f"{container}/{network}")])
+		if result.exit_code == 0 or force:
+			node["interfaces"] = [i for i in node["interfaces"] if i[1] != network]
+			self._write("nodes", container, node)
+		return result
+
+	def run_container(self, name, image, network, ip, privileged=True, labels=None):
+		if self._read("nodes", name) is not None:
+			return _error(f"container name {name} is already in use")
+		result = _run(["ip", "netns", "add", name])
+		if result.exit_code != 0:
+			return result
+		# a new namespace does not forward packets and answers on every interface
+		_ip_batch(["link set lo up"], name)
+		_run(["ip", "netns", "exec", name, "sysctl", "-q", "-e", "-w", "net.ipv4.ip_forward=1",
+		      "net.ipv4.conf.all.rp_filter=0", "net.ipv4.conf.default.rp_filter=0",
+		      "net.ipv6.conf.all.disable_ipv6=1", "net.ipv6.conf.default.disable_ipv6=1"])
+		self._write("nodes", name, {"image": image, "labels": labels or {}, "interfaces": [], "next_if": -1})
+		result = self.connect_network(network, name, ip)
+		if result.exit_code != 0:
+			self.remove_container(name)
+		return result
+
+	def remove_container(self, name, force=True):
+		node = self._read("nodes", name)
+		if node is None:
+			return _error(f"no such container: {name}")
+		# a process left in the namespace would keep it and its interfaces alive
+		if self.agents is not None:
+			self.agents.discard(name)
+		with self._lock:
+			processes = [p for (node_name, _), p in self._processes.items() if node_name == name]
+		for process in processes:
+			if process.poll() is None:
+				process.kill()
+		# and so would processes a command left running in the background
+		pids = _run(["ip", "netns", "pids", name]).stdout.split()
+		if pids:
+			_run(["kill", "-9"] + [pid.decode() for pid in pids])
+		# the veth pairs of a deleted namespace disappear asynchronously, a new node could not reuse their names
+		_ip_batch([f"link del {_short_name('nmv', f'{name}/{network}')}" for _, network, _ in node["interfaces"]],
+		          force=True)
+		result = _run(["ip", "netns", "del", name])
+		if result.exit_code == 0:
+			self._delete("nodes", name)
+		return result
+
+	def rename_container(self, name, new_name):
+		return _error("network namespaces cannot be renamed, the container pool needs docker")
+
+	def container_networks(self, name):
+		node = self._read("nodes", name)
+		return [network for _, network, _ in node["interfaces"]] if node else []
+
+	def container_memory(self, name):
+		# a namespace holds no processes of its own
+		return 0 if self._read("nodes", name) is not None else None
+
+	def list_containers(self, labels=None):
+		return self._list("nodes", labels)
+
+	def list_networks(self, labels=None):
+		return self._list("networks", labels)
+
+	def inspect_image(self, name):
+		return None
+
+	def build_image(self, name, path, dockerfile="Dockerfile", labels=None):
+		return _ok()
+
+	def exec(self, container, cmd, stdin=None):
+		if self._read("nodes", container) is None:
+			return _error(f"no such container: {container}")
+		if self.agents is not None:
+			result = self.agents.exec(container, cmd, stdin)
+			if result is not None:
+				return result
+		return _run(["ip", "netns", "exec", container] + list(cmd), stdin)
+
+	def open_exec(self, container, cmd):
+		try:
+			process = subprocess.Popen(["ip", "netns", "exec", container] + list(cmd), stdin=subprocess.PIPE,
+			                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		except OSError:
+			return None
+		return _ProcessChannel(process)
+
+	def exec_detached(self, container, cmd):
+		if self._read("nodes", container) is None:
+			return _error(f"no such container: {container}"), None
+		try:
+			process = subprocess.Popen(["ip", "netns", "exec", container] + list(cmd), stdin=subprocess.DEVNULL,
+			                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+			                           start_new_session=True)
+		except OSError as e:
+			return _error(str(e)), None
+		with self._lock:
+			self._processes[(container, process.pid)] = process
+		return _ok(), (container, process.pid)
+
+	def inspect_exec(self, exec_id):
+		with self._lock:
+			process = self._processes.get(tuple(exec_id))
+		if process is None:
+			return None
+		exit_code = process.poll()
+		return {"Running": exit_code is None, "ExitCode": exit_code, "Pid": process.pid}
@@ -0,0 +1,74 @@
+"""
+Exec agent running inside a node, started by exec_agent.AgentPool as
+python3 -c with this source over one long lived exec. It reads requests from
+stdin, runs each in a thread of its own and streams the output back on stdout.
+
+Every message in both directions is a 4 byte big endian length, a json header
+of that length and header["len"] bytes of payload. A request header is
+{"id": n, "cmd": [...], "stdin": bool} with the stdin of the command as
+payload. The replies to it are {"id": n, "stream": 1 or 2, "ts": t} headers
+with a chunk of stdout or stderr as payload, followed by
+{"id": n, "exit": exit status, "start": t, "ts": t}. On start the agent sends
+{"id": 0, "ready": true}. It only uses the standard library of python 3.
+"""
+import json
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+
+def main():
+	requests = sys.stdin.buffer
+	replies = sys.stdout.buffer
+	lock = threading.Lock()
+
+	def send(header, data=b""):
+		header["len"] = len(data)
+		encoded = json.dumps(header).encode()
+		with lock:
+			replies.write(struct.pack(">L", len(encoded)) + encoded + data)
+			replies.flush()
+
+	def pump(request_id, pipe, stream):
+		for chunk in iter(lambda: os.read(pipe.fileno(), 65536), b""):
+			send({"id": request_id, "stream": stream, "ts": time.time()}, chunk)
+
+	def run(request, stdin):
+		start = time.time()
+		try:
+			process = subprocess.Popen(request["cmd"], stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+			                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		except OSError as e:
+			send({"id": request["id"], "stream": 2, "ts": time.time()}, f"{e}\n".encode())
+			send({"id": request["id"], "exit": 127, "start": start, "ts": time.time()})
+			return
+		pumps = [threading.Thread(target=pump, args=(request["id"], process.stdout, 1)),
+		         threading.Thread(target=pump, args=(request["id"], process.stderr, 2))]
+		for thread in pumps:
+			thread.start()
+		if stdin is not None:
+			try:
+				process.stdin.write(stdin)
+				process.stdin.close()
+			except OSError:
+				pass
+		for thread in pumps:
+			thread.join()
+		exit_code = process.wait()
+		send({"id": request["id"], "exit": exit_code, "start": start, "ts": time.time()})
+
+	send({"id": 0, "ready": True})
+	while True:
+		size = requests.read(4)
+		if len(size) < 4:
+			break
+		request = json.loads(requests.read(struct.unpack(">L", size)[0]))
+		stdin = requests.read(request["len"])
+		threading.Thread(target=run, args=(request, stdin if request.get("stdin") else None), daemon=True).start()
+
+
+if __name__ == "__main__":
+	main()
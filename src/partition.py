@@ -0,0 +1,122 @@
+"""
+Partitioning of a topology across hosts.
+
+Nodes are spread over the hosts in proportion to their capacity while keeping
+the number of links between hosts small, since every such link is a VXLAN
+tunnel over the network between the hosts. The partition is grown greedily
+host by host from a peripheral node, always adding the frontier node with the
+most links into the part, and then refined by moving boundary nodes to the
+part they have the most links to as long as no part exceeds its share by more
+than the allowed imbalance.
+"""
+import heapq
+import math
+from collections import Counter, deque
+
+
+def adjacency(nodes, links):
+	"""
+	:param nodes: names of all nodes
+	:param links: link information as generated by generate_link_param.
+	:return: dict node -> Counter neighbor -> number of links
+	"""
+	neighbors = {node: Counter() for node in nodes}
+	for link_param in links.values():
+		(a, _, _), (b, _, _) = link_param[1]
+		neighbors.setdefault(a, Counter())[b] += 1
+		neighbors.setdefault(b, Counter())[a] += 1
+	return neighbors
+
+
+def _peripheral(neighbors, candidates):
+	# the last node reached by a breadth first search is far from the start
+	start = min(candidates)
+	seen = {start}
+	queue = deque([start])
+	node = start
+	while queue:
+		node = queue.popleft()
+		for neighbor in neighbors[node]:
+			if neighbor in candidates and neighbor not in seen:
+				seen.add(neighbor)
+				queue.append(neighbor)
+	return node
+
+
+def _grow(neighbors, unassigned, size):
+	part = set()
+	frontier = []
+	while len(part) < size and unassigned:
+		if not frontier:
+			node = _peripheral(neighbors, unassigned)
+		else:
+			_, node = heapq.heappop(frontier)
+			if node not in unassigned:
+				continue
+		part.add(node)
+		unassigned.discard(node)
+		for neighbor in neighbors[node]:
+			if neighbor in unassigned:
+				links_into_part = sum(count for n, count in neighbors[neighbor].items() if n in part)
+				heapq.heappush(frontier, (-links_into_part, neighbor))
+	return part
+
+
+def partition(nodes, links, capacities, imbalance=0.05, passes=10):
+	"""
+	Assign nodes to hosts
+	:param nodes: names of all nodes
+	:param links: link information as generated by generate_link_param.
+	:param capacities: dict host -> relative capacity
+	:param imbalance: fraction by which a host may exceed its share of the nodes
+	:param passes: maximum number of refinement passes
+	:return: dict node -> host
+	"""
+	hosts = sorted(capacities, key=lambda host: (-capacities[host], host))
+	neighbors = adjacency(nodes, links)
+	total = sum(capacities.values())
+	shares = {host: len(neighbors) * capacities[host] / total for host in hosts}
+	limits = {host: max(1, math.ceil(shares[host] * (1 + imbalance))) for host in hosts}
+
+	placement = {}
+	unassigned = set(neighbors)
+	for host in hosts[:-1]:
+		for node in _grow(neighbors, unassigned, round(shares[host])):
+			placement[node] = host
+	for node in unassigned:
+		placement[node] = hosts[-1]
+
+	sizes = Counter(placement.values())
+	for _ in range(passes):
+		moved = 0
+		for node in sorted(neighbors):
+			own = placement[node]
+			links_to = Counter()
+			for neighbor, count in neighbors[node].items():
+				links_to[placement[neighbor]] += count
+			best, best_gain = None, 0
+			for host, count in links_to.items():
+				if host == own or sizes[host] + 1 > limits[host]:
+					continue
+				gain = count - links_to[own]
+				# moves without gain are only made towards a smaller part
+				if gain > best_gain or gain == best_gain == 0 and best is None and sizes[host] + 1 < sizes[own]:
+					best, best_gain = host, gain
+			if best is not None:
+				placement[node] = best
+				sizes[own] -= 1
+				sizes[best] += 1
+				moved += 1
+		if not moved:
+			break
+	return placement
+
+
+def cut_links(links, placement):
+	"""
+	:param links: link information as generated by generate_link_param.
+	:param placement: dict node -> host
+	:return: names of the links whose endpoints are on different hosts
+	"""
+	return [link_name for link_name, link_param in links.items()
+	        if placement[link_param[1][0][0]] != placement[link_param[1][1][0]]]
@@ -0,0 +1,253 @@
+"""
+Warm pool of node containers.
+
+Instead of removing the containers of a topology on teardown they are
+released into a pool: their routes and qdiscs are flushed, they are
+disconnected from all networks and renamed to an idle name. The next setup
+assigns idle containers to node names by renaming them and only wires their
+interfaces, so container creation and start are skipped.
+
+Docker numbers the interfaces of a container in the order they are
+connected and never reuses a number, so a reused container gets eth3, eth4,
+... where the topology expects eth0, eth1, ... After all networks of a node
+are connected the interfaces are renamed to the names of the plan inside the
+container. The name docker gave an interface is kept as its alias and
+restored before docker disconnects the network again.
+
+Pool containers are labeled with POOL_LABEL instead of the run labels, so a
+teardown by label does not remove them, and with POOL_IMAGE_LABEL, so a node
+only gets an idle container of its own image.
+"""
+import json
+import time
+import uuid
+from docker_backend import get_backend
+
+POOL_LABEL = "net-measure.pool"
+POOL_IMAGE_LABEL = "net-measure.pool-image"
+
+
+def _check(result):
+	if result.exit_code != 0:
+		print(result.stderr.decode('utf-8', errors='replace').strip())
+	return result.exit_code
+
+
+def read_interfaces(container):
+	"""
+	Interfaces of a container
+	:param container: name of container
+	:return: dict interface -> (docker name stored as alias or None, list of ipv4 addresses),
+	None if ip failed
+	"""
+	result = get_backend().exec(container, ["ip", "-j", "addr", "show"])
+	if result.exit_code != 0:
+		return None
+	interfaces = {}
+	for link in json.loads(result.stdout.decode('utf-8') or "[]"):
+		if link.get("ifname", "lo") == "lo":
+			continue
+		ips = [addr["local"] for addr in link.get("addr_info", []) if addr.get("family") == "inet"]
+		interfaces[link["ifname"]] = (link.get("ifalias"), ips)
+	return interfaces
+
+
+def rename_commands(renames, aliases=None):
+	"""
+	ip batch commands renaming interfaces. All interfaces are moved to temporary
+	names first, so the new names may be taken by other interfaces of the batch.
+	:param renames: dict current name -> new name
+	:param aliases: dict current name -> alias set on the interface before renaming
+	:return: list of ip batch commands
+	"""
+	commands = []
+	for i, name in enumerate(renames):
+		if aliases and name in aliases:
+			commands.append(f"link set dev {name} alias {aliases[name]}")
+		commands.append(f"link set dev {name} down")
+		commands.append(f"link set dev {name} name pooltmp{i}")
+	for i, new_name in enumerate(renames.values()):
+		commands.append(f"link set dev pooltmp{i} name {new_name}")
+		commands.append(f"link set dev {new_name} up")
+	return commands
+
+
+def _run_ip_batch(container, commands, force=False):
+	if not commands:
+		return 0
+	script = "".join(command + "\n" for command in commands)
+	cmd = ["ip"] + (["-force"] if force else []) + ["-batch", "-"]
+	return _check(get_backend().exec(container, cmd, stdin=script.encode()))
+
+
+class ContainerPool:
+	"""
+	Pool of warm node containers of a testbed
+	:param testbed: name of the testbed
+	:param image: image of containers started for nodes without an image given
+	"""
+
+	def __init__(self, testbed, image="node-image"):
+		self.testbed = testbed
+		self.image = image
+		self.labels = {POOL_LABEL: testbed}
+		self.idle_prefix = f"pool-{testbed}-"
+		self.reserved = {}
+		# node -> seconds it took to start the container, cold or warm
+		self.cold = {}
+		self.warm = {}
+
+	def idle(self, image=None):
+		"""
+		:param image: only return containers of this image
+		:return: names of the idle containers of the pool
+		"""
+		labels = self.labels if image is None else dict(self.labels, **{POOL_IMAGE_LABEL: image})
+		return [name for name in get_backend().list_containers(labels) if name.startswith(self.idle_prefix)]
+
+	def in_use(self):
+		"""
+		:return: names of the pooled containers assigned to nodes
+		"""
+		return [name for name in get_backend().list_containers(self.labels)
+		        if not name.startswith(self.idle_prefix)]
+
+	def reserve(self, node_images):
+		"""
+		Assign idle containers of the right image to nodes. Nodes without an idle
+		container are created cold by start.
+		:param node_images: dict node -> image of the nodes of the topology
+		:return: dict node -> idle container
+		"""
+		self.reserved = {}
+		for image in set(node_images.values()):
+			node_names = [node_name for node_name, node_image in node_images.items() if node_image == image]
+			self.reserved.update(zip(node_names, self.idle(image)))
+		return self.reserved
+
+	def start(self, node_name, network, ip, image=None):
+		"""
+		Provide the container of a node attached to its base network, reusing a
+		reserved idle container if there is one
+		:param node_name: name of node
+		:param network: base network of the node
+		:param ip: ip address of the node on the base network
+		:param image: image of the node, the image of the pool if None
+		:return: exit status of the docker operations
+		"""
+		backend = get_backend()
+		start = time.monotonic()
+		idle_name = self.reserved.get(node_name)
+		if idle_name is None:
+			image = image or self.image
+			labels = dict(self.labels, **{POOL_IMAGE_LABEL: image})
+			status = _check(backend.run_container(node_name, image, network, ip, labels=labels))
+			self.cold[node_name] = time.monotonic() - start
+			return status
+		status = _check(backend.rename_container(idle_name, node_name))
+		if status == 0:
+			status = _check(backend.connect_network(network, node_name, ip))
+		self.warm[node_name] = time.monotonic() - start
+		return status
+
+	def wire(self, node_name, interface_ips):
+		"""
+		Rename the interfaces of a node to the names of the plan
+		:param node_name: name of node
+		:param interface_ips: dict ip -> planned interface name
+		:return: exit status of ip
+		"""
+		interfaces = read_interfaces(node_name)
+		if interfaces is None:
+			return 1
+		renames = {}
+		aliases = {}
+		for name, (alias, ips) in interfaces.items():
+			for ip in ips:
+				if ip in interface_ips and interface_ips[ip] != name:
+					renames[name] = interface_ips[ip]
+					if not alias:
+						aliases[name] = name
+		return _run_ip_batch(node_name, rename_commands(renames, aliases))
+
+	def unwire(self, node_name, names=None):
+		"""
+		Give interfaces back the names docker assigned to them, so docker can
+		disconnect their networks. Interfaces holding one of those names are moved
+		aside and returned as they have to be renamed back by wire.
+		:param node_name: name of node
+		:param names: current names of the interfaces to restore, all if None
+		:return: exit status of ip
+		"""
+		interfaces = read_interfaces(node_name)
+		if interfaces is None:
+			return 1
+		renames = {name: alias for name, (alias, _) in interfaces.items()
+		           if alias and alias != name and (names is None or name in names)}
+		targets = set(renames.values())
+		aliases = {}
+		for i, name in enumerate(n for n in interfaces if n in targets and n not in renames):
+			renames[name] = f"poolaside{i}"
+			if not interfaces[name][0]:
+				aliases[name] = name
+		return _run_ip_batch(node_name, rename_commands(renames, aliases))
+
+	def release(self, node_name):
+		"""
+		Return the container of a node to the pool: flush its qdiscs and routes,
+		disconnect it from all networks and rename it to an idle name
+		:param node_name: name of node
+		:return: exit status of the docker operations
+		"""
+		backend = get_backend()
+		interfaces = read_interfaces(node_name) or {}
+		script = "".join(f"qdisc del dev {name} root\n" for name in interfaces)
+		backend.exec(node_name, ["tc", "-force", "-batch", "-"], stdin=script.encode())
+		_run_ip_batch(node_name, ["route flush table main"], force=True)
+		self.unwire(node_name)
+		for network in backend.container_networks(node_name):
+			status = _check(backend.disconnect_network(network, node_name, force=True))
+			if status != 0:
+				return status
+		return _check(backend.rename_container(node_name, self.idle_prefix + uuid.uuid4().hex[:8]))
+
+	def release_all(self, keep=()):
+		"""
+		Return all containers of the pool assigned to nodes
+		:param keep: names of nodes whose containers stay assigned
+		:return: names of the released containers
+		"""
+		released = [name for name in self.in_use() if name not in keep]
+		for name in released:
+			self.release(name)
+		return released
+
+	def drain(self):
+		"""
+		Remove the idle containers of the pool
+		:return: number of removed containers
+		"""
+		backend = get_backend()
+		idle = self.idle()
+		for name in idle:
+			_check(backend.remove_container(name))
+		return len(idle)
+
+	def report(self, cold_estimate=None):
+		"""
+		Print the hit rate of the pool and the time saved compared to starting every
+		container cold
+		:param cold_estimate: seconds of a cold start used if no container was started cold
+		:return: mean seconds of a cold start in this run, None if there was none
+		"""
+		hits, misses = len(self.warm), len(self.cold)
+		if not hits + misses:
+			return None
+		mean_cold = sum(self.cold.values()) / misses if misses else cold_estimate
+		mean_warm = sum(self.warm.values()) / hits if hits else 0.
+		print(f"\nContainer pool: {hits} of {hits + misses} containers reused "
+		      f"(hit rate {hits / (hits + misses):.0%}), {misses} started cold")
+		if hits and mean_cold is not None:
+			print(f"  warm start {mean_warm:.3f}s vs cold start {mean_cold:.3f}s, "
+			      f"saved {hits * (mean_cold - mean_warm):.3f}s of container start time")
+		return sum(self.cold.values()) / misses if misses else None
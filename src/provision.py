@@ -0,0 +1,244 @@
+"""
+Concurrent provisioning engine used by the setup script.
+
+The topology is turned into a dependency graph of steps (subnets -> containers
+-> network connects -> tc -> routes). Steps whose dependencies are done are run
+on a bounded worker pool. The number of steps allowed in flight adapts to the
+observed step latency, so a struggling Docker daemon is not flooded with
+requests. The first failing step stops the run and the completed steps are
+rolled back in reverse order.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+PHASES = ["subnets", "containers", "connects", "tc", "routes"]
+
+
+class ProvisioningError(Exception):
+	"""
+	Raised when a provisioning step fails. The failed step name and its
+	result are available as attributes.
+	"""
+
+	def __init__(self, step, result):
+		super().__init__(f"step {step} failed with result {result}")
+		self.step = step
+		self.result = result
+
+
+class Step:
+	"""
+	A single unit of provisioning work
+	:param name: unique name of the step
+	:param phase: phase the step belongs to (one of PHASES)
+	:param action: callable returning 0 (or None) on success
+	:param deps: names of steps that have to complete first
+	:param undo: optional callable reverting the action during rollback
+	"""
+
+	def __init__(self, name, phase, action, deps=(), undo=None):
+		self.name = name
+		self.phase = phase
+		self.action = action
+		self.deps = set(deps)
+		self.undo = undo
+		self.duration = None
+
+
+class AdaptiveLimiter:
+	"""
+	Limits the number of steps in flight. Latency is tracked separately for
+	each phase since a route step costs far more than creating a subnet. The
+	limit grows by one for every step finishing close to its phase baseline
+	and is halved when the smoothed latency of a phase climbs above
+	backoff_factor times its baseline.
+	:param max_limit: upper bound on concurrent steps
+	:param min_limit: lower bound on concurrent steps
+	:param backoff_factor: latency ratio over baseline triggering a backoff
+	:param min_latency: latencies below this many seconds never trigger a backoff
+	"""
+
+	def __init__(self, max_limit, min_limit=1, backoff_factor=3.0, min_latency=0.005):
+		self.max_limit = max_limit
+		self.min_limit = min_limit
+		self.limit = max_limit
+		self.backoff_factor = backoff_factor
+		self.min_latency = min_latency
+		self.baseline = {}
+		self.ewma = {}
+		self.backoffs = 0
+		self.in_flight = 0
+		self._cond = threading.Condition()
+
+	def acquire(self):
+		with self._cond:
+			while self.in_flight >= self.limit:
+				self._cond.wait()
+			self.in_flight += 1
+
+	def release(self, phase, latency):
+		with self._cond:
+			self.in_flight -= 1
+			self._observe(phase, latency)
+			self._cond.notify_all()
+
+	def _observe(self, phase, latency):
+		if phase not in self.ewma:
+			self.ewma[phase] = latency
+			self.baseline[phase] = latency
+			return
+		ewma = 0.8 * self.ewma[phase] + 0.2 * latency
+		self.ewma[phase] = ewma
+		self.baseline[phase] = min(self.baseline[phase], ewma)
+		if ewma > self.backoff_factor * max(self.baseline[phase], self.min_latency):
+			new_limit = max(self.min_limit, self.limit // 2)
+			if new_limit < self.limit:
+				self.backoffs += 1
+			self.limit = new_limit
+			# start measuring against the current latency again
+			self.baseline[phase] = ewma
+		elif self.limit < self.max_limit:
+			self.limit += 1
+
+
+class Provisioner:
+	"""
+	Runs a dependency graph of steps on a bounded worker pool
+	:param max_workers: number of worker threads
+	:param verbose: print a line for each finished step
+	"""
+
+	def __init__(self, max_workers=8, verbose=False):
+		self.max_workers = max_workers
+		self.verbose = verbose
+		self.steps = {}
+		self.order = []
+		self.limiter = AdaptiveLimiter(max_workers)
+		self.phase_times = {}
+
+	def add_step(self, name, phase, action, deps=(), undo=None):
+		"""
+		Add a step to the graph
+		:param name: unique name of the step
+		:param phase: phase of the step
+		:param action: callable returning 0 (or None) on success
+		:param deps: names of steps this step depends on
+		:param undo: callable reverting the step
+		:return: the new step
+		"""
+		if name in self.steps:
+			raise ValueError(f"Duplicate step {name}")
+		step = Step(name, phase, action, deps, undo)
+		self.steps[name] = step
+		return step
+
+	def _check(self):
+		for step in self.steps.values():
+			for dep in step.deps:
+				if dep not in self.steps:
+					raise ValueError(f"Step {step.name} depends on unknown step {dep}")
+
+	def _run_step(self, step):
+		start = time.monotonic()
+		try:
+			return step.action()
+		finally:
+			step.duration = time.monotonic() - start
+
+	def _submit(self, pool, step):
+		# the slot is taken before the step is handed to the pool, so the limit bounds the requests in flight
+		self.limiter.acquire()
+		future = pool.submit(self._run_step, step)
+		future.add_done_callback(lambda _: self.limiter.release(step.phase, step.duration))
+		return future
+
+	def run(self):
+		"""
+		Run all steps. Steps are started as soon as their dependencies
+		completed. On the first failure no further steps are started and the
+		completed steps are rolled back.
+		:return: dict phase -> (wall time, summed step time, number of steps)
+		"""
+		self._check()
+		remaining = {name: set(step.deps) for name, step in self.steps.items()}
+		dependents = {name: [] for name in self.steps}
+		for name, step in self.steps.items():
+			for dep in step.deps:
+				dependents[dep].append(name)
+		phase_start = {}
+		phase_end = {}
+		failure = None
+		running = {}
+		with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+			ready = [name for name, deps in remaining.items() if not deps]
+			while ready or running:
+				while ready and failure is None:
+					name = ready.pop(0)
+					step = self.steps[name]
+					phase_start.setdefault(step.phase, time.monotonic())
+					running[self._submit(pool, step)] = name
+				if not running:
+					break
+				done, _ = wait(running, return_when=FIRST_COMPLETED)
+				for future in done:
+					name = running.pop(future)
+					step = self.steps[name]
+					phase_end[step.phase] = time.monotonic()
+					try:
+						result = future.result()
+					except Exception as e:
+						result = e
+					if result not in (0, None):
+						if failure is None:
+							failure = ProvisioningError(name, result)
+						continue
+					self.order.append(name)
+					if self.verbose:
+						print(f"[{step.phase}] {name} done in {step.duration:.3f}s")
+					for dependent in dependents[name]:
+						remaining[dependent].discard(name)
+						if not remaining[dependent]:
+							ready.append(dependent)
+				if failure is not None:
+					ready = []
+		self.phase_times = {}
+		for phase in phase_start:
+			steps = [s for s in self.steps.values() if s.phase == phase and s.duration is not None]
+			self.phase_times[phase] = (phase_end[phase] - phase_start[phase],
+			                           sum(s.duration for s in steps), len(steps))
+		if failure is not None:
+			self.rollback()
+			raise failure
+		if len(self.order) != len(self.steps):
+			raise ValueError("Dependency cycle between provisioning steps")
+		return self.phase_times
+
+	def rollback(self):
+		"""
+		Undo all completed steps in reverse order of completion
+		:return: None
+		"""
+		for name in reversed(self.order):
+			step = self.steps[name]
+			if step.undo is not None:
+				try:
+					step.undo()
+				except Exception as e:
+					print(f"Rollback of {name} failed: {e}")
+		self.order = []
+
+	def report(self):
+		"""
+		Print timings for each phase
+		:return: None
+		"""
+		print("\nProvisioning timings:")
+		for phase in PHASES + [p for p in self.phase_times if p not in PHASES]:
+			if phase not in self.phase_times:
+				continue
+			wall, busy, count = self.phase_times[phase]
+			print(f"  {phase:<12} {count:>5} steps  wall {wall:8.3f}s  step time {busy:8.3f}s")
+		if self.limiter.backoffs:
+			print(f"  backed off {self.limiter.backoffs} times due to daemon latency "
+			      f"(final concurrency {self.limiter.limit})")
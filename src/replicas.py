@@ -0,0 +1,191 @@
+"""
+Replicas of a topology.
+
+setup --replicas K sets up K isolated copies of a topology on the same
+testbed, so measurements that must not interfere can run side by side. Replica
+k of a node is the container rep<k>.<node>; the links and networks between
+the replicated nodes are named after their endpoints as usual, rep<k>.a-rep<k>.b.
+The addresses of replica k are the addresses of the topology shifted by k
+blocks, the smallest power of two holding every subnet and node address of the
+topology, so every replica has the same layout:
+
+	replica 0   10.0.0.0/29, 10.0.0.8/29, ...
+	replica 1   10.0.0.64/29, 10.0.0.72/29, ...
+
+replicate_plan turns the compiled plan of the topology into the plan of the
+replicas without compiling it again. The routing of the replicas keeps the
+next hop matrix of the topology once, as a stack of blocks, and the block every
+replica routes with; routing.route_table maps the indices of a block to the names of
+the replica. A link added to or removed from one replica gives that replica a
+block of its own. The number of replicas, the block and
+the endpoints of the links of the topology are kept in the state store, so
+the experiment helpers address a node as (replica, name).
+"""
+import ipaddress
+import json
+import re
+import numpy as np
+from images import image_of
+
+REPLICAS_KEY = "replicas"
+REPLICA_NAME = re.compile(r"rep(\d+)\.(.+)")
+
+
+def replica_name(replica, name):
+	"""
+	:param replica: index of the replica
+	:param name: name of a node of the topology
+	:return: name of the node in the replica
+	"""
+	return f"rep{replica}.{name}"
+
+
+def resolve_node(node):
+	"""
+	:param node: name of a node, or tuple (replica, name) of a node of a replica
+	:return: name of the container of the node
+	"""
+	if isinstance(node, (tuple, list)):
+		return replica_name(*node)
+	return node
+
+
+def replica_link(replica, link, replicas):
+	"""
+	:param replica: index of the replica
+	:param link: name of a link of the topology
+	:param replicas: replica settings as returned by load_replicas
+	:return: name of the link in the replica
+	"""
+	node0, node1 = replicas["links"][link]
+	return f"{replica_name(replica, node0)}-{replica_name(replica, node1)}"
+
+
+def replica_address(replica, address, replicas):
+	"""
+	:param replica: index of the replica
+	:param address: address or subnet of the topology
+	:param replicas: replica settings as returned by load_replicas
+	:return: the address or subnet in the replica
+	"""
+	return _shift(address, replica * replicas["block"])
+
+
+def address_block(plan):
+	"""
+	:param plan: compiled plan of the topology
+	:return: tuple (number of addresses of the block of one replica, first address of the topology)
+	"""
+	networks = [ipaddress.ip_network(subnet, strict=False) for subnet in plan["subnets"].values()]
+	networks += [ipaddress.ip_network(ip) for ip, _ in plan["nodes"].values()]
+	first = min(int(network.network_address) for network in networks)
+	last = max(int(network.broadcast_address) for network in networks)
+	return 1 << (last - first).bit_length(), first
+
+
+def _shift(address, offset):
+	# address or subnet in CIDR notation moved by offset addresses
+	if "/" in address:
+		ip, prefix = address.split("/")
+		return f"{ipaddress.ip_address(ip) + offset}/{prefix}"
+	return str(ipaddress.ip_address(address) + offset)
+
+
+def split_replica_name(name):
+	"""
+	:param name: name of a node of a replica
+	:return: tuple (index of the replica, name of the node in the topology)
+	:raises ValueError: if the name is not the name of a node of a replica
+	"""
+	match = REPLICA_NAME.fullmatch(name)
+	if match is None:
+		raise ValueError(f"{name} is not a node of a replica")
+	return int(match.group(1)), match.group(2)
+
+
+def _replicate_routing(routing, replicas):
+	# every replica routes with the single block of the topology
+	return {"nodes": routing["nodes"], "replicas": np.zeros(replicas, dtype=np.int32),
+	        "next_hop": routing["next_hop"][None]}
+
+
+def replicate_plan(plan, replicas):
+	"""
+	Plan of replicas of a topology
+	:param plan: compiled plan of the topology, see compiler.compile_topology
+	:param replicas: number of replicas
+	:return: tuple (plan of all replicas, replica settings to store with save_replicas)
+	:raises ValueError: if the addresses of the replicas do not fit into the address pool
+	"""
+	block, first = address_block(plan)
+	pool = ipaddress.ip_network(plan["ipam"]["pool"])
+	if first + replicas * block - 1 > int(pool.broadcast_address):
+		raise ValueError(f"{replicas} replicas of {block} addresses each do not fit into {pool}")
+
+	nodes, links, node_vs_eth, node_vs_ip = {}, {}, {}, {}
+	subnets, interfaces, tc, connections, roles = {}, {}, {}, {}, {}
+	for replica in range(replicas):
+		offset = replica * block
+
+		def name(node):
+			return replica_name(replica, node)
+
+		link_names = {}
+		for link_name, (subnet, endpoints, tc_params) in plan["links"].items():
+			new_name = "-".join(name(node) for node, _, _ in endpoints)
+			link_names[link_name] = new_name
+			links[new_name] = (_shift(subnet, offset),
+			                   tuple((name(node), _shift(ip, offset), interface) for node, ip, interface in endpoints),
+			                   tc_params)
+			subnets[new_name] = _shift(subnet, offset)
+		for node, (ip, base_link) in plan["nodes"].items():
+			nodes[name(node)] = (_shift(ip, offset), link_names.get(base_link, base_link))
+		for node, counter in plan["node_vs_eth"].items():
+			node_vs_eth[name(node)] = counter
+		for node, ips in plan["node_vs_ip"].items():
+			node_vs_ip[name(node)] = [_shift(ip, offset) for ip in ips]
+		for node, node_interfaces in plan["interfaces"].items():
+			interfaces[name(node)] = {interface: (_shift(ip, offset), link_names[link])
+			                          for interface, (ip, link) in node_interfaces.items()}
+		for node, params in plan["tc"].items():
+			tc[name(node)] = dict(params)
+		for node, neighbors in plan["connections"].items():
+			connections[name(node)] = {name(neighbor): (_shift(ip, offset), interface)
+			                           for neighbor, (ip, interface) in neighbors.items()}
+		for node, role in plan["roles"].items():
+			roles[name(node)] = role
+
+	replicated = dict(plan, nodes=nodes, links=links, node_vs_eth=node_vs_eth, node_vs_ip=node_vs_ip,
+	                  subnets=subnets, interfaces=interfaces, tc=tc, connections=connections, roles=roles,
+	                  images={node: image_of(role) for node, role in roles.items()},
+	                  routing=_replicate_routing(plan["routing"], replicas))
+	settings = {"count": replicas, "block": block,
+	            "links": {link_name: [endpoints[0][0], endpoints[1][0]]
+	                      for link_name, (_, endpoints, _) in plan["links"].items()}}
+	return replicated, settings
+
+
+def save_replicas(store, settings):
+	"""
+	:param store: state_store.StateStore
+	:param settings: replica settings as returned by replicate_plan, None for a topology without replicas
+	:return: None
+	"""
+	store.set_meta(REPLICAS_KEY, json.dumps(settings) if settings else "")
+
+
+def load_replicas(store):
+	"""
+	:param store: state_store.StateStore
+	:return: replica settings as returned by replicate_plan, None if the topology has no replicas
+	"""
+	settings = store.get_meta(REPLICAS_KEY)
+	return json.loads(settings) if settings else None
+
+
+def report_replicas(settings):
+	"""
+	:param settings: replica settings as returned by replicate_plan
+	:return: None
+	"""
+	print(f"{settings['count']} replicas of {len(settings['links'])} links, {settings['block']} addresses each")
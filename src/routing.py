@@ -0,0 +1,495 @@
+"""
+Routing of the testbed.
+
+All pairs shortest paths are computed in a single pass over an indexed
+adjacency structure. Only the next hop from every source to every destination
+is kept (-1 where there is none), as a numpy matrix indexed by node position
+in the smallest integer type holding the indices; the distance and predecessor
+matrices are dropped once it is built. With scipy installed the shortest paths
+come from scipy.sparse.csgraph, otherwise a heapq based Dijkstra is run from
+every source. In an undirected graph the next hop from s to t is the
+predecessor of s on the path from t, so the matrix is the transposed
+predecessor matrix. Directed graphs derive it from the predecessors by pointer
+jumping instead of walking the paths one by one. Every next hop lies on a
+shortest path, so the hop by hop routes are free of loops.
+
+The next hop matrix is kept in the state store. When a link is added or
+removed only the rows of the sources whose shortest paths can change are
+recomputed. The distances of the sources to the endpoints u and v of the link
+are those of u and v to the sources and take two Dijkstra runs:
+
+- adding a link (u, v) changes the paths of a source s only if the new link
+  shortens the distance to u or v, i.e. dist[u] + w < dist[v] or the other way
+  around.
+- removing a link changes the paths of s only if the link is on a shortest
+  path of s, i.e. dist[u] + w = dist[v] or the other way around.
+
+Only the routes that actually changed are emitted for a runtime change.
+
+The routing of replicas of a topology (see replicas.py) has the key "replicas"
+with the block index of every replica and stacks the distinct blocks in the
+next hop matrix, "nodes" names the nodes of the topology. A replica only gets
+a block of its own once a link inside it is added or removed.
+"""
+import heapq
+import numpy as np
+from replicas import replica_name, split_replica_name
+
+try:
+	from scipy.sparse import csr_matrix
+	from scipy.sparse.csgraph import dijkstra as csgraph_dijkstra
+except ImportError:
+	csgraph_dijkstra = None
+
+# sources per shortest path run of compute_routing
+SOURCE_CHUNK = 256
+
+
+def link_cost(tc_params):
+	"""
+	Cost of a link, the multiplicative inverse of its bandwidth
+	:param tc_params: tuple (bandwidth, burst, latency)
+	:return: cost
+	"""
+	return 1. / tc_params[0]
+
+
+def build_graph(links):
+	"""
+	Build the graph of the network from the links
+	:param links: link information as generated by generate_link_param.
+	:return: tuple (graph, connections). graph maps node -> list of (neighbor, tc_params),
+	connections maps node -> {neighbor: (ip of neighbor, own interface)}
+	"""
+	graph = {}
+	connections = {}
+	for link_name, link_param in links.items():
+		endpoints = link_param[1]
+		tc_params = link_param[2]
+
+		if endpoints[0][0] not in graph:
+			graph[endpoints[0][0]] = []
+			connections[endpoints[0][0]] = {}
+		graph[endpoints[0][0]].append((endpoints[1][0], tc_params))
+		connections[endpoints[0][0]][endpoints[1][0]] = (
+			endpoints[1][1], endpoints[0][2])  # ip of other node,eth of itself
+		if endpoints[1][0] not in graph:
+			graph[endpoints[1][0]] = []
+			connections[endpoints[1][0]] = {}
+		graph[endpoints[1][0]].append((endpoints[0][0], tc_params))
+		connections[endpoints[1][0]][endpoints[0][0]] = (endpoints[0][1], endpoints[1][2])
+	return graph, connections
+
+
+def index_graph(graph):
+	"""
+	Number the nodes of a graph and build an indexed adjacency structure
+	:param graph: dict node -> list of (neighbor, tc_params), may be directed
+	:return: tuple (nodes, index, adjacency). adjacency[i] maps the index of every
+	neighbor of node i to the cost of the cheapest link to it
+	"""
+	nodes = list(graph)
+	for neighbors in graph.values():
+		for neighbor, _ in neighbors:
+			if neighbor not in graph and neighbor not in nodes:
+				nodes.append(neighbor)
+	index = {node: i for i, node in enumerate(nodes)}
+	adjacency = [{} for _ in nodes]
+	for node, neighbors in graph.items():
+		row = adjacency[index[node]]
+		for neighbor, tc_params in neighbors:
+			j = index[neighbor]
+			cost = link_cost(tc_params)
+			if cost < row.get(j, float('inf')):
+				row[j] = cost
+	return nodes, index, adjacency
+
+
+def _heap_dijkstra(adjacency, source):
+	n = len(adjacency)
+	dist = [float('inf')] * n
+	pred = [-1] * n
+	dist[source] = 0.
+	heap = [(0., source)]
+	while heap:
+		current_dist, current = heapq.heappop(heap)
+		if current_dist > dist[current]:
+			continue
+		for neighbor, cost in adjacency[current].items():
+			distance = current_dist + cost
+			if distance < dist[neighbor]:
+				dist[neighbor] = distance
+				pred[neighbor] = current
+				heapq.heappush(heap, (distance, neighbor))
+	return dist, pred
+
+
+def shortest_paths(adjacency, sources=None):
+	"""
+	Shortest paths from a set of sources
+	:param adjacency: indexed adjacency as returned by index_graph
+	:param sources: indices of the sources, all nodes if None
+	:return: tuple (dist, pred) of matrices with one row per source. pred is -1 for
+	the source itself and for unreachable nodes.
+	"""
+	n = len(adjacency)
+	if sources is None:
+		sources = np.arange(n)
+	sources = np.asarray(sources, dtype=np.int64)
+	if n == 0 or len(sources) == 0:
+		return np.zeros((len(sources), n)), np.full((len(sources), n), -1, dtype=np.int32)
+	if csgraph_dijkstra is not None:
+		rows = [i for i, row in enumerate(adjacency) for _ in row]
+		cols = [j for row in adjacency for j in row]
+		costs = [cost for row in adjacency for cost in row.values()]
+		matrix = csr_matrix((costs, (rows, cols)), shape=(n, n))
+		dist, pred = csgraph_dijkstra(matrix, directed=True, indices=sources, return_predecessors=True)
+		dist = np.atleast_2d(dist)
+		pred = np.atleast_2d(pred).astype(np.int32)
+		pred[pred < 0] = -1
+		return dist, pred
+	dist = np.empty((len(sources), n))
+	pred = np.empty((len(sources), n), dtype=np.int32)
+	for row, source in enumerate(sources):
+		dist[row], pred[row] = _heap_dijkstra(adjacency, int(source))
+	return dist, pred
+
+
+def index_dtype(n):
+	"""
+	:param n: number of nodes
+	:return: smallest signed integer dtype holding the indices of n nodes and -1
+	"""
+	return np.min_scalar_type(-max(n, 1))
+
+
+def first_hops(pred, sources):
+	"""
+	Next hop matrix from a predecessor matrix. Every entry starts at the node
+	itself if its predecessor is the source and at its predecessor otherwise;
+	following the pointers twice as far in every round ends at the neighbor of
+	the source that starts the path after O(log(path length)) rounds.
+	:param pred: predecessor matrix with one row per source
+	:param sources: indices of the sources of the rows
+	:return: matrix of next hop indices, -1 for the source and unreachable nodes
+	"""
+	rows = np.arange(pred.shape[0])[:, None]
+	targets = np.broadcast_to(np.arange(pred.shape[1]), pred.shape)
+	hops = np.where(pred == np.asarray(sources)[:, None], targets, pred).astype(np.int32)
+	while True:
+		jumped = np.where(hops < 0, -1, hops[rows, np.maximum(hops, 0)])
+		if np.array_equal(jumped, hops):
+			return hops
+		hops = jumped
+
+
+def prune_leaves(adjacency):
+	"""
+	Repeatedly strip nodes with a single neighbor off an undirected graph. The
+	shortest paths of a stripped node all run through the neighbor it hangs off,
+	so only the remaining core needs a shortest path computation.
+	:param adjacency: indexed adjacency as returned by index_graph
+	:return: tuple (core, stripped). core lists the indices of the remaining nodes,
+	stripped lists (node, neighbor, cost) in the order the nodes were stripped
+	"""
+	degree = [len(row) for row in adjacency]
+	removed = [False] * len(adjacency)
+	leaves = [i for i, d in enumerate(degree) if d == 1]
+	stripped = []
+	remaining = sum(1 for d in degree if d > 0)
+	while leaves and remaining > 1:
+		leaf = leaves.pop()
+		if removed[leaf] or degree[leaf] != 1:
+			continue
+		neighbor = next(j for j in adjacency[leaf] if not removed[j])
+		removed[leaf] = True
+		remaining -= 1
+		stripped.append((leaf, neighbor, adjacency[leaf][neighbor]))
+		degree[neighbor] -= 1
+		if degree[neighbor] == 1:
+			leaves.append(neighbor)
+	core = [i for i in range(len(adjacency)) if not removed[i]]
+	return core, stripped
+
+
+def _is_symmetric(adjacency):
+	return all(adjacency[j].get(i) == cost for i, row in enumerate(adjacency) for j, cost in row.items())
+
+
+def compute_routing(links, graph=None):
+	"""
+	Compute the all pairs shortest paths and the next hop matrix. For undirected
+	graphs the nodes with a single neighbor are stripped first and their rows and
+	columns are filled in from the node they hang off.
+	:param links: link information as generated by generate_link_param.
+	:param graph: graph to route on instead of the graph of the links
+	:return: routing state dict with "nodes" (node names in matrix order) and the
+	matrix "next_hop"
+	"""
+	if graph is None:
+		graph, _ = build_graph(links)
+	nodes, _, adjacency = index_graph(graph)
+	n = len(nodes)
+	if not _is_symmetric(adjacency):
+		sources = np.arange(n)
+		_, pred = shortest_paths(adjacency, sources)
+		return {"nodes": nodes, "next_hop": first_hops(pred, sources).astype(index_dtype(n))}
+
+	core, stripped = prune_leaves(adjacency)
+	core = np.array(core, dtype=np.int64)
+	position = {int(node): i for i, node in enumerate(core)}
+	core_adjacency = [{position[j]: cost for j, cost in adjacency[i].items() if j in position} for i in core]
+	next_hop = np.full((n, n), -1, dtype=index_dtype(n))
+	# a chunk of sources at a time, the distances of all pairs are never held at once
+	for start in range(0, len(core), SOURCE_CHUNK):
+		sources = np.arange(start, min(start + SOURCE_CHUNK, len(core)))
+		_, pred = shortest_paths(core_adjacency, sources)
+		# the predecessor of s on the path from t is the next hop from s to t
+		next_hop[np.ix_(core, core[sources])] = np.where(pred >= 0, core[np.maximum(pred, 0)], -1).T
+	# put the stripped nodes back, the last stripped hangs off the core
+	for leaf, neighbor, _ in reversed(stripped):
+		next_hop[:, leaf] = next_hop[:, neighbor]
+		next_hop[neighbor, leaf] = leaf
+		next_hop[leaf] = np.where(next_hop[neighbor] >= 0, neighbor, -1)
+		next_hop[leaf, neighbor] = neighbor
+		next_hop[leaf, leaf] = -1
+	return {"nodes": nodes, "next_hop": next_hop}
+
+
+def replica_routing(routing, replica):
+	"""
+	Routing of one replica
+	:param routing: routing state of replicas, see replicas.replicate_plan
+	:param replica: index of the replica
+	:return: routing state of the block of the replica, indexed like the topology
+	"""
+	block = routing["replicas"][replica]
+	return {"nodes": routing["nodes"], "next_hop": routing["next_hop"][block]}
+
+
+def routing_nodes(routing):
+	"""
+	:param routing: routing state as returned by compute_routing or of replicas
+	:return: list of the names of all routed nodes
+	"""
+	if "replicas" not in routing:
+		return list(routing["nodes"])
+	return [replica_name(replica, node) for replica in range(len(routing["replicas"])) for node in routing["nodes"]]
+
+
+def route_table(routing, start, connections, node_vs_ip):
+	"""
+	Routing table of a node
+	:param routing: routing state as returned by compute_routing or of replicas
+	:param start: node to compute the table for
+	:param connections: connections as returned by build_graph
+	:param node_vs_ip: dict node -> list of ips
+	:return: dict destination ip -> (gateway ip, interface)
+	"""
+	nodes = names = routing["nodes"]
+	index = start
+	if "replicas" in routing:
+		# the block is indexed like the topology, the replica prefixes the names
+		replica, index = split_replica_name(start)
+		routing = replica_routing(routing, replica)
+		names = [replica_name(replica, node) for node in nodes]
+	row = routing["next_hop"][nodes.index(index)]
+	table = {}
+	for hop in np.unique(row[row >= 0]):
+		gateway = connections[start][names[hop]]
+		for dest in np.nonzero(row == hop)[0]:
+			for dest_node_ip in node_vs_ip[names[dest]]:
+				table[dest_node_ip] = gateway
+	return table
+
+
+def node_routes(routing, start, connections, node_vs_ip):
+	"""
+	All routes of a node
+	:param routing: routing state as returned by compute_routing or of replicas
+	:param start: node to compute the routes for
+	:param connections: connections as returned by build_graph
+	:param node_vs_ip: dict node -> list of ips
+	:return: list of (destination ip, gateway ip, interface)
+	"""
+	return [(ip, gateway_ip, interface) for ip, (gateway_ip, interface)
+	        in route_table(routing, start, connections, node_vs_ip).items()]
+
+
+def affected_sources(routing, graph, u, v, cost, added):
+	"""
+	Sources whose shortest paths can change when the link (u, v) is added or removed
+	:param routing: routing state as returned by compute_routing
+	:param graph: undirected graph before the change as returned by build_graph
+	:param u: first endpoint of the link
+	:param v: second endpoint of the link
+	:param cost: cost of the link
+	:param added: True if the link was added, False if it was removed
+	:return: array of source indices
+	"""
+	_, index, adjacency = index_graph(graph)
+	dist, _ = shortest_paths(adjacency, [index[u], index[v]])
+	# the distances of all sources to u and v in the order of the routing
+	to_u, to_v = dist[:, [index[node] for node in routing["nodes"]]]
+	if added:
+		mask = (to_u + cost < to_v) | (to_v + cost < to_u)
+	else:
+		# ties count, recomputing a source too many is harmless
+		mask = np.isfinite(to_u) & (np.isclose(to_u + cost, to_v, rtol=1e-9, atol=0) |
+		                            np.isclose(to_v + cost, to_u, rtol=1e-9, atol=0))
+	return np.nonzero(mask)[0]
+
+
+def diff_table(old, new):
+	"""
+	Routes that have to be replaced or deleted to get from one table to another
+	:param old: installed routing table
+	:param new: wanted routing table
+	:return: tuple (list of (destination ip, gateway ip, interface), list of destination ips)
+	"""
+	changed = [(ip, gateway_ip, interface) for ip, (gateway_ip, interface) in new.items()
+	           if tuple(old.get(ip, ())) != (gateway_ip, interface)]
+	removed = [ip for ip in old if ip not in new]
+	return changed, removed
+
+
+def _local_name(name, replica):
+	# name of a node of the replica in the topology, None for nodes of other replicas
+	try:
+		index, node = split_replica_name(name)
+	except ValueError:
+		return None
+	return node if index == replica else None
+
+
+def _local_links(links, replica):
+	# the links inside the replica with the node names of the topology
+	local = {}
+	for link_name, (subnet, endpoints, tc_params) in links.items():
+		names = [_local_name(node, replica) for node, _, _ in endpoints]
+		if None not in names:
+			local[link_name] = (subnet, tuple((name,) + tuple(endpoint[1:]) for name, endpoint in zip(names, endpoints)),
+			                    tc_params)
+	return local
+
+
+def _reorder(routing, nodes):
+	# the routing state indexed in the order of nodes
+	order = np.array([routing["nodes"].index(node) for node in nodes], dtype=np.int64)
+	position = np.empty(len(nodes), dtype=routing["next_hop"].dtype)
+	position[order] = np.arange(len(nodes))
+	next_hop = routing["next_hop"][np.ix_(order, order)]
+	return {"nodes": list(nodes), "next_hop": np.where(next_hop >= 0, position[next_hop], -1).astype(next_hop.dtype)}
+
+
+def _with_block(routing, replica, block):
+	# the replica routes with the block, identical blocks are shared and unused ones dropped
+	indices = routing["replicas"].copy()
+	stacked = routing["next_hop"]
+	same = [i for i in range(len(stacked)) if np.array_equal(stacked[i], block["next_hop"])]
+	if same:
+		indices[replica] = same[0]
+	else:
+		stacked = np.concatenate([stacked, block["next_hop"][None].astype(stacked.dtype)])
+		indices[replica] = len(routing["next_hop"])
+	used, indices = np.unique(indices, return_inverse=True)
+	return {"nodes": routing["nodes"], "replicas": indices.astype(np.int32), "next_hop": stacked[used]}
+
+
+def _update_replica(routing, old_links, links, old_node_vs_ip, node_vs_ip, changed_link, added):
+	# a link inside one replica only changes the block of that replica, None if the link is not inside one
+	try:
+		(replica, _), (other, _) = (split_replica_name(node) for node, _, _ in changed_link[1])
+	except ValueError:
+		return None
+	if replica != other:
+		return None
+	local_links = _local_links(links, replica)
+	local_changed, = _local_links({None: changed_link}, replica).values()
+	block, replacements, deletions, recomputed = update_routing(
+		replica_routing(routing, replica), _local_links(old_links, replica), local_links,
+		{_local_name(node, replica): ips for node, ips in old_node_vs_ip.items() if _local_name(node, replica)},
+		{_local_name(node, replica): ips for node, ips in node_vs_ip.items() if _local_name(node, replica)},
+		local_changed, added)
+	if set(block["nodes"]) != set(routing["nodes"]):
+		return None
+	if block["nodes"] != routing["nodes"]:
+		block = _reorder(block, routing["nodes"])
+	return (_with_block(routing, replica, block),
+	        {replica_name(replica, node): routes for node, routes in replacements.items()},
+	        {replica_name(replica, node): ips for node, ips in deletions.items()}, recomputed)
+
+
+def update_routing(routing, old_links, links, old_node_vs_ip, node_vs_ip, changed_link, added):
+	"""
+	Update the routing state after a link was added or removed. Only the rows of
+	the affected sources are recomputed and only changed routes are returned.
+	:param routing: routing state before the change, recomputed from scratch if None. A link
+	inside one replica only updates the block of that replica.
+	:param old_links: links before the change
+	:param links: links after the change
+	:param old_node_vs_ip: dict node -> list of ips before the change
+	:param node_vs_ip: dict node -> list of ips after the change
+	:param changed_link: link_param of the added or removed link
+	:param added: True if the link was added, False if it was removed
+	:return: tuple (new routing state, replacements, deletions, number of recomputed
+	sources). replacements maps node -> list of (destination ip, gateway ip, interface),
+	deletions maps node -> list of destination ips.
+	"""
+	if routing is not None and "replicas" in routing:
+		updated = _update_replica(routing, old_links, links, old_node_vs_ip, node_vs_ip, changed_link, added)
+		if updated is not None:
+			return updated
+	graph, connections = build_graph(links)
+	old_graph, old_connections = build_graph(old_links)
+	nodes, _, adjacency = index_graph(graph)
+	old_nodes = set(routing_nodes(routing)) if routing is not None else set()
+	replacements = {}
+	deletions = {}
+
+	def diff_node(node, old_routing, new_routing):
+		old = route_table(old_routing, node, old_connections, old_node_vs_ip) if node in old_nodes else {}
+		new = route_table(new_routing, node, connections, node_vs_ip)
+		changed, removed = diff_table(old, new)
+		if changed:
+			replacements[node] = changed
+		if removed:
+			deletions[node] = removed
+
+	if routing is None or "replicas" in routing or routing["nodes"] != nodes:
+		# the set of nodes changed or a link joins replicas, start over
+		new_routing = compute_routing(links, graph)
+		for node in nodes:
+			diff_node(node, routing, new_routing)
+		return new_routing, replacements, deletions, len(nodes)
+
+	u, v = changed_link[1][0][0], changed_link[1][1][0]
+	recompute = affected_sources(routing, old_graph, u, v, link_cost(changed_link[2]), added)
+	new_routing = {"nodes": routing["nodes"], "next_hop": routing["next_hop"].copy()}
+	if len(recompute):
+		_, pred = shortest_paths(adjacency, recompute)
+		new_routing["next_hop"][recompute] = first_hops(pred, recompute)
+
+	# sources with a new tree and the endpoints of the link get a full diff
+	full = set(nodes[i] for i in recompute) | {u, v}
+	for node in full:
+		diff_node(node, routing, new_routing)
+	# everyone else only sees the addresses of the link come or go
+	old_ips = {ip: node for node, ips in old_node_vs_ip.items() for ip in ips}
+	new_ips = {ip: node for node, ips in node_vs_ip.items() for ip in ips}
+	index = {node: i for i, node in enumerate(nodes)}
+	for i, node in enumerate(nodes):
+		if node in full:
+			continue
+		row = new_routing["next_hop"][i]
+		changed = []
+		for ip, owner in new_ips.items():
+			if old_ips.get(ip) != owner and row[index[owner]] >= 0:
+				changed.append((ip,) + tuple(connections[node][nodes[row[index[owner]]]]))
+		removed = [ip for ip, owner in old_ips.items()
+		           if new_ips.get(ip) != owner and owner in index and routing["next_hop"][i][index[owner]] >= 0]
+		if changed:
+			replacements[node] = changed
+		if removed:
+			deletions[node] = removed
+	return new_routing, replacements, deletions, len(recompute)
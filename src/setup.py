@@ -1,58 +1,48 @@
-import os
 import ast
-import importlib
-from queue import PriorityQueue
-import json
 import argparse
-
-
-def dijkstra(graph, start):
-	"""
-	Function to compute the shortest path from a source node to all other nodes in the graph
-	param: graph: the graph of the network
-	param: start: the source/start node from where minimum distance to other nodes is calculated.
-	return: Distance dictionary, where each element is a tuple of distance from source node and 
-	the previous node in the shortest path from the source.
-	"""
-	# Initialize the distance dictionary and set the distance of the start node to 0
-	dist = {}
-	for node in graph:
-		dist[node] = [float('inf'), node]
-	dist[start][0] = 0
-
-	# Initialize the priority queue and add the start node with distance 0
-	pq = PriorityQueue()
-	pq.put((0, start))
-
-	# Traverse the graph using BFS and update the distance for each neighbor node
-	while not pq.empty():
-		current_dist, current_node = pq.get()
-		if current_dist > dist[current_node][0]:
-			continue
-		for neighbor, weight in graph[current_node]:
-			# weights are bandwidth values
-			distance = current_dist + 1. / weight[0]
-			if distance < dist[neighbor][0]:
-				dist[neighbor] = [distance, current_node]
-				pq.put([distance, neighbor])
-
-	# Return the distance dictionary
-	return dist
-
-
-def build_image(img_name, img_path):
+import json
+import sys
+import time
+from functools import partial
+from compiler import generate_link_param, get_node_vs_ip, get_plan, link_name_of, plan_routes
+from cost_model import COST_KEY, CostModel
+from docker_backend import default_backend, get_backend, set_backend
+from dry_run import DryRunBackend, record_plan, report_plan
+from images import build_images, report_roles
+from partition import partition
+from ipam import AddressPool, address_links
+from netns_backend import NetnsBackend
+from provision import Provisioner, ProvisioningError
+from replicas import replicate_plan, report_replicas, save_replicas
+from pool import ContainerPool
+from routing import build_graph, node_routes, routing_nodes, update_routing
+from sharding import HELPER_ROLE, ShardedBackend, load_hosts, report_placement, save_placement
+from state_store import get_store
+from teardown import DEFAULT_TESTBED, TEARDOWN_WORKERS, new_run_id, run_labels, teardown
+from traffic_control import apply_tc
+
+# node -> (number of routes, seconds) of the last route installation
+route_stats = {}
+# node -> (routes, deletions) of the last route installation, stored after provisioning
+installed_routes = {}
+# node -> seconds it took to create and start its container
+start_latency = {}
+
+
+def check(result, operation=None):
 	"""
-	Build docker image
-	:param img_name: name of image
-	:param img_path: path of Dockerfile
-	:return: None
+	Print the error output of a failed backend operation
+	:param result: docker_backend.ExecResult
+	:param operation: description of the operation printed with the error, e.g. "run_container a"
+	:return: exit status of the operation
 	"""
-	cmd = f"docker build -t {img_name} {img_path}"
-	print(cmd)
-	os.system(cmd)
+	if result.exit_code != 0:
+		error = result.stderr.decode('utf-8', errors='replace').strip()
+		print(f"{operation} failed: {error}" if operation else error)
+	return result.exit_code
 
 
-def create_container(container_name, img_name, network, ip):
+def create_container(container_name, img_name, network, ip, labels=None):
 	"""
 	Create and start container
 	:param container_name: name of container
@@ -60,37 +50,44 @@ def create_container(container_name, img_name, network, ip):
 	:param img_name: name of image
 	:param network: network name on eth0 interface
 	:param ip: ip address of node on <network>
-	:return: None
+	:param labels: dict of labels of the container
+	:return: exit status of the docker operation
+	"""
+	start = time.monotonic()
+	status = check(get_backend().run_container(container_name, img_name, network, ip, labels=labels),
+	               f"run_container {container_name}")
+	start_latency[container_name] = time.monotonic() - start
+	return status
+
+
+def remove_container(container_name):
+	"""
+	Stop and remove container
+	:param container_name: name of container
+	:return: exit status of the docker operation
 	"""
-	cmd = f"docker run -d --name {container_name}" \
-	      f" --network {network}" \
-	      f" --ip {ip}" \
-	      f" --privileged {img_name}"
-	print(cmd)
-	os.system(cmd)
+	return check(get_backend().remove_container(container_name), f"remove_container {container_name}")
 
 
-def create_subnet(ip_range, subnet_name):
+def create_subnet(ip_range, subnet_name, labels=None):
 	"""
 	Create subnet
 	:param ip_range: range of ips on subnet
 	:param subnet_name: name of subnet
-	:return: None
+	:param labels: dict of labels of the network
+	:return: exit status of the docker operation
 	"""
-	cmd = f"docker network create --subnet={ip_range} {subnet_name}"
-	print(cmd)
-	os.system(cmd)
+	return check(get_backend().create_network(subnet_name, ip_range, labels=labels),
+	             f"create_network {subnet_name} {ip_range}")
 
 
 def remove_subnet(subnet_name):
 	"""
 	Remove subnet
 	:param subnet_name: name of subnet
-	:return: None
+	:return: exit status of the docker operation
 	"""
-	cmd = f"docker network rm {subnet_name}"
-	print(cmd)
-	os.system(cmd)
+	return check(get_backend().remove_network(subnet_name), f"remove_network {subnet_name}")
 
 
 def attach(ip, subnet_name, container_name, interface, tc_params):
@@ -99,15 +96,25 @@ def attach(ip, subnet_name, container_name, interface, tc_params):
 	:param subnet_name: name of subnet
 	:param container_name: name of container
 	:param tc_params: tuple (bandwidth, burst, latency)
-	:return: None
+	:return: exit status of the first failing command, 0 on success
 	"""
-	if interface == "eth0":
-		configure_link(container_name, interface, tc_params)
-	else:
-		cmd = f"docker network connect --ip {ip} {subnet_name} {container_name}"
-		print(cmd)
-		os.system(cmd)
-		configure_link(container_name, interface, tc_params)
+	if interface != "eth0":
+		cmd_value = connect(ip, subnet_name, container_name)
+		if cmd_value != 0:
+			return cmd_value
+	return configure_link(container_name, interface, tc_params)
+
+
+def connect(ip, subnet_name, container_name):
+	"""
+	Connect container to subnet on its next free interface
+	:param ip: ip address of container on subnet
+	:param subnet_name: name of subnet
+	:param container_name: name of container
+	:return: exit status of the docker operation
+	"""
+	return check(get_backend().connect_network(subnet_name, container_name, ip),
+	             f"connect_network {subnet_name} {container_name} {ip}")
 
 
 def detach(subnet_name, container_name):
@@ -115,11 +122,10 @@ def detach(subnet_name, container_name):
 	Detach container from a subnet
 	:param subnet_name: name of subnet
 	:param container_name: name of container
-	:return: None
+	:return: exit status of the docker operation
 	"""
-	cmd = f"docker network disconnect {subnet_name} {container_name}"
-	print(cmd)
-	os.system(cmd)
+	return check(get_backend().disconnect_network(subnet_name, container_name),
+	             f"disconnect_network {subnet_name} {container_name}")
 
 
 def add_route(container_name, ip_range, gateway_ip, interface):
@@ -129,15 +135,15 @@ def add_route(container_name, ip_range, gateway_ip, interface):
 	:param ip_range: destination subnet
 	:param gateway_ip: ip of next hop gateway
 	:param interface: interface through which packets will be sent
-	:return: None
+	:return: exit status of the last command run
 	"""
-	cmd = f"docker exec {container_name} ip route add {ip_range}" \
-	      f" via {gateway_ip} dev {interface}"
-	cmdValue = os.system(cmd)
-	if cmdValue != 0:
-		cmd = f"docker exec {container_name} ip route change {ip_range}" \
-		      f" via {gateway_ip} dev {interface}"
-		os.system(cmd)
+	backend = get_backend()
+	cmd = ["ip", "route", "add", ip_range, "via", gateway_ip, "dev", interface]
+	result = backend.exec(container_name, cmd)
+	if result.exit_code != 0:
+		cmd[2] = "change"
+		result = backend.exec(container_name, cmd)
+	return check(result)
 
 
 def del_route(container_name, ip_range):
@@ -145,86 +151,235 @@ def del_route(container_name, ip_range):
 	Deleting routing rule corresponding to a link
 	:param container_name: name of src container
 	:param ip_range: destination node ip address
-	:return: None
+	:return: exit status of ip route
 	"""
-	cmd = f"docker exec {container_name} ip route delete {ip_range}"
-	os.system(cmd)
+	return check(get_backend().exec(container_name, ["ip", "route", "delete", ip_range]))
 
 
-def write_state_json(nodes, links, node_vs_ip, node_vs_eth):
+def write_state(nodes, links, node_vs_eth, routing=None):
 	"""
-	Reads from the current state (consisting of all the input parameters of this function)
-	and stores it in the state.json file
-	:param nodes: node information in the format as defined in json file.
-	:param links: link information in the format as defined in json file.
-	:param node_vs_ip: list of ips associated with the nodes
-	:param: node_vs_eth: the highest ethernet interface number used.
-	:return: the current state of the graph in dictionary format
+	Replace the stored state of the testbed in one transaction, together with the
+	routes installed by this process
+	:param nodes: node information in the format as defined in the config file.
+	:param links: link information as generated by generate_link_param.
+	:param node_vs_eth: the highest ethernet interface number used.
+	:param routing: routing state of all nodes as returned by routing.compute_routing
+	:return: None
 	"""
-	with open("../tmp/state.json", "w") as f:
-		json.dump({"nodes": nodes, "links": links, "node_vs_ip": node_vs_ip, "node_vs_eth": node_vs_eth}, f, indent=4)
+	get_store().replace(nodes, links, node_vs_eth, routing,
+	                    {node: routes for node, (routes, _) in installed_routes.items()})
 
 
-def read_state_json():
+def read_state():
 	"""
-	Read the state json file which stores the current state.
+	Read a consistent snapshot of the current state from the state store.
 	:param: None
-	:return: the current state of the graph in dictionary format
-	"""
-	with open("../tmp/state.json", "r") as f:
-		current_state = json.load(f)
-	return current_state
-
-
-def generate_link_param(node_vs_eth, link_info):
-	"""
-	Generates more parameters from the limited set of info taken form config file.
-	:param node_vs_eth: contains the node vs ethernet number mapping to decide the next
-	ethernet available to use for the link.
-	:param link_info: contains the info provided for the link in the config file or add
-	and delete link commands.
-	:return: link_name, node_vs_eth, link_param
+	:return: dict with the nodes, links, node_vs_ip and node_vs_eth of the testbed
 	"""
-	node0 = link_info[0]
-	node1 = link_info[1]
-	link_name = node0[0] + "-" + node1[0]
-	subnet_ip = ".".join(node0[1].split(".")[:3]) + ".0/24"
-	if node0[0] not in node_vs_eth:
-		node_vs_eth[node0[0]] = 0
-	else:
-		node_vs_eth[node0[0]] += 1
-	if node1[0] not in node_vs_eth:
-		node_vs_eth[node1[0]] = 0
-	else:
-		node_vs_eth[node1[0]] += 1
-	link_param = (subnet_ip, ((node0[0], node0[1], "eth" + str(node_vs_eth[node0[0]])),
-	                          (node1[0], node1[1], "eth" + str(node_vs_eth[node1[0]]))), link_info[2])
-	return link_name, node_vs_eth, link_param
+	return get_store().snapshot()
 
 
 def configure_link(node, interface, tc_params):
 	"""
-	Configure interface on node
+	Configure interface on node. Only the qdiscs whose parameters differ are
+	changed, see traffic_control.apply_tc.
 	:param node: node to configure
 	:param interface: interface to configure
 	:param tc_params: tuple (bandwidth, burst, latency)
+	:return: 0 if the qdiscs are in place, else the failing exit status
+	"""
+	return apply_tc(node, {interface: tc_params})
+
+
+def install_routes(container_name, routes, deletions=()):
+	"""
+	Install routes on a container with a single docker exec. The routes are
+	written as an ip -batch script of "route replace" and "route delete"
+	commands to the stdin of the exec, so existing routes are updated in place.
+	:param container_name: name of container
+	:param routes: list of (destination ip, gateway ip, interface) or a callable returning it
+	:param deletions: list of destination ips whose routes are deleted
+	:return: exit status of the batch, 0 on success
+	"""
+	if callable(routes):
+		routes = routes()
+	script = "".join(f"route delete {dest_ip}\n" for dest_ip in deletions)
+	script += "".join(f"route replace {dest_ip} via {gateway_ip} dev {interface}\n"
+	                  for dest_ip, gateway_ip, interface in routes)
+	n_routes = len(routes) + len(deletions)
+	start = time.monotonic()
+	result = get_backend().exec(container_name, ["ip", "-batch", "-"], stdin=script.encode())
+	duration = time.monotonic() - start
+	route_stats[container_name] = (n_routes, duration)
+	if result.exit_code == 0:
+		installed_routes[container_name] = (routes, deletions)
+	print(f"Installed {len(routes)} and deleted {len(deletions)} routes on {container_name} in {duration:.3f}s")
+	return check(result)
+
+
+def report_route_installation():
+	"""
+	Print how long the route installation took on every node and how many
+	docker execs were saved compared to one exec per route
+	:return: None
+	"""
+	if not route_stats:
+		return
+	n_routes = sum(n for n, _ in route_stats.values())
+	print("\nRoute installation:")
+	for container_name, (n, duration) in sorted(route_stats.items()):
+		print(f"  {container_name:<12} {n:>6} routes  {duration:8.3f}s")
+	print(f"  {len(route_stats)} execs for {n_routes} routes, "
+	      f"saved {n_routes - len(route_stats)} docker execs")
+
+
+def plan_provisioning(provisioner, nodes, links, routes, new_links=None, new_nodes=None, deletions=None,
+                      labels=None, pool=None, images=None):
+	"""
+	Add the steps needed to set up the topology to a provisioner. Containers depend
+	on their base subnet, network connects on the subnet and the container, tc on
+	all connects of its node and routes on the tc of their node. Connects of the same
+	container are chained so interfaces are numbered in the order of the config.
+	:param provisioner: provision.Provisioner to add the steps to
+	:param nodes: node information in the format as defined in the config file.
+	:param links: link information as generated by generate_link_param.
+	:param routes: dict node -> list of (destination ip, gateway ip, interface) to install,
+	or a callable building that list when the route step runs
+	:param new_links: names of links to create, all links if None
+	:param new_nodes: names of containers to create, all nodes if None
+	:param deletions: dict node -> list of destination ips whose routes are deleted
+	:param labels: dict of labels put on the created containers and subnets
+	:param pool: pool.ContainerPool providing the containers. The interfaces of every
+	node with new connects are renamed to their planned names before tc is set up.
+	:param images: dict node -> image of its container, node-image for nodes missing
+	:return: None
+	"""
+	deletions = deletions or {}
+	images = images or {}
+	if new_links is None:
+		new_links = list(links)
+	if new_nodes is None:
+		new_nodes = list(nodes)
+	link_set = set(new_links)
+	node_set = set(new_nodes)
+
+	for link_name in new_links:
+		provisioner.add_step(f"subnet:{link_name}", "subnets",
+		                     partial(create_subnet, links[link_name][0], link_name, labels),
+		                     undo=partial(remove_subnet, link_name))
+
+	for node_name in new_nodes:
+		ip, base_link = nodes[node_name]
+		image = images.get(node_name, "node-image")
+		deps = [f"subnet:{base_link}"] if base_link in link_set else []
+		if pool is not None:
+			provisioner.add_step(f"container:{node_name}", "containers",
+			                     partial(pool.start, node_name, base_link, ip, image),
+			                     deps=deps, undo=partial(pool.release, node_name))
+			continue
+		provisioner.add_step(f"container:{node_name}", "containers",
+		                     partial(create_container, node_name, image, base_link, ip, labels),
+		                     deps=deps, undo=partial(remove_container, node_name))
+
+	connect_steps = {}
+	interface_params = {}
+	for link_name in new_links:
+		endpoints = links[link_name][1]
+		tc_params = links[link_name][2]
+		for node_name, ip, interface in endpoints:
+			interface_params.setdefault(node_name, {})[interface] = tuple(tc_params)
+			if interface == "eth0":
+				continue
+			connect_step = f"connect:{link_name}:{node_name}"
+			deps = [f"subnet:{link_name}"]
+			if node_name in node_set:
+				deps.append(f"container:{node_name}")
+			if node_name in connect_steps:
+				deps.append(connect_steps[node_name][-1])
+			# releasing a pooled container disconnects all of its networks
+			provisioner.add_step(connect_step, "connects",
+			                     partial(connect, ip, link_name, node_name), deps=deps,
+			                     undo=partial(detach, link_name, node_name) if pool is None else None)
+			connect_steps.setdefault(node_name, []).append(connect_step)
+
+	if pool is not None:
+		for node_name in set(connect_steps) | (node_set & set(interface_params)):
+			interface_ips = {ip: interface for link_param in links.values()
+			                 for name, ip, interface in link_param[1] if name == node_name}
+			deps = list(connect_steps.get(node_name, []))
+			if node_name in node_set:
+				deps.append(f"container:{node_name}")
+			provisioner.add_step(f"wire:{node_name}", "connects", partial(pool.wire, node_name, interface_ips),
+			                     deps=deps)
+			connect_steps.setdefault(node_name, []).append(f"wire:{node_name}")
+
+	# the new interfaces have no qdiscs yet, so all of a node is set up with one tc batch
+	for node_name, params in interface_params.items():
+		deps = list(connect_steps.get(node_name, []))
+		if node_name in node_set:
+			deps.append(f"container:{node_name}")
+		provisioner.add_step(f"tc:{node_name}", "tc", partial(apply_tc, node_name, params, {}), deps=deps)
+
+	for node_name in set(routes) | set(deletions):
+		deps = [f"tc:{node_name}"] if node_name in interface_params else []
+		provisioner.add_step(f"routes:{node_name}", "routes",
+		                     partial(install_routes, node_name, routes.get(node_name, []),
+		                             deletions.get(node_name, [])), deps=deps)
+
+
+def run_provisioner(provisioner):
+	"""
+	Run a provisioner, exiting if a step fails
+	:param provisioner: provision.Provisioner with all steps added
+	:return: None
+	"""
+	try:
+		provisioner.run()
+	except ProvisioningError as e:
+		print(f"Setup failed, rolled back: {e}")
+		raise SystemExit(1)
+	finally:
+		provisioner.report()
+		report_route_installation()
+
+
+def store_installed_routes(store):
+	"""
+	Record the routes installed by this process in the state store
+	:param store: state_store.StateStore
 	:return: None
 	"""
-	bandwidth, burst, latency = tc_params
-	cmd_bandwidth = f"docker exec {node} tc qdisc add dev {interface} " \
-	                f"root handle 1: tbf rate {bandwidth}mbit burst {burst}kb latency 10ms"
-	cmd_latency = f"docker exec {node} tc qdisc add dev {interface} " \
-	              f"parent 1:1 handle 10: netem delay {latency}ms"
-	cmd_value_bandwidth = os.system(cmd_bandwidth)
-	cmd_value_latency = os.system(cmd_latency)
-	# Error handling for cmd_bandwidth and cmd_latency
-	if cmd_value_bandwidth != 0 or cmd_value_latency != 0:
-		clear_child = f"docker exec {node} tc qdisc del dev {interface} parent 1:1 handle 10"
-		clear_cmd = f"docker exec {node} tc qdisc del dev {interface} root"
-		os.system(clear_child)
-		os.system(clear_cmd)
-		os.system(cmd_bandwidth)
-		os.system(cmd_latency)
+	with store.transaction():
+		for node, (routes, deletions) in installed_routes.items():
+			store.update_routes(node, routes, deletions)
+
+
+def dry_run(args, plan, routes, log):
+	"""
+	Write the commands a setup of the plan would run and print the estimated setup time
+	:param args: parameters describing network topology
+	:param plan: compiled plan of the topology
+	:param routes: dict node -> callable building the routes of the node
+	:param log: log of the recording backends of a sharded dry run, unused otherwise
+	:return: estimated seconds of the setup
+	"""
+	backend = get_backend()
+	kind = type(backend).__name__
+	if not isinstance(backend, ShardedBackend):
+		set_backend(DryRunBackend(log))
+	provisioner = Provisioner(max_workers=args.workers)
+	plan_provisioning(provisioner, plan["nodes"], plan["links"], routes,
+	                  labels=run_labels(args.testbed, new_run_id()), images=plan["images"])
+	try:
+		if args.dry_run == "-":
+			operations = record_plan(provisioner, log, sys.stdout)
+		else:
+			with open(args.dry_run, "w") as out:
+				operations = record_plan(provisioner, log, out)
+			print(f"Wrote {len(log)} commands of {len(operations)} steps to {args.dry_run}")
+	finally:
+		set_backend(backend)
+	return report_plan(provisioner, operations, CostModel.from_store(get_store(), kind), args.workers)
 
 
 def main(args):
@@ -233,139 +388,210 @@ def main(args):
 	:param args: parameters describing network topology
 	:return: None
 	"""
+	provisioner = Provisioner(max_workers=args.workers, verbose=True)
+	store = get_store()
 	if args.add_link is not None:
 		print(f'Adding link: {args.add_link}')
-		# Handling add_link functionality
-		current_state = read_state_json()
-		node_vs_eth = current_state["node_vs_eth"]
-		link_info = ast.literal_eval(args.add_link)
-		link_name, node_vs_eth, link_param = generate_link_param(node_vs_eth, link_info)
-		current_state["links"][link_name] = link_param
-		links = current_state["links"]
-		nodes = current_state["nodes"]
-		create_subnet(link_param[0], link_name)
-		endpoints = link_param[1]
-		tc_params = link_param[2]
-		attach(endpoints[0][1], link_name, endpoints[0][0], endpoints[0][2], tc_params)
-		attach(endpoints[1][1], link_name, endpoints[1][0], endpoints[1][2], tc_params)
+		# Handling add_link functionality, other writers wait until the change is stored
+		with store.lock():
+			node_vs_eth = store.node_vs_eth()
+			old_links = store.links()
+			# endpoints without ip get the lowest free subnet of the address pool
+			address_pool = AddressPool.from_settings(store.get_meta("ipam"),
+			                                         [link_param[0] for link_param in old_links.values()])
+			try:
+				(link_info, subnet), = address_links([ast.literal_eval(args.add_link)], address_pool)
+			except ValueError as e:
+				print(e)
+				return
+			link_name, node_vs_eth, link_param = generate_link_param(node_vs_eth, link_info, subnet)
+			if link_name in old_links:
+				print(f"Link {link_name} is already present.")
+				return
+			backend = get_backend()
+			if isinstance(backend, ShardedBackend):
+				# a link between nodes on different hosts becomes a tunnel
+				backend.place({}, {link_name: link_param})
+			links = dict(old_links)
+			links[link_name] = link_param
+			nodes = store.nodes()
+			# only the shortest path trees the new link can shorten are recomputed
+			routing, routes, deletions, recomputed = update_routing(
+				store.routing(), old_links, links, get_node_vs_ip(nodes, old_links),
+				get_node_vs_ip(nodes, links), link_param, True)
+			print(f"Recomputed shortest paths of {recomputed} of {len(routing_nodes(routing))} nodes")
+			labels = run_labels(args.testbed, store.get_meta("run_id", new_run_id()))
+			pool = ContainerPool(args.testbed) if store.get_meta("pool") else None
+			plan_provisioning(provisioner, nodes, links, routes, [link_name], [], deletions, labels, pool)
+			run_provisioner(provisioner)
+			with store.transaction():
+				store.add_link(link_name, link_param, node_vs_eth)
+				store.set_routing(routing)
+				store_installed_routes(store)
 	elif args.remove_link:
 		print(f'Removing link: {args.remove_link}')
 		# Handling remove_link functionality
-		current_state = read_state_json()
-		node_vs_eth_not_used = {}
-		link_info = ast.literal_eval(args.remove_link)
-		link_name, node_vs_eth_not_used, link_param = generate_link_param(node_vs_eth_not_used, link_info)
-		node_vs_eth = current_state["node_vs_eth"]
-		endpoints = link_param[1]
-		if link_name in current_state["links"]:
-			start_node = endpoints[0][0]
-			dest_node = endpoints[1][0]
-			# deleting direct connections due to this link in routing tables
-			for dest_node_ip in current_state["node_vs_ip"][dest_node]:
-				del_route(start_node, dest_node_ip)
-			# because bidirectional
-			for start_node_ip in current_state["node_vs_ip"][start_node]:
-				del_route(dest_node, start_node_ip)
-			# deleting from links data structure
-			del current_state["links"][link_name]
-		else:
-			print("Link being deleted not present.")
-			exit()
-		links = current_state["links"]
-		nodes = current_state["nodes"]
-		detach(link_name, endpoints[0][0])
-		detach(link_name, endpoints[1][0])
-		remove_subnet(link_name)  # remove subnet after detaching containers or containers will get killed.
+		link_name = link_name_of(ast.literal_eval(args.remove_link))
+		with store.lock():
+			old_links = store.links()
+			if link_name not in old_links:
+				print("Link being deleted not present.")
+				exit()
+			links = dict(old_links)
+			link_param = links.pop(link_name)
+			endpoints = link_param[1]
+			nodes = store.nodes()
+			# only the shortest path trees containing the link are recomputed
+			routing, routes, deletions, recomputed = update_routing(
+				store.routing(), old_links, links, get_node_vs_ip(nodes, old_links),
+				get_node_vs_ip(nodes, links), link_param, False)
+			print(f"Recomputed shortest paths of {recomputed} of {len(routing_nodes(routing))} nodes")
+			# reroute before the interfaces of the link disappear
+			plan_provisioning(provisioner, nodes, links, routes, [], [], deletions)
+			run_provisioner(provisioner)
+			if store.get_meta("pool"):
+				# the interfaces of pooled containers carry their planned names, docker needs its own
+				pool = ContainerPool(args.testbed)
+				graph, connections = build_graph(links)
+				node_vs_ip = get_node_vs_ip(nodes, links)
+				for node_name, ip, interface in endpoints:
+					pool.unwire(node_name, [interface])
+					detach(link_name, node_name)
+					pool.wire(node_name, {ip: interface for link_param in links.values()
+					                      for name, ip, interface in link_param[1] if name == node_name})
+					# renaming takes interfaces down, which drops their routes
+					if node_name in connections:
+						install_routes(node_name, node_routes(routing, node_name, connections, node_vs_ip))
+			else:
+				detach(link_name, endpoints[0][0])
+				detach(link_name, endpoints[1][0])
+			remove_subnet(link_name)  # remove subnet after detaching containers or containers will get killed.
+			with store.transaction():
+				store.remove_link(link_name)
+				store.set_routing(routing)
+				store_installed_routes(store)
+	elif args.teardown or args.gc:
+		pool = ContainerPool(args.testbed)
+		with store.lock():
+			if args.teardown:
+				# pooled containers are kept warm, they only have to leave the networks
+				pool.release_all()
+				teardown(args.testbed, workers=max(args.workers, TEARDOWN_WORKERS))
+				# the measurements of earlier runs outlive the topology
+				kept = {key: store.get_meta(key) for key in ("pool_cold_start", COST_KEY)}
+				with store.transaction():
+					store.clear()
+					for key, value in kept.items():
+						if value:
+							store.set_meta(key, value)
+			else:
+				# everything of the testbed not created by the current run is an orphan
+				pool.release_all(keep=store.nodes())
+				teardown(args.testbed, store.get_meta("run_id"), max(args.workers, TEARDOWN_WORKERS))
+			if args.drain_pool:
+				print(f"Removed {pool.drain()} idle containers of the pool")
+		return
+	elif args.drain_pool:
+		print(f"Removed {ContainerPool(args.testbed).drain()} idle containers of the pool")
+		return
 	# Reading and storing information from the config.py file
 	elif args.config is not None:
-		config = importlib.import_module(args.config)
-		node_vs_ip = {}
-		node_vs_eth = {}
-		for node_name, node_param in config.nodes.items():
-			if node_name not in node_vs_ip:
-				node_vs_ip[node_name] = []
-			node_vs_ip[node_name].append(node_param[0])
-		# update links to include interface and link_name
-		links = {}
-		for link_info in config.links:
-			link_name, node_vs_eth, link_param = generate_link_param(node_vs_eth, link_info)
-			links[link_name] = link_param
-		nodes = config.nodes
-		# build image for node
-		build_image("node-image", "..")
-
-		# create subnets
-		for link_name, link_param in links.items():
-			create_subnet(link_param[0], link_name)
-
-		# create containers
-		for node_name, node_param in nodes.items():
-			create_container(node_name, "node-image", node_param[1], node_param[0])
-
-		# attach containers to networks
-		for link_name, link_param in links.items():
-			endpoints = link_param[1]
-			tc_params = link_param[2]
+		start = time.monotonic()
+		plan, cached = get_plan(args.config)
+		print(f"{'Loaded cached' if cached else 'Compiled'} plan {plan['hash'][:12]} of {args.config} "
+		      f"in {time.monotonic() - start:.3f}s")
+		replicas = None
+		if args.replicas is not None:
+			# isolated copies of the topology with prefixed names and shifted addresses
 			try:
-				attach(endpoints[0][1], link_name, endpoints[0][0], endpoints[0][2], tc_params)
-				attach(endpoints[1][1], link_name, endpoints[1][0], endpoints[1][2], tc_params)
-			except Exception as e:
+				plan, replicas = replicate_plan(plan, args.replicas)
+			except ValueError as e:
 				print(e)
+				return
+			report_replicas(replicas)
+		nodes = plan["nodes"]
+		links = plan["links"]
+		routing = plan["routing"]
+		roles = list(plan["roles"].values())
+		hosts = None
+		# commands recorded instead of run by a dry run
+		log = []
+		if args.hosts:
+			if args.pool:
+				print("The container pool cannot be used with --hosts")
+				return
+			# spread the nodes over the daemons of the hosts config
+			hosts = load_hosts(args.hosts)
+			placement = partition(nodes, links, {host: spec["capacity"] for host, spec in hosts.items()})
+			backend = ShardedBackend(hosts, {host: DryRunBackend(log, spec["docker_host"])
+			                                 for host, spec in hosts.items()} if args.dry_run else None)
+			backend.place(placement, links)
+			set_backend(backend)
+			report_placement(placement, links)
+			# the tunnels are set up by a helper container with the router image
+			roles.append(HELPER_ROLE)
+		elif isinstance(get_backend(), ShardedBackend):
+			# the last testbed was spread over several hosts, this one runs on one daemon
+			set_backend(default_backend())
+		if not plan["ipam"]["gateway"] and not isinstance(get_backend(), NetnsBackend):
+			# docker takes the first host address of every network for its gateway
+			print(f"Subnets without gateway (\"gateway\": False in the ipam of {args.config}) need the netns "
+			      f"backend, Docker takes the first address of every subnet for the gateway")
+			return
+		if isinstance(get_backend(), NetnsBackend):
+			if args.pool:
+				print("The container pool cannot be used with the netns backend")
+				return
+			# the nodes run the tools of the host, there are no images
+			roles = []
+		# the routes are only built when the route step of a node runs
+		routes = {node: partial(plan_routes, plan, node) for node in plan["connections"]}
+		if args.dry_run:
+			if args.pool:
+				print("The dry run plans a setup without the container pool")
+			dry_run(args, plan, routes, log)
+			return
+		# build the images of the roles, skipped for images whose content did not change
+		if build_images(roles, args.rebuild) != 0:
+			print("Building the node images failed")
+			return
+		run_id = new_run_id()
+		print(f"Run {run_id} of testbed {args.testbed}")
+		pool = None
+		if args.pool:
+			pool = ContainerPool(args.testbed)
+			pool.reserve(plan["images"])
+		plan_provisioning(provisioner, nodes, links, routes, labels=run_labels(args.testbed, run_id), pool=pool,
+		                  images=plan["images"])
+		cold_estimate = store.get_meta("pool_cold_start")
+		run_provisioner(provisioner)
+		# Store the current state in the state store
+		with store.transaction():
+			write_state(nodes, links, plan["node_vs_eth"], routing)
+			store.set_meta("run_id", run_id)
+			store.set_meta("ipam", json.dumps(plan["ipam"]))
+			save_replicas(store, replicas)
+			if hosts is not None:
+				save_placement(store, hosts, placement)
+			else:
+				store.set_meta("hosts", "")
+			if pool is not None:
+				store.set_meta("pool", "1")
+				cold_start = pool.report(float(cold_estimate) if cold_estimate else None)
+				# remembered to estimate the savings of runs without cold starts
+				store.set_meta("pool_cold_start", str(cold_start or cold_estimate or ""))
+			else:
+				# the step times of a setup from scratch calibrate the estimates of dry runs
+				model = CostModel.from_store(store, type(get_backend()).__name__)
+				model.calibrate(provisioner, route_stats, run_id)
+				model.save(store)
+		if pool is not None:
+			start_latency.update(pool.cold)
+			start_latency.update(pool.warm)
+		report_roles(plan["roles"], start_latency, args.workers)
 	else:
 		print("Invalid Argument")
 
-	# Using Dijkstra to configure routing tables with add route function above
-	graph = {}
-	connections = {}
-	# Create Graph
-	for link_name, link_param in links.items():
-		endpoints = link_param[1]
-		tc_params = link_param[2]
-
-		if endpoints[0][0] not in node_vs_ip:
-			node_vs_ip[endpoints[0][0]] = []
-		node_vs_ip[endpoints[0][0]].append(endpoints[0][1])
-		if endpoints[1][0] not in node_vs_ip:
-			node_vs_ip[endpoints[1][0]] = []
-		node_vs_ip[endpoints[1][0]].append(endpoints[1][1])
-
-		if endpoints[0][0] not in graph:
-			graph[endpoints[0][0]] = []
-			connections[endpoints[0][0]] = {}
-		graph[endpoints[0][0]].append((endpoints[1][0], tc_params))
-		connections[endpoints[0][0]][endpoints[1][0]] = (
-			endpoints[1][1], endpoints[0][2])  # ip of other node,eth of itself
-		if endpoints[1][0] not in graph:
-			graph[endpoints[1][0]] = []
-			connections[endpoints[1][0]] = {}
-		graph[endpoints[1][0]].append((endpoints[0][0], tc_params))
-		connections[endpoints[1][0]][endpoints[0][0]] = (endpoints[0][1], endpoints[1][2])
-
-	for start_node in graph:
-		dist = dijkstra(graph, start_node)
-		hops = []
-		for node in graph:
-			if node == start_node:
-				continue
-			prev_node = dist[node][1]
-			next_hop = node
-			while prev_node != start_node and dist[prev_node][0] != float('inf'):
-				next_hop = prev_node
-				prev_node = dist[prev_node][1]
-			if dist[prev_node][0] == float('inf'):
-				continue
-			hops.append((node, next_hop))
-		print(f"\nStart Node = {start_node}")
-		for dest_node, next_hop_node in hops:
-			next_hop_node_ip = connections[start_node][next_hop_node][0]
-			interface = connections[start_node][next_hop_node][1]
-			for dest_node_ip in node_vs_ip[dest_node]:
-				add_route(start_node, dest_node_ip, next_hop_node_ip, interface)
-			print(f"Destination Node = {dest_node}, Next hop = {next_hop_node}")
-
-	# Store the current state to state.json file
-	write_state_json(nodes, links, node_vs_ip, node_vs_eth)
-
 
 if __name__ == "__main__":
 	# parse arguments
@@ -377,5 +603,28 @@ if __name__ == "__main__":
 	parser.add_argument('-c', '--config', type=str, required=False, default='topology_config',
 	                    help='config file describing topology to set up '
 	                         '(see examples folder for examples)')
+	parser.add_argument('-t', '--teardown', action='store_true',
+	                    help='remove all containers and subnets of the testbed')
+	parser.add_argument('--gc', action='store_true',
+	                    help='remove containers and subnets of the testbed left behind by earlier runs')
+	parser.add_argument('-p', '--pool', action='store_true',
+	                    help='reuse warm containers of the pool and keep them on teardown')
+	parser.add_argument('--drain-pool', action='store_true',
+	                    help='remove the idle containers of the pool')
+	parser.add_argument('--rebuild', action='store_true',
+	                    help='build the node images even if their content did not change')
+	parser.add_argument('--hosts', type=str, required=False, default=None,
+	                    help='hosts config describing the docker daemons to spread the topology over '
+	                         '(see hosts_config.py)')
+	parser.add_argument('--dry-run', type=str, nargs='?', const='-', default=None, metavar='FILE',
+	                    help='write the commands of the setup to FILE (stdout if missing) with an '
+	                         'estimate of the setup time instead of running them')
+	parser.add_argument('-n', '--testbed', type=str, required=False, default=DEFAULT_TESTBED,
+	                    help='name of the testbed the containers and subnets are labeled with')
+	parser.add_argument('-k', '--replicas', type=int, required=False, default=None,
+	                    help='set up this many isolated copies of the topology, node rep<k>.<name> of '
+	                         'copy k (see replicas.py)')
+	parser.add_argument('-w', '--workers', type=int, required=False, default=8,
+	                    help='maximum number of docker operations run concurrently')
 	args = parser.parse_args()
 	main(args)
@@ -0,0 +1,308 @@
+"""
+Deployment of a topology across several Docker daemons.
+
+The hosts are described in a hosts config, a python module like the topology
+config defining a dict
+
+	hosts = {host_name: {"docker_host": ..., "address": ..., "capacity": ...}, ...}
+
+with docker_host the daemon of the host (unix://<socket> for the Engine API,
+anything docker -H accepts for the CLI, or fake for an in-memory daemon), address
+the ip of the host on the network connecting the hosts and capacity its relative
+share of the nodes (1 if missing). The nodes are assigned to hosts by the
+partitioner (see partition.py).
+
+ShardedBackend behaves like a single backend and sends every operation to the
+daemon of the container it concerns, so setup, traffic control, routing and the
+experiment helpers are unchanged. A link within one host is a plain bridge
+network. A link between two hosts is a bridge network with the same subnet on
+both daemons whose bridges are joined by a VXLAN tunnel, so the containers see
+the same veth interfaces and get the same tc shaping as on a single host. The
+tunnel interfaces are set up in the network namespace of the host through a
+helper container running with the host network. Only the bridge of the first
+host keeps the gateway address of the subnet.
+
+The hosts and the placement of the nodes are kept in the state store, so every
+later process (add-link, teardown, experiments) gets the sharded backend from
+get_backend.
+"""
+import importlib
+import ipaddress
+import json
+import os
+import threading
+from docker_backend import CliBackend, EngineBackend, ExecResult, FakeBackend
+from images import image_of
+from partition import cut_links
+from state_store import STATE_DB, get_store
+
+HOST_HELPER = "net-measure-host"
+HELPER_LABEL = "net-measure.host-helper"
+HELPER_ROLE = "router"
+VXLAN_PORT = 4789
+# 50 bytes of VXLAN, UDP, IP and ethernet headers fit into a 1500 byte MTU between the hosts
+VXLAN_MTU = 1450
+BRIDGE_NAME_OPTION = "com.docker.network.bridge.name"
+MTU_OPTION = "com.docker.network.driver.mtu"
+
+
+def host_backend(docker_host):
+	"""
+	:param docker_host: daemon of a host as given in the hosts config
+	:return: backend talking to the daemon
+	"""
+	if docker_host == "fake":
+		return FakeBackend()
+	if docker_host.startswith("unix://"):
+		return EngineBackend(docker_host[len("unix://"):])
+	return CliBackend(host=docker_host)
+
+
+def vni(subnet):
+	"""
+	VXLAN network identifier of a cross-host link, unique among the subnets of a /8
+	:param subnet: subnet of the link
+	:return: vni
+	"""
+	network = ipaddress.ip_network(subnet)
+	return (int(network.network_address) >> (32 - network.prefixlen)) & 0xffffff
+
+
+def tunnel_names(subnet):
+	"""
+	:param subnet: subnet of a cross-host link
+	:return: tuple (name of the bridge, name of the vxlan interface) on both hosts
+	"""
+	return f"nmbr{vni(subnet)}", f"nmvx{vni(subnet)}"
+
+
+class ShardedBackend:
+	"""
+	Backend spreading the containers of a topology over several daemons
+	:param hosts: dict host -> dict with docker_host, address and capacity as in the hosts config
+	:param backends: dict host -> backend, created from docker_host if None
+	"""
+
+	def __init__(self, hosts, backends=None):
+		self.hosts = hosts
+		self.backends = backends or {host: host_backend(spec["docker_host"]) for host, spec in hosts.items()}
+		self.placement = {}
+		# link -> (subnet, hosts of its endpoints)
+		self.networks = {}
+		# containers and networks seen on a host by a list call, for names without placement
+		self._seen = {}
+		self._helpers = set()
+		self._lock = threading.Lock()
+
+	def place(self, placement, links):
+		"""
+		Set the host of every node and derive the hosts of every link
+		:param placement: dict node -> host
+		:param links: link information as generated by generate_link_param.
+		:return: None
+		"""
+		self.placement.update(placement)
+		for link_name, link_param in links.items():
+			hosts = []
+			for node_name, _, _ in link_param[1]:
+				if self.placement[node_name] not in hosts:
+					hosts.append(self.placement[node_name])
+			self.networks[link_name] = (link_param[0], hosts)
+
+	def _owner(self, container):
+		host = self.placement.get(container) or self._seen.get(("container", container))
+		return self.backends[host or next(iter(self.backends))]
+
+	def _network_hosts(self, network):
+		if network in self.networks:
+			return self.networks[network][1]
+		seen = [host for host in self.backends if ("network", network, host) in self._seen]
+		return seen or list(self.backends)
+
+	def host_exec(self, host, commands, force=False):
+		"""
+		Run ip commands in the network namespace of a host
+		:param host: name of host
+		:param commands: list of ip batch commands
+		:param force: continue after failing commands
+		:return: ExecResult
+		"""
+		backend = self.backends[host]
+		with self._lock:
+			if host not in self._helpers:
+				if HOST_HELPER not in backend.list_containers({HELPER_LABEL: None}):
+					result = backend.run_container(HOST_HELPER, image_of(HELPER_ROLE), "host", None,
+					                               labels={HELPER_LABEL: "1"})
+					if result.exit_code != 0:
+						return result
+				self._helpers.add(host)
+		script = "".join(command + "\n" for command in commands)
+		cmd = ["ip"] + (["-force"] if force else []) + ["-batch", "-"]
+		return backend.exec(HOST_HELPER, cmd, stdin=script.encode())
+
+	def ping(self):
+		return all(backend.ping() for backend in self.backends.values())
+
+	def create_network(self, name, subnet, labels=None, options=None):
+		hosts = self._network_hosts(name)
+		if len(hosts) == 1:
+			return self.backends[hosts[0]].create_network(name, subnet, labels, options)
+		bridge, tunnel = tunnel_names(subnet)
+		options = dict(options or {}, **{BRIDGE_NAME_OPTION: bridge, MTU_OPTION: str(VXLAN_MTU)})
+		for i, host in enumerate(hosts):
+			peer = self.hosts[hosts[1 - i]]["address"]
+			result = self.backends[host].create_network(name, subnet, labels, options)
+			if result.exit_code == 0:
+				# a tunnel left behind by a network removed without this backend is replaced
+				self.host_exec(host, [f"link del {tunnel}"], force=True)
+				commands = [f"link add {tunnel} type vxlan id {vni(subnet)} remote {peer} dstport {VXLAN_PORT}",
+				            f"link set {tunnel} mtu {VXLAN_MTU} master {bridge}",
+				            f"link set {tunnel} up"]
+				if i > 0:
+					commands.append(f"addr flush dev {bridge}")
+				result = self.host_exec(host, commands)
+			if result.exit_code != 0:
+				for created in hosts[:i + 1]:
+					self.backends[created].remove_network(name)
+				return result
+		return result
+
+	def remove_network(self, name):
+		hosts = self._network_hosts(name)
+		subnet = self.networks.get(name, (None,))[0]
+		result = ExecResult(0, b"", b"")
+		for host in hosts:
+			if len(hosts) > 1 and subnet is not None:
+				self.host_exec(host, [f"link del {tunnel_names(subnet)[1]}"], force=True)
+			host_result = self.backends[host].remove_network(name)
+			if host_result.exit_code != 0:
+				result = host_result
+		return result
+
+	def connect_network(self, network, container, ip=None):
+		return self._owner(container).connect_network(network, container, ip)
+
+	def disconnect_network(self, network, container, force=False):
+		return self._owner(container).disconnect_network(network, container, force)
+
+	def run_container(self, name, image, network, ip, privileged=True, labels=None):
+		return self._owner(name).run_container(name, image, network, ip, privileged, labels)
+
+	def remove_container(self, name, force=True):
+		return self._owner(name).remove_container(name, force)
+
+	def rename_container(self, name, new_name):
+		return self._owner(name).rename_container(name, new_name)
+
+	def container_networks(self, name):
+		return self._owner(name).container_networks(name)
+
+	def container_memory(self, name):
+		return self._owner(name).container_memory(name)
+
+	def list_containers(self, labels=None):
+		names = []
+		for host, backend in self.backends.items():
+			for name in backend.list_containers(labels):
+				self._seen[("container", name)] = host
+				names.append(name)
+		return names
+
+	def list_networks(self, labels=None):
+		names = []
+		for host, backend in self.backends.items():
+			for name in backend.list_networks(labels):
+				self._seen[("network", name, host)] = True
+				if name not in names:
+					names.append(name)
+		return names
+
+	def inspect_image(self, name):
+		# an image counts as present if all hosts have it with the same labels
+		images = [backend.inspect_image(name) for backend in self.backends.values()]
+		if any(image is None for image in images):
+			return None
+		labels = [(image.get("Config") or {}).get("Labels") for image in images]
+		return images[0] if all(label == labels[0] for label in labels) else None
+
+	def build_image(self, name, path, dockerfile="Dockerfile", labels=None):
+		for backend in self.backends.values():
+			result = backend.build_image(name, path, dockerfile, labels)
+			if result.exit_code != 0:
+				return result
+		return result
+
+	def exec(self, container, cmd, stdin=None):
+		return self._owner(container).exec(container, cmd, stdin)
+
+	def open_exec(self, container, cmd):
+		return self._owner(container).open_exec(container, cmd)
+
+	def exec_detached(self, container, cmd):
+		result, exec_id = self._owner(container).exec_detached(container, cmd)
+		return result, (container, exec_id) if exec_id is not None else None
+
+	def inspect_exec(self, exec_id):
+		container, host_exec_id = exec_id
+		return self._owner(container).inspect_exec(host_exec_id)
+
+
+def load_hosts(config):
+	"""
+	:param config: name of the hosts config module
+	:return: dict host -> dict with docker_host, address and capacity
+	"""
+	hosts = importlib.import_module(config).hosts
+	return {host: dict({"capacity": 1}, **spec) for host, spec in hosts.items()}
+
+
+def save_placement(store, hosts, placement):
+	"""
+	Keep the hosts and the placement of the nodes in the state store
+	:param store: state_store.StateStore
+	:param hosts: dict host -> dict as returned by load_hosts
+	:param placement: dict node -> host
+	:return: None
+	"""
+	store.set_meta("hosts", json.dumps(hosts))
+	store.set_meta("placement", json.dumps(placement))
+
+
+def backend_from_store(store):
+	"""
+	Sharded backend of the testbed in the state store
+	:param store: state_store.StateStore
+	:return: ShardedBackend placed like the stored topology, None if the testbed runs on one daemon
+	"""
+	hosts = store.get_meta("hosts")
+	if not hosts:
+		return None
+	backend = ShardedBackend(json.loads(hosts))
+	backend.place(json.loads(store.get_meta("placement") or "{}"), store.links())
+	return backend
+
+
+def stored_backend():
+	"""
+	:return: sharded backend of the testbed in the default state store, None if there is none
+	"""
+	if not os.path.exists(STATE_DB):
+		return None
+	return backend_from_store(get_store())
+
+
+def report_placement(placement, links):
+	"""
+	Print the number of nodes per host and the links crossing hosts
+	:param placement: dict node -> host
+	:param links: link information as generated by generate_link_param.
+	:return: number of links crossing hosts
+	"""
+	counts = {}
+	for host in placement.values():
+		counts[host] = counts.get(host, 0) + 1
+	n_cut = len(cut_links(links, placement))
+	print(f"Placed {len(placement)} nodes on {len(counts)} hosts: "
+	      + ", ".join(f"{host} {count}" for host, count in sorted(counts.items())))
+	print(f"  {n_cut} of {len(links)} links cross hosts as VXLAN tunnels")
+	return n_cut
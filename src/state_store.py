@@ -0,0 +1,392 @@
+"""
+State of the running testbed.
+
+The state lives in an SQLite database (tmp/state.db) with typed tables for
+nodes, links, interfaces and installed routes instead of a json file that is
+rewritten after every operation. Interfaces are indexed by node, link and ip,
+so the links of a node or the node owning an ip are single index lookups.
+The next hop matrix of the routing is kept as an npz blob.
+
+Writes go through transaction(), which takes an exclusive lock on
+tmp/state.db.lock and runs the updates in one SQLite transaction, so a
+runtime link change and an experiment can modify the state concurrently
+without seeing each other's partial updates. Readers are never blocked, the
+database runs in WAL mode. lock() takes the same file lock without a
+transaction, for read-modify-write sequences spanning Docker operations.
+"""
+import fcntl
+import io
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+STATE_DB = "../tmp/state.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+	id INTEGER PRIMARY KEY,
+	name TEXT NOT NULL UNIQUE,
+	ip TEXT NOT NULL,
+	base_link TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS links (
+	id INTEGER PRIMARY KEY,
+	name TEXT NOT NULL UNIQUE,
+	subnet TEXT NOT NULL,
+	bandwidth NUMERIC NOT NULL,
+	burst NUMERIC NOT NULL,
+	latency NUMERIC NOT NULL
+);
+CREATE TABLE IF NOT EXISTS interfaces (
+	node TEXT NOT NULL,
+	interface TEXT NOT NULL,
+	ip TEXT NOT NULL,
+	link TEXT NOT NULL REFERENCES links(name) ON DELETE CASCADE,
+	side INTEGER NOT NULL,
+	PRIMARY KEY (node, interface)
+);
+CREATE INDEX IF NOT EXISTS interfaces_link ON interfaces(link);
+CREATE INDEX IF NOT EXISTS interfaces_ip ON interfaces(ip);
+CREATE TABLE IF NOT EXISTS eth_counters (
+	node TEXT PRIMARY KEY,
+	last_eth INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS routes (
+	node TEXT NOT NULL,
+	destination TEXT NOT NULL,
+	gateway TEXT NOT NULL,
+	interface TEXT NOT NULL,
+	PRIMARY KEY (node, destination)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blobs (
+	name TEXT PRIMARY KEY,
+	value BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+	key TEXT PRIMARY KEY,
+	value TEXT NOT NULL
+);
+"""
+
+
+class StateStore:
+	"""
+	Transactional store of the testbed state
+	:param path: path of the database file
+	"""
+
+	def __init__(self, path=STATE_DB):
+		self.path = path
+		self._local = threading.local()
+		# executescript commits on its own, so the schema is created outside of a transaction
+		with self.lock():
+			self._conn().executescript(SCHEMA)
+
+	def _conn(self):
+		conn = getattr(self._local, "conn", None)
+		if conn is None:
+			os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+			conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute("PRAGMA synchronous=NORMAL")
+			conn.execute("PRAGMA foreign_keys=ON")
+			self._local.conn = conn
+			self._local.lock_depth = 0
+			self._local.tx_depth = 0
+		return conn
+
+	@contextmanager
+	def lock(self):
+		"""
+		Hold the exclusive state lock. Reentrant within a thread.
+		:return: context manager
+		"""
+		self._conn()
+		if self._local.lock_depth == 0:
+			self._local.lock_file = open(self.path + ".lock", "a")
+			fcntl.flock(self._local.lock_file, fcntl.LOCK_EX)
+		self._local.lock_depth += 1
+		try:
+			yield
+		finally:
+			self._local.lock_depth -= 1
+			if self._local.lock_depth == 0:
+				fcntl.flock(self._local.lock_file, fcntl.LOCK_UN)
+				self._local.lock_file.close()
+
+	@contextmanager
+	def transaction(self):
+		"""
+		Run the updates of the with block atomically under the state lock.
+		Nested transactions join the outer one.
+		:return: context manager yielding the sqlite connection
+		"""
+		conn = self._conn()
+		with self.lock():
+			if self._local.tx_depth > 0:
+				self._local.tx_depth += 1
+				try:
+					yield conn
+				finally:
+					self._local.tx_depth -= 1
+				return
+			conn.execute("BEGIN IMMEDIATE")
+			self._local.tx_depth = 1
+			try:
+				yield conn
+			except BaseException:
+				conn.execute("ROLLBACK")
+				raise
+			else:
+				conn.execute("COMMIT")
+			finally:
+				self._local.tx_depth = 0
+
+	def clear(self):
+		"""
+		Remove all state
+		:return: None
+		"""
+		with self.transaction() as conn:
+			for table in ("routes", "interfaces", "links", "nodes", "eth_counters", "blobs", "meta"):
+				conn.execute(f"DELETE FROM {table}")
+
+	def replace(self, nodes, links, node_vs_eth, routing=None, routes=None):
+		"""
+		Replace the whole state
+		:param nodes: node information in the format as defined in the config file.
+		:param links: link information as generated by generate_link_param.
+		:param node_vs_eth: dict node -> highest interface number used
+		:param routing: routing state as returned by routing.compute_routing
+		:param routes: dict node -> list of installed (destination ip, gateway ip, interface)
+		:return: None
+		"""
+		with self.transaction() as conn:
+			self.clear()
+			conn.executemany("INSERT INTO nodes (name, ip, base_link) VALUES (?, ?, ?)",
+			                 [(name, param[0], param[1]) for name, param in nodes.items()])
+			for link_name, link_param in links.items():
+				self.add_link(link_name, link_param)
+			self.set_node_vs_eth(node_vs_eth)
+			self.set_routing(routing)
+			for node, node_routes in (routes or {}).items():
+				self.update_routes(node, node_routes)
+
+	def add_link(self, link_name, link_param, node_vs_eth=None):
+		"""
+		Add a link and its two interfaces
+		:param link_name: name of the link
+		:param link_param: link parameters as generated by generate_link_param
+		:param node_vs_eth: dict node -> highest interface number used, stored if given
+		:return: None
+		"""
+		subnet, endpoints, tc_params = link_param
+		with self.transaction() as conn:
+			conn.execute("INSERT INTO links (name, subnet, bandwidth, burst, latency) VALUES (?, ?, ?, ?, ?)",
+			             (link_name, subnet, *tc_params))
+			conn.executemany("INSERT INTO interfaces (node, interface, ip, link, side) VALUES (?, ?, ?, ?, ?)",
+			                 [(node, interface, ip, link_name, side)
+			                  for side, (node, ip, interface) in enumerate(endpoints)])
+			if node_vs_eth is not None:
+				self.set_node_vs_eth(node_vs_eth)
+
+	def remove_link(self, link_name):
+		"""
+		Remove a link and its interfaces
+		:param link_name: name of the link
+		:return: link parameters of the removed link, None if it did not exist
+		"""
+		with self.transaction() as conn:
+			link_param = self.link(link_name)
+			conn.execute("DELETE FROM links WHERE name = ?", (link_name,))
+		return link_param
+
+	def set_link_params(self, link_name, tc_params):
+		"""
+		Update the tc parameters of a link
+		:param link_name: name of the link
+		:param tc_params: tuple (bandwidth, burst, latency)
+		:return: None
+		"""
+		with self.transaction() as conn:
+			conn.execute("UPDATE links SET bandwidth = ?, burst = ?, latency = ? WHERE name = ?",
+			             (*tc_params, link_name))
+
+	def set_node_vs_eth(self, node_vs_eth):
+		with self.transaction() as conn:
+			conn.executemany("INSERT OR REPLACE INTO eth_counters (node, last_eth) VALUES (?, ?)",
+			                 list(node_vs_eth.items()))
+
+	def set_routing(self, routing):
+		"""
+		Store the next hop matrix of the routing
+		:param routing: routing state as returned by routing.compute_routing or of replicas, None removes it
+		:return: None
+		"""
+		with self.transaction() as conn:
+			if routing is None:
+				conn.execute("DELETE FROM blobs WHERE name = 'routing'")
+				return
+			buffer = io.BytesIO()
+			# the routing of replicas adds the block index of every replica
+			np.savez(buffer, **dict(routing, nodes=np.array(routing["nodes"], dtype=str)))
+			conn.execute("INSERT OR REPLACE INTO blobs (name, value) VALUES ('routing', ?)",
+			             (buffer.getvalue(),))
+
+	def set_meta(self, key, value):
+		"""
+		Store a single value, e.g. the run id of the testbed
+		:param key: name of the value
+		:param value: string value
+		:return: None
+		"""
+		with self.transaction() as conn:
+			conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+	def get_meta(self, key, default=None):
+		"""
+		:param key: name of the value
+		:param default: returned if the value is not set
+		:return: value stored with set_meta
+		"""
+		row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+		return row[0] if row else default
+
+	def update_routes(self, node, routes, deletions=()):
+		"""
+		Record routes installed on a node
+		:param node: name of node
+		:param routes: list of (destination ip, gateway ip, interface) replaced
+		:param deletions: list of destination ips whose routes were deleted
+		:return: None
+		"""
+		with self.transaction() as conn:
+			conn.executemany("DELETE FROM routes WHERE node = ? AND destination = ?",
+			                 [(node, dest_ip) for dest_ip in deletions])
+			conn.executemany("INSERT OR REPLACE INTO routes (node, destination, gateway, interface) "
+			                 "VALUES (?, ?, ?, ?)", [(node, *route) for route in routes])
+
+	def nodes(self):
+		"""
+		:return: dict node -> (ip, base link) in the format of the config file
+		"""
+		rows = self._conn().execute("SELECT name, ip, base_link FROM nodes ORDER BY id")
+		return {name: (ip, base_link) for name, ip, base_link in rows}
+
+	def links(self):
+		"""
+		:return: dict link -> link parameters as generated by generate_link_param
+		"""
+		conn = self._conn()
+		endpoints = {}
+		for node, interface, ip, link, side in conn.execute(
+				"SELECT node, interface, ip, link, side FROM interfaces ORDER BY link, side"):
+			endpoints.setdefault(link, []).append((node, ip, interface))
+		return {name: (subnet, tuple(endpoints.get(name, ())), (bandwidth, burst, latency))
+		        for name, subnet, bandwidth, burst, latency in conn.execute(
+				"SELECT name, subnet, bandwidth, burst, latency FROM links ORDER BY id")}
+
+	def link(self, link_name):
+		"""
+		:param link_name: name of the link
+		:return: link parameters as generated by generate_link_param, None if there is no such link
+		"""
+		conn = self._conn()
+		row = conn.execute("SELECT subnet, bandwidth, burst, latency FROM links WHERE name = ?",
+		                   (link_name,)).fetchone()
+		if row is None:
+			return None
+		endpoints = tuple(conn.execute("SELECT node, ip, interface FROM interfaces WHERE link = ? ORDER BY side",
+		                               (link_name,)))
+		return row[0], endpoints, tuple(row[1:])
+
+	def links_of(self, node):
+		"""
+		:param node: name of node
+		:return: dict interface -> link of all links of a node
+		"""
+		return dict(self._conn().execute("SELECT interface, link FROM interfaces WHERE node = ? ORDER BY interface",
+		                                 (node,)))
+
+	def node_of_ip(self, ip):
+		"""
+		:param ip: ip address
+		:return: name of the node owning the ip, None if it is unknown
+		"""
+		row = self._conn().execute("SELECT node FROM interfaces WHERE ip = ? "
+		                           "UNION ALL SELECT name FROM nodes WHERE ip = ? LIMIT 1", (ip, ip)).fetchone()
+		return row[0] if row else None
+
+	def node_vs_eth(self):
+		"""
+		:return: dict node -> highest interface number used
+		"""
+		return dict(self._conn().execute("SELECT node, last_eth FROM eth_counters"))
+
+	def node_vs_ip(self):
+		"""
+		:return: dict node -> list of ips, base ip first
+		"""
+		node_vs_ip = {name: [ip] for name, ip in self._conn().execute("SELECT name, ip FROM nodes ORDER BY id")}
+		for node, ip in self._conn().execute(
+				"SELECT interfaces.node, interfaces.ip FROM interfaces JOIN links ON interfaces.link = links.name "
+				"ORDER BY links.id, interfaces.side"):
+			ips = node_vs_ip.setdefault(node, [])
+			if ip not in ips:
+				ips.append(ip)
+		return node_vs_ip
+
+	def routes(self, node):
+		"""
+		:param node: name of node
+		:return: dict destination ip -> (gateway ip, interface) of the routes installed on a node
+		"""
+		return {dest: (gateway, interface) for dest, gateway, interface in self._conn().execute(
+			"SELECT destination, gateway, interface FROM routes WHERE node = ?", (node,))}
+
+	def routing(self):
+		"""
+		:return: routing state as returned by routing.compute_routing, None if none is stored
+		"""
+		row = self._conn().execute("SELECT value FROM blobs WHERE name = 'routing'").fetchone()
+		if row is None:
+			return None
+		data = np.load(io.BytesIO(row[0]))
+		return dict({name: data[name] for name in data.files}, nodes=data["nodes"].tolist())
+
+	def snapshot(self):
+		"""
+		Consistent copy of the state in the format of the former state.json file
+		:return: dict with the keys nodes, links, node_vs_ip and node_vs_eth
+		"""
+		conn = self._conn()
+		if self._local.tx_depth > 0:
+			return self._snapshot()
+		conn.execute("BEGIN")
+		try:
+			return self._snapshot()
+		finally:
+			conn.execute("COMMIT")
+
+	def _snapshot(self):
+		return {"nodes": self.nodes(), "links": self.links(), "node_vs_ip": self.node_vs_ip(),
+		        "node_vs_eth": self.node_vs_eth()}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store(path=STATE_DB):
+	"""
+	Store of this process, opened on first use
+	:param path: path of the database file
+	:return: StateStore
+	"""
+	global _store
+	with _store_lock:
+		if _store is None or _store.path != path:
+			_store = StateStore(path)
+		return _store
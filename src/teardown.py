@@ -0,0 +1,97 @@
+"""
+Teardown and garbage collection of testbed resources.
+
+Every container and network created by setup carries two labels: the name
+of the testbed (TESTBED_LABEL) and the id of the setup run that created it
+(RUN_LABEL). Teardown finds the resources of a testbed by label instead of
+trusting the state store, removes all containers concurrently and then all
+networks concurrently. The same mechanism collects the leftovers of crashed
+runs: everything of the testbed not labeled with the current run id.
+
+Removing a container also removes its network endpoints, so the time of a
+teardown is bound by the slowest container removal and the slowest network
+removal rather than by the size of the topology, as long as the daemon keeps
+up with the concurrent requests.
+"""
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from docker_backend import get_backend
+
+TESTBED_LABEL = "net-measure.testbed"
+RUN_LABEL = "net-measure.run"
+DEFAULT_TESTBED = "default"
+TEARDOWN_WORKERS = 32
+
+
+def new_run_id():
+	"""
+	:return: id identifying a setup run
+	"""
+	return uuid.uuid4().hex[:12]
+
+
+def run_labels(testbed, run_id):
+	"""
+	Labels put on every container and network of a run
+	:param testbed: name of the testbed
+	:param run_id: id of the setup run
+	:return: dict of labels
+	"""
+	return {TESTBED_LABEL: testbed, RUN_LABEL: run_id}
+
+
+def _remove_all(remove, names, workers):
+	if not names:
+		return []
+	with ThreadPoolExecutor(max_workers=min(workers, len(names))) as pool:
+		results = list(pool.map(remove, names))
+	failed = []
+	for name, result in zip(names, results):
+		if result.exit_code != 0:
+			print(f"Removing {name} failed: {result.stderr.decode('utf-8', errors='replace').strip()}")
+			failed.append(name)
+	return failed
+
+
+def remove_resources(containers, networks, workers=TEARDOWN_WORKERS):
+	"""
+	Remove containers and then networks, each set concurrently
+	:param containers: names of containers
+	:param networks: names of networks
+	:param workers: number of concurrent docker operations
+	:return: tuple (names of containers, names of networks) that could not be removed
+	"""
+	backend = get_backend()
+	failed_containers = _remove_all(backend.remove_container, list(containers), workers)
+	failed_networks = _remove_all(backend.remove_network, list(networks), workers)
+	return failed_containers, failed_networks
+
+
+def teardown(testbed=DEFAULT_TESTBED, keep_run=None, workers=TEARDOWN_WORKERS):
+	"""
+	Remove the containers and networks of a testbed found by label
+	:param testbed: name of the testbed
+	:param keep_run: id of a run whose resources are kept, only orphans of other runs
+	are removed if given
+	:param workers: number of concurrent docker operations
+	:return: tuple (number of removed containers, number of removed networks, seconds)
+	"""
+	backend = get_backend()
+	start = time.monotonic()
+	labels = {TESTBED_LABEL: testbed}
+	containers = backend.list_containers(labels)
+	networks = backend.list_networks(labels)
+	if keep_run is not None:
+		kept = dict(labels, **{RUN_LABEL: keep_run})
+		kept_containers = set(backend.list_containers(kept))
+		kept_networks = set(backend.list_networks(kept))
+		containers = [name for name in containers if name not in kept_containers]
+		networks = [name for name in networks if name not in kept_networks]
+	failed_containers, failed_networks = remove_resources(containers, networks, workers)
+	duration = time.monotonic() - start
+	n_containers = len(containers) - len(failed_containers)
+	n_networks = len(networks) - len(failed_networks)
+	print(f"Removed {n_containers} containers and {n_networks} networks of testbed {testbed} "
+	      f"in {duration:.3f}s")
+	return n_containers, n_networks, duration
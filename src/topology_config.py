@@ -14,6 +14,8 @@ nodes = {"c1": ("10.0.1.2", "c1-r1"),
 """
 Links Format:
 [(endpoint_name1, ip1, (endpoint_name2, ip2)), (bandwidth[Mbit/s], burst[kb], latency[ms])), ...]
+or, to get the subnet and addresses from the address pool (see ipam.py):
+[(endpoint_name1, endpoint_name2, (bandwidth[Mbit/s], burst[kb], latency[ms])), ...]
 """
 links = [(("c1", "10.0.1.2"), ("r1", "10.0.1.4"), (100, 12500, 1)),
          (("r2", "10.0.2.2"), ("r3", "10.0.2.4"), (100, 12500, 1)),
@@ -22,4 +24,8 @@ links = [(("c1", "10.0.1.2"), ("r1", "10.0.1.4"), (100, 12500, 1)),
          (("c2", "10.0.5.2"), ("r5", "10.0.5.4"), (100, 12500, 1)),
          (("r1", "10.0.6.2"), ("r2", "10.0.6.4"), (100, 12500, 1)),
          (("r3", "10.0.7.2"), ("r4", "10.0.7.4"), (100, 12500, 1)),
-         (("r5", "10.0.8.2"), ("r6", "10.0.8.4"), (100, 12500, 1))]
\ No newline at end of file
+         (("r5", "10.0.8.2"), ("r6", "10.0.8.4"), (100, 12500, 1))]
+"""
+Roles Format (optional, nodes missing get the role node with the full image):
+{node_name: role, ...} with role one of node, router, host or probe (see images.py)
+"""
\ No newline at end of file
@@ -0,0 +1,410 @@
+"""
+Generators of large topologies.
+
+Every generator builds a Graph of node names and undirected edges, and
+to_config turns a Graph into the links and roles of a topology config,
+drawing the bandwidth and latency of every link from a distribution. Graphs
+can be written to a config module with write_config, so setup can load them
+like a hand-written config:
+
+	python3 topology_generator.py fat-tree --k 8 --bandwidth 100,1000 --latency 1:5 -o fat_tree.py
+	python3 setup.py -c fat_tree
+
+Supported graphs are fat-trees, k-ary trees, grids (and tori), random
+connected graphs, Waxman graphs and GraphML files such as the ones of the
+Internet Topology Zoo. Nodes of degree one that are meant to send and receive
+traffic are hosts and get the host role, all other nodes the router role.
+
+A distribution is given as
+- a number: every link gets this value
+- a tuple (low, high): uniform between low and high
+- a list: uniform choice among the values
+- a callable: called with a random.Random instance for every link
+"""
+import argparse
+import math
+import random
+import re
+import xml.etree.ElementTree as ElementTree
+from collections import namedtuple
+import numpy as np
+
+DEFAULT_BANDWIDTH = 100
+DEFAULT_BURST = 12500
+DEFAULT_LATENCY = 1
+# propagation speed in fiber in km per ms, used for the latency of GraphML links with coordinates
+FIBER_KM_PER_MS = 200
+GRAPHML_NS = "{http://graphml.graphdrawing.org/xmlns}"
+
+"""
+nodes: list of node names
+edges: list of (node, node, attributes) with attributes a dict that may fix the
+bandwidth or latency of the link
+hosts: set of nodes that are hosts
+"""
+Graph = namedtuple("Graph", ["nodes", "edges", "hosts"])
+
+
+def sample(distribution, rng):
+	"""
+	Draw a value from a distribution
+	:param distribution: distribution as described in the module docstring
+	:param rng: random.Random instance
+	:return: value
+	"""
+	if callable(distribution):
+		return distribution(rng)
+	if isinstance(distribution, tuple):
+		return rng.uniform(*distribution)
+	if isinstance(distribution, list):
+		return rng.choice(distribution)
+	return distribution
+
+
+def parse_distribution(text):
+	"""
+	Parse a distribution given on the command line
+	:param text: "v" for a constant, "low:high" for a uniform and "v1,v2,..." for a choice
+	:return: distribution
+	"""
+	if ":" in text:
+		low, high = text.split(":")
+		return float(low), float(high)
+	if "," in text:
+		return [float(value) for value in text.split(",")]
+	return float(text)
+
+
+def _edge(a, b, **attributes):
+	return a, b, attributes
+
+
+def fat_tree(k):
+	"""
+	Fat-tree of k pods: (k/2)^2 core switches, k/2 aggregation and k/2 edge switches
+	per pod and k/2 hosts per edge switch, k^3/4 hosts in total
+	:param k: number of ports of every switch, even
+	:return: Graph
+	"""
+	if k < 2 or k % 2:
+		raise ValueError(f"The number of ports of a fat-tree must be even, got {k}")
+	half = k // 2
+	cores = [f"c{i}" for i in range(half * half)]
+	nodes = list(cores)
+	edges = []
+	hosts = set()
+	for pod in range(k):
+		aggregations = [f"a{pod}_{i}" for i in range(half)]
+		nodes += aggregations
+		for i, aggregation in enumerate(aggregations):
+			# aggregation switch i of every pod connects to the cores i * k/2 ... (i + 1) * k/2 - 1
+			edges += [_edge(aggregation, core) for core in cores[i * half:(i + 1) * half]]
+		for i in range(half):
+			switch = f"e{pod}_{i}"
+			nodes.append(switch)
+			edges += [_edge(switch, aggregation) for aggregation in aggregations]
+			for j in range(half):
+				host = f"h{pod}_{i}_{j}"
+				nodes.append(host)
+				hosts.add(host)
+				edges.append(_edge(host, switch))
+	return Graph(nodes, edges, hosts)
+
+
+def kary_tree(k, depth):
+	"""
+	Complete k-ary tree, the leaves are hosts
+	:param k: number of children of every inner node
+	:param depth: number of levels below the root
+	:return: Graph
+	"""
+	if k < 1 or depth < 1:
+		raise ValueError(f"A k-ary tree needs k >= 1 and depth >= 1, got k={k} depth={depth}")
+	nodes = ["n0"]
+	edges = []
+	level = ["n0"]
+	for _ in range(depth):
+		children = []
+		for parent in level:
+			for _ in range(k):
+				child = f"n{len(nodes)}"
+				nodes.append(child)
+				children.append(child)
+				edges.append(_edge(parent, child))
+		level = children
+	return Graph(nodes, edges, set(level))
+
+
+def grid(rows, cols, torus=False):
+	"""
+	Grid of routers, optionally wrapped around into a torus
+	:param rows: number of rows
+	:param cols: number of columns
+	:param torus: connect the last row and column to the first one
+	:return: Graph
+	"""
+	nodes = [f"g{r}_{c}" for r in range(rows) for c in range(cols)]
+	edges = []
+	for r in range(rows):
+		for c in range(cols):
+			if c + 1 < cols or torus and cols > 2:
+				edges.append(_edge(f"g{r}_{c}", f"g{r}_{(c + 1) % cols}"))
+			if r + 1 < rows or torus and rows > 2:
+				edges.append(_edge(f"g{r}_{c}", f"g{(r + 1) % rows}_{c}"))
+	return Graph(nodes, edges, set())
+
+
+def _connect_components(nodes, edges, rng):
+	"""
+	Add edges between random nodes of different components until the graph is connected
+	:param nodes: list of node names
+	:param edges: list of edges, extended in place
+	:param rng: random.Random instance
+	:return: edges
+	"""
+	parent = {node: node for node in nodes}
+
+	def find(node):
+		while parent[node] != node:
+			parent[node] = parent[parent[node]]
+			node = parent[node]
+		return node
+
+	for a, b, _ in edges:
+		parent[find(a)] = find(b)
+	components = {}
+	for node in nodes:
+		components.setdefault(find(node), []).append(node)
+	groups = list(components.values())
+	for previous, group in zip(groups, groups[1:]):
+		edges.append(_edge(rng.choice(previous), rng.choice(group)))
+	return edges
+
+
+def random_graph(n, degree=3.0, seed=0):
+	"""
+	Connected random graph: a random tree with random links added until the mean
+	degree is reached
+	:param n: number of nodes
+	:param degree: mean node degree
+	:param seed: random seed
+	:return: Graph
+	"""
+	rng = random.Random(seed)
+	nodes = [f"n{i}" for i in range(n)]
+	pairs = {(i, rng.randrange(i)) for i in range(1, n)}
+	n_edges = min(int(n * degree / 2), n * (n - 1) // 2)
+	while len(pairs) < n_edges:
+		i, j = sorted(rng.sample(range(n), 2), reverse=True)
+		pairs.add((i, j))
+	return Graph(nodes, [_edge(nodes[i], nodes[j]) for i, j in sorted(pairs)], set())
+
+
+def waxman(n, alpha=0.4, beta=0.1, seed=0):
+	"""
+	Waxman graph: nodes placed uniformly in the unit square and linked with
+	probability alpha * exp(-d / (beta * L)), d the distance of the nodes and L the
+	largest distance. Components are joined by random links.
+	:param n: number of nodes
+	:param alpha: link density
+	:param beta: ratio of long to short links
+	:param seed: random seed
+	:return: Graph
+	"""
+	rng = random.Random(seed)
+	generator = np.random.default_rng(seed)
+	positions = generator.random((n, 2))
+	i, j = np.triu_indices(n, k=1)
+	distance = np.hypot(*(positions[i] - positions[j]).T)
+	scale = distance.max() if len(distance) else 1.
+	linked = generator.random(len(distance)) < alpha * np.exp(-distance / (beta * scale))
+	nodes = [f"w{k}" for k in range(n)]
+	edges = [_edge(nodes[a], nodes[b]) for a, b in zip(i[linked], j[linked])]
+	return Graph(nodes, _connect_components(nodes, edges, rng), set())
+
+
+def _node_name(label, index, taken):
+	name = re.sub(r"[^A-Za-z0-9_]", "", label.replace(" ", "_")) or f"n{index}"
+	if not name[0].isalpha():
+		name = "n" + name
+	if name in taken:
+		name = f"{name}_{index}"
+	taken.add(name)
+	return name
+
+
+def _haversine(lat0, lon0, lat1, lon1):
+	lat0, lon0, lat1, lon1 = map(math.radians, (lat0, lon0, lat1, lon1))
+	h = math.sin((lat1 - lat0) / 2) ** 2 + math.cos(lat0) * math.cos(lat1) * math.sin((lon1 - lon0) / 2) ** 2
+	return 2 * 6371 * math.asin(math.sqrt(h))
+
+
+def read_graphml(path, seed=0):
+	"""
+	Import a GraphML file, e.g. of the Internet Topology Zoo. Nodes are named after
+	their label. Self loops and parallel links are dropped and components are joined
+	by random links. Links between nodes with coordinates get the propagation delay
+	over the great circle distance as latency, links with a LinkSpeedRaw attribute
+	(bits/s) its bandwidth.
+	:param path: path of the GraphML file
+	:param seed: random seed for joining components
+	:return: Graph
+	"""
+	root = ElementTree.parse(path).getroot()
+	keys = {key.get("id"): key.get("attr.name") for key in root.iter(f"{GRAPHML_NS}key")}
+	graph = root.find(f"{GRAPHML_NS}graph")
+	if graph is None:
+		raise ValueError(f"{path} contains no graph")
+
+	def data(element):
+		return {keys.get(d.get("key"), d.get("key")): (d.text or "").strip() for d in element.iter(f"{GRAPHML_NS}data")}
+
+	names = {}
+	coordinates = {}
+	taken = set()
+	for index, node in enumerate(graph.iter(f"{GRAPHML_NS}node")):
+		attributes = data(node)
+		name = _node_name(attributes.get("label", ""), index, taken)
+		names[node.get("id")] = name
+		try:
+			coordinates[name] = (float(attributes["Latitude"]), float(attributes["Longitude"]))
+		except (KeyError, ValueError):
+			pass
+	edges = []
+	seen = set()
+	for edge in graph.iter(f"{GRAPHML_NS}edge"):
+		a, b = names[edge.get("source")], names[edge.get("target")]
+		if a == b or frozenset((a, b)) in seen:
+			continue
+		seen.add(frozenset((a, b)))
+		attributes = data(edge)
+		fixed = {}
+		if a in coordinates and b in coordinates:
+			fixed["latency"] = max(_haversine(*coordinates[a], *coordinates[b]) / FIBER_KM_PER_MS, 0.01)
+		try:
+			fixed["bandwidth"] = float(attributes["LinkSpeedRaw"]) / 1e6
+		except (KeyError, ValueError):
+			pass
+		edges.append(_edge(a, b, **fixed))
+	nodes = list(names.values())
+	return Graph(nodes, _connect_components(nodes, edges, random.Random(seed)), set())
+
+
+def attach_hosts(graph, n_hosts, seed=0):
+	"""
+	Attach hosts to random routers of a graph
+	:param graph: Graph
+	:param n_hosts: number of hosts
+	:param seed: random seed
+	:return: Graph with the hosts h0 ... h<n_hosts - 1> added
+	"""
+	rng = random.Random(seed)
+	routers = [node for node in graph.nodes if node not in graph.hosts]
+	hosts = [f"h{i}" for i in range(n_hosts)]
+	edges = graph.edges + [_edge(host, rng.choice(routers)) for host in hosts]
+	return Graph(graph.nodes + hosts, edges, graph.hosts | set(hosts))
+
+
+def to_config(graph, bandwidth=DEFAULT_BANDWIDTH, latency=DEFAULT_LATENCY, burst=DEFAULT_BURST, seed=0,
+              host_role="host", router_role="router"):
+	"""
+	Turn a graph into the links and roles of a topology config. The endpoints of the
+	links are given by name only, so the compiler assigns their subnets and addresses
+	from the address pool and the base link of every node is its first link.
+	Bandwidths are rounded to whole Mbit/s and latencies to 10us.
+	:param graph: Graph
+	:param bandwidth: distribution of the bandwidth in Mbit/s of links without a fixed one
+	:param latency: distribution of the latency in ms of links without a fixed one
+	:param burst: burst in kb of all links
+	:param seed: random seed
+	:param host_role: role of the hosts, None for the default role
+	:param router_role: role of the other nodes, None for the default role
+	:return: tuple (links, roles) in the format of a topology config
+	"""
+	rng = random.Random(seed)
+	links = []
+	for a, b, fixed in graph.edges:
+		link_bandwidth = fixed.get("bandwidth", sample(bandwidth, rng))
+		link_latency = fixed.get("latency", sample(latency, rng))
+		links.append((a, b, (max(1, int(round(link_bandwidth))), burst, round(link_latency, 2))))
+	roles = {}
+	for a, b, _ in graph.edges:
+		for name in (a, b):
+			role = host_role if name in graph.hosts else router_role
+			if role is not None:
+				roles.setdefault(name, role)
+	return links, roles
+
+
+def write_config(path, links, roles=None, ipam=None, comment=None):
+	"""
+	Write a topology config module
+	:param path: path of the config file
+	:param links: links as returned by to_config
+	:param roles: roles as returned by to_config
+	:param ipam: dict of address pool settings (pool, prefix, gateway), the defaults if None
+	:param comment: text put at the top of the file
+	:return: None
+	"""
+	with open(path, "w") as f:
+		if comment:
+			f.write(f'"""\n{comment}\n"""\n')
+		f.write('"""\nLinks Format:\n[(endpoint_name1, endpoint_name2, '
+		        '(bandwidth[Mbit/s], burst[kb], latency[ms])), ...]\n"""\nlinks = [\n')
+		f.writelines(f"    {link!r},\n" for link in links)
+		f.write("]\n")
+		if roles:
+			f.write("\nroles = {\n")
+			f.writelines(f"    {name!r}: {role!r},\n" for name, role in roles.items())
+			f.write("}\n")
+		if ipam:
+			f.write(f"\nipam = {ipam!r}\n")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Generate a topology config")
+	parser.add_argument('kind', choices=['fat-tree', 'tree', 'grid', 'torus', 'random', 'waxman', 'graphml'])
+	parser.add_argument('-o', '--output', type=str, required=True, help='path of the config file to write')
+	parser.add_argument('-k', '--k', type=int, default=4, help='ports of a fat-tree switch or children of a tree node')
+	parser.add_argument('--depth', type=int, default=3, help='depth of a tree')
+	parser.add_argument('--rows', type=int, default=10, help='rows of a grid')
+	parser.add_argument('--cols', type=int, default=10, help='columns of a grid')
+	parser.add_argument('-n', '--nodes', type=int, default=100, help='nodes of a random or Waxman graph')
+	parser.add_argument('--degree', type=float, default=3.0, help='mean degree of a random graph')
+	parser.add_argument('--alpha', type=float, default=0.4, help='link density of a Waxman graph')
+	parser.add_argument('--beta', type=float, default=0.1, help='ratio of long links of a Waxman graph')
+	parser.add_argument('--graphml', type=str, help='GraphML file to import')
+	parser.add_argument('--hosts', type=int, default=0, help='hosts attached to random routers')
+	parser.add_argument('--bandwidth', type=parse_distribution, default=DEFAULT_BANDWIDTH,
+	                    help='bandwidth in Mbit/s: v, low:high or v1,v2,...')
+	parser.add_argument('--latency', type=parse_distribution, default=DEFAULT_LATENCY,
+	                    help='latency in ms: v, low:high or v1,v2,...')
+	parser.add_argument('--burst', type=int, default=DEFAULT_BURST, help='burst in kb')
+	parser.add_argument('--pool', type=str, default=None, help='network the link subnets are allocated from')
+	parser.add_argument('--prefix', type=int, default=None, help='prefix length of the link subnets')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--no-roles', action='store_true', help='give all nodes the default role')
+	args = parser.parse_args()
+
+	if args.kind == 'fat-tree':
+		graph = fat_tree(args.k)
+	elif args.kind == 'tree':
+		graph = kary_tree(args.k, args.depth)
+	elif args.kind in ('grid', 'torus'):
+		graph = grid(args.rows, args.cols, args.kind == 'torus')
+	elif args.kind == 'random':
+		graph = random_graph(args.nodes, args.degree, args.seed)
+	elif args.kind == 'waxman':
+		graph = waxman(args.nodes, args.alpha, args.beta, args.seed)
+	else:
+		if args.graphml is None:
+			parser.error("graphml needs --graphml")
+		graph = read_graphml(args.graphml, args.seed)
+	if args.hosts:
+		graph = attach_hosts(graph, args.hosts, args.seed)
+	roles = (None, None) if args.no_roles else ("host", "router")
+	links, roles = to_config(graph, args.bandwidth, args.latency, args.burst, args.seed, *roles)
+	ipam = {key: value for key, value in (("pool", args.pool), ("prefix", args.prefix)) if value is not None}
+	write_config(args.output, links, roles, ipam, f"Generated by topology_generator.py {args.kind}")
+	print(f"Wrote {len({name for link in links for name in link[:2]})} nodes and {len(links)} links "
+	      f"to {args.output}")
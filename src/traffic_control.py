@@ -0,0 +1,182 @@
+"""
+Traffic control of the links in the testbed.
+
+Every shaped interface carries the same qdisc tree, a tbf root qdisc limiting
+the bandwidth with a netem child adding the latency:
+
+	root handle 1: tbf rate <bandwidth>mbit burst <burst>kb latency 10ms
+	parent 1:1 handle 10: netem delay <latency>ms
+
+The current tree of a node is read with tc -j qdisc show and compared to the
+wanted parameters. Only the qdiscs that differ are changed, all interfaces of a
+node in one tc -batch exec. Qdiscs are changed in place with change/replace so
+the shaping is never torn down while reconfiguring. A caller that owns the links
+of a node, like a sweep on its instance, can pass a cache of the applied state
+to skip reading the tree again; without one the tree is always read.
+"""
+import json
+from docker_backend import get_backend
+
+TBF_LATENCY = "10ms"
+
+
+def read_qdiscs(node):
+	"""
+	Read the current qdisc tree of a node
+	:param node: name of node
+	:return: dict interface -> tc_params tuple (bandwidth, burst, latency) with
+	None for every value not set by a matching qdisc, None if tc failed
+	"""
+	result = get_backend().exec(node, ["tc", "-j", "qdisc", "show"])
+	if result.exit_code != 0:
+		return None
+	return parse_qdiscs(result.stdout.decode('utf-8'))
+
+
+def parse_qdiscs(output):
+	"""
+	Parse the output of tc -j qdisc show
+	:param output: json output of tc
+	:return: dict interface -> (bandwidth, burst, latency) in the units of the
+	config file, values are None if the matching qdisc is missing
+	"""
+	current = {}
+	for qdisc in json.loads(output or "[]"):
+		dev = qdisc.get("dev")
+		if dev is None:
+			continue
+		bandwidth, burst, latency = current.get(dev, (None, None, None))
+		options = qdisc.get("options", {})
+		if qdisc.get("kind") == "tbf" and qdisc.get("root") and qdisc.get("handle") == "1:":
+			# tc reports the rate in bytes/s and the burst in bytes
+			bandwidth = options.get("rate", 0) * 8 / 1e6
+			burst = options.get("burst", 0) / 1024
+		elif qdisc.get("kind") == "netem" and qdisc.get("parent") == "1:1" and qdisc.get("handle") == "10:":
+			delay = options.get("delay", {})
+			if isinstance(delay, dict):
+				# delay is reported in seconds
+				latency = delay.get("delay", 0) * 1000
+			else:
+				latency = 0
+		current[dev] = (bandwidth, burst, latency)
+	return current
+
+
+def _close(value, wanted, rel_tol):
+	return value is not None and abs(value - wanted) <= rel_tol * max(abs(wanted), 1e-9)
+
+
+def tbf_command(verb, interface, tc_params):
+	"""
+	tc batch command for the bandwidth limiting root qdisc
+	:param verb: add, change or replace
+	:param interface: interface to configure
+	:param tc_params: tuple (bandwidth, burst, latency)
+	:return: command without the leading tc
+	"""
+	bandwidth, burst, _ = tc_params
+	return f"qdisc {verb} dev {interface} root handle 1: tbf rate {bandwidth}mbit " \
+	       f"burst {burst}kb latency {TBF_LATENCY}"
+
+
+def netem_command(verb, interface, tc_params):
+	"""
+	tc batch command for the latency adding netem qdisc
+	:param verb: add, change or replace
+	:param interface: interface to configure
+	:param tc_params: tuple (bandwidth, burst, latency)
+	:return: command without the leading tc
+	"""
+	return f"qdisc {verb} dev {interface} parent 1:1 handle 10: netem delay {tc_params[2]}ms"
+
+
+def plan_changes(interface_params, current):
+	"""
+	Compute the minimal set of tc commands turning the current qdisc trees
+	into the wanted ones
+	:param interface_params: dict interface -> tc_params tuple (bandwidth, burst, latency)
+	:param current: dict interface -> tc_params as returned by parse_qdiscs
+	:return: list of tc batch commands
+	"""
+	commands = []
+	for interface, tc_params in interface_params.items():
+		bandwidth, burst, latency = current.get(interface, (None, None, None))
+		if bandwidth is None:
+			# no tbf root yet, replace whatever root qdisc there is atomically
+			commands.append(tbf_command("replace", interface, tc_params))
+			commands.append(netem_command("replace", interface, tc_params))
+			continue
+		# tc rounds the burst to its internal buffer time
+		if not (_close(bandwidth, tc_params[0], 0.01) and _close(burst, tc_params[1], 0.02)):
+			commands.append(tbf_command("change", interface, tc_params))
+		if latency is None:
+			commands.append(netem_command("replace", interface, tc_params))
+		elif not _close(latency, tc_params[2], 0.001):
+			commands.append(netem_command("change", interface, tc_params))
+	return commands
+
+
+def apply_tc(node, interface_params, current=None, cache=None):
+	"""
+	Bring the qdiscs of the given interfaces of a node to the wanted parameters
+	with at most one tc -batch exec
+	:param node: name of node
+	:param interface_params: dict interface -> tc_params tuple (bandwidth, burst, latency)
+	:param current: known qdisc state as returned by parse_qdiscs, an empty dict
+	for freshly created interfaces. If None the state in cache is used, or read from
+	the node if there is none.
+	:param cache: dict node -> qdisc state applied earlier, updated with the applied
+	state. Only valid as long as nobody else changes the qdiscs of the node.
+	:return: exit status of tc, 0 if nothing had to be changed
+	"""
+	if current is None:
+		current = cache.get(node) if cache is not None else None
+	if current is None:
+		current = read_qdiscs(node)
+		if current is None:
+			current = {}
+	commands = plan_changes(interface_params, current)
+	if not commands:
+		return 0
+	script = "".join(command + "\n" for command in commands)
+	result = get_backend().exec(node, ["tc", "-batch", "-"], stdin=script.encode())
+	if result.exit_code != 0:
+		print(result.stderr.decode('utf-8'))
+		if cache is not None:
+			# the state on the node is unknown now
+			cache.pop(node, None)
+		return result.exit_code
+	if cache is not None:
+		state = dict(current)
+		state.update({interface: tuple(tc_params) for interface, tc_params in interface_params.items()})
+		cache[node] = state
+	return 0
+
+
+def group_by_node(links, params=None):
+	"""
+	Collect the wanted tc parameters of all link endpoints per node
+	:param links: link information as generated by generate_link_param
+	:param params: tc_params applied to every link, the configured parameters
+	of each link if None
+	:return: dict node -> {interface: tc_params}
+	"""
+	per_node = {}
+	for link_name, link_param in links.items():
+		tc_params = params if params is not None else link_param[2]
+		for endpoint in link_param[1]:
+			per_node.setdefault(endpoint[0], {})[endpoint[2]] = tuple(tc_params)
+	return per_node
+
+
+def configure_links(links, params=None, cache=None):
+	"""
+	Reconfigure the links of a topology with one exec per node
+	:param links: link information as stored in the state store
+	:param params: tc_params applied to every link, the configured parameters
+	of each link if None
+	:param cache: qdisc state applied earlier, see apply_tc
+	:return: dict node -> exit status
+	"""
+	return {node: apply_tc(node, interface_params, cache=cache)
+	        for node, interface_params in group_by_node(links, params).items()}
@@ -0,0 +1,65 @@
+"""
+Fixtures of the unit tests. The tests run without Docker: the testbed runs on
+a FakeBackend, the state store and the plan cache live in a temporary directory.
+"""
+import os
+import sys
+from functools import partial
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SRC = os.path.join(ROOT, 'src')
+sys.path.append(SRC)
+sys.path.append(os.path.join(ROOT, 'utils'))
+
+import compiler
+import docker_backend
+import setup
+import state_store
+
+
+@pytest.fixture
+def fake_backend():
+	"""
+	:return: FakeBackend used by the testbed for the duration of the test
+	"""
+	previous = docker_backend._backend
+	backend = docker_backend.FakeBackend()
+	docker_backend.set_backend(backend)
+	yield backend
+	docker_backend.set_backend(previous)
+
+
+@pytest.fixture
+def store(tmp_path):
+	"""
+	:return: empty StateStore in the temporary directory
+	"""
+	return state_store.StateStore(str(tmp_path / "state.db"))
+
+
+@pytest.fixture
+def testbed(tmp_path, monkeypatch, fake_backend, store):
+	"""
+	Run setup.main on the fake backend. Configs are modules written to the
+	temporary directory, setup runs in src like make setup.
+	:return: function (config source, **args) -> FakeBackend, the config source is the text of the config
+	"""
+	monkeypatch.chdir(SRC)
+	monkeypatch.syspath_prepend(str(tmp_path))
+	monkeypatch.setattr(setup, "get_store", lambda: store)
+	monkeypatch.setattr(setup, "get_plan", partial(compiler.get_plan, cache_dir=str(tmp_path / "plans")))
+	configs = iter(range(1000))
+
+	def run(config=None, **args):
+		if config is not None:
+			name = f"config_{os.path.basename(tmp_path)}_{next(configs)}".replace("-", "_")
+			(tmp_path / f"{name}.py").write_text(config)
+			args["config"] = name
+		defaults = dict(add_link=None, remove_link=None, config=None, teardown=False, gc=False, pool=False,
+		                drain_pool=False, rebuild=False, hosts=None, dry_run=None, testbed="default",
+		                replicas=None, workers=4)
+		setup.main(setup.argparse.Namespace(**{**defaults, **args}))
+		return fake_backend
+
+	return run
@@ -0,0 +1,149 @@
+"""
+Captures streamed from the nodes into files and rings of files
+"""
+import queue
+import struct
+import pytest
+import capture as capture_module
+from capture import Capture
+from docker_backend import ExecResult
+from pcap_reader import read_pcap
+
+START = 1760000000
+
+
+def pcap(packets, header=True):
+	"""
+	:param packets: number of packets, the i-th sent at START + i ms with 60 captured bytes
+	:return: pcap stream
+	"""
+	data = struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 96, 1) if header else b""
+	for i in range(packets):
+		data += struct.pack("<IIII", START, i * 1000, 60, 1500) + bytes(60)
+	return data
+
+
+class Channel:
+	"""
+	Output of tcpdump on a node: the PID line and the pcap stream in small chunks
+	"""
+
+	def __init__(self, data, chunk=7, end=True):
+		self.chunks = queue.Queue()
+		self.closed = False
+		for i in range(0, len(data), chunk):
+			self.chunks.put(data[i:i + chunk])
+		if end:
+			self.end()
+
+	def end(self):
+		self.chunks.put(b"")
+
+	def read(self, size):
+		data = self.chunks.get()
+		if data and len(data) > size:
+			# a read returns at most size bytes, the rest stays for the next read
+			self.chunks.queue.appendleft(data[size:])
+			data = data[:size]
+		if not data:
+			self.chunks.put(b"")
+		return data
+
+	def close(self):
+		self.closed = True
+		self.end()
+
+
+@pytest.fixture
+def node(fake_backend):
+	"""
+	:return: function data, **Channel args -> Channel that the next capture on node r1 reads
+	"""
+	fake_backend.run_container("r1", "node-image", "host", None)
+	channels = []
+
+	def open_exec(container, cmd):
+		return channels.pop(0) if channels else None
+
+	fake_backend.open_exec = open_exec
+
+	def add(data, **args):
+		channels.append(Channel(data, **args))
+		return channels[-1]
+
+	return add
+
+
+def test_command():
+	capture = Capture("r1", "eth1", "r1.pcap", bpf_filter="udp and port 6001", snaplen=64, duration=5, count=100)
+	assert capture.command() == ["sh", "-c", "echo $$; exec timeout -s INT 5 tcpdump -i eth1 -s 64 -U -n -w - "
+	                                         "-c 100 'udp and port 6001'"]
+
+
+def test_single_file(node, tmp_path):
+	node(b"4242\n" + pcap(10))
+	capture = Capture("r1", "eth0", str(tmp_path / "captures" / "r1.pcap"))
+	assert capture.start()
+	assert capture.wait(5)
+	assert capture.pid == 4242
+	assert capture.files == [str(tmp_path / "captures" / "r1.pcap")]
+	assert capture.packets == 10
+	result = read_pcap(capture.files)
+	assert result.timestamps.tolist() == pytest.approx([i / 1000 for i in range(10)])
+
+
+def test_ring_is_split_at_packets(node, tmp_path):
+	# 24 bytes of header and 6 records of 76 bytes fit into a file of 500 bytes
+	node(b"1\n" + pcap(20))
+	capture = Capture("r1", "eth0", str(tmp_path / "ring"), file_size=0.0005, files=3)
+	assert capture.start() and capture.wait(5)
+	assert capture.packets == 20
+	# 4 files were written, the first was overwritten by the last
+	assert capture.files == [str(tmp_path / f"ring{i}") for i in (1, 2, 0)]
+	assert [len(read_pcap(path).timestamps) for path in capture.files] == [6, 6, 2]
+	assert read_pcap(capture.files).timestamps[0] == pytest.approx(0.006)
+
+
+def test_stop_interrupts_tcpdump(node, fake_backend, tmp_path, monkeypatch):
+	channel = node(b"4242\n" + pcap(3), end=False)
+
+	def handler(container, cmd, stdin):
+		# tcpdump flushes the packets it still has and ends
+		for chunk in (pcap(2, header=False), b""):
+			channel.chunks.put(chunk)
+		return ExecResult(0, b"", b"")
+
+	fake_backend.exec_handler = handler
+	capture = Capture("r1", "eth0", str(tmp_path / "r1.pcap"))
+	assert capture.start()
+	assert not capture.wait(0.1)
+	assert capture.stop() == [str(tmp_path / "r1.pcap")]
+	assert [args["cmd"] for op, args in fake_backend.calls if op == "exec"] == [["kill", "-INT", "4242"]]
+	assert capture.packets == 5
+	assert capture.error is None
+
+	# tcpdump not ending on the interrupt is cut off after STOP_TIMEOUT
+	monkeypatch.setattr(capture_module, "STOP_TIMEOUT", 0.1)
+	fake_backend.exec_handler = None
+	channel = node(b"4243\n" + pcap(1), end=False)
+	capture = Capture("r1", "eth0", str(tmp_path / "r2.pcap"))
+	assert capture.start()
+	assert capture.stop() == [str(tmp_path / "r2.pcap")]
+	# stop returns, the channel that never ends was closed
+	assert channel.closed and capture.packets == 1
+
+
+def test_failed_captures(node, tmp_path, capsys):
+	# no channel to the node
+	capture = Capture("r1", "eth0", str(tmp_path / "a.pcap"))
+	assert not capture.start()
+	assert capture.error == "capture on r1 could not be started"
+	# the shell ended before printing its PID
+	node(b"")
+	assert not Capture("r1", "eth0", str(tmp_path / "b.pcap")).start()
+	# tcpdump ended without writing a pcap header
+	node(b"4242\n")
+	capture = Capture("r1", "eth9", str(tmp_path / "c.pcap"))
+	assert capture.start() and capture.wait(5)
+	assert capture.stop() == []
+	assert "is eth9 an interface?" in capsys.readouterr().out
@@ -0,0 +1,47 @@
+"""
+Cache key of compiled plans
+"""
+import os
+import compiler
+from compiler import config_hash, get_plan, local_sources
+
+CONFIG = """
+from link_helper import LINKS
+links = LINKS
+"""
+
+
+def test_plan_cache(tmp_path, monkeypatch):
+	monkeypatch.syspath_prepend(str(tmp_path))
+	(tmp_path / "cached_config.py").write_text(CONFIG)
+	helper = tmp_path / "link_helper.py"
+	helper.write_text('LINKS = [("a", "b", (10, 12500, 1))]\n')
+	cache_dir = str(tmp_path / "plans")
+	assert not get_plan("cached_config", cache_dir)[1]
+	assert get_plan("cached_config", cache_dir)[1]
+	# a changed module imported by the config is compiled again
+	helper.write_text('LINKS = [("a", "b", (10, 12500, 1)), ("b", "c", (10, 12500, 1))]\n')
+	assert not get_plan("cached_config", cache_dir)[1]
+
+
+def test_hash_covers_the_compiler_modules(tmp_path, monkeypatch):
+	monkeypatch.syspath_prepend(str(tmp_path))
+	(tmp_path / "hashed_config.py").write_text('links = [("a", "b", (10, 12500, 1))]\n')
+	src = os.path.dirname(os.path.abspath(compiler.__file__))
+	names = {os.path.basename(path) for path in local_sources(os.path.abspath(compiler.__file__), {src})}
+	assert {"compiler.py", "ipam.py", "routing.py", "images.py", "replicas.py"} <= names
+	# modules outside the testbed such as numpy are not hashed
+	assert all(os.path.dirname(path) == src for path in local_sources(os.path.abspath(compiler.__file__), {src}))
+
+	digest = config_hash("hashed_config")
+	routing_path = os.path.join(src, "routing.py")
+	original = local_sources(routing_path, set())[routing_path]
+
+	def changed(path, directories, sources=None):
+		sources = local_sources(path, directories, sources)
+		if routing_path in sources:
+			sources[routing_path] = original + b"\n# changed\n"
+		return sources
+
+	monkeypatch.setattr(compiler, "local_sources", changed)
+	assert config_hash("hashed_config") != digest
@@ -0,0 +1,77 @@
+"""
+Dry runs of a setup and the cost model estimating its duration
+"""
+import json
+import pytest
+from cost_model import COST_KEY, CostModel
+from provision import Provisioner
+
+CONFIG = """
+links = [("h1", "r1", (100, 12500, 5)), ("r1", "h2", (100, 12500, 5))]
+"""
+
+
+def diamond():
+	# a subnet, two containers on it and a route step needing both
+	provisioner = Provisioner()
+	for name, phase, deps in (("net", "subnets", ()), ("a", "containers", ["net"]), ("b", "containers", ["net"]),
+	                          ("routes", "routes", ["a", "b"])):
+		provisioner.add_step(name, phase, lambda: 0, deps)
+	return provisioner
+
+
+def test_estimate_simulates_the_workers():
+	model = CostModel("FakeBackend")
+	costs = {"net": 1.0, "a": 2.0, "b": 3.0, "routes": 0.5}
+	total, phases = model.estimate(diamond(), costs, workers=2)
+	assert total == pytest.approx(4.5)
+	assert phases["containers"] == (pytest.approx(3.0), pytest.approx(5.0), 2)
+	total, phases = model.estimate(diamond(), costs, workers=1)
+	assert total == pytest.approx(6.5)
+	assert phases["containers"][0] == pytest.approx(5.0)
+
+
+def test_calibrate_and_store(store):
+	provisioner = diamond()
+	for name, duration in (("net", 0.1), ("a", 0.4), ("b", 0.6), ("routes", 9.0)):
+		provisioner.steps[name].duration = duration
+	# the route steps take 20ms plus 1ms per route
+	route_stats = {"h1": (10, 0.03), "r1": (30, 0.05), "h2": (50, 0.07)}
+	model = CostModel("EngineBackend")
+	model.calibrate(provisioner, route_stats, "run-1")
+	assert model.costs["network"] == pytest.approx(0.1)
+	assert model.costs["container"] == pytest.approx(0.5)
+	assert model.costs["exec_line"] == pytest.approx(0.001)
+	assert model.cost("exec", 100) == pytest.approx(0.12)
+	model.save(store)
+	CostModel("NetnsBackend").save(store)
+	assert set(json.loads(store.get_meta(COST_KEY))) == {"EngineBackend", "NetnsBackend"}
+	loaded = CostModel.from_store(store, "EngineBackend")
+	assert (loaded.costs, loaded.calibrated) == (model.costs, "run-1")
+	# a backend without a calibration gets the defaults
+	assert CostModel.from_store(store, "CliBackend").calibrated is None
+
+
+def test_dry_run_changes_nothing(testbed, fake_backend, store, tmp_path, capsys):
+	script = tmp_path / "setup.sh"
+	testbed(CONFIG, dry_run=str(script))
+	assert fake_backend.calls == []
+	assert store.nodes() == {}
+	lines = script.read_text().splitlines()
+	# every step is a comment followed by the docker commands it would run
+	assert lines[0].startswith("# [subnets] ")
+	assert sum(line.startswith("docker network create") for line in lines) == 2
+	assert sum(line.startswith("docker run") for line in lines) == 3
+	assert "docker exec -i h1 ip -batch - <<'EOF'" in lines
+	out = capsys.readouterr().out
+	assert "estimated setup time" in out and "defaults, not calibrated yet" in out
+
+
+def test_setup_calibrates_the_dry_run(testbed, store, capsys):
+	testbed(CONFIG)
+	assert CostModel.from_store(store, "FakeBackend").calibrated is not None
+	testbed(CONFIG, teardown=True)
+	testbed(CONFIG, dry_run="-")
+	out = capsys.readouterr().out
+	assert "# [containers] " in out
+	assert "FakeBackend costs measured in run" in out
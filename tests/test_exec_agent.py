@@ -0,0 +1,123 @@
+"""
+Exec agents, run as local processes instead of in the nodes
+"""
+import subprocess
+import sys
+import threading
+import time
+import exec_agent
+from docker_backend import _ProcessChannel
+from exec_agent import AgentPool
+
+
+class LocalBackend:
+	"""
+	Backend opening the exec of an agent on this host, the container is ignored
+	"""
+
+	def __init__(self):
+		self.opened = []
+
+	def open_exec(self, container, cmd):
+		self.opened.append(container)
+		process = subprocess.Popen([sys.executable] + list(cmd[1:]), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+		                           stderr=subprocess.DEVNULL)
+		return _ProcessChannel(process)
+
+
+def test_requests_share_one_agent():
+	backend = LocalBackend()
+	agents = AgentPool(backend)
+	try:
+		result = agents.exec("a", ["sh", "-c", "cat; echo err >&2; exit 3"], stdin=b"in\n")
+		assert (result.exit_code, result.stdout, result.stderr) == (3, b"in\n", b"err\n")
+		# output larger than one chunk arrives in several messages and is joined
+		result = agents.exec("a", [sys.executable, "-c", "print('x' * 200000)"])
+		assert result.stdout == b"x" * 200000 + b"\n"
+		assert agents.exec("a", ["no-such-command"]).exit_code == 127
+		# concurrent requests run side by side in the node and get their own output
+		results = {}
+
+		def run(i):
+			results[i] = agents.request("a", ["sh", "-c", f"sleep 0.2; echo {i}"])
+
+		threads = [threading.Thread(target=run, args=(i,)) for i in range(5)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join(5)
+		assert {i: result.stdout for i, result in results.items()} == {i: f"{i}\n".encode() for i in range(5)}
+		assert max(result.start for result in results.values()) < min(result.end for result in results.values())
+		assert backend.opened == ["a"]
+	finally:
+		agents.close()
+
+
+def test_raising_callback_does_not_end_the_agent(capsys):
+	agents = AgentPool(LocalBackend())
+	chunks = []
+
+	def callback(stream, timestamp, data):
+		chunks.append((stream, data))
+		raise ValueError("bad record")
+
+	try:
+		result = agents.request("a", ["sh", "-c", "echo one; sleep 0.1; echo two"], callback=callback)
+		assert (result.exit_code, result.stdout) == (0, b"one\ntwo\n")
+		# the callback is dropped after it raised, the output is still collected
+		assert chunks == [(1, b"one\n")]
+		assert "Output callback of sh raised ValueError: bad record" in capsys.readouterr().out
+		assert agents.exec("a", ["echo", "still running"]).stdout == b"still running\n"
+	finally:
+		agents.close()
+
+
+def test_ended_agent_releases_its_requests():
+	agents = AgentPool(LocalBackend())
+	try:
+		agent = agents.agent("a")
+		result = {}
+		thread = threading.Thread(target=lambda: result.update(r=agents.request("a", ["sleep", "30"])))
+		thread.start()
+		while not agent.busy():
+			time.sleep(0.01)
+		agent.close()
+		thread.join(5)
+		assert not thread.is_alive()
+		assert result["r"].exit_code == 1 and b"ended" in result["r"].stderr
+		# the next request starts a new agent
+		assert agents.exec("a", ["true"]).exit_code == 0
+		assert agents.agent("a") is not agent
+	finally:
+		agents.close()
+
+
+def test_failed_start_falls_back_to_plain_execs(monkeypatch):
+	class Broken(LocalBackend):
+		def open_exec(self, container, cmd):
+			self.opened.append(container)
+			return None
+
+	backend = Broken()
+	agents = AgentPool(backend)
+	assert agents.exec("a", ["true"]) is None
+	# the agent is not tried again until AGENT_RETRY passed
+	assert agents.exec("a", ["true"]) is None
+	assert backend.opened == ["a"]
+	monkeypatch.setattr(exec_agent, "AGENT_RETRY", 0)
+	assert agents.exec("a", ["true"]) is None
+	assert backend.opened == ["a", "a"]
+
+
+def test_idle_agents_beyond_the_limit_are_closed():
+	agents = AgentPool(LocalBackend(), max_agents=2)
+	try:
+		first = agents.agent("a")
+		agents.agent("b")
+		agents.agent("a")
+		agents.agent("c")
+		# b was used least recently
+		assert list(agents._agents) == ["a", "c"]
+		assert agents.agent("a") is first
+	finally:
+		agents.close()
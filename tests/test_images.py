@@ -0,0 +1,52 @@
+"""
+Content addressed builds of the role images on the fake backend
+"""
+import pytest
+import images
+from images import HASH_LABEL, build_images, content_hash, image_of
+
+
+@pytest.fixture
+def context(tmp_path, monkeypatch):
+	"""
+	:return: build context of the router role in the temporary directory
+	"""
+	(tmp_path / "Dockerfile").write_text("FROM alpine\nCOPY start.sh /\n")
+	(tmp_path / "start.sh").write_text("#!/bin/sh\n")
+	(tmp_path / ".dockerignore").write_text("*.log\n")
+	monkeypatch.setitem(images.ROLES, "router", ("node-image-router", str(tmp_path), "Dockerfile"))
+	return tmp_path
+
+
+def test_content_hash(context):
+	digest = content_hash(str(context))
+	# files the daemon never sees do not change the hash
+	(context / "build.log").write_text("ignored")
+	assert content_hash(str(context)) == digest
+	(context / "start.sh").write_text("#!/bin/sh\nexec sleep infinity\n")
+	assert content_hash(str(context)) != digest
+	digest = content_hash(str(context))
+	# the name of a file is part of the hash, not only its content
+	(context / "start.sh").rename(context / "run.sh")
+	assert content_hash(str(context)) != digest
+
+
+def test_build_is_skipped_while_up_to_date(fake_backend, context, capsys):
+	assert build_images(["router", "router"]) == 0
+	assert fake_backend.count("build_image") == 1
+	assert fake_backend.images["node-image-router"]["Config"]["Labels"] == {HASH_LABEL: content_hash(str(context))}
+	assert build_images(["router"]) == 0
+	assert fake_backend.count("build_image") == 1
+	assert "node-image-router is up to date" in capsys.readouterr().out
+	# a changed context and a forced build are built again
+	(context / "start.sh").write_text("#!/bin/sh\nexec sleep infinity\n")
+	assert build_images(["router"]) == 0
+	assert build_images(["router"], force=True) == 0
+	assert fake_backend.count("build_image") == 3
+
+
+def test_unknown_role():
+	with pytest.raises(ValueError):
+		image_of("switch")
+	with pytest.raises(ValueError):
+		build_images(["switch"])
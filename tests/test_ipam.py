@@ -0,0 +1,64 @@
+"""
+Allocation of link subnets out of the address pool
+"""
+import pytest
+from ipam import AddressPool, address_links
+
+
+def test_allocate_in_order():
+	pool = AddressPool("10.0.0.0/24")
+	assert [pool.allocate() for _ in range(3)] == ["10.0.0.0/29", "10.0.0.8/29", "10.0.0.16/29"]
+	# the first host address is the gateway of docker
+	assert pool.endpoints("10.0.0.8/29") == ("10.0.0.10", "10.0.0.11")
+
+
+def test_release_reuses_lowest_subnet():
+	pool = AddressPool("10.0.0.0/24")
+	subnets = [pool.allocate() for _ in range(4)]
+	pool.release(subnets[1])
+	pool.release(subnets[2])
+	assert pool.allocate() == subnets[1]
+	assert pool.allocate() == subnets[2]
+	assert pool.allocate() == "10.0.0.32/29"
+	# releasing a subnet that is not in use changes nothing
+	pool.release("10.0.0.128/29")
+	assert pool.allocate() == "10.0.0.40/29"
+
+
+def test_reserved_subnets_are_skipped():
+	pool = AddressPool("10.0.0.0/24")
+	pool.reserve("10.0.0.0/28")
+	assert pool.allocate() == "10.0.0.16/29"
+	with pytest.raises(ValueError):
+		pool.reserve("10.0.0.16/30")
+	restored = AddressPool.from_settings('{"pool": "10.0.0.0/24", "prefix": 29, "gateway": true}',
+	                                     ["10.0.0.0/29", "10.0.0.16/29"])
+	assert restored.allocate() == "10.0.0.8/29"
+	assert restored.allocate() == "10.0.0.24/29"
+
+
+def test_exhausted_pool():
+	pool = AddressPool("10.0.0.0/28")
+	assert pool.capacity == 2
+	pool.allocate()
+	pool.allocate()
+	with pytest.raises(ValueError):
+		pool.allocate()
+
+
+def test_prefix_without_gateway():
+	with pytest.raises(ValueError):
+		AddressPool(prefix=30)
+	pool = AddressPool("10.0.0.0/24", prefix=31, gateway=False)
+	assert pool.allocate() == "10.0.0.0/31"
+	assert pool.endpoints("10.0.0.0/31") == ("10.0.0.0", "10.0.0.1")
+	pool = AddressPool("10.0.0.0/24", prefix=30, gateway=False)
+	assert pool.endpoints(pool.allocate()) == ("10.0.0.1", "10.0.0.2")
+
+
+def test_address_links():
+	pool = AddressPool("10.0.0.0/16")
+	links = address_links([("a", "b", (10, 12500, 1)), (("c", "10.0.5.2"), ("d", "10.0.5.3"), (10, 12500, 1)),
+	                       ("b", "c", (10, 12500, 1))], pool)
+	assert [subnet for _, subnet in links] == ["10.0.0.0/29", "10.0.5.0/24", "10.0.0.8/29"]
+	assert links[0][0][:2] == (("a", "10.0.0.2"), ("b", "10.0.0.3"))
@@ -0,0 +1,100 @@
+"""
+Limits, timeouts and retries of the measurement runner on the fake backend
+"""
+import asyncio
+import threading
+import time
+import pytest
+import measurement_runner
+from docker_backend import ExecResult
+from measurement_runner import Job, MeasurementRunner
+from tool_parsers import PingSummary
+
+PING = (b"64 bytes from 10.0.4.4: icmp_seq=1 ttl=61 time=20.2 ms\n\n"
+        b"3 packets transmitted, 3 received, 0% packet loss, time 2003ms\n"
+        b"rtt min/avg/max/mdev = 20.211/23.633/30.412/4.793 ms\n")
+
+
+@pytest.fixture
+def nodes(fake_backend):
+	for node in ("c1", "c2", "c3"):
+		fake_backend.run_container(node, "node-image", "host", None)
+	return fake_backend
+
+
+def run(runner, jobs, limit=10):
+	# the runner must finish on its own, a stalled runner fails the test instead of hanging it
+	async def collect():
+		return [result async for result in runner.stream(jobs)]
+
+	return asyncio.run(asyncio.wait_for(collect(), limit))
+
+
+def test_limits_and_records(nodes):
+	lock = threading.Lock()
+	running = {"all": 0, "max": 0}
+	per_node = {}
+
+	def handler(container, cmd, stdin):
+		with lock:
+			running["all"] += 1
+			running["max"] = max(running["max"], running["all"])
+			per_node.setdefault(container, [0, 0])
+			per_node[container][0] += 1
+			per_node[container][1] = max(per_node[container])
+		time.sleep(0.02)
+		with lock:
+			running["all"] -= 1
+			per_node[container][0] -= 1
+		return ExecResult(0, PING, b"")
+
+	nodes.exec_handler = handler
+	jobs = [Job("ping", node, "10.0.4.4", {"count": 3}, tag=i) for i in range(4) for node in ("c1", "c2", "c3")]
+	results = run(MeasurementRunner(global_limit=2, node_limit=1, timeout=5), jobs)
+	assert sorted(result.job.tag for result in results) == sorted(job.tag for job in jobs)
+	assert running["max"] <= 2
+	assert all(peak == 1 for _, peak in per_node.values())
+	# the probe runs under timeout and its output is parsed
+	cmd = next(args["cmd"] for op, args in nodes.calls if op == "exec")
+	assert cmd == ["timeout", "-k", str(measurement_runner.KILL_AFTER), "5", "ping", "-c", "3", "10.0.4.4"]
+	assert results[0].records[-1] == PingSummary(3, 3, 20.211, 23.633, 30.412, 4.793)
+
+
+def test_timeout_is_retried(nodes):
+	attempts = []
+
+	def handler(container, cmd, stdin):
+		attempts.append(container)
+		# timeout killed the probe the first time
+		return ExecResult(124 if len(attempts) == 1 else 0, b"", b"")
+
+	nodes.exec_handler = handler
+	result, = run(MeasurementRunner(timeout=5, retries=1), [Job("ping", "c1", "10.0.4.4")])
+	assert (result.attempts, result.timed_out, result.exit_code) == (2, False, 0)
+	nodes.exec_handler = lambda container, cmd, stdin: ExecResult(137, b"", b"")
+	result, = run(MeasurementRunner(timeout=5, retries=2), [Job("ping", "c1", "10.0.4.4")])
+	assert (result.attempts, result.timed_out) == (3, True)
+
+
+def test_hung_exec_frees_its_slot(nodes, monkeypatch):
+	# an exec that never returns gives up its slots after the timeout, the jobs after it still run
+	monkeypatch.setattr(measurement_runner, "KILL_AFTER", 0)
+	monkeypatch.setattr(measurement_runner, "EXEC_GRACE", 0)
+	release = threading.Event()
+
+	def handler(container, cmd, stdin):
+		if container == "c1":
+			release.wait(10)
+		return ExecResult(0, b"", b"")
+
+	nodes.exec_handler = handler
+	jobs = [Job("ping", "c1", "10.0.4.4", timeout=0.05, retries=0, tag="hung")]
+	jobs += [Job("ping", node, "10.0.4.4", tag=i) for i in range(3) for node in ("c2", "c3")]
+	try:
+		results = run(MeasurementRunner(global_limit=1, node_limit=1, timeout=5), jobs, limit=5)
+	finally:
+		release.set()
+	assert len(results) == 7
+	hung, = [result for result in results if result.job.tag == "hung"]
+	assert hung.timed_out and hung.exit_code is None
+	assert all(result.exit_code == 0 for result in results if result is not hung)
@@ -0,0 +1,106 @@
+"""
+Nodes and networks of the netns backend. The tests create namespaces and
+bridges on this host, they are skipped without root and ip netns.
+"""
+import json
+import os
+import subprocess
+import pytest
+from netns_backend import NetnsBackend
+
+
+def _netns_available():
+	if os.geteuid() != 0:
+		return False
+	try:
+		return subprocess.run(["ip", "netns", "list"], capture_output=True).returncode == 0
+	except OSError:
+		return False
+
+
+pytestmark = pytest.mark.skipif(not _netns_available(), reason="needs root and ip netns")
+
+
+@pytest.fixture
+def netns(tmp_path):
+	"""
+	:return: NetnsBackend with its registry in the temporary directory, its nodes and networks are removed afterwards
+	"""
+	backend = NetnsBackend(str(tmp_path / "registry"), exec_agent=False)
+	yield backend
+	for name in backend.list_containers():
+		backend.remove_container(name)
+	for name in backend.list_networks():
+		backend.remove_network(name)
+
+
+def names(prefix):
+	# namespaces are global to the host, the names of parallel runs must not collide
+	return [f"nmt{os.getpid()}{prefix}{i}" for i in range(2)]
+
+
+def addresses(backend, node):
+	result = backend.exec(node, ["ip", "-j", "addr", "show"])
+	assert result.exit_code == 0, result.stderr
+	return {link["ifname"]: [addr["local"] for addr in link["addr_info"] if addr["family"] == "inet"]
+	        for link in json.loads(result.stdout) if link["ifname"] != "lo"}
+
+
+def test_nodes_and_networks(netns):
+	a, b = names("n")
+	ab, bc = names("l")
+	labels = {"net-measure.testbed": "test"}
+	assert netns.create_network(ab, "10.0.0.0/29", labels).exit_code == 0
+	assert netns.create_network(bc, "10.0.0.8/29").exit_code == 0
+	assert netns.create_network(ab, "10.0.0.0/29").exit_code != 0
+	assert netns.run_container(a, "node-image", ab, "10.0.0.2", labels=labels).exit_code == 0
+	assert netns.run_container(b, "node-image", ab, "10.0.0.3").exit_code == 0
+	assert netns.connect_network(bc, b, "10.0.0.10").exit_code == 0
+	assert netns.list_containers(labels) == [a]
+	assert netns.list_networks(labels) == [ab]
+	# interfaces are named in the order of the connects like docker names them
+	assert addresses(netns, b) == {"eth0": ["10.0.0.3"], "eth1": ["10.0.0.10"]}
+	assert netns.container_networks(b) == [ab, bc]
+	# the nodes of a network share its bridge
+	result = subprocess.run(["ip", "-j", "link", "show", "type", "veth"], capture_output=True)
+	masters = [link.get("master") for link in json.loads(result.stdout or b"[]")]
+	bridge = netns._read("networks", ab)["bridge"]
+	assert masters.count(bridge) == 2
+
+	# the index of a disconnected interface is not reused
+	assert netns.disconnect_network(bc, b).exit_code == 0
+	assert netns.connect_network(bc, b, "10.0.0.10").exit_code == 0
+	assert addresses(netns, b) == {"eth0": ["10.0.0.3"], "eth2": ["10.0.0.10"]}
+	# removing a node deletes its namespace
+	assert netns.remove_container(b).exit_code == 0
+	assert netns.exec(b, ["true"]).exit_code != 0
+	assert subprocess.run(["ip", "netns", "exec", b, "true"], capture_output=True).returncode != 0
+	assert netns.list_containers() == [a]
+	assert netns.remove_network(bc).exit_code == 0
+	assert netns.list_networks() == [ab]
+
+
+def test_failed_connect_leaves_no_node(netns):
+	a, _ = names("f")
+	net, _ = names("m")
+	assert netns.create_network(net, "10.0.0.0/29").exit_code == 0
+	# every interface needs an address
+	assert netns.run_container(a, "node-image", net, None).exit_code != 0
+	assert netns.list_containers() == []
+	assert subprocess.run(["ip", "netns", "exec", a, "true"], capture_output=True).returncode != 0
+
+
+def test_detached_exec(netns):
+	a, _ = names("d")
+	net, _ = names("e")
+	netns.create_network(net, "10.0.0.0/29")
+	netns.run_container(a, "node-image", net, "10.0.0.2")
+	result, exec_id = netns.exec_detached(a, ["sleep", "30"])
+	assert result.exit_code == 0
+	assert netns.inspect_exec(exec_id)["Running"]
+	# removing the node kills what runs in its namespace
+	assert netns.remove_container(a).exit_code == 0
+	process = netns._processes[tuple(exec_id)]
+	assert process.wait(5) is not None
+	assert not netns.inspect_exec(exec_id)["Running"]
+	assert netns.rename_container(a, "b").exit_code != 0
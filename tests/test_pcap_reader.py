@@ -0,0 +1,80 @@
+"""
+Reading and analysis of small synthetic pcap files
+"""
+import struct
+import numpy as np
+import pytest
+from pcap_reader import read_pcap, gaps, throughput, trains
+
+START = 1760000000
+
+
+def write_pcap(path, packets, nanoseconds=False, order="<"):
+	"""
+	:param packets: list of (seconds, sub-seconds, length on the wire, captured length)
+	"""
+	with open(path, "wb") as f:
+		f.write(struct.pack(order + "IHHiIII", 0xa1b23c4d if nanoseconds else 0xa1b2c3d4, 2, 4, 0, 0, 96, 1))
+		for seconds, sub_seconds, length, captured in packets:
+			f.write(struct.pack(order + "IIII", seconds, sub_seconds, captured, length) + bytes(captured))
+	return str(path)
+
+
+@pytest.mark.parametrize("nanoseconds, order", [(False, "<"), (False, ">"), (True, "<"), (True, ">")])
+def test_read_pcap(tmp_path, nanoseconds, order):
+	unit = 1000 if nanoseconds else 1
+	# captured lengths of every size, so the records start at every alignment
+	packets = [(START + i // 4, (250000 * (i % 4) + 7) * unit, 1500 - i, 40 + i) for i in range(12)]
+	result = read_pcap(write_pcap(tmp_path / "a.pcap", packets, nanoseconds, order))
+	assert result.start == START
+	assert result.lengths.tolist() == [1500 - i for i in range(12)]
+	assert result.captured.tolist() == [40 + i for i in range(12)]
+	assert np.allclose(result.timestamps, [i // 4 + 0.25 * (i % 4) + 7e-6 for i in range(12)], rtol=0, atol=1e-12)
+
+
+def test_ring_and_partial_record(tmp_path):
+	first = write_pcap(tmp_path / "r0", [(START, 0, 100, 60), (START, 500000, 100, 60)])
+	second = write_pcap(tmp_path / "r1", [(START + 2, 0, 200, 60)])
+	# the last record of a file still being written is skipped
+	with open(second, "ab") as f:
+		f.write(struct.pack("<IIII", START + 3, 0, 60, 100) + bytes(10))
+	result = read_pcap([first, second])
+	assert result.timestamps.tolist() == [0.0, 0.5, 2.0]
+	assert result.lengths.tolist() == [100, 100, 200]
+	empty = tmp_path / "empty"
+	empty.write_bytes(b"")
+	assert len(read_pcap([str(empty)]).timestamps) == 0
+	assert read_pcap([str(empty), first]).start == START
+	pcapng = tmp_path / "capture.pcapng"
+	pcapng.write_bytes(bytes.fromhex("0a0d0d0a") + bytes(24))
+	with pytest.raises(ValueError):
+		read_pcap(str(pcapng))
+
+
+def test_train_dispersion_keeps_resolution(tmp_path):
+	# 11 packets 0.4 ms apart: a dispersion of exactly 4 ms, not rounded to the 0.2 us of a float of the Unix time
+	nanoseconds = write_pcap(tmp_path / "ns", [(START + 5, 123456789 + i * 400000, 1500, 60) for i in range(11)], True)
+	# crossing a second
+	microseconds = write_pcap(tmp_path / "us", [(START + 5 + (999900 + i * 400) // 1000000,
+	                                             (999900 + i * 400) % 1000000, 1500, 60) for i in range(11)])
+	for path in (nanoseconds, microseconds):
+		packets = read_pcap(path)
+		per_train = trains(packets.timestamps, packets.lengths, max_gap=0.001)
+		assert per_train.count.tolist() == [11]
+		assert per_train.dispersion[0] == pytest.approx(0.004, abs=1e-12)
+		assert per_train.rate[0] == pytest.approx(10 * 1500 * 8 / 0.004)
+
+
+def test_analyses():
+	timestamps = np.array([0.0, 0.05, 0.1, 0.35, 0.351, 0.352])
+	lengths = np.array([1000, 1000, 500, 1500, 1500, 1500])
+	starts, bits = throughput(timestamps, lengths, 0.1)
+	assert starts.tolist() == pytest.approx([0.0, 0.1, 0.2, 0.3])
+	assert bits.tolist() == pytest.approx([16000 / 0.1, 4000 / 0.1, 0.0, 36000 / 0.1])
+	assert gaps(timestamps) == pytest.approx([0.05, 0.05, 0.25, 0.001, 0.001])
+	per_train = trains(timestamps, lengths, max_gap=0.06)
+	assert per_train.count.tolist() == [3, 3]
+	assert per_train.bytes.tolist() == [2500, 4500]
+	assert per_train.dispersion == pytest.approx([0.1, 0.002])
+	single = trains(np.array([1.0]), np.array([100]), max_gap=0.1)
+	assert np.isnan(single.rate[0])
@@ -0,0 +1,131 @@
+"""
+Reuse of pooled containers and the renaming of their interfaces on the fake backend
+"""
+import json
+import pytest
+from docker_backend import ExecResult
+from pool import POOL_IMAGE_LABEL, ContainerPool, rename_commands
+
+
+@pytest.fixture
+def interfaces(fake_backend):
+	"""
+	Let the fake backend run ip inside the containers: interface names and
+	aliases are kept per container, keyed by the name docker gave the interface
+	:return: function container -> dict interface -> alias
+	"""
+	def names(container):
+		return fake_backend.containers[container].setdefault("ifnames", {})
+
+	def handler(container, cmd, stdin):
+		current = names(container)
+		if list(cmd) == ["ip", "-j", "addr", "show"]:
+			links = []
+			for docker_name, _, ip in fake_backend.containers[container]["interfaces"]:
+				name, alias = current.get(docker_name, (docker_name, None))
+				links.append({"ifname": name, "ifalias": alias,
+				              "addr_info": [{"family": "inet", "local": ip}] if ip else []})
+			return ExecResult(0, json.dumps(links).encode(), b"")
+		if cmd[0] == "ip" and cmd[-2:] == ["-batch", "-"]:
+			by_name = {current.get(docker_name, (docker_name, None))[0]: docker_name
+			           for docker_name, _, _ in fake_backend.containers[container]["interfaces"]}
+			for line in stdin.decode().splitlines():
+				words = line.split()
+				if words[:3] != ["link", "set", "dev"] or words[4] not in ("name", "alias"):
+					continue
+				docker_name = by_name.get(words[3])
+				if docker_name is None:
+					return ExecResult(1, b"", f"Cannot find device \"{words[3]}\"".encode())
+				name, alias = current.get(docker_name, (docker_name, None))
+				if words[4] == "alias":
+					current[docker_name] = (name, words[5])
+					continue
+				if words[5] in by_name:
+					return ExecResult(2, b"", b"RTNETLINK answers: File exists")
+				current[docker_name] = (words[5], alias)
+				by_name[words[5]] = by_name.pop(words[3])
+		return ExecResult(0, b"", b"")
+
+	fake_backend.exec_handler = handler
+	return lambda container: {name: alias for name, alias in
+	                          (names(container).get(docker_name, (docker_name, None))
+	                           for docker_name, _, _ in fake_backend.containers[container]["interfaces"])}
+
+
+def connect(backend, node, links):
+	for network, ip in links:
+		backend.create_network(network, "10.0.0.0/24")
+		backend.connect_network(network, node, ip)
+
+
+def test_rename_commands_move_through_temporary_names():
+	assert rename_commands({"eth0": "eth1", "eth1": "eth0"}, {"eth0": "eth0"}) == [
+		"link set dev eth0 alias eth0", "link set dev eth0 down", "link set dev eth0 name pooltmp0",
+		"link set dev eth1 down", "link set dev eth1 name pooltmp1",
+		"link set dev pooltmp0 name eth1", "link set dev eth1 up",
+		"link set dev pooltmp1 name eth0", "link set dev eth0 up"]
+
+
+def test_wire_and_unwire(fake_backend, interfaces):
+	fake_backend.run_container("a", "node-image", "host", None)
+	# a reused container got eth3 and eth4 from docker
+	fake_backend.containers["a"]["next_if"] = 2
+	connect(fake_backend, "a", [("a-b", "10.0.0.2"), ("a-c", "10.0.0.10")])
+	pool = ContainerPool("default")
+	assert pool.wire("a", {"10.0.0.2": "eth0", "10.0.0.10": "eth1"}) == 0
+	assert interfaces("a") == {"eth0": "eth3", "eth1": "eth4"}
+	# wiring again changes nothing
+	calls = fake_backend.count("exec")
+	assert pool.wire("a", {"10.0.0.2": "eth0", "10.0.0.10": "eth1"}) == 0
+	assert fake_backend.count("exec") == calls + 1
+	assert pool.unwire("a") == 0
+	assert interfaces("a") == {"eth3": "eth3", "eth4": "eth4"}
+
+
+def test_unwire_moves_holders_of_docker_names_aside(fake_backend, interfaces):
+	fake_backend.run_container("a", "node-image", "host", None)
+	connect(fake_backend, "a", [("a-b", "10.0.0.2"), ("a-c", "10.0.0.10")])
+	pool = ContainerPool("default")
+	# the plan swaps the names docker gave
+	assert pool.wire("a", {"10.0.0.2": "eth1", "10.0.0.10": "eth0"}) == 0
+	assert interfaces("a") == {"eth1": "eth0", "eth0": "eth1"}
+	# docker disconnects a-b only, eth0 is taken by the interface of a-c
+	assert pool.unwire("a", ["eth1"]) == 0
+	assert interfaces("a") == {"eth0": "eth0", "poolaside0": "eth1"}
+	fake_backend.disconnect_network("a-b", "a")
+	# a new link and the wire of the node give the interface of a-c its planned name back
+	connect(fake_backend, "a", [("a-d", "10.0.0.18")])
+	assert pool.wire("a", {"10.0.0.10": "eth0", "10.0.0.18": "eth1"}) == 0
+	assert interfaces("a") == {"eth0": "eth1", "eth1": "eth2"}
+
+
+def test_start_reuses_idle_containers(fake_backend, interfaces):
+	pool = ContainerPool("default")
+	fake_backend.create_network("base", "10.0.0.0/24")
+	assert pool.start("a", "base", "10.0.0.2") == 0
+	assert pool.start("b", "base", "10.0.0.3", image="other-image") == 0
+	assert pool.in_use() == ["a", "b"]
+	assert fake_backend.containers["b"]["labels"][POOL_IMAGE_LABEL] == "other-image"
+	assert sorted(pool.release_all(keep=["b"])) == ["a"]
+	idle, = pool.idle()
+	assert idle.startswith("pool-default-")
+	assert fake_backend.container_networks(idle) == []
+	# the routes of a released container are flushed
+	assert any(op == "exec" and args["container"] == "a" and args["stdin"] == b"route flush table main\n"
+	           for op, args in fake_backend.calls)
+
+	# only nodes of the image of the idle container get it
+	assert pool.reserve({"c": "other-image", "d": "node-image"}) == {"d": idle}
+	fake_backend.calls.clear()
+	assert pool.start("c", "base", "10.0.0.4", image="other-image") == 0
+	assert pool.start("d", "base", "10.0.0.5") == 0
+	assert [op for op, _ in fake_backend.calls] == ["run_container", "rename_container", "connect_network"]
+	assert (sorted(pool.cold), list(pool.warm)) == (["a", "b", "c"], ["d"])
+	# the reused container has its old interface numbers, wire names them as planned
+	assert interfaces("d") == {"eth1": None}
+	assert pool.wire("d", {"10.0.0.5": "eth0"}) == 0
+	assert interfaces("d") == {"eth0": "eth1"}
+
+	pool.release_all()
+	assert pool.drain() == 3
+	assert fake_backend.containers == {}
@@ -0,0 +1,123 @@
+"""
+Dependency order, rollback and the adaptive limit of the provisioner
+"""
+import threading
+import time
+import pytest
+import provision
+from provision import AdaptiveLimiter, Provisioner, ProvisioningError
+
+
+def recording(log, name, result=0, delay=0.0):
+	def action():
+		time.sleep(delay)
+		log.append(name)
+		return result
+	return action
+
+
+def test_dependency_order():
+	log = []
+	provisioner = Provisioner(max_workers=4)
+	# a diamond behind a slow step, the steps become ready in any order
+	provisioner.add_step("subnet", "subnets", recording(log, "subnet", delay=0.02))
+	for name in ("a", "b", "c"):
+		provisioner.add_step(f"container:{name}", "containers", recording(log, name), deps=["subnet"])
+	provisioner.add_step("tc", "tc", recording(log, "tc"), deps=["container:a", "container:b", "container:c"])
+	provisioner.add_step("routes", "routes", recording(log, "routes"), deps=["tc"])
+	times = provisioner.run()
+	assert log[0] == "subnet"
+	assert sorted(log[1:4]) == ["a", "b", "c"]
+	assert log[4:] == ["tc", "routes"]
+	assert provisioner.order[0] == "subnet"
+	assert provisioner.order[4:] == ["tc", "routes"]
+	assert times["containers"][2] == 3
+
+
+def test_invalid_graphs():
+	provisioner = Provisioner()
+	provisioner.add_step("a", "subnets", lambda: 0)
+	with pytest.raises(ValueError):
+		provisioner.add_step("a", "subnets", lambda: 0)
+	provisioner.add_step("b", "containers", lambda: 0, deps=["missing"])
+	with pytest.raises(ValueError):
+		provisioner.run()
+	provisioner = Provisioner()
+	provisioner.add_step("a", "subnets", lambda: 0, deps=["b"])
+	provisioner.add_step("b", "subnets", lambda: 0, deps=["a"])
+	with pytest.raises(ValueError):
+		provisioner.run()
+
+
+@pytest.mark.parametrize("failure", [1, RuntimeError("daemon gone")])
+def test_rollback(failure):
+	log, undone = [], []
+
+	def failing():
+		if isinstance(failure, Exception):
+			raise failure
+		return failure
+
+	provisioner = Provisioner(max_workers=2)
+	provisioner.add_step("subnet", "subnets", recording(log, "subnet"), undo=lambda: undone.append("subnet"))
+	provisioner.add_step("a", "containers", recording(log, "a"), deps=["subnet"], undo=lambda: undone.append("a"))
+	provisioner.add_step("b", "containers", failing, deps=["a"], undo=lambda: undone.append("b"))
+	provisioner.add_step("tc", "tc", recording(log, "tc"), deps=["b"], undo=lambda: undone.append("tc"))
+	with pytest.raises(ProvisioningError) as error:
+		provisioner.run()
+	assert error.value.step == "b"
+	assert error.value.result is failure
+	# the completed steps are undone in reverse order, nothing after the failure runs
+	assert log == ["subnet", "a"]
+	assert undone == ["a", "subnet"]
+	assert provisioner.order == []
+
+
+def test_limiter_backoff():
+	limiter = AdaptiveLimiter(8, min_latency=0.001)
+	for _ in range(5):
+		limiter.acquire()
+		limiter.release("routes", 0.01)
+	assert limiter.limit == 8
+	# the smoothed latency of the phase climbs above three times its baseline
+	for _ in range(5):
+		limiter.acquire()
+		limiter.release("routes", 0.5)
+	assert limiter.backoffs > 0
+	assert limiter.limit < 8
+	# a phase with a different baseline does not count against the other
+	limit = limiter.limit
+	limiter.acquire()
+	limiter.release("subnets", 0.001)
+	assert limiter.limit == limit
+	assert limiter.in_flight == 0
+
+
+def test_limit_bounds_submissions(monkeypatch):
+	# the pool never holds more steps than the limiter allows, its threads are not parked on the limiter
+	lock = threading.Lock()
+	outstanding = [0, 0]
+
+	class CountingPool(provision.ThreadPoolExecutor):
+		def submit(self, fn, *args):
+			with lock:
+				outstanding[0] += 1
+				outstanding[1] = max(outstanding)
+			future = super().submit(fn, *args)
+			future.add_done_callback(lambda _: done())
+			return future
+
+	def done():
+		with lock:
+			outstanding[0] -= 1
+
+	monkeypatch.setattr(provision, "ThreadPoolExecutor", CountingPool)
+	provisioner = Provisioner(max_workers=8)
+	provisioner.limiter.limit = provisioner.limiter.max_limit = 2
+	log = []
+	for i in range(20):
+		provisioner.add_step(f"s{i}", "containers", recording(log, i, delay=0.005))
+	provisioner.run()
+	assert len(log) == 20
+	assert outstanding[1] <= 2
+	assert provisioner.limiter.in_flight == 0
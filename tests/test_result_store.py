@@ -0,0 +1,55 @@
+"""
+Write and query round trip of the result store
+"""
+import numpy as np
+from result_store import ResultStore
+from tool_parsers import PathneckHop
+
+
+def hop(hop, bandwidth, bottleneck=False):
+	return PathneckHop(hop, 10.0 * hop, f"10.0.{hop}.3", 1200, 1200, bottleneck, bandwidth, "ub")
+
+
+def test_round_trip(tmp_path):
+	store = ResultStore(str(tmp_path / "results"))
+	with store.writer(batch_size=4) as writer:
+		for bandwidth in (10, 20, 30):
+			for iteration in range(2):
+				writer.append_records([hop(0, 90.0), hop(1, bandwidth * 0.9, True), hop(2, 80.0)],
+				                      experiment="bw", topology="t1", point={"bandwidth": bandwidth},
+				                      iteration=iteration, run="r1")
+		writer.append("bottleneck", [{"bottleneck": 1, "bottleneck_bw": 9.0}], experiment="other", run="r2")
+	assert store.tables() == ["bottleneck", "pathneck_hop"]
+	# several segments were written for the batches
+	assert len(store.segments("pathneck_hop")) > 1
+
+	rows = store.query("pathneck_hop", ["point_bandwidth", "iteration", "hop", "bandwidth", "ip"],
+	                   {"experiment": "bw", "bottleneck": True})
+	assert len(rows["hop"]) == 6
+	assert set(rows["hop"]) == {1}
+	assert sorted(zip(rows["point_bandwidth"], rows["iteration"])) == \
+	       [(10, 0), (10, 1), (20, 0), (20, 1), (30, 0), (30, 1)]
+	assert np.allclose(rows["bandwidth"], rows["point_bandwidth"] * 0.9)
+	assert set(rows["ip"]) == {"10.0.1.3"}
+
+	# ranges, sets and the json of the point
+	rows = store.query("pathneck_hop", ["hop", "point"], {"point_bandwidth": (15, 30), "hop": [0, 2]})
+	assert len(rows["hop"]) == 8
+	assert set(rows["point"]) == {'{"bandwidth": 20}', '{"bandwidth": 30}'}
+	assert len(store.query("pathneck_hop", ["hop"], {"experiment": "none"})["hop"]) == 0
+	# a column missing in the segments of a table is nan
+	rows = store.query("bottleneck", ["bottleneck_bw", "iteration"], {"run": "r2"})
+	assert rows["bottleneck_bw"].tolist() == [9.0]
+	assert np.isnan(rows["iteration"]).all()
+
+
+def test_concurrent_stores(tmp_path):
+	# two stores on the same directory, e.g. of two processes, see the segments of each other
+	first, second = ResultStore(str(tmp_path)), ResultStore(str(tmp_path))
+	with first.writer() as writer:
+		writer.append("t", [{"x": 1}], run="a")
+	with second.writer() as writer:
+		writer.append("t", [{"x": 2}], run="b")
+	rows = first.query("t", ["x", "run"])
+	assert rows["x"].tolist() == [1, 2]
+	assert rows["run"].tolist() == ["a", "b"]
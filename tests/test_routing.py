@@ -0,0 +1,172 @@
+"""
+Routing matrices against the per source Dijkstra of the former
+src/static/routing/dijkstra.py and incremental updates against a full recompute
+"""
+import random
+from queue import PriorityQueue
+import numpy as np
+import pytest
+from compiler import compile_topology, generate_link_param, get_node_vs_ip
+import routing as routing_module
+from replicas import replicate_plan
+from routing import build_graph, compute_routing, route_table, update_routing
+
+
+def legacy_next_hops(graph, start):
+	# the former dijkstra.py: dict node -> next hop from start, for reachable nodes
+	dist = {node: [float('inf'), node] for node in graph}
+	dist[start][0] = 0
+	pq = PriorityQueue()
+	pq.put((0, start))
+	while not pq.empty():
+		current_dist, current_node = pq.get()
+		if current_dist > dist[current_node][0]:
+			continue
+		for neighbor, weight in graph[current_node]:
+			distance = current_dist + 1. / weight
+			if distance < dist[neighbor][0]:
+				dist[neighbor] = [distance, current_node]
+				pq.put((distance, neighbor))
+	hops = {}
+	for node in graph:
+		if node == start:
+			continue
+		prev_node = dist[node][1]
+		next_hop = node
+		while prev_node != start and dist[prev_node][0] != float('inf'):
+			next_hop = prev_node
+			prev_node = dist[prev_node][1]
+		if dist[prev_node][0] == float('inf'):
+			continue
+		hops[node] = next_hop
+	return hops
+
+
+def random_links(rng, n, extra, leaves=0):
+	# connected topology: a random tree, extra links and leaves hanging off it, distinct random bandwidths
+	names = [f"n{i}" for i in range(n + leaves)]
+	edges = [(names[rng.randrange(i)], names[i]) for i in range(1, n)]
+	edges += [(names[rng.randrange(n)], names[i]) for i in range(n, n + leaves)]
+	while extra:
+		u, v = rng.sample(names[:n], 2)
+		if (u, v) not in edges and (v, u) not in edges:
+			edges.append((u, v))
+			extra -= 1
+	return [(u, v, (rng.uniform(1, 1000), 12500, 1)) for u, v in edges]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("scipy", [True, False])
+def test_compute_routing_matches_legacy_dijkstra(seed, scipy, monkeypatch):
+	if not scipy:
+		monkeypatch.setattr(routing_module, "csgraph_dijkstra", None)
+	rng = random.Random(seed)
+	# directed graph as given to dijkstra.py, the weights are bandwidths
+	graph = {}
+	for u, v, tc_params in random_links(rng, 40, 60, leaves=10):
+		graph.setdefault(u, []).append((v, tc_params))
+		graph.setdefault(v, [])
+		if rng.random() < 0.7:
+			graph[v].append((u, (rng.uniform(1, 1000),)))
+	routing = compute_routing(None, graph)
+	nodes = routing["nodes"]
+	legacy_graph = {node: [(neighbor, tc_params[0]) for neighbor, tc_params in neighbors]
+	                for node, neighbors in graph.items()}
+	for i, start in enumerate(nodes):
+		row = routing["next_hop"][i]
+		assert {nodes[j]: nodes[hop] for j, hop in enumerate(row) if hop >= 0} == legacy_next_hops(legacy_graph, start)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_compute_routing_undirected_with_leaves(seed, monkeypatch):
+	# the leaves are stripped before the shortest paths of the core are computed, a few sources at a time
+	monkeypatch.setattr(routing_module, "SOURCE_CHUNK", 7)
+	rng = random.Random(seed)
+	plan = compile_topology({}, random_links(rng, 30, 20, leaves=15))
+	graph, _ = build_graph(plan["links"])
+	routing = plan["routing"]
+	nodes = routing["nodes"]
+	legacy_graph = {node: [(neighbor, tc_params[0]) for neighbor, tc_params in neighbors]
+	                for node, neighbors in graph.items()}
+	for i, start in enumerate(nodes):
+		row = routing["next_hop"][i]
+		assert {nodes[j]: nodes[hop] for j, hop in enumerate(row) if hop >= 0} == legacy_next_hops(legacy_graph, start)
+		assert routing["next_hop"][i, i] == -1
+
+
+def test_next_hop_storage(store):
+	# only the next hop matrix is kept, in the smallest type holding the indices
+	rng = random.Random(3)
+	routing = compile_topology({}, random_links(rng, 100, 60, leaves=40))["routing"]
+	assert set(routing) == {"nodes", "next_hop"}
+	assert routing["next_hop"].dtype == np.int16
+	assert compute_routing(None, {"a": [("b", (10,))], "b": [("a", (10,))]})["next_hop"].dtype == np.int8
+	store.set_routing(routing)
+	stored = store.routing()
+	assert stored["nodes"] == routing["nodes"]
+	assert stored["next_hop"].dtype == np.int16
+	assert np.array_equal(stored["next_hop"], routing["next_hop"])
+
+
+def tables(routing, links):
+	_, connections = build_graph(links)
+	node_vs_ip = get_node_vs_ip({}, links)
+	return {node: route_table(routing, node, connections, node_vs_ip) for node in connections}
+
+
+def check_update(routing, links, new_links, link_param, added):
+	# update_routing gives the routing of a full recompute and the changes turning the old tables into the new ones
+	new_routing, replacements, deletions, _ = update_routing(
+		routing, links, new_links, get_node_vs_ip({}, links), get_node_vs_ip({}, new_links), link_param, added)
+	old, new = tables(routing, links), tables(new_routing, new_links)
+	assert new == tables(compute_routing(new_links), new_links)
+	for node, table in new.items():
+		patched = {ip: route for ip, route in old.get(node, {}).items() if ip not in deletions.get(node, [])}
+		patched.update({ip: (gateway, interface) for ip, gateway, interface in replacements.get(node, [])})
+		assert patched == table
+	return new_routing
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_update_routing_matches_recompute(seed):
+	rng = random.Random(seed)
+	plan = compile_topology({}, random_links(rng, 25, 15, leaves=5))
+	links, routing = plan["links"], plan["routing"]
+	node_vs_eth = dict(plan["node_vs_eth"])
+	for step in range(6):
+		new_links = dict(links)
+		if step % 2 == 0:
+			u, v = rng.sample(sorted(node_vs_eth), 2)
+			subnet = f"10.200.{step}.0/29"
+			name, node_vs_eth, link_param = generate_link_param(
+				node_vs_eth, ((u, f"10.200.{step}.2"), (v, f"10.200.{step}.3"), (rng.uniform(1, 1000), 12500, 1)),
+				subnet)
+			if name in new_links:
+				continue
+			new_links[name] = link_param
+		else:
+			name = rng.choice(sorted(links))
+			link_param = new_links.pop(name)
+		routing = check_update(routing, links, new_links, link_param, step % 2 == 0)
+		links = new_links
+
+
+def test_replica_routing():
+	rng = random.Random(7)
+	plan, _ = replicate_plan(compile_topology({}, random_links(rng, 8, 4)), 4)
+	routing, links = plan["routing"], plan["links"]
+	# one block of the topology for all replicas, the same routes as the dense matrices
+	assert routing["next_hop"].shape == (1, 8, 8)
+	assert tables(routing, links) == tables(compute_routing(links), links)
+
+	# a link inside replica 2 gives it a block of its own, removing it shares the block again
+	node_vs_eth = dict(plan["node_vs_eth"])
+	name, node_vs_eth, link_param = generate_link_param(
+		node_vs_eth, (("rep2.n2", "10.200.0.2"), ("rep2.n3", "10.200.0.3"), (5000, 12500, 1)), "10.200.0.0/29")
+	added = dict(links, **{name: link_param})
+	routing = check_update(routing, links, added, link_param, True)
+	assert routing["next_hop"].shape == (2, 8, 8)
+	assert list(routing["replicas"]) == [0, 0, 1, 0]
+	routing = check_update(routing, added, links, link_param, False)
+	assert routing["next_hop"].shape == (1, 8, 8)
+	assert np.array_equal(routing["replicas"], np.zeros(4))
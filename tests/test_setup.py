@@ -0,0 +1,104 @@
+"""
+Call stream of setup on the fake backend
+"""
+from compiler import get_node_vs_ip
+from routing import build_graph, compute_routing, node_routes
+
+CONFIG = """
+links = [("h1", "r1", (100, 12500, 5)), ("r1", "r2", (10, 12500, 10)), ("r2", "h2", (100, 12500, 5)),
+         ("r1", "r3", (50, 12500, 1)), ("r3", "r2", (50, 12500, 1))]
+"""
+
+
+def batch_lines(backend, container, cmd):
+	# lines of the batches of the exec calls of cmd on container
+	return [line for op, args in backend.calls
+	        if op == "exec" and args["container"] == container and args["cmd"] == cmd
+	        for line in args["stdin"].decode().splitlines()]
+
+
+def installed_routes(backend, container):
+	routes = set()
+	for line in batch_lines(backend, container, ["ip", "-batch", "-"]):
+		_, _, dest, _, gateway, _, interface = line.split()
+		routes.add((dest, gateway, interface))
+	return routes
+
+
+def stored_routes(store, node):
+	return {(dest, gateway, interface) for dest, (gateway, interface) in store.routes(node).items()}
+
+
+def expected_routes(store):
+	nodes, links = store.nodes(), store.links()
+	_, connections = build_graph(links)
+	routing = compute_routing(links)
+	return {node: set(node_routes(routing, node, connections, get_node_vs_ip(nodes, links))) for node in connections}
+
+
+def test_setup_call_stream(testbed, store):
+	backend = testbed(CONFIG)
+	links = store.links()
+	assert set(links) == {"h1-r1", "r1-r2", "r2-h2", "r1-r3", "r3-r2"}
+	assert {args["name"]: args["subnet"] for op, args in backend.calls if op == "create_network"} == \
+	       {name: link_param[0] for name, link_param in links.items()}
+	assert set(backend.containers) == {"h1", "h2", "r1", "r2", "r3"}
+	# one container per node, one connect per further interface
+	assert backend.count("run_container") == 5
+	assert backend.count("connect_network") == sum(len(link_param[1]) for link_param in links.values()) - 5
+	for node, container in backend.containers.items():
+		assert sorted(ip for _, _, ip in container["interfaces"]) == sorted(get_node_vs_ip(store.nodes(), links)[node])
+
+	# a network exists before a container is started or connected on it
+	created = set()
+	for op, args in backend.calls:
+		if op == "create_network":
+			created.add(args["name"])
+		elif op in ("run_container", "connect_network"):
+			assert args["network"] in created
+
+	# every endpoint is shaped with one tc batch per node
+	for link_param in links.values():
+		bandwidth, burst, latency = link_param[2]
+		for node, _, interface in link_param[1]:
+			lines = batch_lines(backend, node, ["tc", "-batch", "-"])
+			assert f"qdisc replace dev {interface} root handle 1: tbf rate {bandwidth}mbit burst {burst}kb " \
+			       f"latency 10ms" in lines
+			assert f"qdisc replace dev {interface} parent 1:1 handle 10: netem delay {latency}ms" in lines
+	for node in backend.containers:
+		assert len([args for op, args in backend.calls if op == "exec" and args["container"] == node
+		            and args["cmd"][0] == "tc"]) == 1
+
+	# one route batch per node with the shortest path routes
+	for node, routes in expected_routes(store).items():
+		assert installed_routes(backend, node) == routes
+		assert stored_routes(store, node) == routes
+
+
+def test_runtime_link_change(testbed, store):
+	backend = testbed(CONFIG)
+	backend.calls.clear()
+	testbed(add_link='(("h1", "10.0.9.1"), ("h2", "10.0.9.2"), (1000, 12500, 1))')
+	assert "h1-h2" in store.links()
+	assert [args["name"] for op, args in backend.calls if op == "create_network"] == ["h1-h2"]
+	assert sorted(args["container"] for op, args in backend.calls if op == "connect_network") == ["h1", "h2"]
+	# the routes changed at runtime end where a fresh setup would
+	for node, routes in expected_routes(store).items():
+		assert stored_routes(store, node) == routes
+
+	backend.calls.clear()
+	testbed(remove_link='(("h1", "10.0.9.1"), ("h2", "10.0.9.2"), (1000, 12500, 1))')
+	assert "h1-h2" not in store.links()
+	assert sorted(args["container"] for op, args in backend.calls if op == "disconnect_network") == ["h1", "h2"]
+	assert [args["name"] for op, args in backend.calls if op == "remove_network"] == ["h1-h2"]
+	assert "h1-h2" not in backend.networks
+	for node, routes in expected_routes(store).items():
+		assert stored_routes(store, node) == routes
+
+
+def test_teardown(testbed, store):
+	backend = testbed(CONFIG)
+	testbed(teardown=True)
+	assert backend.containers == {}
+	assert backend.networks == {}
+	assert store.links() == {}
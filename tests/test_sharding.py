@@ -0,0 +1,103 @@
+"""
+Partitioning of topologies across hosts and the VXLAN tunnels of the links between them
+"""
+from collections import Counter
+from docker_backend import ExecResult, FakeBackend
+from partition import cut_links, partition
+from sharding import BRIDGE_NAME_OPTION, HOST_HELPER, MTU_OPTION, VXLAN_MTU, ShardedBackend, tunnel_names, vni
+
+
+def make_links(pairs):
+	links = {}
+	for i, (a, b) in enumerate(pairs):
+		subnet = f"10.0.{i}.0/29"
+		links[f"{a}-{b}"] = (subnet, ((a, f"10.0.{i}.2", "eth0"), (b, f"10.0.{i}.3", "eth0")), (10, 12500, 1))
+	return links
+
+
+def clique(prefix, size):
+	return [(f"{prefix}{i}", f"{prefix}{j}") for i in range(size) for j in range(i + 1, size)]
+
+
+def test_partition_cuts_between_clusters():
+	links = make_links(clique("a", 5) + clique("b", 5) + [("a0", "b0")])
+	nodes = sorted({node for pair in (link[1] for link in links.values()) for node, _, _ in pair})
+	placement = partition(nodes, links, {"h1": 1, "h2": 1})
+	assert cut_links(links, placement) == ["a0-b0"]
+	assert sorted(Counter(placement.values()).values()) == [5, 5]
+	assert len({placement[f"a{i}"] for i in range(5)}) == 1
+
+
+def test_partition_follows_capacity():
+	# a ring of 40 nodes on hosts of capacity 3 and 1
+	nodes = [f"n{i}" for i in range(40)]
+	links = make_links([(nodes[i], nodes[(i + 1) % 40]) for i in range(40)])
+	placement = partition(nodes, links, {"big": 3, "small": 1}, imbalance=0.05)
+	sizes = Counter(placement.values())
+	assert sizes["big"] <= 32 and sizes["small"] <= 11
+	assert sizes["big"] + sizes["small"] == 40
+	# both parts are arcs of the ring
+	assert len(cut_links(links, placement)) == 2
+
+
+def test_vni():
+	assert vni("10.0.1.0/29") == vni("10.0.1.0/29") != vni("10.0.1.8/29")
+	# the subnets of a /8 get distinct vnis of 24 bits, the interface names fit into 15 characters
+	assert len({vni(f"10.{i}.{j}.{k}/29") for i in (0, 255) for j in (0, 255) for k in (0, 8, 248)}) == 12
+	assert all(len(name) <= 15 for name in tunnel_names("10.255.255.248/29"))
+
+
+def sharded():
+	hosts = {"h1": {"docker_host": "fake", "address": "192.168.0.1", "capacity": 1},
+	         "h2": {"docker_host": "fake", "address": "192.168.0.2", "capacity": 1}}
+	backend = ShardedBackend(hosts, {"h1": FakeBackend(), "h2": FakeBackend()})
+	backend.place({"a": "h1", "b": "h1", "c": "h2"}, make_links([("a", "b"), ("b", "c")]))
+	return backend
+
+
+def helper_commands(backend, host):
+	return [args["stdin"].decode().splitlines() for op, args in backend.backends[host].calls
+	        if op == "exec" and args["container"] == HOST_HELPER]
+
+
+def test_links_within_a_host_are_plain_bridges():
+	backend = sharded()
+	assert backend.create_network("a-b", "10.0.0.0/29").exit_code == 0
+	assert list(backend.backends["h1"].networks) == ["a-b"]
+	assert backend.backends["h2"].networks == {}
+	assert helper_commands(backend, "h1") == []
+	assert backend.run_container("c", "node-image", "host", None).exit_code == 0
+	assert list(backend.backends["h2"].containers) == ["c"]
+
+
+def test_links_across_hosts_are_tunneled():
+	backend = sharded()
+	bridge, tunnel = tunnel_names("10.0.1.0/29")
+	assert backend.create_network("b-c", "10.0.1.0/29").exit_code == 0
+	for host, peer in (("h1", "192.168.0.2"), ("h2", "192.168.0.1")):
+		network = backend.backends[host].networks["b-c"]
+		assert network["subnet"] == "10.0.1.0/29"
+		assert network["options"] == {BRIDGE_NAME_OPTION: bridge, MTU_OPTION: str(VXLAN_MTU)}
+		stale, setup = helper_commands(backend, host)
+		assert stale == [f"link del {tunnel}"]
+		assert setup[0] == f"link add {tunnel} type vxlan id {vni('10.0.1.0/29')} remote {peer} dstport 4789"
+		# only the first host keeps the gateway address of the subnet
+		assert (f"addr flush dev {bridge}" in setup) == (host == "h2")
+	assert backend.remove_network("b-c").exit_code == 0
+	assert backend.backends["h1"].networks == backend.backends["h2"].networks == {}
+	assert helper_commands(backend, "h2")[-1] == [f"link del {tunnel}"]
+
+
+def test_failed_tunnel_removes_the_networks():
+	backend = sharded()
+	fail = backend.backends["h2"]
+
+	def no_vxlan(container, cmd, stdin):
+		if b"vxlan" in stdin:
+			return ExecResult(2, b"", b"RTNETLINK answers: Operation not supported")
+		return ExecResult(0, b"", b"")
+
+	fail.exec_handler = no_vxlan
+	result = backend.create_network("b-c", "10.0.1.0/29")
+	assert result.exit_code == 2
+	assert backend.backends["h1"].networks == fail.networks == {}
@@ -0,0 +1,95 @@
+"""
+Transactions, locking and the queries of the state store
+"""
+import threading
+import time
+import pytest
+from state_store import StateStore
+
+LINKS = {
+	"a-b": ("10.0.0.0/29", (("a", "10.0.0.2", "eth0"), ("b", "10.0.0.3", "eth0")), (10, 12500, 1)),
+	"b-c": ("10.0.0.8/29", (("b", "10.0.0.10", "eth1"), ("c", "10.0.0.11", "eth0")), (20, 12500, 2)),
+}
+NODES = {"a": ("10.0.0.2", "a-b"), "b": ("10.0.0.3", "a-b"), "c": ("10.0.0.11", "b-c")}
+
+
+@pytest.fixture
+def filled(store):
+	store.replace(NODES, LINKS, {"a": 0, "b": 1, "c": 0}, routes={"a": [("10.0.0.11", "10.0.0.3", "eth0")]})
+	return store
+
+
+def test_round_trip(filled):
+	assert filled.nodes() == NODES
+	assert filled.links() == LINKS
+	assert filled.link("b-c") == LINKS["b-c"]
+	assert filled.link("x-y") is None
+	assert filled.links_of("b") == {"eth0": "a-b", "eth1": "b-c"}
+	assert filled.node_of_ip("10.0.0.10") == "b"
+	assert filled.node_of_ip("10.9.9.9") is None
+	assert filled.node_vs_ip()["b"] == ["10.0.0.3", "10.0.0.10"]
+	assert filled.node_vs_eth() == {"a": 0, "b": 1, "c": 0}
+	assert filled.routes("a") == {"10.0.0.11": ("10.0.0.3", "eth0")}
+	filled.update_routes("a", [("10.0.0.10", "10.0.0.3", "eth0")], deletions=["10.0.0.11"])
+	assert filled.routes("a") == {"10.0.0.10": ("10.0.0.3", "eth0")}
+	filled.set_link_params("a-b", (50, 12500, 5))
+	assert filled.link("a-b")[2] == (50, 12500, 5)
+	# the interfaces go with their link
+	assert filled.remove_link("b-c") == LINKS["b-c"]
+	assert filled.links_of("b") == {"eth0": "a-b"}
+	assert filled.remove_link("b-c") is None
+
+
+def test_failed_transaction_is_rolled_back(filled):
+	with pytest.raises(RuntimeError):
+		with filled.transaction():
+			filled.remove_link("a-b")
+			# a nested transaction joins the outer one and fails it as a whole
+			with filled.transaction():
+				filled.set_meta("run", "r1")
+			raise RuntimeError("docker failed")
+	assert filled.links() == LINKS
+	assert filled.get_meta("run") is None
+	with filled.transaction():
+		filled.set_meta("run", "r1")
+	assert filled.get_meta("run") == "r1"
+
+
+def test_readers_see_committed_state(filled, tmp_path):
+	# a reader on its own connection is not blocked by a writer and never sees its partial updates
+	reader = StateStore(str(tmp_path / "state.db"))
+	with filled.transaction():
+		filled.remove_link("a-b")
+		assert "a-b" not in filled.snapshot()["links"]
+		assert set(reader.snapshot()["links"]) == {"a-b", "b-c"}
+	assert set(reader.links()) == {"b-c"}
+
+
+def test_lock_serializes_writers(filled, tmp_path):
+	# a second store, e.g. of another process, waits for the lock and then sees the committed state
+	other = StateStore(str(tmp_path / "state.db"))
+	events = []
+
+	def writer():
+		with other.transaction():
+			events.append(("other", other.get_meta("count")))
+			other.set_meta("count", "2")
+
+	with filled.lock():
+		thread = threading.Thread(target=writer)
+		thread.start()
+		time.sleep(0.1)
+		assert events == []
+		filled.set_meta("count", "1")
+		# the lock is reentrant
+		with filled.transaction():
+			events.append(("filled", filled.get_meta("count")))
+	thread.join(5)
+	assert events == [("filled", "1"), ("other", "1")]
+	assert filled.get_meta("count") == "2"
+
+
+def test_clear(filled):
+	filled.clear()
+	assert filled.snapshot() == {"nodes": {}, "links": {}, "node_vs_ip": {}, "node_vs_eth": {}}
+	assert filled.routing() is None
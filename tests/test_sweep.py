@@ -0,0 +1,105 @@
+"""
+Sampling of parameter spaces and the scheduling of sweeps over instances
+"""
+import threading
+import pytest
+import sweep as sweep_module
+from result_store import ResultStore
+from sweep import Instance, Sweep, grid, latin_hypercube
+
+
+@pytest.fixture
+def instances(store, monkeypatch):
+	"""
+	:return: function names -> list of Instance of the empty topology of the store
+	"""
+	monkeypatch.setattr(sweep_module, "WAIT_INTERVAL", 0.001)
+	return lambda *names: [Instance(name, store) for name in names]
+
+
+def test_sampling():
+	assert grid({"a": [1, 2], "b": ["x", "y", "z"]})[:4] == [{"a": 1, "b": "x"}, {"a": 1, "b": "y"},
+	                                                        {"a": 1, "b": "z"}, {"a": 2, "b": "x"}]
+	points = latin_hypercube({"bandwidth": (0, 100), "loss": [0, 1, 2, 3, 4]}, 5, seed=1)
+	# every fifth of each range holds exactly one point
+	assert sorted(int(point["bandwidth"] // 20) for point in points) == list(range(5))
+	assert sorted(point["loss"] for point in points) == [0, 1, 2, 3, 4]
+	assert latin_hypercube({"bandwidth": (0, 100)}, 5, seed=1) == latin_hypercube({"bandwidth": (0, 100)}, 5, seed=1)
+
+
+def test_invalid_sweeps():
+	with pytest.raises(ValueError):
+		Sweep("s", {"x": [1]}, None, sampling="sobol")
+	with pytest.raises(ValueError):
+		Sweep("s", {"x": (0, 1)}, None, sampling="lhs")
+	with pytest.raises(ValueError):
+		Sweep("s", {"bandwidth": [10]}, None)
+	with pytest.raises(ValueError):
+		Sweep("s", {"load": [10]}, None)
+
+
+def test_results_are_tagged(instances, tmp_path):
+	results = ResultStore(str(tmp_path / "results"))
+
+	def procedure(instance, point, replication):
+		return {"probe": [{"value": point["x"] * 10 + replication}]}
+
+	summary = Sweep("tagged", {"x": [1, 2, 3]}, procedure, replications=2).run(instances("i1", "i2"), results)
+	assert (summary["points"], summary["done"], summary["failed"], summary["retired"]) == (3, 6, [], [])
+	rows = results.query("probe", ["value", "point_x", "iteration", "instance", "run"], {"experiment": "tagged"})
+	assert sorted(rows["value"]) == [10, 11, 20, 21, 30, 31]
+	assert all(value == x * 10 + iteration
+	           for value, x, iteration in zip(rows["value"], rows["point_x"], rows["iteration"]))
+	assert set(rows["instance"]) <= {"i1", "i2"} and set(rows["run"]) == {summary["run"]}
+
+
+def test_failed_points_move_to_healthy_instances(instances, tmp_path):
+	runs = []
+	lock = threading.Lock()
+	retired = threading.Event()
+
+	def procedure(instance, point, replication):
+		with lock:
+			runs.append((instance.name, point["x"]))
+			if [name for name, _ in runs].count("broken") == sweep_module.MAX_FAILURES:
+				retired.set()
+		if instance.name == "broken":
+			raise RuntimeError("node unreachable")
+		# the healthy instance holds its first point until the other one failed enough to retire
+		retired.wait(5)
+		return []
+
+	summary = Sweep("requeue", {"x": list(range(8))}, procedure).run(instances("broken", "healthy"),
+	                                                                ResultStore(str(tmp_path / "results")))
+	# the broken instance is retired after MAX_FAILURES points, all of them are measured on the other one
+	assert summary["retired"] == ["broken"]
+	assert [name for name, _ in runs].count("broken") == sweep_module.MAX_FAILURES
+	assert (summary["done"], summary["failed"]) == (8, [])
+	assert sorted(x for name, x in runs if name == "healthy") == list(range(8))
+
+
+def test_point_failing_everywhere_is_given_up(instances, tmp_path):
+	attempts = []
+
+	def procedure(instance, point, replication):
+		if point["x"] == 0:
+			attempts.append(instance.name)
+			raise RuntimeError("probe crashed")
+		return []
+
+	summary = Sweep("give-up", {"x": list(range(4))}, procedure).run(instances("only"),
+	                                                                ResultStore(str(tmp_path / "results")))
+	# the measurements between its attempts keep the instance from being retired
+	assert len(attempts) == sweep_module.MAX_ATTEMPTS
+	assert (summary["done"], summary["failed"], summary["retired"]) == (3, [({"x": 0}, 0)], [])
+
+
+def test_points_left_when_all_instances_retired(instances, tmp_path):
+	def procedure(instance, point, replication):
+		raise RuntimeError("testbed down")
+
+	summary = Sweep("down", {"x": list(range(5))}, procedure).run(instances("a", "b"),
+	                                                             ResultStore(str(tmp_path / "results")))
+	assert sorted(summary["retired"]) == ["a", "b"]
+	assert summary["done"] == 0
+	assert sorted(point["x"] for point, _ in summary["failed"]) == list(range(5))
@@ -0,0 +1,52 @@
+"""
+Label based teardown and garbage collection on the fake backend
+"""
+from docker_backend import ExecResult
+from teardown import RUN_LABEL, TESTBED_LABEL, run_labels, teardown
+
+
+def make_run(backend, testbed, run_id, names):
+	labels = run_labels(testbed, run_id)
+	for name in names:
+		backend.create_network(f"{name}-net", "10.0.0.0/29", labels)
+		backend.run_container(name, "node-image", f"{name}-net", None, labels=labels)
+
+
+def test_teardown_selects_by_label(fake_backend):
+	make_run(fake_backend, "default", "r1", ["a", "b"])
+	make_run(fake_backend, "other", "r2", ["c"])
+	# resources without labels are not the testbed's
+	fake_backend.run_container("unrelated", "node-image", "host", None)
+	removed_containers, removed_networks, _ = teardown("default")
+	assert (removed_containers, removed_networks) == (2, 2)
+	assert set(fake_backend.containers) == {"c", "unrelated"}
+	assert set(fake_backend.networks) == {"c-net"}
+
+
+def test_gc_keeps_the_current_run(fake_backend):
+	make_run(fake_backend, "default", "crashed", ["a", "b"])
+	make_run(fake_backend, "default", "current", ["c"])
+	removed_containers, removed_networks, _ = teardown("default", keep_run="current")
+	assert (removed_containers, removed_networks) == (2, 2)
+	assert set(fake_backend.containers) == {"c"}
+	assert fake_backend.containers["c"]["labels"] == {TESTBED_LABEL: "default", RUN_LABEL: "current"}
+	# every container is removed before the first network
+	ops = [op for op, _ in fake_backend.calls if op in ("remove_container", "remove_network")]
+	assert ops == ["remove_container"] * 2 + ["remove_network"] * 2
+
+
+def test_failed_removals_are_reported(fake_backend, capsys):
+	make_run(fake_backend, "default", "r1", ["a", "b"])
+	remove = fake_backend.remove_container
+
+	def failing(name, force=True):
+		if name == "a":
+			return ExecResult(1, b"", b"device busy")
+		return remove(name, force)
+
+	fake_backend.remove_container = failing
+	removed_containers, removed_networks, _ = teardown("default")
+	# the network of the container left behind still has an endpoint
+	assert (removed_containers, removed_networks) == (1, 1)
+	assert set(fake_backend.containers) == {"a"}
+	assert "Removing a failed: device busy" in capsys.readouterr().out
@@ -0,0 +1,90 @@
+"""
+Parsers of the probe tools on sample outputs in tests/data
+"""
+import os
+import pytest
+from tool_parsers import (IperfInterval, PARSERS, PathneckConf, PathneckHop, PathneckRtt, PingSample, PingSummary,
+                          TracerouteHop, parse)
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def sample(name):
+	with open(os.path.join(DATA, name), "rb") as f:
+		return f.read()
+
+
+def test_pathneck():
+	records = parse("pathneck", sample("pathneck.txt"))
+	hops = [record for record in records if isinstance(record, PathneckHop)]
+	assert len(hops) == 4
+	assert hops[1] == PathneckHop(1, 10.522, "10.0.2.3", 1204, 1199, True, 44.49, "ub")
+	assert [hop.hop for hop in hops if hop.bottleneck] == [1]
+	assert PathneckConf((0.152, 0.0, 0.0)) in records
+	assert records[-1] == PathneckRtt(20.93)
+
+
+def test_ping():
+	records = parse("ping", sample("ping.txt"))
+	assert records[:3] == [PingSample(1, 61, 30.4), PingSample(2, 61, 20.2), PingSample(3, 61, 20.3)]
+	assert records[3] == PingSummary(3, 3, 20.211, 23.633, 30.412, 4.793)
+
+
+def test_ping_busybox():
+	records = parse("ping", sample("ping_busybox.txt"))
+	assert records[0] == PingSample(0, 61, 20.512)
+	assert records[-1] == PingSummary(2, 2, 20.38, 20.446, 20.512, None)
+
+
+def test_ping_without_reply():
+	# the summary without rtt line is returned by close
+	assert parse("ping", sample("ping_unreachable.txt")) == [PingSummary(2, 0, None, None, None, None)]
+
+
+def test_iperf():
+	records = parse("iperf", sample("iperf.txt"))
+	assert records[0] == IperfInterval(3, 0.0, 1.0, int(1.25 * 1024 ** 2), 10.5e6, "")
+	assert [record.end for record in records] == [1.0, 2.0, 2.0]
+
+
+def test_iperf3_text():
+	records = parse("iperf3", sample("iperf3.txt"))
+	assert [record.summary for record in records] == ["", "", "sender", "receiver"]
+	assert records[2].bits_per_second == pytest.approx(9.8e6)
+	assert records[3].end == 2.04
+
+
+def test_iperf3_json():
+	records = parse("iperf3", sample("iperf3.json"))
+	# both streams and their sum per interval, then the sums of the end
+	assert [(record.stream, record.summary) for record in records] == \
+	       [(5, ""), (7, ""), (-1, ""), (-1, "sender"), (-1, "receiver")]
+	assert records[1].bytes == 655360
+
+
+def test_iperf3_json_stream():
+	records = parse("iperf3", sample("iperf3_stream.txt"))
+	assert [(record.stream, record.summary) for record in records] == \
+	       [(5, ""), (5, ""), (-1, "sender"), (-1, "receiver")]
+	assert records[1].start == 1.000046
+
+
+def test_traceroute():
+	records = parse("traceroute", sample("traceroute.txt"))
+	assert records == [TracerouteHop(1, "10.0.1.3", (0.061, 0.021, 0.018)),
+	                   TracerouteHop(2, "10.0.2.3", (None, 10.412, None)),
+	                   TracerouteHop(3, None, (None, None, None)),
+	                   TracerouteHop(4, "10.0.4.4", (20.72, 20.681, 20.655))]
+
+
+@pytest.mark.parametrize("tool, name", [("pathneck", "pathneck.txt"), ("ping", "ping.txt"), ("iperf", "iperf.txt"),
+                                        ("iperf3", "iperf3.json"), ("traceroute", "traceroute.txt")])
+def test_chunked_feed(tool, name):
+	# the records do not depend on where the output is split into chunks
+	output = sample(name)
+	for size in (1, 7, 64):
+		parser = PARSERS[tool]()
+		records = []
+		for offset in range(0, len(output), size):
+			records += parser.feed(output[offset:offset + size])
+		assert records + parser.close() == parse(tool, output)
@@ -0,0 +1,69 @@
+"""
+Parsing of tc qdisc trees and the minimal changes planned from them
+"""
+import json
+from traffic_control import apply_tc, parse_qdiscs, plan_changes
+from docker_backend import ExecResult
+
+# tc -j qdisc show of a node with a shaped eth0, an eth1 without netem child and an unshaped eth2
+QDISCS = json.dumps([
+	{"kind": "noqueue", "handle": "0:", "dev": "lo", "root": True, "refcnt": 2, "options": {}},
+	{"kind": "tbf", "handle": "1:", "dev": "eth0", "root": True, "refcnt": 2,
+	 "options": {"rate": 12500000, "burst": 12800000, "lat": 0.01}},
+	{"kind": "netem", "handle": "10:", "dev": "eth0", "parent": "1:1",
+	 "options": {"limit": 1000, "delay": {"delay": 0.005, "jitter": 0, "correlation": 0}, "ecn": False}},
+	{"kind": "tbf", "handle": "1:", "dev": "eth1", "root": True, "refcnt": 2,
+	 "options": {"rate": 1250000, "burst": 12800000, "lat": 0.01}},
+	{"kind": "noqueue", "handle": "0:", "dev": "eth2", "root": True, "refcnt": 2, "options": {}},
+])
+
+
+def test_parse_qdiscs():
+	current = parse_qdiscs(QDISCS)
+	assert current["eth0"] == (100.0, 12500.0, 5.0)
+	assert current["eth1"] == (10.0, 12500.0, None)
+	assert current["eth2"] == (None, None, None)
+	assert parse_qdiscs("") == {}
+
+
+def test_plan_changes():
+	current = parse_qdiscs(QDISCS)
+	# unchanged parameters need no command, tc rounding of the burst is tolerated
+	assert plan_changes({"eth0": (100, 12500, 5)}, current) == []
+	assert plan_changes({"eth0": (100, 12600, 5)}, current) == []
+	assert plan_changes({"eth0": (50, 12500, 5)}, current) == \
+	       ["qdisc change dev eth0 root handle 1: tbf rate 50mbit burst 12500kb latency 10ms"]
+	assert plan_changes({"eth0": (100, 12500, 20)}, current) == \
+	       ["qdisc change dev eth0 parent 1:1 handle 10: netem delay 20ms"]
+	# a missing netem child is added, a foreign root qdisc replaced by the whole tree
+	assert plan_changes({"eth1": (10, 12500, 5)}, current) == \
+	       ["qdisc replace dev eth1 parent 1:1 handle 10: netem delay 5ms"]
+	assert plan_changes({"eth2": (10, 12500, 5)}, current) == \
+	       ["qdisc replace dev eth2 root handle 1: tbf rate 10mbit burst 12500kb latency 10ms",
+	        "qdisc replace dev eth2 parent 1:1 handle 10: netem delay 5ms"]
+	assert plan_changes({"eth3": (10, 12500, 5)}, {})[0].startswith("qdisc replace dev eth3 root")
+
+
+def test_apply_tc_cache(fake_backend):
+	fake_backend.exec_handler = lambda container, cmd, stdin: ExecResult(0, QDISCS.encode(), b"")
+	fake_backend.run_container("n", "node-image", "host", None)
+
+	def tc_calls():
+		calls = [args["cmd"][1] for op, args in fake_backend.calls if op == "exec"]
+		fake_backend.calls.clear()
+		return calls
+
+	# without a cache the tree is read every time
+	assert apply_tc("n", {"eth0": (100, 12500, 5)}) == 0
+	assert apply_tc("n", {"eth0": (100, 12500, 5)}) == 0
+	assert tc_calls() == ["-j", "-j"]
+	# with a cache only the first call reads it
+	cache = {}
+	assert apply_tc("n", {"eth0": (50, 12500, 5)}, cache=cache) == 0
+	assert apply_tc("n", {"eth0": (50, 12500, 5)}, cache=cache) == 0
+	assert tc_calls() == ["-j", "-batch"]
+	assert cache["n"]["eth0"] == (50, 12500, 5)
+	# a failed batch leaves the state of the node unknown
+	fake_backend.exec_handler = lambda container, cmd, stdin: ExecResult(1, b"", b"RTNETLINK answers: failure")
+	assert apply_tc("n", {"eth0": (20, 12500, 5)}, cache=cache) == 1
+	assert "n" not in cache
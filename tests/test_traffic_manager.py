@@ -0,0 +1,113 @@
+"""
+Flows of the background traffic on the fake backend
+"""
+import threading
+import pytest
+from docker_backend import ExecResult
+from traffic_manager import BASE_PORT, Flow, TrafficManager, flows_from_matrix
+
+NODES = {"c1": ("10.0.0.2", "c1-r1"), "c2": ("10.0.0.10", "c2-r1"), "s1": ("10.0.0.18", "r1-s1")}
+
+
+@pytest.fixture
+def nodes(fake_backend, store):
+	"""
+	Nodes answering the traffic scripts: servers get pid 100 + flow id, clients 200 + flow id
+	:return: FakeBackend
+	"""
+	store.replace(NODES, {}, {})
+	for node in NODES:
+		fake_backend.run_container(node, "node-image", "host", None)
+	lock = threading.Lock()
+	fake_backend.running = set()
+
+	def handler(container, cmd, stdin):
+		script = cmd[-1]
+		if "iperf -s" in script:
+			port = int(script.split(" -p ")[1].split()[0])
+			return ExecResult(0, f"{100 + port - BASE_PORT}\n".encode(), b"")
+		if "iperf -c" in script:
+			port = int(script.split(" -p ")[1].split()[0])
+			with lock:
+				fake_backend.running.add(200 + port - BASE_PORT)
+			return ExecResult(0, f"eth0 {200 + port - BASE_PORT}\n".encode(), b"")
+		if "kill -0" in script:
+			pids = script.split("for pid in ")[1].split(";")[0].split()
+			return ExecResult(0, "".join(f"{pid}\n" for pid in pids if int(pid) in fake_backend.running).encode(), b"")
+		return ExecResult(0, b"", b"")
+
+	fake_backend.exec_handler = handler
+	return fake_backend
+
+
+def scripts(backend, node):
+	return [args["cmd"][-1] for op, args in backend.calls if op == "exec" and args["container"] == node]
+
+
+def test_start_and_reload(nodes, store):
+	manager = TrafficManager(store=store)
+	flows = manager.start(flows_from_matrix({("c1", "s1"): 40, ("c2", "s1"): {"rate": None, "streams": 4}},
+	                                        protocol="udp", max_rate=100))
+	assert [(flow.id, flow.port, flow.ip) for flow in flows] == [(1, BASE_PORT + 1, "10.0.0.18"),
+	                                                            (2, BASE_PORT + 2, "10.0.0.18")]
+	assert [(flow.server_pid, flow.client_pid, flow.interface) for flow in flows] == [(101, 201, "eth0"),
+	                                                                                 (102, 202, "eth0")]
+	# the servers listen before the first client starts
+	execs = [args["cmd"][-1] for op, args in nodes.calls if op == "exec"]
+	assert [("iperf -s" in script) for script in execs] == [True, True, False, False]
+	policed, = scripts(nodes, "c1")
+	assert "match ip dst 10.0.0.18/32 match ip protocol 17 0xff match ip dport 6001 0xffff" in policed
+	assert "police rate 40mbit burst 48k conform-exceed drop index 1" in policed
+	unpoliced, = scripts(nodes, "c2")
+	assert "tc " not in unpoliced and "-P 4 -u -b 100m" in unpoliced
+	# a later process sees the flows of the store
+	reloaded = TrafficManager(store=store)
+	assert [(flow.id, flow.rate, flow.client_pid) for flow in reloaded.flows.values()] == [(1, 40, 201), (2, None, 202)]
+	assert manager.start([Flow("c1", "s1")])[0].id == 3
+
+
+def test_failed_server_is_not_started(nodes, store, capsys):
+	handler = nodes.exec_handler
+	nodes.exec_handler = lambda container, cmd, stdin: (ExecResult(1, b"", b"iperf: not found")
+	                                                    if "iperf -s" in cmd[-1] else handler(container, cmd, stdin))
+	manager = TrafficManager(store=store)
+	assert manager.start([Flow("c1", "s1", rate=10)]) == []
+	assert scripts(nodes, "c1") == []
+	assert manager.flows == {}
+	assert TrafficManager(store=store).flows == {}
+	assert "1 of 1 flows could not be started" in capsys.readouterr().out
+
+
+def test_set_rates(nodes, store):
+	manager = TrafficManager(store=store)
+	a, b, c = manager.start([Flow("c1", "s1", rate=10), Flow("c1", "s1"), Flow("c2", "s1", rate=20)])
+	nodes.calls.clear()
+	assert manager.set_rates({a: 30, b: 5, c: None}) == {"c1": 0, "c2": 0}
+	# one tc batch per source node
+	batches = {args["container"]: args["stdin"].decode().splitlines() for op, args in nodes.calls if op == "exec"}
+	assert batches["c1"][0] == "actions change action police rate 30mbit burst 36k conform-exceed drop index 1"
+	assert batches["c1"][1:] == ["qdisc replace dev eth0 clsact",
+	                             "filter add dev eth0 egress pref 2 protocol ip u32 match ip dst 10.0.0.18/32 "
+	                             "match ip protocol 6 0xff match ip dport 6002 0xffff action police rate 5mbit "
+	                             "burst 16k conform-exceed drop index 2"]
+	assert batches["c2"] == ["filter del dev eth0 egress pref 3"]
+	assert [flow.rate for flow in TrafficManager(store=store).flows.values()] == [30, 5, None]
+
+
+def test_running_and_stop(nodes, store):
+	manager = TrafficManager(store=store)
+	a, b = manager.start([Flow("c1", "s1", rate=10), Flow("c2", "s1")])
+	nodes.running.discard(b.client_pid)
+	assert manager.running() == [a]
+	nodes.calls.clear()
+	manager.stop([a])
+	assert scripts(nodes, "c1") == ["kill 201 2>/dev/null\ntc filter del dev eth0 egress pref 1 2>/dev/null\ntrue"]
+	assert scripts(nodes, "s1") == ["kill 101 2>/dev/null\ntrue"]
+	assert list(manager.flows) == [2]
+	manager.stop()
+	assert TrafficManager(store=store).flows == {}
+
+
+def test_unknown_protocol():
+	with pytest.raises(ValueError):
+		Flow("c1", "s1", protocol="sctp")
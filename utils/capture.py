@@ -0,0 +1,247 @@
+"""
+Packet capture on the nodes, streamed to the host.
+
+tcpdump runs on the node with a BPF filter and a snap length and writes the
+pcap to its stdout, which stays open over one exec (open_exec of the
+backend). A thread on the host reads the stream and writes it to a file, or
+to a ring of files of at most file_size MB each, the oldest overwritten once
+there are files of them, like tcpdump -C -W but without using the disk of the
+node. The stream is only split at packet boundaries, every file of the ring
+is a pcap file of its own.
+
+	capture = Capture("r5", "eth1", "captures/r5.pcap", bpf_filter="udp", snaplen=96, duration=60)
+	capture.start()
+	capture.wait()
+	packets = pcap_reader.read_pcap(capture.files)
+"""
+import os
+import shlex
+import struct
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from docker_backend import get_backend
+from pcap_reader import GLOBAL_HEADER, RECORD_HEADER, pcap_format
+
+CHUNK = 65536
+# seconds a stopped capture waits for tcpdump to flush and end
+STOP_TIMEOUT = 10
+
+
+class _RingWriter:
+	"""
+	Writes a pcap stream to a file or a ring of files, split at packet boundaries
+	"""
+
+	def __init__(self, path, file_size=None, files=None):
+		self.path = path
+		self.file_size = file_size * 1000000 if file_size else None
+		self.files = files
+		self.paths = []
+		self.packets = 0
+		self.bytes = 0
+		self._buffer = bytearray()
+		self._header = None
+		self._unpack = None
+		self._file = None
+		self._file_bytes = 0
+		self._index = 0
+
+	def _open(self):
+		if self._file is not None:
+			self._file.close()
+		if self.file_size is None:
+			path = self.path
+		else:
+			path = f"{self.path}{self._index}"
+			self._index = (self._index + 1) % self.files if self.files else self._index + 1
+		if path in self.paths:
+			self.paths.remove(path)
+		self.paths.append(path)
+		self._file = open(path, "wb")
+		self._file.write(self._header)
+		self._file_bytes = len(self._header)
+
+	def write(self, data):
+		self._buffer += data
+		if self._header is None:
+			if len(self._buffer) < GLOBAL_HEADER:
+				return
+			self._header = bytes(self._buffer[:GLOBAL_HEADER])
+			order, _ = pcap_format(self._header)
+			self._unpack = struct.Struct(order + "I").unpack_from
+			del self._buffer[:GLOBAL_HEADER]
+			os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+			self._open()
+		# complete records are written in spans, a new file of the ring starts at a record
+		buffer = self._buffer
+		offset = span = 0
+		while offset + RECORD_HEADER <= len(buffer):
+			size = RECORD_HEADER + self._unpack(buffer, offset + 8)[0]
+			if offset + size > len(buffer):
+				break
+			if self.file_size is not None and self._file_bytes + offset - span + size > self.file_size \
+					and self._file_bytes + offset - span > len(self._header):
+				self._file.write(buffer[span:offset])
+				self._open()
+				span = offset
+			offset += size
+			self.packets += 1
+		self._file.write(buffer[span:offset])
+		self._file_bytes += offset - span
+		self.bytes += offset
+		del buffer[:offset]
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+
+class Capture:
+	"""
+	tcpdump on one interface of a node, streamed to files on the host
+	:param node: name of node
+	:param interface: interface to capture on, any for all
+	:param path: file written on the host, the prefix of the files path0, path1, ... of a ring
+	:param bpf_filter: BPF filter expression, e.g. "udp and dst port 6001"
+	:param snaplen: bytes captured of every packet
+	:param file_size: MB per file of a ring, a single file if None
+	:param files: number of files of the ring, unlimited if None
+	:param duration: seconds after which tcpdump ends, until stop if None
+	:param count: number of packets after which tcpdump ends
+	"""
+
+	def __init__(self, node, interface, path, bpf_filter="", snaplen=96, file_size=None, files=None, duration=None,
+	             count=None):
+		self.node = node
+		self.interface = interface
+		self.bpf_filter = bpf_filter
+		self.snaplen = snaplen
+		self.duration = duration
+		self.count = count
+		self.writer = _RingWriter(path, file_size, files)
+		self.pid = None
+		self.error = None
+		self._channel = None
+		self._thread = None
+		self._started = threading.Event()
+
+	def command(self):
+		"""
+		:return: command run on the node, it prints its PID and then the pcap stream
+		"""
+		cmd = ["tcpdump", "-i", self.interface, "-s", str(self.snaplen), "-U", "-n", "-w", "-"]
+		if self.count is not None:
+			cmd += ["-c", str(self.count)]
+		if self.bpf_filter:
+			cmd.append(self.bpf_filter)
+		if self.duration is not None:
+			# timeout passes the interrupt of stop on to tcpdump
+			cmd = ["timeout", "-s", "INT", str(self.duration)] + cmd
+		return ["sh", "-c", f"echo $$; exec {shlex.join(cmd)}"]
+
+	def _read_pid(self):
+		line = b""
+		while not line.endswith(b"\n"):
+			data = self._channel.read(1)
+			if not data:
+				return None
+			line += data
+		return int(line)
+
+	def _read(self):
+		try:
+			self.pid = self._read_pid()
+			self._started.set()
+			if self.pid is None:
+				self.error = f"capture on {self.node} could not be started"
+				return
+			while True:
+				data = self._channel.read(CHUNK)
+				if not data:
+					break
+				self.writer.write(data)
+			if self.writer.paths == []:
+				self.error = f"tcpdump on {self.node} wrote no pcap, is it installed and is {self.interface} an interface?"
+		except (OSError, ValueError) as e:
+			self.error = str(e)
+		finally:
+			self._started.set()
+			self.writer.close()
+			self._channel.close()
+
+	def start(self):
+		"""
+		Start tcpdump and the thread streaming its output
+		:return: True if tcpdump was started
+		"""
+		open_exec = getattr(get_backend(), "open_exec", None)
+		self._channel = open_exec(self.node, self.command()) if open_exec is not None else None
+		if self._channel is None:
+			self.error = f"capture on {self.node} could not be started"
+			print(self.error)
+			return False
+		self._thread = threading.Thread(target=self._read, daemon=True)
+		self._thread.start()
+		self._started.wait()
+		return self.pid is not None
+
+	def wait(self, timeout=None):
+		"""
+		Wait for tcpdump to end
+		:param timeout: seconds to wait, forever if None
+		:return: True if the capture ended
+		"""
+		if self._thread is None:
+			return True
+		self._thread.join(timeout)
+		return not self._thread.is_alive()
+
+	def stop(self):
+		"""
+		End tcpdump, it flushes its buffer first
+		:return: list of the files written, oldest first
+		"""
+		if self._thread is not None and self._thread.is_alive() and self.pid is not None:
+			get_backend().exec(self.node, ["kill", "-INT", str(self.pid)])
+			if not self.wait(STOP_TIMEOUT):
+				self._channel.close()
+				self.wait()
+		if self.error:
+			print(self.error)
+		return self.files
+
+	@property
+	def files(self):
+		"""
+		:return: list of the files written so far, oldest first
+		"""
+		return list(self.writer.paths)
+
+	@property
+	def packets(self):
+		"""
+		:return: number of packets streamed to the host so far
+		"""
+		return self.writer.packets
+
+
+def capture_all(captures, duration=None):
+	"""
+	Run captures on several nodes at the same time
+	:param captures: list of Capture
+	:param duration: seconds to capture, until every capture ended if None
+	:return: dict path -> list of files of every capture
+	"""
+	for capture in captures:
+		capture.start()
+	if duration is None:
+		for capture in captures:
+			capture.wait()
+	else:
+		time.sleep(duration)
+	return {capture.writer.path: capture.stop() for capture in captures}
@@ -1,23 +1,61 @@
 """
 Helper functions useful when setting up an experiment
+
+A node is given by its name, or on a testbed set up with replicas of the
+topology (setup --replicas) as tuple (replica, name).
 """
-import subprocess
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from capture import Capture
+from docker_backend import get_backend
+from replicas import resolve_node
+from state_store import get_store
+from tool_parsers import PathneckHop, parse
+
+
+def run_detached(node_name, cmd):
+	"""
+	Start a command on a node in the background
+	:param node_name: name of node
+	:param cmd: command as list of arguments
+	:return: exec id of the command, None if it could not be started
+	"""
+	node_name = resolve_node(node_name)
+	result, exec_id = get_backend().exec_detached(node_name, cmd)
+	if result.exit_code != 0:
+		print(f"Command {' '.join(cmd)} on {node_name} returned non-zero exit status: {result.exit_code}")
+		print(result.stderr.decode('utf-8', errors='replace'))
+		return None
+	return exec_id
 
 
-def capture_traffic(node_name, interface, duration, filename):
+def node_address(node_name):
+	"""
+	:param node_name: name of node
+	:return: ip address of the node
+	"""
+	return get_store().nodes()[resolve_node(node_name)][0]
+
+
+def capture_traffic(node_name, interface, duration, filename, bpf_filter="", snaplen=96):
 	"""
 	Capture traffic with tcpdump on a node for a given time
-	duration and write to file.
+	duration and write to file. The pcap is streamed to the host while
+	tcpdump runs, see capture.Capture for ring buffers of files.
 	:param node_name: name of node to run tcpdump on
 	:param interface: interface to capture traffic on
 	:param duration: time to measure traffic in seconds
 	:param filename: file to write output to
-	:return: None
+	:param bpf_filter: BPF filter expression, all packets if empty
+	:param snaplen: bytes captured of every packet
+	:return: the running capture.Capture, wait() for it to end
 	"""
-	try:
-		subprocess.check_call(f"docker exec {node_name} timeout {duration} -i {interface} > {filename} &", shell=True)
-	except subprocess.CalledProcessError as e:
-		print(f"Command {e.cmd} returned non-zero exit status: {e.returncode}")
+	capture = Capture(resolve_node(node_name), interface, filename, bpf_filter=bpf_filter, snaplen=snaplen, duration=duration)
+	capture.start()
+	return capture
 
 
 def iperf_server(node_name):
@@ -26,10 +64,7 @@ def iperf_server(node_name):
 	:param node_name: name of node to start iperf server on
 	:return: None
 	"""
-	try:
-		subprocess.check_call(f'docker exec {node_name} iperf -s &', shell=True)
-	except subprocess.CalledProcessError as e:
-		print(f"Command {e.cmd} returned non-zero exit status: {e.returncode}")
+	run_detached(node_name, ["iperf", "-s"])
 
 
 def iperf_client(node_name, server_ip):
@@ -39,10 +74,7 @@ def iperf_client(node_name, server_ip):
 	:param server_ip: ip address of server node
 	:return: None
 	"""
-	try:
-		subprocess.check_call(f"docker exec {node_name} iperf -t 0 -c {server_ip} &", shell=True)
-	except subprocess.CalledProcessError as e:
-		print(f"Command {e.cmd} returned non-zero exit status: {e.returncode}")
+	run_detached(node_name, ["iperf", "-t", "0", "-c", server_ip])
 
 
 def pathneck(client_name, server_ip):
@@ -53,8 +85,10 @@ def pathneck(client_name, server_ip):
 	:return: String containing output of Pathneck
 	run with online flag set
 	"""
-	result = subprocess.run(['docker', 'exec', f'{client_name}', './pathneck-1.3/pathneck', '-o', f'{server_ip}'],
-	                        stdout=subprocess.PIPE)
+	client_name = resolve_node(client_name)
+	result = get_backend().exec(client_name, ['./pathneck-1.3/pathneck', '-o', server_ip])
+	if result.exit_code != 0:
+		print(f"pathneck on {client_name} returned non-zero exit status: {result.exit_code}")
 	return result.stdout.decode('utf-8')
 
 
@@ -64,14 +98,10 @@ def parse_pathneck_result(pathneck_result):
 	:param pathneck_result: result of pathneck run such as output
 	of pathneck function
 	:return: tuple (bottleneck, bottleneck_bandwidth)
-	the detected bottleneck and the estimated bottleneck bandwidth if found,
-	else returns None
+	the hop id of the first detected bottleneck and the estimated bottleneck
+	bandwidth if found, else returns None
 	"""
-	for line in pathneck_result.splitlines():
-		line = line.split()
-		if len(line) == 8:
-			if line[5] == '1':
-				bottleneck = line[0]
-				bottleneck_bw = float(line[6])
-				return bottleneck, bottleneck_bw
-	return None, None
\ No newline at end of file
+	for record in parse('pathneck', pathneck_result):
+		if isinstance(record, PathneckHop) and record.bottleneck:
+			return record.hop, record.bandwidth
+	return None, None
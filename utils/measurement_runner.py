@@ -0,0 +1,214 @@
+"""
+Asynchronous runner for measurement jobs.
+
+A job runs a probe tool (pathneck, ping, iperf, ...) on a node against a
+target. The runner overlaps independent jobs while keeping at most node_limit
+jobs per node and global_limit jobs in total in flight; a job waiting for its
+node does not take a global slot from jobs on other nodes. Every probe runs
+under timeout on the node, so a hung probe is killed on the node itself after
+the timeout of its job and retried. The results are handed out as the jobs
+complete, with the output of the tools in tool_parsers.PARSERS parsed into
+records. On backends with exec agents the output is parsed while it arrives.
+
+	runner = MeasurementRunner(global_limit=16, timeout=60)
+	for result in runner.run([Job("ping", "c1", "10.0.4.4", {"count": 5}), ...]):
+		...
+
+The backend calls block, so every exec runs on a thread of its own while it
+holds its slots. An exec that does not return within the timeout of its job
+plus a grace period gives up its slots and is left to finish on its thread,
+so hung execs never take capacity from the jobs after them.
+"""
+import asyncio
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from docker_backend import ExecResult, get_backend
+from replicas import resolve_node
+from tool_parsers import PARSERS, stream_callback
+
+# exit status of timeout after sending the TERM signal and after the KILL signal
+TIMEOUT_EXIT_CODES = (124, 137)
+# seconds between TERM and KILL of a probe that timed out
+KILL_AFTER = 2
+# seconds on top of the timeout the exec itself may take before the runner gives up on it
+EXEC_GRACE = 10
+
+
+def _pathneck(target, params):
+	return ["./pathneck-1.3/pathneck", "-o", target]
+
+
+def _ping(target, params):
+	return ["ping", "-c", str(params.get("count", 10)), target]
+
+
+def _iperf(target, params):
+	return ["iperf", "-c", target, "-t", str(params.get("duration", 10))]
+
+
+def _iperf3(target, params):
+	return ["iperf3", "-J", "-c", target, "-t", str(params.get("duration", 10))]
+
+
+def _traceroute(target, params):
+	return ["traceroute", "-n", target]
+
+
+# tool -> function (target, params) -> command
+TOOLS = {"pathneck": _pathneck, "ping": _ping, "iperf": _iperf, "iperf3": _iperf3, "traceroute": _traceroute}
+
+JobResult = namedtuple("JobResult", ["job", "exit_code", "stdout", "stderr", "attempts", "start", "end",
+                                     "timed_out", "records"])
+
+
+def _in_thread(function, *args):
+	"""
+	Run a blocking function on a thread of its own
+	:return: asyncio future of the result of the function
+	"""
+	future = concurrent.futures.Future()
+
+	def run():
+		if not future.set_running_or_notify_cancel():
+			return
+		try:
+			future.set_result(function(*args))
+		except BaseException as e:
+			future.set_exception(e)
+
+	threading.Thread(target=run, daemon=True).start()
+	return asyncio.wrap_future(future)
+
+
+class Job:
+	"""
+	A probe to run on a node
+	:param tool: name of a tool in TOOLS, or a function (target, params) -> command
+	:param node: name of the node running the probe, or tuple (replica, name)
+	:param target: address the probe measures
+	:param params: dict of tool parameters, extra command line arguments under "args"
+	:param timeout: seconds after which the probe is killed, the default of the runner if None
+	:param retries: number of retries after a timeout, the default of the runner if None
+	:param tag: value identifying the job in its result, e.g. the iteration
+	"""
+
+	def __init__(self, tool, node, target, params=None, timeout=None, retries=None, tag=None):
+		self.tool = tool
+		self.node = resolve_node(node)
+		self.target = target
+		self.params = params or {}
+		self.timeout = timeout
+		self.retries = retries
+		self.tag = tag
+
+	def command(self):
+		"""
+		:return: command of the probe as list of arguments
+		"""
+		build = TOOLS[self.tool] if isinstance(self.tool, str) else self.tool
+		return build(self.target, self.params) + [str(arg) for arg in self.params.get("args", [])]
+
+	def __repr__(self):
+		return f"Job({self.tool!r}, {self.node!r}, {self.target!r}, tag={self.tag!r})"
+
+
+class MeasurementRunner:
+	"""
+	Runs measurement jobs concurrently
+	:param global_limit: maximum number of jobs in flight
+	:param node_limit: maximum number of jobs in flight per node
+	:param timeout: default seconds after which a probe is killed
+	:param retries: default number of retries after a timeout
+	:param node_limits: dict node -> limit for nodes with another limit than node_limit
+	"""
+
+	def __init__(self, global_limit=16, node_limit=1, timeout=60, retries=1, node_limits=None):
+		self.global_limit = global_limit
+		self.node_limit = node_limit
+		self.timeout = timeout
+		self.retries = retries
+		self.node_limits = node_limits or {}
+
+	@staticmethod
+	def _exec(backend, job, cmd):
+		"""
+		:return: tuple (ExecResult, list of records of the output, None if the tool has no parser)
+		"""
+		parser_class = PARSERS.get(job.tool) if isinstance(job.tool, str) else None
+		if parser_class is None:
+			return backend.exec(job.node, cmd), None
+		parser = parser_class()
+		records = []
+		agents = getattr(backend, "agents", None)
+		if agents is not None:
+			callback = stream_callback(parser, lambda record, _: records.append(record))
+			result = agents.request(job.node, cmd, callback=callback)
+			if result is not None:
+				return ExecResult(result.exit_code, result.stdout, result.stderr), records + parser.close()
+		result = backend.exec(job.node, cmd)
+		return result, parser.feed(result.stdout) + parser.close()
+
+	async def _run_job(self, job, backend, global_slots, node_slots):
+		timeout = job.timeout if job.timeout is not None else self.timeout
+		retries = job.retries if job.retries is not None else self.retries
+		cmd = ["timeout", "-k", str(KILL_AFTER), str(timeout)] + job.command()
+		attempt = 0
+		async with node_slots[job.node]:
+			while True:
+				attempt += 1
+				async with global_slots:
+					start = time.time()
+					try:
+						result, records = await asyncio.wait_for(
+							_in_thread(self._exec, backend, job, cmd), timeout + KILL_AFTER + EXEC_GRACE)
+						timed_out = result.exit_code in TIMEOUT_EXIT_CODES
+					except asyncio.TimeoutError:
+						# the exec hangs, its thread is left to finish on its own without a slot
+						result, records = ExecResult(None, b"", b"exec did not return"), None
+						timed_out = True
+					end = time.time()
+				if not timed_out or attempt > retries:
+					return JobResult(job, result.exit_code, result.stdout, result.stderr, attempt, start, end,
+					                 timed_out, records)
+
+	async def stream(self, jobs):
+		"""
+		Run jobs, yielding their results as they complete
+		:param jobs: iterable of Job
+		:return: async generator of JobResult
+		"""
+		jobs = list(jobs)
+		backend = get_backend()
+		global_slots = asyncio.Semaphore(self.global_limit)
+		node_slots = {job.node: asyncio.Semaphore(self.node_limits.get(job.node, self.node_limit)) for job in jobs}
+		tasks = [asyncio.ensure_future(self._run_job(job, backend, global_slots, node_slots)) for job in jobs]
+		try:
+			for future in asyncio.as_completed(tasks):
+				yield await future
+		finally:
+			for task in tasks:
+				task.cancel()
+
+	def run(self, jobs, callback=None):
+		"""
+		Run jobs and wait for all of them
+		:param jobs: iterable of Job
+		:param callback: function called with every JobResult as soon as its job completed
+		:return: list of JobResult in the order the jobs completed
+		"""
+		async def collect():
+			results = []
+			async for result in self.stream(jobs):
+				if callback is not None:
+					callback(result)
+				results.append(result)
+			return results
+
+		return asyncio.run(collect())
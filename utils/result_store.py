@@ -0,0 +1,375 @@
+"""
+Columnar store of experiment results.
+
+Records are appended to tables in batches. Every batch is written as an
+immutable segment directory holding one .npy file per column and a meta.json
+with the number of rows and, per column, its dtype, the minimum and maximum
+and for string columns the dictionary of its values; strings are stored as
+int32 codes into that dictionary. Every row carries the tags it was appended
+with: the experiment, the topology fingerprint, the sweep point (as json in
+the column point and as one column point_<name> per parameter) and any other
+tag such as the node or the iteration.
+
+	store = ResultStore()
+	with store.writer() as writer:
+		writer.append_records(records, experiment="bw-sweep", topology=topology_fingerprint(),
+		                      point={"bandwidth": 10}, iteration=3)
+	hops = store.query("pathneck_hop", ["hop", "bandwidth"],
+	                   {"experiment": "bw-sweep", "point_bandwidth": (10, 50), "bottleneck": True})
+
+A query only opens the segments whose minimum, maximum and dictionaries can
+match the filter and only memory-maps the columns it reads, so analyses over
+millions of records load just the columns they need. Segments are written to
+a temporary directory and renamed into place, several writers of different
+processes can append to the same store concurrently.
+"""
+import functools
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from state_store import get_store
+
+RESULTS_DIR = "../measurements/results"
+# rows buffered per table before a segment is written
+BATCH_SIZE = 65536
+
+
+def topology_fingerprint(store=None):
+	"""
+	Fingerprint of the structure of the running topology, the nodes and the
+	subnets and endpoints of the links, without the link parameters
+	:param store: state_store.StateStore, the store of this process if None
+	:return: hex digest
+	"""
+	state = (store or get_store()).snapshot()
+	structure = {"nodes": state["nodes"],
+	             "links": {name: [subnet, endpoints] for name, (subnet, endpoints, _) in state["links"].items()}}
+	return hashlib.sha256(json.dumps(structure, sort_keys=True).encode()).hexdigest()[:16]
+
+
+@functools.lru_cache(maxsize=None)
+def _type_table(record_type):
+	name = record_type.__name__
+	return "".join("_" + c.lower() if c.isupper() and i else c.lower() for i, c in enumerate(name))
+
+
+def table_name(record):
+	"""
+	:param record: namedtuple record, e.g. of tool_parsers
+	:return: name of the table of its type, PathneckHop -> pathneck_hop
+	"""
+	return _type_table(type(record))
+
+
+def _batch_columns(rows):
+	"""
+	:param rows: list of namedtuples of one type or of dicts
+	:return: dict column -> list of values, tuple values expanded into one column per item
+	"""
+	if rows and hasattr(rows[0], "_fields"):
+		# fields of a namedtuple type hold tuples in every row or in none
+		columns = dict(zip(rows[0]._fields, map(list, zip(*rows))))
+		expand = [name for name, value in zip(rows[0]._fields, rows[0]) if isinstance(value, (tuple, list))]
+	else:
+		names = dict.fromkeys(key for row in rows for key in row)
+		columns = {name: [row.get(name) for row in rows] for name in names}
+		expand = [name for name, values in columns.items()
+		          if any(isinstance(value, (tuple, list)) for value in values)]
+	for name in expand:
+		values = columns.pop(name)
+		for i in range(max(len(value) for value in values if isinstance(value, (tuple, list)))):
+			columns[f"{name}{i}"] = [value[i] if isinstance(value, (tuple, list)) and i < len(value) else None
+			                         for value in values]
+	return columns
+
+
+def _tag_columns(tags):
+	columns = {}
+	for key, value in tags.items():
+		if key == "point" and isinstance(value, dict):
+			# numpy scalars of parameter ranges as plain numbers
+			columns["point"] = json.dumps(value, sort_keys=True, default=lambda v: v.item())
+			for name, param in value.items():
+				columns[f"point_{name}"] = param
+		else:
+			columns[key] = value
+	return columns
+
+
+def _column(values):
+	"""
+	:return: tuple (array, meta) of a column
+	"""
+	array = np.array(values)
+	if array.dtype.kind == "U":
+		dictionary, codes = np.unique(array, return_inverse=True)
+		return codes.astype(np.int32), {"dtype": "str", "dictionary": dictionary.tolist()}
+	if array.dtype.kind == "O":
+		if any(isinstance(value, str) for value in values):
+			dictionary = {}
+			codes = np.fromiter((-1 if value is None else dictionary.setdefault(str(value), len(dictionary))
+			                     for value in values), dtype=np.int32, count=len(values))
+			return codes, {"dtype": "str", "dictionary": list(dictionary)}
+		array = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+	elif array.dtype.kind not in "bif":
+		array = array.astype(np.float64)
+	meta = {"dtype": array.dtype.str}
+	if len(array) and array.dtype.kind != "b" and not (array.dtype.kind == "f" and np.isnan(array).all()):
+		meta["min"], meta["max"] = np.nanmin(array).item(), np.nanmax(array).item()
+	return array, meta
+
+
+def _matches(values, condition):
+	"""
+	:param values: numpy array
+	:param condition: value, list or set of values, or tuple (low, high) of an inclusive range,
+	None for an open end
+	:return: boolean numpy array
+	"""
+	if isinstance(condition, tuple):
+		low, high = condition
+		mask = np.ones(len(values), dtype=bool)
+		if low is not None:
+			mask &= values >= low
+		if high is not None:
+			mask &= values <= high
+		return mask
+	if isinstance(condition, (list, set, frozenset)):
+		return np.isin(values, list(condition))
+	return values == condition
+
+
+def _may_match(meta, condition):
+	if "min" not in meta:
+		return meta["dtype"] != "str" or bool(meta["dictionary"])
+	if isinstance(condition, tuple):
+		low, high = condition
+		return (low is None or meta["max"] >= low) and (high is None or meta["min"] <= high)
+	values = condition if isinstance(condition, (list, set, frozenset)) else [condition]
+	return any(meta["min"] <= value <= meta["max"] for value in values
+	           if isinstance(value, (int, float, np.number)))
+
+
+class ResultStore:
+	"""
+	Columnar store of result tables in a directory
+	:param path: directory of the store, created if missing
+	"""
+
+	def __init__(self, path=RESULTS_DIR):
+		self.path = path
+		os.makedirs(path, exist_ok=True)
+		self._meta = {}
+		self._lock = threading.Lock()
+
+	def tables(self):
+		"""
+		:return: sorted list of the names of the tables
+		"""
+		return sorted(name for name in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, name)))
+
+	def segments(self, table):
+		"""
+		:param table: name of table
+		:return: list of (segment directory, meta) in the order they were written
+		"""
+		directory = os.path.join(self.path, table)
+		if not os.path.isdir(directory):
+			return []
+		segments = []
+		for name in sorted(os.listdir(directory)):
+			if name.startswith("."):
+				continue
+			segment = os.path.join(directory, name)
+			with self._lock:
+				meta = self._meta.get(segment)
+			if meta is None:
+				with open(os.path.join(segment, "meta.json")) as f:
+					meta = json.load(f)
+				with self._lock:
+					self._meta[segment] = meta
+			segments.append((segment, meta))
+		return segments
+
+	def write_segment(self, table, batches):
+		"""
+		Write rows as a new segment of a table
+		:param table: name of table
+		:param batches: list of tuples (dict tag column -> value, list of namedtuples or dicts)
+		:return: directory of the segment
+		"""
+		batches = [(tags, len(rows), _batch_columns(rows)) for tags, rows in batches]
+		names = list(dict.fromkeys([key for tags, _, _ in batches for key in tags] +
+		                           [key for _, _, columns in batches for key in columns]))
+		directory = os.path.join(self.path, table)
+		os.makedirs(directory, exist_ok=True)
+		name = f"{time.time_ns():016x}-{uuid.uuid4().hex[:8]}"
+		tmp = os.path.join(directory, "." + name)
+		os.makedirs(tmp)
+		meta = {"rows": sum(size for _, size, _ in batches), "columns": {}}
+		for i, column in enumerate(names):
+			values = []
+			for tags, size, columns in batches:
+				if column in tags:
+					values.extend([tags[column]] * size)
+				else:
+					values.extend(columns.get(column) or [None] * size)
+			array, meta["columns"][column] = _column(values)
+			np.save(os.path.join(tmp, f"{i}.npy"), array)
+			meta["columns"][column]["file"] = f"{i}.npy"
+		with open(os.path.join(tmp, "meta.json"), "w") as f:
+			json.dump(meta, f)
+		segment = os.path.join(directory, name)
+		os.rename(tmp, segment)
+		return segment
+
+	@contextmanager
+	def writer(self, batch_size=BATCH_SIZE):
+		"""
+		Writer appending to the store, flushed when the context ends
+		:param batch_size: rows buffered per table before a segment is written
+		:return: ResultWriter
+		"""
+		writer = ResultWriter(self, batch_size)
+		try:
+			yield writer
+		finally:
+			writer.flush()
+
+	def scan(self, table, columns=None, where=None):
+		"""
+		Rows of a table matching a filter, segment by segment
+		:param table: name of table
+		:param columns: list of columns to return, all columns of every segment if None
+		:param where: dict column -> value, list or set of values, or tuple (low, high) of
+		an inclusive range; a segment without the column matches no row
+		:return: generator of dicts column -> numpy array, one per segment with matching rows,
+		strings as object arrays and columns missing in a segment as nan
+		"""
+		where = where or {}
+		for segment, meta in self.segments(table):
+			column_meta = meta["columns"]
+			if any(name not in column_meta or not _may_match(column_meta[name], condition)
+			       for name, condition in where.items()):
+				continue
+			mask = None
+			for name, condition in where.items():
+				values = np.load(os.path.join(segment, column_meta[name]["file"]), mmap_mode="r")
+				if column_meta[name]["dtype"] == "str":
+					# the condition is evaluated on the dictionary, the codes select its result
+					dictionary = np.array(column_meta[name]["dictionary"], dtype=object)
+					allowed = np.append(_matches(dictionary, condition), False)
+					matched = allowed[values]
+				else:
+					matched = _matches(values, condition)
+				mask = matched if mask is None else mask & matched
+			if mask is not None and not mask.any():
+				continue
+			result = {}
+			for name in (columns if columns is not None else column_meta):
+				if name not in column_meta:
+					result[name] = np.full(meta["rows"] if mask is None else int(mask.sum()), np.nan)
+					continue
+				values = np.load(os.path.join(segment, column_meta[name]["file"]), mmap_mode="r")
+				values = values if mask is None else values[mask]
+				if column_meta[name]["dtype"] == "str":
+					values = np.array(column_meta[name]["dictionary"] + [None], dtype=object)[values]
+				result[name] = values
+			yield result
+
+	def query(self, table, columns=None, where=None):
+		"""
+		Rows of a table matching a filter
+		:param table: name of table
+		:param columns: list of columns to return, all columns if None
+		:param where: filter as for scan
+		:return: dict column -> numpy array of the matching rows of all segments
+		"""
+		parts = list(self.scan(table, columns, where))
+		names = columns if columns is not None else list(dict.fromkeys(name for part in parts for name in part))
+		result = {}
+		for name in names:
+			arrays = [part[name] if name in part else np.full(len(next(iter(part.values()))), np.nan)
+			          for part in parts]
+			result[name] = np.concatenate(arrays) if arrays else np.array([])
+		return result
+
+
+class ResultWriter:
+	"""
+	Buffers appended rows per table and writes every table as a segment once
+	batch_size rows are buffered. Safe to share between threads.
+	:param store: ResultStore written to
+	:param batch_size: rows buffered per table before a segment is written
+	"""
+
+	def __init__(self, store, batch_size=BATCH_SIZE):
+		self.store = store
+		self.batch_size = batch_size
+		self._rows = {}
+		self._lock = threading.Lock()
+
+	def append(self, table, rows, **tags):
+		"""
+		Append rows to a table
+		:param table: name of table
+		:param rows: iterable of dicts or of namedtuples of one type, tuple values are stored
+		as one column per item, name0, name1, ...
+		:param tags: tags of all rows, e.g. experiment, topology, point (dict of the sweep
+		parameters), node, iteration
+		:return: None
+		"""
+		tag_columns = _tag_columns(tags)
+		rows = list(rows)
+		with self._lock:
+			batches = self._rows.setdefault(table, [])
+			batches.append((tag_columns, rows))
+			if sum(len(rows) for _, rows in batches) < self.batch_size:
+				return
+			del self._rows[table]
+		self._write(table, batches)
+
+	def append_records(self, records, **tags):
+		"""
+		Append records to the tables of their types
+		:param records: iterable of namedtuple records, e.g. of tool_parsers
+		:param tags: tags of all records as for append
+		:return: None
+		"""
+		types = {}
+		for record in records:
+			types.setdefault(type(record), []).append(record)
+		for record_type, rows in types.items():
+			self.append(_type_table(record_type), rows, **tags)
+
+	def _write(self, table, batches):
+		# segments of at most batch_size rows
+		segment, size = [], 0
+		for tags, rows in batches:
+			while rows:
+				part, rows = rows[:self.batch_size - size], rows[self.batch_size - size:]
+				segment.append((tags, part))
+				size += len(part)
+				if size == self.batch_size:
+					self.store.write_segment(table, segment)
+					segment, size = [], 0
+		if segment:
+			self.store.write_segment(table, segment)
+
+	def flush(self):
+		"""
+		Write all buffered rows
+		:return: None
+		"""
+		with self._lock:
+			tables, self._rows = self._rows, {}
+		for table, batches in tables.items():
+			self._write(table, batches)
@@ -0,0 +1,385 @@
+"""
+Declarative parameter sweeps.
+
+A sweep declares its parameter space, the procedure measuring one point and
+the number of replications of every point. The points are sampled from the
+space on a grid, at random or as a Latin hypercube:
+
+	grid            dict name -> list of values, every combination
+	random          dict name -> (low, high) or list of values, samples points drawn uniformly
+	latin_hypercube dict name -> (low, high) or list of values, samples points with every
+	                parameter stratified into samples intervals
+
+The parameters bandwidth, burst and latency set the tc parameters of the swept
+links (the configured parameters of a link for the ones not swept), load sets
+the rate in Mbit/s of the background flows of the sweep. All other parameters
+are only handed to the procedure. A point is applied with one tc exec per
+node of the swept links and one tc exec per source of the flows, parameters
+equal to the ones of the previous point are not changed.
+
+The points are run concurrently on the instances of the topology, the
+replicas of a testbed set up with setup --replicas or the single topology
+otherwise. Each instance runs one point at a time, the replications of a point
+are queued after each other and taken by the next free instance.
+The procedure gets the instance, the point and the replication and returns the
+records of its measurements, which are written to one result store tagged with
+the experiment, the topology fingerprint, the point, the replication as
+iteration, the instance and the id of the sweep run:
+
+	def procedure(instance, point, replication):
+		return pathneck(instance, "extra", "ue1")
+
+	sweep = Sweep("bw-limited", {"bandwidth": list(range(10, 101, 10))}, procedure, replications=5,
+	              links=["r1-enb1"], flows=[Flow("extra", "ue1")])
+	sweep.run()
+
+A point that fails is put back on the queue for another instance, at most
+MAX_ATTEMPTS times. An instance whose background traffic cannot be started, or
+that failed MAX_FAILURES points in a row, is retired and leaves the remaining
+points to the healthy instances. The links are reset to their configured
+parameters and the flows are stopped once the sweep is done.
+"""
+import itertools
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+import uuid
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from replicas import load_replicas, replica_address, replica_link, replica_name
+from state_store import get_store
+from traffic_control import apply_tc
+from measurement_runner import Job, MeasurementRunner
+from result_store import ResultStore, ResultWriter, topology_fingerprint
+from traffic_manager import Flow, TrafficManager
+
+# parameter -> index in the tc_params tuple (bandwidth, burst, latency)
+LINK_PARAMETERS = {"bandwidth": 0, "burst": 1, "latency": 2}
+LOAD_PARAMETER = "load"
+# a failed point is put back for another instance until it failed this many times
+MAX_ATTEMPTS = 3
+# an instance failing this many points in a row takes no more points
+MAX_FAILURES = 3
+# seconds an idle instance waits for points put back by other instances
+WAIT_INTERVAL = 0.05
+
+
+def _sample(values, u):
+	# value of a uniform sample u in [0, 1) of a range (low, high) or of a list of values
+	if isinstance(values, tuple):
+		low, high = values
+		return float(low + u * (high - low))
+	values = list(values)
+	return values[min(int(u * len(values)), len(values) - 1)]
+
+
+def grid(parameters, samples=None, seed=None):
+	"""
+	:param parameters: dict name -> list of values
+	:param samples: unused, the grid has every combination of the values
+	:param seed: unused
+	:return: list of points, dicts name -> value
+	"""
+	names = list(parameters)
+	return [dict(zip(names, values)) for values in itertools.product(*(parameters[name] for name in names))]
+
+
+def random_points(parameters, samples, seed=None):
+	"""
+	:param parameters: dict name -> (low, high) or list of values
+	:param samples: number of points
+	:param seed: seed of the random generator
+	:return: list of points, dicts name -> value
+	"""
+	uniform = np.random.default_rng(seed).random((samples, len(parameters)))
+	return [{name: _sample(values, u) for (name, values), u in zip(parameters.items(), row)} for row in uniform]
+
+
+def latin_hypercube(parameters, samples, seed=None):
+	"""
+	Latin hypercube sample, every parameter has exactly one point in each of samples
+	equally likely intervals
+	:param parameters: dict name -> (low, high) or list of values
+	:param samples: number of points
+	:param seed: seed of the random generator
+	:return: list of points, dicts name -> value
+	"""
+	rng = np.random.default_rng(seed)
+	strata = np.stack([rng.permutation(samples) for _ in parameters], axis=1) if parameters else \
+		np.zeros((samples, 0))
+	uniform = (strata + rng.random(strata.shape)) / samples
+	return [{name: _sample(values, u) for (name, values), u in zip(parameters.items(), row)} for row in uniform]
+
+
+# sampling -> function (parameters, samples, seed) -> points
+SAMPLERS = {"grid": grid, "random": random_points, "lhs": latin_hypercube}
+
+
+class Instance:
+	"""
+	A copy of the topology the points of a sweep run on
+	:param name: name of the instance, tagged on its results
+	:param store: state_store.StateStore of the topology, the store of this process if None
+	:param replica: index of the replica of the topology, None on a testbed without replicas
+	"""
+
+	def __init__(self, name="default", store=None, replica=None):
+		self.name = name
+		self.store = store or get_store()
+		self.replica = replica
+		self.replicas = load_replicas(self.store) if replica is not None else None
+
+	def node(self, name):
+		"""
+		:param name: name of a node of the topology
+		:return: name of the node in this instance
+		"""
+		return name if self.replica is None else replica_name(self.replica, name)
+
+	def ip(self, name):
+		"""
+		:param name: name of a node of the topology
+		:return: ip address of the node in this instance
+		"""
+		return self.store.nodes()[self.node(name)][0]
+
+	def address(self, address):
+		"""
+		:param address: address of the topology
+		:return: the address in this instance
+		"""
+		return address if self.replica is None else replica_address(self.replica, address, self.replicas)
+
+	def link(self, name):
+		"""
+		:param name: name of a link of the topology
+		:return: link parameters of the link in this instance as generated by generate_link_param
+		"""
+		return self.store.link(name if self.replica is None else replica_link(self.replica, name, self.replicas))
+
+	def __repr__(self):
+		return f"Instance({self.name!r})"
+
+
+def topology_instances(store=None):
+	"""
+	:param store: state_store.StateStore of the testbed, the store of this process if None
+	:return: list of an Instance for every replica of the testbed, the topology itself if it has no replicas
+	"""
+	store = store or get_store()
+	replicas = load_replicas(store)
+	if replicas is None:
+		return [Instance(store=store)]
+	return [Instance(f"rep{replica}", store, replica) for replica in range(replicas["count"])]
+
+
+def pathneck(instance, client, server, runner=None):
+	"""
+	Run pathneck on an instance, a procedure step of a sweep
+	:param instance: Instance
+	:param client: name of the node running pathneck
+	:param server: name of the node probed
+	:param runner: MeasurementRunner, one with its defaults if None
+	:return: list of the records of the output
+	"""
+	result = (runner or MeasurementRunner()).run([Job("pathneck", instance.node(client), instance.ip(server))])[0]
+	if result.exit_code != 0:
+		print(f"pathneck on {result.job.node} returned non-zero exit status: {result.exit_code}")
+	return result.records or []
+
+
+class Sweep:
+	"""
+	A sweep over a parameter space
+	:param experiment: name of the experiment, tagged on the results
+	:param parameters: parameter space as expected by the sampling
+	:param procedure: function (instance, point, replication) -> iterable of records, or dict
+	table -> rows, measuring one replication of a point
+	:param replications: number of times every point is measured
+	:param sampling: grid, random or lhs
+	:param samples: number of points of random and lhs sampling
+	:param seed: seed of random and lhs sampling
+	:param links: names of the links bandwidth, burst and latency are applied to
+	:param flows: Flow templates of the background traffic load is applied to, started on
+	every instance with the names of its nodes
+	"""
+
+	def __init__(self, experiment, parameters, procedure, replications=1, sampling="grid", samples=None,
+	             seed=None, links=(), flows=()):
+		if sampling not in SAMPLERS:
+			raise ValueError(f"Unknown sampling {sampling}")
+		if sampling != "grid" and samples is None:
+			raise ValueError(f"{sampling} sampling needs a number of samples")
+		if any(name in LINK_PARAMETERS for name in parameters) and not links:
+			raise ValueError("Link parameters are swept without links")
+		if LOAD_PARAMETER in parameters and not flows:
+			raise ValueError("Load is swept without flows")
+		self.experiment = experiment
+		self.parameters = parameters
+		self.procedure = procedure
+		self.replications = replications
+		self.sampling = sampling
+		self.samples = samples
+		self.seed = seed
+		self.links = list(links)
+		self.flows = list(flows)
+
+	def points(self):
+		"""
+		:return: list of the points of the sweep, dicts name -> value
+		"""
+		return SAMPLERS[self.sampling](self.parameters, self.samples, self.seed)
+
+	def _link_params(self, instance, point):
+		# node -> {interface: tc_params} of the swept links at a point, the configured ones if point is None
+		per_node = {}
+		for name in self.links:
+			_, endpoints, tc_params = instance.link(name)
+			tc_params = list(tc_params)
+			for parameter, index in LINK_PARAMETERS.items():
+				if point is not None and parameter in point:
+					tc_params[index] = point[parameter]
+			for node, _, interface in endpoints:
+				per_node.setdefault(node, {})[interface] = tuple(tc_params)
+		return per_node
+
+	def _apply(self, instance, point, traffic, flows, qdiscs):
+		for node, interface_params in self._link_params(instance, point).items():
+			if apply_tc(node, interface_params, cache=qdiscs) != 0:
+				raise RuntimeError(f"Link parameters of {point} could not be applied on {node}")
+		if LOAD_PARAMETER in point:
+			status = traffic.set_rates({flow: point[LOAD_PARAMETER] for flow in flows
+			                            if flow.rate != point[LOAD_PARAMETER]})
+			if any(status.values()):
+				raise RuntimeError(f"Load of {point} could not be applied on {instance}")
+
+	def _start_flows(self, instance, traffic, first):
+		flows = []
+		for template in self.flows:
+			flow = Flow.from_dict({**template.to_dict(), "source": instance.node(template.source),
+			                       "destination": instance.node(template.destination),
+			                       "ip": instance.address(template.ip) if template.ip else instance.ip(template.destination)})
+			if LOAD_PARAMETER in first:
+				flow.rate = first[LOAD_PARAMETER]
+			flows.append(flow)
+		started = traffic.start(flows) if flows else []
+		if len(started) != len(flows):
+			traffic.stop(started)
+			raise RuntimeError(f"Background traffic could not be started on {instance}")
+		return started
+
+	def _run_instance(self, instance, tasks, traffic, writer, summary, lock):
+		topology = topology_fingerprint(instance.store)
+		flows = None
+		current = None
+		# qdiscs applied on the nodes of the instance, nobody else changes them during the sweep
+		qdiscs = {}
+		failures = 0
+		try:
+			while True:
+				with lock:
+					try:
+						point, replication, attempt = tasks.get_nowait()
+						summary["in_flight"] += 1
+					except queue.Empty:
+						# a point running on another instance may still be put back
+						if summary["in_flight"] == 0:
+							return
+						point = None
+				if point is None:
+					time.sleep(WAIT_INTERVAL)
+					continue
+				try:
+					if flows is None:
+						try:
+							flows = self._start_flows(instance, traffic, point)
+						except Exception:
+							# without its background traffic the instance cannot measure any point
+							failures = MAX_FAILURES - 1
+							raise
+					if point != current:
+						self._apply(instance, point, traffic, flows, qdiscs)
+						current = point
+					result = self.procedure(instance, point, replication)
+					tags = {"experiment": self.experiment, "topology": topology, "point": point,
+					        "iteration": replication, "instance": instance.name, "run": summary["run"]}
+					if isinstance(result, dict):
+						for table, rows in result.items():
+							writer.append(table, rows, **tags)
+					else:
+						writer.append_records(result or [], **tags)
+				except Exception:
+					print(f"Point {point} replication {replication} failed on {instance}:")
+					traceback.print_exc()
+					# the parameters on the instance are unknown now
+					current = None
+					qdiscs.clear()
+					failures += 1
+					with lock:
+						if attempt + 1 < MAX_ATTEMPTS:
+							# another instance takes the point
+							tasks.put((point, replication, attempt + 1))
+						else:
+							summary["failed"].append((point, replication))
+					if failures >= MAX_FAILURES:
+						print(f"{instance} failed {failures} times in a row and takes no more points")
+						with lock:
+							summary["retired"].append(instance.name)
+						return
+				else:
+					failures = 0
+					with lock:
+						summary["done"] += 1
+				finally:
+					with lock:
+						summary["in_flight"] -= 1
+		finally:
+			if flows:
+				traffic.stop(flows)
+			for node, interface_params in self._link_params(instance, None).items():
+				apply_tc(node, interface_params, cache=qdiscs)
+
+	def run(self, instances=None, store=None):
+		"""
+		Run all points, each instance runs one point at a time
+		:param instances: list of Instance, all instances of the testbed of this process if None
+		:param store: result_store.ResultStore written to, the store under RESULTS_DIR if None
+		:return: dict with the id of the run its results are tagged with, the number of points, of
+		measurements done, the list of failed (point, replication), the names of the retired
+		instances and the seconds the sweep took
+		"""
+		instances = instances or topology_instances()
+		points = self.points()
+		tasks = queue.Queue()
+		for point in points:
+			for replication in range(self.replications):
+				tasks.put((point, replication, 0))
+		print(f"Sweep {self.experiment}: {len(points)} points x {self.replications} replications "
+		      f"on {len(instances)} instances")
+		summary = {"run": uuid.uuid4().hex[:12], "points": len(points), "done": 0, "failed": [], "retired": [],
+		           "in_flight": 0}
+		writer = ResultWriter(store or ResultStore())
+		traffic = TrafficManager(store=instances[0].store)
+		start = time.time()
+		lock = threading.Lock()
+		threads = [threading.Thread(target=self._run_instance, args=(instance, tasks, traffic, writer, summary, lock))
+		           for instance in instances]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		# points left over once every instance retired
+		while not tasks.empty():
+			point, replication, _ = tasks.get_nowait()
+			summary["failed"].append((point, replication))
+		writer.flush()
+		del summary["in_flight"]
+		summary["seconds"] = time.time() - start
+		print(f"Sweep {self.experiment}: {summary['done']} measurements in {summary['seconds']:.1f} s, "
+		      f"{len(summary['failed'])} failed")
+		return summary
@@ -0,0 +1,269 @@
+"""
+Streaming parsers for the output of the probe tools.
+
+A parser is fed the output of its tool in chunks of bytes as they arrive from
+the process and returns the records of every line completed by the chunk, so
+only the last incomplete line is kept between chunks. The records are
+namedtuples:
+
+	pathneck    PathneckHop for every hop, PathneckConf, PathneckRtt
+	ping        PingSample for every reply, PingSummary
+	iperf       IperfInterval for every interval and the summaries
+	iperf3      IperfInterval, from the text output, from -J or from --json-stream
+	traceroute  TracerouteHop for every hop
+
+	parser = PathneckParser()
+	for chunk in chunks:
+		for record in parser.feed(chunk):
+			...
+	records = parser.close()
+
+parse(tool, output) parses a complete output, stream_callback(parser, sink)
+adapts a parser to the output callback of exec_agent.AgentPool.request.
+Lines a parser does not know are skipped.
+"""
+import json
+import re
+from collections import namedtuple
+
+# raw_gap and gap are the 4th and 5th field pathneck prints for a hop, bound is ub or lb
+PathneckHop = namedtuple("PathneckHop", ["hop", "rtt", "ip", "raw_gap", "gap", "bottleneck", "bandwidth", "bound"])
+PathneckConf = namedtuple("PathneckConf", ["values"])
+PathneckRtt = namedtuple("PathneckRtt", ["rtt"])
+PingSample = namedtuple("PingSample", ["seq", "ttl", "rtt"])
+PingSummary = namedtuple("PingSummary", ["transmitted", "received", "min", "avg", "max", "mdev"])
+# stream is -1 for the sum over all streams, summary is "sender", "receiver" or "" for an interval
+IperfInterval = namedtuple("IperfInterval", ["stream", "start", "end", "bytes", "bits_per_second", "summary"])
+# ip is the first address answering for the hop, rtts has None for every probe without answer
+TracerouteHop = namedtuple("TracerouteHop", ["hop", "ip", "rtts"])
+
+BYTE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+BIT_UNITS = {"": 1, "K": 1e3, "M": 1e6, "G": 1e9, "T": 1e12}
+
+
+class LineParser:
+	"""
+	Base of the parsers, splits the chunks into lines and hands every complete
+	line to parse_line
+	"""
+
+	def __init__(self):
+		self._partial = b""
+
+	def parse_line(self, line):
+		"""
+		:param line: line of output without line break
+		:return: list of records of the line
+		"""
+		raise NotImplementedError
+
+	def feed(self, data):
+		"""
+		:param data: next chunk of output as bytes
+		:return: list of records of the lines completed by the chunk
+		"""
+		lines = (self._partial + data).split(b"\n")
+		self._partial = lines.pop()
+		records = []
+		for line in lines:
+			records.extend(self.parse_line(line.decode("utf-8", errors="replace").rstrip("\r")))
+		return records
+
+	def close(self):
+		"""
+		End of output
+		:return: list of records of the last line and of state kept until the end
+		"""
+		line, self._partial = self._partial, b""
+		return self.parse_line(line.decode("utf-8", errors="replace").rstrip("\r")) if line else []
+
+
+class PathneckParser(LineParser):
+	"""
+	Parser of the output of pathneck -o
+	"""
+
+	def parse_line(self, line):
+		fields = line.split()
+		if len(fields) == 8 and fields[0].isdigit():
+			try:
+				return [PathneckHop(int(fields[0]), float(fields[1]), fields[2], int(fields[3]), int(fields[4]),
+				                    fields[5] == "1", float(fields[6]), fields[7])]
+			except ValueError:
+				return []
+		if len(fields) >= 3 and fields[1] == "=" and fields[0] in ("conf", "rtt"):
+			try:
+				values = tuple(float(value) for value in fields[2:] if value[0].isdigit())
+			except ValueError:
+				return []
+			if fields[0] == "conf":
+				return [PathneckConf(values)]
+			return [PathneckRtt(values[0])] if values else []
+		return []
+
+
+PING_REPLY = re.compile(r"(?:icmp_seq|seq)=(\d+) ttl=(\d+) time=([\d.]+)")
+PING_COUNTS = re.compile(r"(\d+) packets transmitted, (\d+) (?:packets )?received")
+PING_RTT = re.compile(r"(?:rtt|round-trip) min/avg/max(?:/mdev)? = ([\d.]+)/([\d.]+)/([\d.]+)(?:/([\d.]+))?")
+
+
+class PingParser(LineParser):
+	"""
+	Parser of the output of ping of iputils and busybox. The summary is
+	returned with the rtt line, or by close if no reply arrived.
+	"""
+
+	def __init__(self):
+		super().__init__()
+		self._counts = None
+
+	def parse_line(self, line):
+		match = PING_REPLY.search(line)
+		if match:
+			return [PingSample(int(match.group(1)), int(match.group(2)), float(match.group(3)))]
+		match = PING_COUNTS.search(line)
+		if match:
+			self._counts = (int(match.group(1)), int(match.group(2)))
+			return []
+		match = PING_RTT.search(line)
+		if match:
+			counts, self._counts = self._counts or (None, None), None
+			mdev = match.group(4)
+			return [PingSummary(*counts, float(match.group(1)), float(match.group(2)), float(match.group(3)),
+			                    float(mdev) if mdev else None)]
+		return []
+
+	def close(self):
+		records = super().close()
+		if self._counts is not None:
+			records.append(PingSummary(*self._counts, None, None, None, None))
+			self._counts = None
+		return records
+
+
+IPERF_INTERVAL = re.compile(r"\[\s*(\d+|SUM)\]\s+([\d.]+)\s*-\s*([\d.]+)\s+sec\s+([\d.]+)\s+([KMGT]?)Bytes"
+                            r"\s+([\d.]+)\s+([KMGT]?)bits/sec(?:.*\s(sender|receiver)\s*$)?")
+
+
+class IperfParser(LineParser):
+	"""
+	Parser of the text output of iperf and iperf3
+	"""
+
+	def parse_line(self, line):
+		match = IPERF_INTERVAL.search(line)
+		if match is None:
+			return []
+		stream, start, end, size, size_unit, rate, rate_unit, summary = match.groups()
+		return [IperfInterval(-1 if stream == "SUM" else int(stream), float(start), float(end),
+		                      int(float(size) * BYTE_UNITS[size_unit]), float(rate) * BIT_UNITS[rate_unit],
+		                      summary or "")]
+
+
+def _iperf3_interval(entry, stream, summary=""):
+	return IperfInterval(stream, entry["start"], entry["end"], entry["bytes"], entry["bits_per_second"], summary)
+
+
+class Iperf3Parser(IperfParser):
+	"""
+	Parser of the output of iperf3, as text, as the document of -J (--json) or
+	as the events of --json-stream (iperf3 3.17 or later), one per line. iperf3
+	prints the document of -J only when it ends, its lines are kept until the
+	closing brace.
+	"""
+
+	def __init__(self):
+		super().__init__()
+		self._document = None
+
+	def _records(self, event, data):
+		if event == "interval":
+			records = [_iperf3_interval(entry, entry["socket"]) for entry in data["streams"]]
+			if len(data["streams"]) > 1:
+				records.append(_iperf3_interval(data["sum"], -1))
+			return records
+		if event == "end":
+			return [_iperf3_interval(data[key], -1, summary)
+			        for key, summary in (("sum_sent", "sender"), ("sum_received", "receiver")) if key in data]
+		return []
+
+	def parse_line(self, line):
+		if self._document is not None:
+			self._document.append(line)
+			if line != "}":
+				return []
+			lines, self._document = self._document, None
+			try:
+				document = json.loads("\n".join(lines))
+			except ValueError:
+				return []
+			records = []
+			for interval in document.get("intervals", []):
+				records.extend(self._records("interval", interval))
+			return records + self._records("end", document.get("end", {}))
+		if line == "{":
+			self._document = [line]
+			return []
+		if line.startswith('{"event"'):
+			try:
+				event = json.loads(line)
+			except ValueError:
+				return []
+			return self._records(event["event"], event.get("data") or {})
+		return super().parse_line(line)
+
+
+class TracerouteParser(LineParser):
+	"""
+	Parser of the output of traceroute -n
+	"""
+
+	def parse_line(self, line):
+		fields = line.split()
+		if not fields or not fields[0].isdigit():
+			return []
+		ip = None
+		rtts = []
+		for i, field in enumerate(fields[1:], 1):
+			if field == "*":
+				rtts.append(None)
+			elif field == "ms":
+				continue
+			elif i + 1 < len(fields) and fields[i + 1] == "ms":
+				rtts.append(float(field))
+			elif ip is None and not field.startswith("!"):
+				ip = field
+		return [TracerouteHop(int(fields[0]), ip, tuple(rtts))]
+
+
+# tool -> parser class
+PARSERS = {"pathneck": PathneckParser, "ping": PingParser, "iperf": IperfParser, "iperf3": Iperf3Parser,
+           "traceroute": TracerouteParser}
+
+
+def parse(tool, output):
+	"""
+	Parse the complete output of a tool
+	:param tool: name of a tool in PARSERS
+	:param output: output as bytes or string
+	:return: list of records
+	"""
+	parser = PARSERS[tool]()
+	records = parser.feed(output.encode("utf-8") if isinstance(output, str) else output)
+	return records + parser.close()
+
+
+def stream_callback(parser, sink):
+	"""
+	Feed the stdout chunks of a callback of exec_agent.AgentPool.request to a parser
+	:param parser: parser of the tool
+	:param sink: function (record, timestamp) called with every record, the timestamp of
+	the chunk completing its line on the node
+	:return: function (stream, timestamp, bytes)
+	"""
+	def callback(stream, timestamp, data):
+		if stream == 1:
+			for record in parser.feed(data):
+				sink(record, timestamp)
+
+	return callback
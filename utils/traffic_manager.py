@@ -0,0 +1,340 @@
+"""
+Background traffic of an experiment.
+
+A flow sends iperf traffic from a source node to a destination node with a
+protocol, a target rate in Mbit/s, a number of parallel streams and a
+duration (0 until it is stopped). Every flow gets a server of its own on a
+port of its own, so flows are started, stopped and changed independently, and
+the PIDs of its server and client are kept. The flows of a traffic matrix are
+started concurrently, the servers first.
+
+The rate of a flow is enforced by a policer on the egress interface of the
+source, a u32 filter matching the destination address and port on a clsact
+qdisc, which leaves the tbf and netem tree of the link untouched:
+
+	qdisc replace dev <interface> clsact
+	filter add dev <interface> egress pref <id> protocol ip u32 match ip dst <ip>/32
+		match ip dport <port> 0xffff action police rate <rate>mbit burst <burst>k conform-exceed drop index <id>
+
+set_rates changes the policers in place with tc actions change, one tc -batch
+exec per source node, so the rate of a running flow changes without
+restarting it. A flow without rate is not policed. UDP clients send at
+max_rate (the rate if not given), a policed flow cannot get faster than its
+client sends.
+
+The flows are kept in the state store, a later process can change or stop the
+flows an experiment started:
+
+	manager = TrafficManager()
+	manager.start(flows_from_matrix({("c2", "r6"): 40, ("c3", "r6"): 20}, protocol="udp", max_rate=100))
+	manager.set_rates({flow: 60 for flow in manager.flows.values()})
+	manager.stop()
+"""
+import json
+import os
+import shlex
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from docker_backend import get_backend
+from replicas import resolve_node
+from state_store import get_store
+
+TRAFFIC_KEY = "traffic"
+# port of the server of flow n is BASE_PORT + n
+BASE_PORT = 6000
+# seconds the server start waits for the server to listen
+LISTEN_TIMEOUT = 5
+# burst of the policer in seconds of traffic at its rate, at least MIN_BURST kbyte
+BURST_TIME = 0.01
+MIN_BURST = 16
+
+
+class Flow:
+	"""
+	Background traffic from one node to another
+	:param source: name of the node running the client, or tuple (replica, name)
+	:param destination: name of the node running the server, or tuple (replica, name)
+	:param rate: rate in Mbit/s the flow is policed to, None for an unpoliced flow
+	:param protocol: tcp or udp
+	:param streams: number of parallel streams of the client
+	:param duration: seconds the client sends, 0 until the flow is stopped
+	:param max_rate: rate in Mbit/s the client sends at, the rate for udp and unlimited
+	for tcp if None
+	:param ip: address of the destination, the address of the destination node if None
+	"""
+
+	def __init__(self, source, destination, rate=None, protocol="tcp", streams=1, duration=0, max_rate=None,
+	             ip=None):
+		if protocol not in ("tcp", "udp"):
+			raise ValueError(f"Unknown protocol {protocol}")
+		self.source = resolve_node(source)
+		self.destination = resolve_node(destination)
+		self.rate = rate
+		self.protocol = protocol
+		self.streams = streams
+		self.duration = duration
+		self.max_rate = max_rate
+		self.ip = ip
+		# set when the flow is started
+		self.id = None
+		self.port = None
+		self.interface = None
+		self.server_pid = None
+		self.client_pid = None
+
+	def client_rate(self):
+		"""
+		:return: rate in Mbit/s the client sends at, None if unlimited
+		"""
+		if self.max_rate is not None:
+			return self.max_rate
+		return self.rate if self.protocol == "udp" else None
+
+	def server_command(self):
+		"""
+		:return: command of the iperf server as list of arguments
+		"""
+		return ["iperf", "-s", "-p", str(self.port)] + (["-u"] if self.protocol == "udp" else [])
+
+	def client_command(self):
+		"""
+		:return: command of the iperf client as list of arguments
+		"""
+		cmd = ["iperf", "-c", self.ip, "-p", str(self.port), "-t", str(self.duration), "-P", str(self.streams)]
+		if self.protocol == "udp":
+			cmd.append("-u")
+		rate = self.client_rate()
+		if rate is not None:
+			cmd += ["-b", f"{rate}m"]
+		return cmd
+
+	def to_dict(self):
+		"""
+		:return: dict of the attributes of the flow
+		"""
+		return dict(vars(self))
+
+	@classmethod
+	def from_dict(cls, attributes):
+		"""
+		:param attributes: dict as returned by to_dict
+		:return: Flow
+		"""
+		flow = cls(attributes["source"], attributes["destination"])
+		vars(flow).update(attributes)
+		return flow
+
+	def __repr__(self):
+		return f"Flow({self.id}: {self.source} -> {self.destination}:{self.port} {self.protocol} " \
+		       f"rate={self.rate} streams={self.streams})"
+
+
+def flows_from_matrix(matrix, **defaults):
+	"""
+	Flows of a traffic matrix
+	:param matrix: dict (source, destination) -> rate in Mbit/s, or dict of Flow parameters
+	:param defaults: Flow parameters of all flows, e.g. protocol or streams
+	:return: list of Flow
+	"""
+	flows = []
+	for (source, destination), params in matrix.items():
+		params = dict(params) if isinstance(params, dict) else {"rate": params}
+		flows.append(Flow(source, destination, **{**defaults, **params}))
+	return flows
+
+
+def police_action(flow, rate):
+	"""
+	:param flow: started Flow
+	:param rate: rate in Mbit/s
+	:return: police action of the flow without the leading tc filter or tc actions arguments
+	"""
+	burst = max(MIN_BURST, int(rate * 1e6 / 8 * BURST_TIME / 1024))
+	return f"action police rate {rate}mbit burst {burst}k conform-exceed drop index {flow.id}"
+
+
+def filter_command(verb, flow, rate=None, interface=None):
+	"""
+	tc batch command for the policing filter of a flow
+	:param verb: add or del
+	:param flow: started Flow
+	:param rate: rate in Mbit/s of an added filter
+	:param interface: egress interface of the source, the interface of the flow if None
+	:return: command without the leading tc
+	"""
+	command = f"filter {verb} dev {interface or flow.interface} egress pref {flow.id}"
+	if verb != "add":
+		return command
+	protocol = 6 if flow.protocol == "tcp" else 17
+	return f"{command} protocol ip u32 match ip dst {flow.ip}/32 match ip protocol {protocol} 0xff " \
+	       f"match ip dport {flow.port} 0xffff {police_action(flow, rate)}"
+
+
+def _server_script(flow):
+	# the client is only started once the server listens, /proc/net lists the port in hex
+	table = "tcp" if flow.protocol == "tcp" else "udp"
+	return f"""{shlex.join(flow.server_command())} > /tmp/flow-{flow.id}-server.log 2>&1 &
+pid=$!
+i=0
+while ! grep -q ':{flow.port:04X} ' /proc/net/{table} /proc/net/{table}6 2>/dev/null; do
+	kill -0 $pid 2>/dev/null || exit 1
+	i=$((i + 1))
+	[ $i -gt {int(LISTEN_TIMEOUT / 0.05)} ] && exit 1
+	sleep 0.05
+done
+echo $pid
+"""
+
+
+def _client_script(flow):
+	police = ""
+	if flow.rate is not None:
+		police = f"tc qdisc replace dev $dev clsact\ntc {filter_command('add', flow, flow.rate, '$dev')}\n"
+	return f"""set -e
+dev=$(ip -o route get {flow.ip} | sed -n 's/.* dev \\([^ ]*\\).*/\\1/p')
+{police}{shlex.join(flow.client_command())} > /tmp/flow-{flow.id}.log 2>&1 &
+echo $dev $!
+"""
+
+
+class TrafficManager:
+	"""
+	Starts, changes and stops the flows of the background traffic
+	:param workers: number of concurrent execs
+	:param store: state_store.StateStore keeping the flows, the store of this process if None
+	"""
+
+	def __init__(self, workers=16, store=None):
+		self.workers = workers
+		self.store = store or get_store()
+		self._lock = threading.Lock()
+		self.flows = {flow["id"]: Flow.from_dict(flow)
+		              for flow in json.loads(self.store.get_meta(TRAFFIC_KEY) or "[]")}
+
+	def _save(self):
+		with self._lock:
+			flows = [flow.to_dict() for flow in self.flows.values()]
+		self.store.set_meta(TRAFFIC_KEY, json.dumps(flows))
+
+	def _map(self, function, items):
+		with ThreadPoolExecutor(max_workers=self.workers) as pool:
+			return list(pool.map(function, items))
+
+	def _run(self, node, script):
+		result = get_backend().exec(node, ["sh", "-c", script])
+		if result.exit_code != 0:
+			print(f"Traffic script on {node} returned non-zero exit status: {result.exit_code}")
+			print(result.stderr.decode('utf-8', errors='replace'))
+			return None
+		return result.stdout.decode('utf-8').split()
+
+	def _start_server(self, flow):
+		output = self._run(flow.destination, _server_script(flow))
+		if output:
+			flow.server_pid = int(output[-1])
+		return flow.server_pid is not None
+
+	def _start_client(self, flow):
+		output = self._run(flow.source, _client_script(flow))
+		if output:
+			flow.interface, flow.client_pid = output[-2], int(output[-1])
+		return flow.client_pid is not None
+
+	def start(self, flows):
+		"""
+		Start flows concurrently
+		:param flows: iterable of Flow, e.g. of flows_from_matrix
+		:return: list of the flows that were started
+		"""
+		flows = list(flows)
+		nodes = self.store.nodes()
+		with self._lock:
+			next_id = max(self.flows, default=0) + 1
+			for flow in flows:
+				flow.id, flow.port = next_id, BASE_PORT + next_id
+				flow.ip = flow.ip or nodes[flow.destination][0]
+				self.flows[flow.id] = flow
+				next_id += 1
+		served = [flow for flow, ok in zip(flows, self._map(self._start_server, flows)) if ok]
+		started = [flow for flow, ok in zip(served, self._map(self._start_client, served)) if ok]
+		failed = [flow for flow in flows if flow not in started]
+		if failed:
+			print(f"{len(failed)} of {len(flows)} flows could not be started: {failed}")
+			self.stop(failed)
+		self._save()
+		return started
+
+	def set_rates(self, rates):
+		"""
+		Change the rates of running flows without restarting them, one tc exec per source node
+		:param rates: dict Flow -> rate in Mbit/s, None to stop policing the flow
+		:return: dict source node -> exit status of tc
+		"""
+		per_node = {}
+		for flow, rate in rates.items():
+			if flow.rate is None and rate is None:
+				continue
+			if flow.rate is None:
+				commands = [f"qdisc replace dev {flow.interface} clsact", filter_command("add", flow, rate)]
+			elif rate is None:
+				commands = [filter_command("del", flow)]
+			else:
+				commands = [f"actions change {police_action(flow, rate)}"]
+			per_node.setdefault(flow.source, []).append((flow, rate, commands))
+
+		def apply(item):
+			node, changes = item
+			script = "".join(command + "\n" for _, _, commands in changes for command in commands)
+			result = get_backend().exec(node, ["tc", "-batch", "-"], stdin=script.encode())
+			if result.exit_code != 0:
+				print(result.stderr.decode('utf-8'))
+				return result.exit_code
+			for flow, rate, _ in changes:
+				flow.rate = rate
+			return 0
+
+		status = dict(zip(per_node, self._map(apply, per_node.items())))
+		self._save()
+		return status
+
+	def running(self):
+		"""
+		:return: list of the flows whose client is still running, one exec per source node
+		"""
+		per_node = {}
+		for flow in self.flows.values():
+			if flow.client_pid is not None:
+				per_node.setdefault(flow.source, []).append(flow)
+
+		def alive(item):
+			node, flows = item
+			pids = " ".join(str(flow.client_pid) for flow in flows)
+			output = self._run(node, f"for pid in {pids}; do kill -0 $pid 2>/dev/null && echo $pid; done; true")
+			return [flow for flow in flows if output is not None and str(flow.client_pid) in output]
+
+		return [flow for flows in self._map(alive, per_node.items()) for flow in flows]
+
+	def stop(self, flows=None):
+		"""
+		Stop flows, their clients, servers and policers
+		:param flows: iterable of Flow, all flows if None
+		:return: None
+		"""
+		with self._lock:
+			flows = list(self.flows.values()) if flows is None else list(flows)
+		per_node = {}
+		for flow in flows:
+			if flow.client_pid is not None:
+				per_node.setdefault(flow.source, []).append(f"kill {flow.client_pid} 2>/dev/null")
+			if flow.interface is not None and flow.rate is not None:
+				per_node.setdefault(flow.source, []).append(f"tc {filter_command('del', flow)} 2>/dev/null")
+			if flow.server_pid is not None:
+				per_node.setdefault(flow.destination, []).append(f"kill {flow.server_pid} 2>/dev/null")
+		self._map(lambda item: self._run(item[0], "\n".join(item[1] + ["true"])), per_node.items())
+		with self._lock:
+			for flow in flows:
+				self.flows.pop(flow.id, None)
+		self._save()